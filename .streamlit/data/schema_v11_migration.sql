@@ -0,0 +1,28 @@
+-- ==============================================================================
+-- V11 Migration: Hàng đợi background_jobs nhiều worker (lease)
+-- Chạy trong Supabase SQL Editor. Chạy sau V10.
+-- ==============================================================================
+-- Worker (thread pool trong mỗi process Streamlit / runner) nhận job bằng UPDATE có điều kiện status = 'pending'
+-- → chỉ một worker thắng. Worker gia hạn lease_expires_at định kỳ; job running mà lease hết hạn (process chết)
+-- được đưa lại về pending (tối đa Config.JOB_MAX_ATTEMPTS lần nhận).
+-- ==============================================================================
+
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'background_jobs' AND column_name = 'claimed_by') THEN
+    ALTER TABLE background_jobs ADD COLUMN claimed_by TEXT;
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'background_jobs' AND column_name = 'lease_expires_at') THEN
+    ALTER TABLE background_jobs ADD COLUMN lease_expires_at TIMESTAMPTZ;
+  END IF;
+  IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'background_jobs' AND column_name = 'attempts') THEN
+    ALTER TABLE background_jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0;
+  END IF;
+END $$;
+
+COMMENT ON COLUMN background_jobs.claimed_by IS 'V11: id worker đang giữ job (host:pid:rand).';
+COMMENT ON COLUMN background_jobs.lease_expires_at IS 'V11: hạn lease; job running quá hạn được đưa lại pending.';
+COMMENT ON COLUMN background_jobs.attempts IS 'V11: số lần job đã được worker nhận.';
+
+CREATE INDEX IF NOT EXISTS idx_background_jobs_pending ON background_jobs(status, created_at) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_background_jobs_running_lease ON background_jobs(lease_expires_at) WHERE status = 'running';
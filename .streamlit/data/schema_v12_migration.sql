@@ -0,0 +1,18 @@
+-- ==============================================================================
+-- V12 Migration: Ước lượng token mỗi chương (chia lô Data Analyze theo token)
+-- Chạy trong Supabase SQL Editor. Chạy sau V11.
+-- ==============================================================================
+-- chapters.token_estimate: cột sinh tự động = số ký tự content / 4 (cùng công thức AIService.estimate_tokens),
+-- Postgres tính lại mỗi lần lưu chương → core/batch_planner.py đọc ước lượng mà không phải tải content.
+-- Chưa chạy migration: batch planner tự ước lượng từ content.
+-- ==============================================================================
+
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'chapters' AND column_name = 'token_estimate') THEN
+    ALTER TABLE chapters ADD COLUMN token_estimate INTEGER
+      GENERATED ALWAYS AS (char_length(btrim(coalesce(content, ''))) / 4) STORED;
+  END IF;
+END $$;
+
+COMMENT ON COLUMN chapters.token_estimate IS 'V12: ước lượng token của content (ký tự / 4), tự tính khi lưu.';
@@ -0,0 +1,71 @@
+-- ==============================================================================
+-- V13 Migration: RPC dọn orphan cho Đồng bộ dữ liệu toàn cục
+-- Chạy trong Supabase SQL Editor. Chạy sau V12.
+-- ==============================================================================
+-- core/global_data_sync.py gọi global_sync_cleanup_orphans(p_story_id) thay vì tải toàn bộ bảng link về Python
+-- rồi xóa từng dòng. Mỗi bước là một lệnh SQL set-based (NOT EXISTS), trả về số dòng đã sửa:
+--   chunk_bible_links / chunk_timeline_links: link tới chunk / bible / timeline không thuộc project → xóa
+--   entity_relations: source hoặc target không thuộc story_bible của project → xóa
+--   timeline_events / chunks: chapter_id trỏ chương không thuộc project → NULL
+-- Chưa chạy migration: global_data_sync tự dọn phía client (xóa / update theo lô).
+-- ==============================================================================
+
+CREATE OR REPLACE FUNCTION global_sync_cleanup_orphans(p_story_id uuid)
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+  n_cbl integer := 0;
+  n_ctl integer := 0;
+  n_rel integer := 0;
+  n_te integer := 0;
+  n_chunk integer := 0;
+BEGIN
+  DELETE FROM chunk_bible_links l
+  WHERE l.story_id = p_story_id
+    AND (
+      NOT EXISTS (SELECT 1 FROM chunks c WHERE c.id = l.chunk_id AND c.story_id = p_story_id)
+      OR NOT EXISTS (SELECT 1 FROM story_bible b WHERE b.id = l.bible_entry_id AND b.story_id = p_story_id)
+    );
+  GET DIAGNOSTICS n_cbl = ROW_COUNT;
+
+  DELETE FROM chunk_timeline_links l
+  WHERE l.story_id = p_story_id
+    AND (
+      NOT EXISTS (SELECT 1 FROM chunks c WHERE c.id = l.chunk_id AND c.story_id = p_story_id)
+      OR NOT EXISTS (SELECT 1 FROM timeline_events t WHERE t.id = l.timeline_event_id AND t.story_id = p_story_id)
+    );
+  GET DIAGNOSTICS n_ctl = ROW_COUNT;
+
+  DELETE FROM entity_relations r
+  WHERE r.story_id = p_story_id
+    AND (
+      NOT EXISTS (SELECT 1 FROM story_bible b WHERE b.id = r.source_entity_id AND b.story_id = p_story_id)
+      OR NOT EXISTS (SELECT 1 FROM story_bible b WHERE b.id = r.target_entity_id AND b.story_id = p_story_id)
+    );
+  GET DIAGNOSTICS n_rel = ROW_COUNT;
+
+  UPDATE timeline_events t SET chapter_id = NULL
+  WHERE t.story_id = p_story_id
+    AND t.chapter_id IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM chapters ch WHERE ch.id = t.chapter_id AND ch.story_id = p_story_id);
+  GET DIAGNOSTICS n_te = ROW_COUNT;
+
+  UPDATE chunks c SET chapter_id = NULL
+  WHERE c.story_id = p_story_id
+    AND c.chapter_id IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM chapters ch WHERE ch.id = c.chapter_id AND ch.story_id = p_story_id);
+  GET DIAGNOSTICS n_chunk = ROW_COUNT;
+
+  RETURN jsonb_build_object(
+    'chunk_bible_links', n_cbl,
+    'chunk_timeline_links', n_ctl,
+    'entity_relations', n_rel,
+    'timeline_events', n_te,
+    'chunks', n_chunk
+  );
+END;
+$$;
+
+COMMENT ON FUNCTION global_sync_cleanup_orphans(uuid) IS 'V13: Dọn orphan link / relation / chapter_id của một project trong một lần gọi (Đồng bộ toàn cục).';
@@ -0,0 +1,47 @@
+-- ==============================================================================
+-- V14 Migration: Đồng bộ toàn cục tăng dần (watermark theo project)
+-- Chạy trong Supabase SQL Editor. Chạy sau V13.
+-- ==============================================================================
+-- 1) updated_at (+ trigger tự cập nhật khi UPDATE) trên các bảng mà global_data_sync xét.
+--    Dòng cũ nhận updated_at = thời điểm chạy migration → lần incremental đầu tiên tương đương quét toàn bộ.
+-- 2) global_sync_state: mỗi project một dòng — thời điểm đồng bộ gần nhất và watermark (updated_at lớn nhất đã xử lý).
+--    run_global_data_sync(mode="incremental") chỉ xét dòng có updated_at > watermark và các chương chúng chạm tới.
+-- Chưa chạy migration: mode incremental tự quay về quét toàn bộ.
+-- ==============================================================================
+
+CREATE OR REPLACE FUNCTION touch_updated_at()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  NEW.updated_at := NOW();
+  RETURN NEW;
+END;
+$$;
+
+DO $$
+DECLARE
+  t text;
+BEGIN
+  FOREACH t IN ARRAY ARRAY['story_bible', 'chunks', 'timeline_events', 'entity_relations', 'chunk_bible_links', 'chunk_timeline_links']
+  LOOP
+    IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = t AND column_name = 'updated_at') THEN
+      EXECUTE format('ALTER TABLE %I ADD COLUMN updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()', t);
+    END IF;
+    EXECUTE format('DROP TRIGGER IF EXISTS trg_%s_touch_updated_at ON %I', t, t);
+    EXECUTE format('CREATE TRIGGER trg_%s_touch_updated_at BEFORE UPDATE ON %I FOR EACH ROW EXECUTE FUNCTION touch_updated_at()', t, t);
+    EXECUTE format('CREATE INDEX IF NOT EXISTS idx_%s_story_updated ON %I(story_id, updated_at)', t, t);
+  END LOOP;
+END $$;
+
+CREATE TABLE IF NOT EXISTS global_sync_state (
+  story_id UUID PRIMARY KEY REFERENCES stories(id) ON DELETE CASCADE,
+  last_sync_at TIMESTAMPTZ,
+  last_full_sync_at TIMESTAMPTZ,
+  watermark TIMESTAMPTZ,
+  last_mode TEXT,
+  last_changed_rows INTEGER DEFAULT 0
+);
+
+COMMENT ON TABLE global_sync_state IS 'V14: Watermark đồng bộ toàn cục theo project (global_data_sync incremental).';
+COMMENT ON COLUMN global_sync_state.watermark IS 'V14: updated_at lớn nhất đã xử lý; lần incremental sau chỉ xét dòng mới hơn.';
@@ -0,0 +1,26 @@
+-- ==============================================================================
+-- V15 Migration: Tiến độ và hủy job background (core/job_progress.py)
+-- Chạy trong Supabase SQL Editor. Chạy sau V14.
+-- ==============================================================================
+-- 1) progress_*: worker job dài (unified_chapter_range, data_operation_batch, global_data_sync) ghi tiến độ
+--    tối đa mỗi Config.JOB_PROGRESS_MIN_INTERVAL_SEC giây; tab Background Jobs hiện thanh tiến độ + ETA.
+-- 2) cancel_requested: nút Hủy bật cờ cho job running; worker đọc cờ giữa các chương / lô / bước rồi dừng.
+-- 3) status 'cancelled': job pending hủy ngay, job running dừng xong thì ghi cancelled.
+-- Chưa chạy migration: không có tiến độ, job running không hủy được, job pending hủy → failed.
+-- ==============================================================================
+
+ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS progress_current INTEGER;
+ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS progress_total INTEGER;
+ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS progress_eta_sec INTEGER;
+ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS progress_message TEXT;
+ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS progress_updated_at TIMESTAMPTZ;
+ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS cancel_requested BOOLEAN NOT NULL DEFAULT false;
+
+ALTER TABLE background_jobs DROP CONSTRAINT IF EXISTS background_jobs_status_check;
+ALTER TABLE background_jobs ADD CONSTRAINT background_jobs_status_check
+  CHECK (status IN ('pending', 'running', 'completed', 'failed', 'cancelled'));
+
+COMMENT ON COLUMN background_jobs.progress_current IS 'V15: số đơn vị (chương / bước) đã xử lý.';
+COMMENT ON COLUMN background_jobs.progress_total IS 'V15: tổng số đơn vị của job.';
+COMMENT ON COLUMN background_jobs.progress_eta_sec IS 'V15: thời gian còn lại ước lượng (giây).';
+COMMENT ON COLUMN background_jobs.cancel_requested IS 'V15: người dùng yêu cầu hủy; worker dừng ở mốc kế tiếp.';
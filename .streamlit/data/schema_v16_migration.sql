@@ -0,0 +1,24 @@
+-- ==============================================================================
+-- V16 Migration: Lane ưu tiên cho hàng đợi background_jobs (core/job_queue.py)
+-- Chạy trong Supabase SQL Editor. Chạy sau V15.
+-- ==============================================================================
+-- priority: interactive (người dùng đang chờ, vd. phân tích 1 chương) > normal > bulk (khoảng chương, đồng bộ toàn cục).
+-- Worker chọn job theo lane sau aging (chờ mỗi Config.JOB_PRIORITY_AGING_SEC giây được nâng một lane), rồi fair share
+-- theo user / project, rồi created_at. Chưa chạy migration: lane suy ra từ job_type (Config.JOB_PRIORITY_BY_TYPE).
+-- ==============================================================================
+
+ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS priority TEXT NOT NULL DEFAULT 'normal';
+
+ALTER TABLE background_jobs DROP CONSTRAINT IF EXISTS background_jobs_priority_check;
+ALTER TABLE background_jobs ADD CONSTRAINT background_jobs_priority_check
+  CHECK (priority IN ('interactive', 'normal', 'bulk'));
+
+-- Job cũ: lane theo job_type (khớp Config.JOB_PRIORITY_BY_TYPE mặc định).
+UPDATE background_jobs SET priority = 'interactive'
+WHERE job_type IN ('unified_chapter_analyze', 'data_analyze_bible', 'data_analyze_relation', 'data_analyze_timeline', 'data_analyze_chunk');
+UPDATE background_jobs SET priority = 'bulk'
+WHERE job_type IN ('unified_chapter_range', 'global_data_sync');
+
+COMMENT ON COLUMN background_jobs.priority IS 'V16: lane ưu tiên interactive | normal | bulk.';
+
+CREATE INDEX IF NOT EXISTS idx_background_jobs_pending_priority ON background_jobs(priority, created_at) WHERE status = 'pending';
@@ -0,0 +1,25 @@
+-- ==============================================================================
+-- V17 Migration: Đánh thức runner hàng đợi bằng Postgres NOTIFY (core/job_runner.py)
+-- Chạy trong Supabase SQL Editor. Chạy sau V16.
+-- ==============================================================================
+-- INSERT job pending (hoặc job quay lại pending khi lease hết hạn) → pg_notify('background_jobs_wake', id).
+-- Runner (python -m core.job_runner) LISTEN kênh này qua Config.JOB_RUNNER_DATABASE_URL nên nhận job gần như ngay,
+-- kể cả job tạo từ máy khác. Chưa chạy migration: runner vẫn nhận tín hiệu UDP cùng máy + polling fallback.
+-- ==============================================================================
+
+CREATE OR REPLACE FUNCTION notify_background_job_pending()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF NEW.status = 'pending' AND (TG_OP = 'INSERT' OR OLD.status IS DISTINCT FROM 'pending') THEN
+    PERFORM pg_notify('background_jobs_wake', NEW.id::text);
+  END IF;
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_background_jobs_notify ON background_jobs;
+CREATE TRIGGER trg_background_jobs_notify
+  AFTER INSERT OR UPDATE OF status ON background_jobs
+  FOR EACH ROW EXECUTE FUNCTION notify_background_job_pending();
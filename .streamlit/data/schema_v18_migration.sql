@@ -0,0 +1,60 @@
+-- ==============================================================================
+-- V18 Migration: Version cho snapshot tổng quan project (ai/project_overview.py)
+-- Chạy trong Supabase SQL Editor. Chạy sau V17.
+-- ==============================================================================
+-- project_overview_versions.version tăng mỗi khi chapters / arcs / story_bible của project đổi.
+-- App giữ snapshot tổng quan (arcs, chương, bible index, số lượng) trong process; mỗi lượt chat chỉ đọc một dòng version,
+-- khớp thì dùng lại snapshot. story_bible: bỏ qua UPDATE chỉ đổi lookup_count / last_lookup_at (tăng ở mỗi lần tìm kiếm).
+-- Chưa chạy migration: snapshot hết hạn sau Config.PROJECT_OVERVIEW_TTL_NO_VERSION_SEC giây.
+-- ==============================================================================
+
+CREATE TABLE IF NOT EXISTS project_overview_versions (
+  story_id UUID PRIMARY KEY REFERENCES stories(id) ON DELETE CASCADE,
+  version BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+COMMENT ON TABLE project_overview_versions IS 'V18: version tổng quan project; trigger tăng khi chapters / arcs / story_bible đổi.';
+
+CREATE OR REPLACE FUNCTION bump_project_overview_version()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  sid UUID;
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    sid := OLD.story_id;
+  ELSE
+    sid := NEW.story_id;
+  END IF;
+  IF sid IS NOT NULL THEN
+    INSERT INTO project_overview_versions (story_id, version, updated_at)
+    VALUES (sid, 1, now())
+    ON CONFLICT (story_id) DO UPDATE
+      SET version = project_overview_versions.version + 1, updated_at = now();
+  END IF;
+  IF TG_OP = 'UPDATE' AND OLD.story_id IS DISTINCT FROM NEW.story_id AND OLD.story_id IS NOT NULL THEN
+    INSERT INTO project_overview_versions (story_id, version, updated_at)
+    VALUES (OLD.story_id, 1, now())
+    ON CONFLICT (story_id) DO UPDATE
+      SET version = project_overview_versions.version + 1, updated_at = now();
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_chapters_overview_version ON chapters;
+CREATE TRIGGER trg_chapters_overview_version
+  AFTER INSERT OR DELETE OR UPDATE OF story_id, chapter_number, title, arc_id ON chapters
+  FOR EACH ROW EXECUTE FUNCTION bump_project_overview_version();
+
+DROP TRIGGER IF EXISTS trg_arcs_overview_version ON arcs;
+CREATE TRIGGER trg_arcs_overview_version
+  AFTER INSERT OR DELETE OR UPDATE ON arcs
+  FOR EACH ROW EXECUTE FUNCTION bump_project_overview_version();
+
+DROP TRIGGER IF EXISTS trg_story_bible_overview_version ON story_bible;
+CREATE TRIGGER trg_story_bible_overview_version
+  AFTER INSERT OR DELETE OR UPDATE OF story_id, entity_name, parent_id, importance_bias ON story_bible
+  FOR EACH ROW EXECUTE FUNCTION bump_project_overview_version();
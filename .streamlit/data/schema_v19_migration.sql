@@ -0,0 +1,19 @@
+-- ==============================================================================
+-- V19 Migration: Dữ liệu huấn luyện intent cục bộ trong chat_turn_logs (ai/intent_classifier.py)
+-- Chạy trong Supabase SQL Editor. Chạy sau V18.
+-- ==============================================================================
+-- query_text: câu user; router_intent: intent bước 1; intent_source: llm (LLM router gán) | local (bộ cục bộ gán).
+-- Bộ phân loại cục bộ chỉ học từ dòng intent_source = 'llm' (không tự học lại dự đoán của chính nó).
+-- Chưa chạy migration: log như cũ, bộ cục bộ chỉ học từ semantic_intent đã duyệt.
+-- ==============================================================================
+
+ALTER TABLE chat_turn_logs ADD COLUMN IF NOT EXISTS query_text TEXT;
+ALTER TABLE chat_turn_logs ADD COLUMN IF NOT EXISTS router_intent TEXT;
+ALTER TABLE chat_turn_logs ADD COLUMN IF NOT EXISTS intent_source TEXT;
+
+COMMENT ON COLUMN chat_turn_logs.query_text IS 'V19: câu user (tối đa 1000 ký tự).';
+COMMENT ON COLUMN chat_turn_logs.router_intent IS 'V19: intent bước 1 (router).';
+COMMENT ON COLUMN chat_turn_logs.intent_source IS 'V19: llm | local — nguồn intent bước 1.';
+
+CREATE INDEX IF NOT EXISTS idx_chat_turn_logs_intent_training
+  ON chat_turn_logs(story_id, created_at DESC) WHERE intent_source = 'llm';
@@ -0,0 +1,25 @@
+-- ==============================================================================
+-- V20 Migration: Digest nhiều cỡ cho từng chương (ai/chapter_digest.py)
+-- Chạy trong Supabase SQL Editor. Chạy sau V19.
+-- ==============================================================================
+-- Mỗi chương có digest ~100 / 400 / 1500 token (Config.CHAPTER_DIGEST_LEVELS), khóa theo md5 nội dung chương:
+-- chương sửa nội dung → hash mới → dựng lại; chỉ đổi số chương / tiêu đề → dùng lại digest cũ.
+-- Dựng nền khi lưu chương (Workstation, import, duyệt yêu cầu sửa) và sau Unified analyze.
+-- Context theo chapter_range chọn cỡ digest vừa ngân sách token thay cho bỏ nội dung chương.
+-- Chưa chạy migration: context chương như cũ (toàn văn, hết token thì chỉ summary).
+-- ==============================================================================
+
+CREATE TABLE IF NOT EXISTS chapter_digests (
+  story_id UUID NOT NULL REFERENCES stories(id) ON DELETE CASCADE,
+  content_hash TEXT NOT NULL,
+  chapter_number INTEGER,
+  digests JSONB NOT NULL DEFAULT '{}'::jsonb,
+  model TEXT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (story_id, content_hash)
+);
+
+COMMENT ON TABLE chapter_digests IS 'V20: digest chương theo cỡ token ({"100": ..., "400": ..., "1500": ...}), khóa theo md5 nội dung.';
+COMMENT ON COLUMN chapter_digests.chapter_number IS 'V20: số chương lúc dựng (để dọn digest cũ khi chương đổi nội dung).';
+
+CREATE INDEX IF NOT EXISTS idx_chapter_digests_story_chapter ON chapter_digests(story_id, chapter_number);
@@ -1,5 +1,6 @@
 # ai/ - Package tách từ ai_engine (Router, Context, Service, helpers)
 from ai.service import AIService, _get_default_tool_model
+from ai.async_service import AsyncAIService, run_sync, gather_sync
 from ai.context_helpers import (
     get_mandatory_rules,
     resolve_chapter_range,
@@ -22,6 +23,9 @@ from ai.rule_mining import RuleMiningSystem
 __all__ = [
     "AIService",
     "_get_default_tool_model",
+    "AsyncAIService",
+    "run_sync",
+    "gather_sync",
     "get_mandatory_rules",
     "resolve_chapter_range",
     "get_entity_relations",
@@ -0,0 +1,207 @@
+# ai/async_service.py - AsyncAIService: bản asyncio của AIService (chat + embedding) với giới hạn đồng thời theo model
+"""
+Dùng khi nhiều lệnh gọi LLM/embedding độc lập trong một turn có thể chạy chồng lên nhau thay vì nối tiếp.
+
+- acall_openrouter / aget_embedding / aget_embeddings_batch: cùng tham số và cách xử lý lỗi như AIService.
+- Mỗi model có một asyncio.Semaphore (Config.OPENROUTER_MAX_CONCURRENCY_PER_MODEL, ghi đè qua OPENROUTER_MODEL_CONCURRENCY).
+- acall_openrouter dùng chung limiter tốc độ theo model với bản sync (ai/rate_limiter.py).
+- run_sync / gather_sync: cầu nối đồng bộ. Coroutine chạy trên một event loop nền riêng của process nên gọi được
+  từ thread script Streamlit và worker nền mà không đụng loop của Streamlit.
+"""
+import asyncio
+import threading
+import weakref
+from typing import Any, Awaitable, Dict, List, Optional
+
+from config import Config
+from ai.client_pool import get_async_openrouter_client
+from ai.embedding_cache import get_embedding_cache
+from ai.rate_limiter import get_rate_limiter, record_error
+from ai.response_cache import lookup_cached_response, store_cached_response
+
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+_semaphores_lock = threading.Lock()
+
+_bridge_loop: Optional[asyncio.AbstractEventLoop] = None
+_bridge_thread: Optional[threading.Thread] = None
+_bridge_lock = threading.Lock()
+
+
+def get_model_concurrency(model: str) -> int:
+    """Số request đồng thời tối đa cho một model (bỏ hậu tố :nitro/:floor khi tra cấu hình)."""
+    overrides = getattr(Config, "OPENROUTER_MODEL_CONCURRENCY", None) or {}
+    base_model = (model or "").split(":")[0]
+    limit = overrides.get(model) or overrides.get(base_model) or getattr(Config, "OPENROUTER_MAX_CONCURRENCY_PER_MODEL", 8)
+    return max(1, int(limit))
+
+
+def _model_semaphore(model: str) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    with _semaphores_lock:
+        per_loop = _semaphores.setdefault(loop, {})
+        sem = per_loop.get(model)
+        if sem is None:
+            sem = asyncio.Semaphore(get_model_concurrency(model))
+            per_loop[model] = sem
+        return sem
+
+
+def _get_bridge_loop() -> asyncio.AbstractEventLoop:
+    global _bridge_loop, _bridge_thread
+    with _bridge_lock:
+        if _bridge_loop is None or _bridge_loop.is_closed() or not (_bridge_thread and _bridge_thread.is_alive()):
+            loop = asyncio.new_event_loop()
+            t = threading.Thread(target=loop.run_forever, name="ai-async-bridge", daemon=True)
+            t.start()
+            _bridge_loop, _bridge_thread = loop, t
+        return _bridge_loop
+
+
+def run_sync(coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+    """Chạy coroutine trên event loop nền và chờ kết quả (chặn thread gọi). Không gọi từ chính coroutine trên loop nền."""
+    loop = _get_bridge_loop()
+    if threading.current_thread() is _bridge_thread:
+        raise RuntimeError("run_sync không được gọi từ bên trong event loop nền (dùng await).")
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    return future.result(timeout=timeout)
+
+
+def gather_sync(coros: List[Awaitable[Any]], return_exceptions: bool = True, timeout: Optional[float] = None) -> List[Any]:
+    """Chạy song song nhiều coroutine, trả về list kết quả cùng thứ tự (lỗi trả về dạng Exception nếu return_exceptions)."""
+    if not coros:
+        return []
+
+    async def _gather():
+        return await asyncio.gather(*coros, return_exceptions=return_exceptions)
+
+    return run_sync(_gather(), timeout=timeout)
+
+
+class AsyncAIService:
+    """Bản async của AIService: chia sẻ AsyncOpenAI client theo loop, giới hạn đồng thời theo model."""
+
+    @staticmethod
+    async def acall_openrouter(
+        messages: List[Dict],
+        model: str,
+        temperature: float = 0.7,
+        max_tokens: int = 8000,
+        stream: bool = False,
+        response_format: Optional[Dict] = None,
+        cache_site: Optional[str] = None,
+    ) -> Any:
+        """Gọi OpenRouter API (async). Lỗi ném Exception giống AIService.call_openrouter; cache_site như bản sync."""
+        cache_key, cached = lookup_cached_response(
+            cache_site, model, messages, temperature, max_tokens, response_format, stream
+        )
+        if cached is not None:
+            return cached
+        limiter = get_rate_limiter(model)
+        max_retries = int(getattr(Config, "RATE_LIMIT_MAX_RETRIES", 2))
+        max_wait = float(getattr(Config, "RATE_LIMIT_MAX_WAIT_SEC", 120))
+        attempt = 0
+        while True:
+            try:
+                client = get_async_openrouter_client()
+                extra = {"provider": {"sort": "throughput"}}
+                async with _model_semaphore(model):
+                    if limiter is not None:
+                        wait = limiter.reserve()
+                        if wait > 0:
+                            await asyncio.sleep(min(wait, max_wait))
+                    response = await client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stream=stream,
+                        response_format=response_format,
+                        extra_body=extra,
+                    )
+                if limiter is not None:
+                    limiter.on_success()
+                break
+            except Exception as e:
+                if record_error(limiter, e) and attempt < max_retries:
+                    attempt += 1
+                    continue
+                raise Exception(f"OpenRouter API error: {str(e)}")
+        if cache_key:
+            store_cached_response(cache_key, cache_site, model, response)
+        return response
+
+    @staticmethod
+    async def aget_embedding(text: str) -> Optional[List[float]]:
+        """Lấy embedding (async). Text rỗng hoặc lỗi → None."""
+        if not text or not isinstance(text, str) or not text.strip():
+            return None
+        cache = get_embedding_cache()
+        if cache is not None:
+            cached = cache.get(Config.EMBEDDING_MODEL, text)
+            if cached is not None:
+                return cached
+        try:
+            client = get_async_openrouter_client()
+            async with _model_semaphore(Config.EMBEDDING_MODEL):
+                response = await client.embeddings.create(
+                    model=Config.EMBEDDING_MODEL,
+                    input=text
+                )
+            embedding = response.data[0].embedding
+            if cache is not None and embedding:
+                cache.put(Config.EMBEDDING_MODEL, text, embedding)
+            return embedding
+        except Exception as e:
+            print(f"Embedding error: {e}")
+            return None
+
+    @staticmethod
+    async def aget_embeddings_batch(texts: List[str], batch_size: int = 100) -> List[Optional[List[float]]]:
+        """Embedding hàng loạt (async): chỉ text chưa có trong cache mới gửi đi, các lô batch_size chạy song song. Phần tử lỗi là None."""
+        if not texts:
+            return []
+        out: List[Optional[List[float]]] = [None] * len(texts)
+        valid_indices: List[int] = []
+        valid_texts: List[str] = []
+        for i, t in enumerate(texts):
+            if t and isinstance(t, str) and t.strip():
+                valid_indices.append(i)
+                valid_texts.append(t.strip())
+        if not valid_texts:
+            return out
+        cache = get_embedding_cache()
+        if cache is not None:
+            cached = cache.get_many(Config.EMBEDDING_MODEL, valid_texts)
+            misses = [(idx, text) for idx, text, vec in zip(valid_indices, valid_texts, cached) if vec is None]
+            for idx, vec in zip(valid_indices, cached):
+                if vec is not None:
+                    out[idx] = vec
+            valid_indices = [m[0] for m in misses]
+            valid_texts = [m[1] for m in misses]
+            if not valid_texts:
+                return out
+
+        async def _one_batch(start: int) -> None:
+            chunk = valid_texts[start:start + batch_size]
+            chunk_indices = valid_indices[start:start + batch_size]
+            client = get_async_openrouter_client()
+            async with _model_semaphore(Config.EMBEDDING_MODEL):
+                response = await client.embeddings.create(
+                    model=Config.EMBEDDING_MODEL,
+                    input=chunk
+                )
+            for j, emb_obj in enumerate(response.data):
+                idx = chunk_indices[j] if j < len(chunk_indices) else start + j
+                if idx < len(out) and emb_obj.embedding is not None:
+                    out[idx] = emb_obj.embedding
+            if cache is not None:
+                cache.put_many(Config.EMBEDDING_MODEL, chunk, [out[i] for i in chunk_indices])
+
+        results = await asyncio.gather(
+            *[_one_batch(s) for s in range(0, len(valid_texts), batch_size)],
+            return_exceptions=True,
+        )
+        for r in results:
+            if isinstance(r, Exception):
+                print(f"Embedding batch error: {r}")
+        return out
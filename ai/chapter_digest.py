@@ -0,0 +1,347 @@
+# ai/chapter_digest.py - Digest nhiều cỡ cho từng chương (~100 / 400 / 1500 token), khóa theo hash nội dung chương
+"""
+Câu hỏi trên khoảng chương dài trước đây nạp toàn văn (load_chapters_by_range / load_full_content), hết token thì chỉ còn
+summary 2-4 câu. Lớp digest:
+
+- Bảng chapter_digests (V20): (story_id, content_hash) → digests {"100": ..., "400": ..., "1500": ...}. content_hash = md5
+  nội dung chương: sửa nội dung → hash mới → dựng lại; chỉ đổi số chương / tiêu đề → dùng lại digest cũ.
+- Dựng tăng dần (refresh_chapter_digest): khi lưu chương (schedule_chapter_digest chạy nền, tối đa
+  Config.CHAPTER_DIGEST_MAX_INFLIGHT song song) và sau Unified analyze; hash đã có digest thì bỏ qua. Một lệnh gọi LLM sinh
+  mọi cỡ (cỡ nhỏ rút gọn từ cỡ lớn); cỡ không nhỏ hơn độ dài chương thì dùng nguyên văn, không gọi LLM.
+- Đọc (render_chapters_with_digests): toàn văn vừa ngân sách → None (caller giữ đường cũ). Không vừa → mọi chương cùng
+  cỡ digest lớn nhất còn vừa, phần dư nâng cấp chương ưu tiên (chương focus / cuối khoảng) lên cỡ lớn hơn hoặc toàn văn;
+  cỡ nhỏ nhất vẫn không vừa thì bỏ các chương đầu khoảng. DB chưa chạy V20 hoặc chưa có digest nào → None.
+"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config import Config, init_services
+
+# Đọc / ghi lỗi (chưa có bảng V20) → không thử lại trong chừng này giây.
+_TABLE_RETRY_SEC = 300
+# Token cộng thêm mỗi chương cho dòng tiêu đề / nhãn block.
+_BLOCK_OVERHEAD_TOKENS = 20
+
+_table_unsupported_until = 0.0
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_scheduled: Dict[Tuple[str, str], bool] = {}
+
+
+def _tokens(text: Optional[str]) -> int:
+    from ai.service import AIService
+
+    return AIService.estimate_tokens(text or "")
+
+
+def chapter_content_hash(content: Optional[str]) -> str:
+    """md5 của nội dung chương (đã strip) — khóa digest."""
+    return hashlib.md5((content or "").strip().encode("utf-8")).hexdigest()
+
+
+def digest_levels() -> List[int]:
+    levels = getattr(Config, "CHAPTER_DIGEST_LEVELS", (100, 400, 1500)) or (100, 400, 1500)
+    return sorted({int(lv) for lv in levels if int(lv) > 0})
+
+
+def _digest_model() -> str:
+    return getattr(Config, "CHAPTER_DIGEST_MODEL", None) or Config.METADATA_MODEL
+
+
+def generate_chapter_digests(content: str, title: str = "") -> Optional[Dict[str, str]]:
+    """Digest mọi cỡ cho một chương ({"100": ..., ...}); None nếu LLM lỗi."""
+    from ai.service import AIService
+
+    content = (content or "").strip()
+    if not content:
+        return None
+    levels = digest_levels()
+    content_tokens = _tokens(content)
+    out = {str(lv): content for lv in levels if lv >= content_tokens}
+    need = [lv for lv in levels if lv < content_tokens]
+    if not need:
+        return out
+    max_chars = int(getattr(Config, "CHAPTER_DIGEST_MAX_INPUT_TOKENS", 60000)) * 4
+    spec = "\n".join(
+        f'- "{lv}": bản tóm lược khoảng {lv} token (~{lv * 3 // 4} từ)' for lv in sorted(need, reverse=True)
+    )
+    prompt = f"""Tóm lược chương truyện dưới đây thành nhiều cỡ, từ dài đến ngắn. Mỗi bản ngắn hơn rút gọn từ bản dài hơn
+(giữ sự kiện, nhân vật, quan hệ và chi tiết quan trọng nhất; đúng thứ tự diễn biến; không thêm chi tiết ngoài văn bản).
+Trả về ĐÚNG MỘT JSON với các key:
+{spec}
+
+CHƯƠNG: {title or "(không tiêu đề)"}
+{content[:max_chars]}
+
+Chỉ trả về JSON."""
+    try:
+        response = AIService.call_openrouter(
+            messages=[{"role": "user", "content": prompt}],
+            model=_digest_model(),
+            temperature=0.2,
+            max_tokens=min(16000, int(sum(need) * 1.5) + 500),
+            response_format={"type": "json_object"},
+        )
+        data = json.loads(AIService.clean_json_text(response.choices[0].message.content or "{}"))
+    except Exception as e:
+        print(f"generate_chapter_digests error: {e}")
+        return None
+    for lv in need:
+        text = str(data.get(str(lv)) or "").strip()
+        if not text:
+            return None
+        out[str(lv)] = text
+    return out
+
+
+def load_chapter_digests(supabase, project_id: str, hashes: Iterable[str]) -> Optional[Dict[str, Dict[str, str]]]:
+    """{content_hash: digests} cho các hash có digest; None nếu DB chưa có bảng chapter_digests."""
+    global _table_unsupported_until
+    hashes = sorted({h for h in hashes if h})
+    if time.monotonic() < _table_unsupported_until:
+        return None
+    if not hashes:
+        return {}
+    out: Dict[str, Dict[str, str]] = {}
+    try:
+        for i in range(0, len(hashes), 200):
+            r = (
+                supabase.table("chapter_digests").select("content_hash, digests")
+                .eq("story_id", project_id).in_("content_hash", hashes[i:i + 200]).execute()
+            )
+            for row in r.data or []:
+                if isinstance(row.get("digests"), dict):
+                    out[row["content_hash"]] = row["digests"]
+    except Exception as e:
+        print(f"load_chapter_digests error: {e}")
+        _table_unsupported_until = time.monotonic() + _TABLE_RETRY_SEC
+        return None
+    return out
+
+
+def refresh_chapter_digest(
+    supabase,
+    project_id: str,
+    chapter_number: Optional[int],
+    content: str,
+    title: str = "",
+    force: bool = False,
+) -> bool:
+    """Dựng digest cho nội dung chương nếu hash chưa có (hoặc force). True nếu đã ghi digest mới."""
+    content = (content or "").strip()
+    if not content or not project_id or not getattr(Config, "CHAPTER_DIGEST_ENABLED", True):
+        return False
+    content_hash = chapter_content_hash(content)
+    if not force:
+        existing = load_chapter_digests(supabase, project_id, [content_hash])
+        if existing is None or content_hash in existing:
+            return False
+    digests = generate_chapter_digests(content, title)
+    if not digests:
+        return False
+    try:
+        supabase.table("chapter_digests").upsert(
+            {
+                "story_id": project_id,
+                "content_hash": content_hash,
+                "chapter_number": chapter_number,
+                "digests": digests,
+                "model": _digest_model(),
+            },
+            on_conflict="story_id,content_hash",
+        ).execute()
+        if chapter_number is not None:
+            # Digest của nội dung cũ cùng chương không còn dùng.
+            supabase.table("chapter_digests").delete().eq("story_id", project_id).eq(
+                "chapter_number", chapter_number
+            ).neq("content_hash", content_hash).execute()
+    except Exception as e:
+        print(f"refresh_chapter_digest error: {e}")
+        return False
+    return True
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, int(getattr(Config, "CHAPTER_DIGEST_MAX_INFLIGHT", 2))),
+                thread_name_prefix="chapter-digest",
+            )
+        return _executor
+
+
+def schedule_chapter_digest(project_id: str, chapter_number: Optional[int], content: str, title: str = "") -> None:
+    """Dựng digest nền sau khi lưu chương (không chặn UI); cùng nội dung đang chờ thì không xếp lại."""
+    content = (content or "").strip()
+    if not content or not project_id or not getattr(Config, "CHAPTER_DIGEST_ENABLED", True):
+        return
+    key = (str(project_id), chapter_content_hash(content))
+    with _executor_lock:
+        if key in _scheduled:
+            return
+        _scheduled[key] = True
+
+    def _run():
+        try:
+            services = init_services()
+            if services:
+                refresh_chapter_digest(services["supabase"], project_id, chapter_number, content, title)
+        except Exception as e:
+            print(f"schedule_chapter_digest error: {e}")
+        finally:
+            with _executor_lock:
+                _scheduled.pop(key, None)
+
+    _get_executor().submit(_run)
+
+
+def _full_cost(item: Dict[str, Any]) -> int:
+    return (
+        item["content_tokens"] + int(item.get("summary_tokens") or 0) + int(item.get("art_style_tokens") or 0)
+        + _BLOCK_OVERHEAD_TOKENS
+    )
+
+
+def plan_chapter_context(
+    items: List[Dict[str, Any]],
+    budget: int,
+    priority: Optional[List[int]] = None,
+) -> List[Tuple[str, Optional[int]]]:
+    """
+    Chọn cách đưa từng chương vào context trong budget token. items: {"content_tokens", "digests" (cỡ → text) | None,
+    "summary_tokens", "art_style_tokens"}. priority: thứ tự chỉ số được nâng cấp trước (mặc định từ chương cuối về đầu).
+    Chi phí mỗi cách tính đúng phần render_chapters_with_digests ghi: full = summary + art_style + content,
+    digest = art_style + digest, summary = summary + art_style.
+    Trả về mỗi chương ("full", None) | ("digest", cỡ) | ("summary", None) | ("omit", None).
+    """
+    n = len(items)
+    if budget <= 0 or sum(_full_cost(it) for it in items) <= budget:
+        return [("full", None)] * n
+    levels = digest_levels()
+    options: List[List[Tuple[str, Optional[int], int]]] = []
+    for it in items:
+        opts: List[Tuple[str, Optional[int], int]] = []
+        digests = it.get("digests") or {}
+        art_style = int(it.get("art_style_tokens") or 0) + _BLOCK_OVERHEAD_TOKENS
+        for lv in levels:
+            text = digests.get(str(lv))
+            if text:
+                opts.append(("digest", lv, _tokens(text) + art_style))
+        if not opts:
+            opts.append(("summary", None, int(it.get("summary_tokens") or 0) + art_style))
+        opts.append(("full", None, _full_cost(it)))
+        options.append(opts)
+
+    def _pick(opts, level):
+        # Cỡ digest lớn nhất <= level (chương thiếu digest: summary).
+        best = 0
+        for idx, (mode, lv, _cost) in enumerate(opts[:-1]):
+            if mode == "summary" or lv <= level:
+                best = idx
+        return best
+
+    choice = [0] * n
+    for level in sorted(levels, reverse=True):
+        trial = [_pick(opts, level) for opts in options]
+        if sum(options[i][c][2] for i, c in enumerate(trial)) <= budget:
+            choice = trial
+            break
+    used = sum(options[i][c][2] for i, c in enumerate(choice))
+    order = priority if priority is not None else list(range(n - 1, -1, -1))
+    omitted = set()
+    if used > budget:
+        # Cỡ nhỏ nhất vẫn không vừa: bỏ chương ít ưu tiên nhất trước.
+        for i in reversed(order):
+            if used <= budget:
+                break
+            used -= options[i][choice[i]][2]
+            omitted.add(i)
+    for i in order:
+        if i in omitted:
+            continue
+        for c in range(len(options[i]) - 1, choice[i], -1):
+            delta = options[i][c][2] - options[i][choice[i]][2]
+            if delta <= budget - used:
+                used += delta
+                choice[i] = c
+                break
+    return [
+        ("omit", None) if i in omitted else options[i][choice[i]][:2]
+        for i in range(n)
+    ]
+
+
+def render_chapters_with_digests(
+    supabase,
+    project_id: str,
+    rows: List[Dict[str, Any]],
+    token_limit: int,
+    priority: Optional[List[int]] = None,
+    header: str = "",
+) -> Optional[Tuple[str, List[str]]]:
+    """
+    Context cho các chương (rows có content / summary / art_style) trong token_limit, dùng digest khi toàn văn không vừa.
+    None khi không cần (toàn văn vừa), lớp digest tắt, DB chưa có V20 hoặc chưa chương nào có digest.
+    """
+    if not rows or token_limit <= 0 or not getattr(Config, "CHAPTER_DIGEST_ENABLED", True):
+        return None
+    contents = [(row.get("content") or "").strip() for row in rows]
+    items = [
+        {
+            "content_tokens": _tokens(contents[i]),
+            "digests": None,
+            "summary_tokens": _tokens(row.get("summary")),
+            "art_style_tokens": _tokens(row.get("art_style")),
+        }
+        for i, row in enumerate(rows)
+    ]
+    if sum(_full_cost(it) for it in items) <= token_limit:
+        return None
+    hashes = [chapter_content_hash(c) if c else "" for c in contents]
+    stored = load_chapter_digests(supabase, project_id, hashes)
+    if not stored:
+        return None
+    for i, it in enumerate(items):
+        it["digests"] = stored.get(hashes[i]) if contents[i] else None
+    plan = plan_chapter_context(items, token_limit, priority)
+
+    full_text = ""
+    sources: List[str] = []
+    omitted: List[str] = []
+    for i, (row, (mode, level)) in enumerate(zip(rows, plan)):
+        title = row.get("title") or f"Chương {row.get('chapter_number', i + 1)}"
+        if mode == "omit":
+            omitted.append(str(row.get("chapter_number") or title))
+            continue
+        summary = row.get("summary") or ""
+        art_style = row.get("art_style") or ""
+        block = f"\n\n=== 📄 {header}{title} ===\n"
+        if mode == "full":
+            if summary:
+                block += f"[Summary]: {summary}\n"
+            if art_style:
+                block += f"[Art style]: {art_style}\n"
+            if contents[i]:
+                block += f"[Content]:\n{contents[i]}\n"
+            sources.append(f"📄 {title}")
+        elif mode == "digest":
+            if art_style:
+                block += f"[Art style]: {art_style}\n"
+            block += f"[Digest ~{level} token]:\n{items[i]['digests'][str(level)]}\n"
+            sources.append(f"📄 {title} (digest {level})")
+        else:
+            if summary:
+                block += f"[Summary]: {summary}\n(Chỉ tóm tắt do giới hạn token.)\n"
+            if art_style:
+                block += f"[Art style]: {art_style}\n"
+            sources.append(f"📄 {title}")
+        full_text += block
+    if omitted:
+        full_text += f"\n\n(Bỏ qua chương {', '.join(omitted)} do giới hạn token.)\n"
+    return full_text, sources
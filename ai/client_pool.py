@@ -0,0 +1,100 @@
+# ai/client_pool.py - Registry OpenAI client dùng chung (keep-alive connection pool) cho OpenRouter
+"""
+Mỗi lần tạo OpenAI(...) là một connection pool + TLS handshake mới. Module này giữ một client
+cho mỗi cấu hình (base_url, api_key, headers) trong toàn process; httpx.Client an toàn khi dùng
+đồng thời nên các thread Streamlit và worker trong core/background_jobs dùng chung được.
+Bản async (AsyncOpenAI) được giữ riêng cho từng event loop.
+"""
+import asyncio
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+from config import Config
+
+_clients: Dict[Tuple, OpenAI] = {}
+_clients_lock = threading.Lock()
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, AsyncOpenAI]]" = weakref.WeakKeyDictionary()
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(getattr(Config, "OPENROUTER_POOL_MAX_CONNECTIONS", 32)),
+        max_keepalive_connections=int(getattr(Config, "OPENROUTER_POOL_MAX_KEEPALIVE", 16)),
+        keepalive_expiry=float(getattr(Config, "OPENROUTER_POOL_KEEPALIVE_EXPIRY_SEC", 60.0)),
+    )
+
+
+def _pool_timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        float(getattr(Config, "OPENROUTER_READ_TIMEOUT_SEC", 600.0)),
+        connect=float(getattr(Config, "OPENROUTER_CONNECT_TIMEOUT_SEC", 10.0)),
+    )
+
+
+def _resolve_client_config(base_url: Optional[str], api_key: Optional[str]):
+    base_url = base_url or Config.OPENROUTER_BASE_URL
+    api_key = api_key if api_key is not None else Config.OPENROUTER_API_KEY
+    headers = dict(getattr(Config, "OPENROUTER_DEFAULT_HEADERS", None) or {})
+    return base_url, api_key, headers, (base_url, api_key, tuple(sorted(headers.items())))
+
+
+def get_openrouter_client(
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+) -> OpenAI:
+    """Trả về OpenAI client dùng chung cho OpenRouter (tạo lần đầu, các lần sau dùng lại pool)."""
+    base_url, api_key, headers, key = _resolve_client_config(base_url, api_key)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = OpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                default_headers=headers or None,
+                timeout=_pool_timeout(),
+                http_client=httpx.Client(limits=_pool_limits(), timeout=_pool_timeout()),
+            )
+            _clients[key] = client
+        return client
+
+
+def reset_openrouter_clients() -> None:
+    """Đóng và xóa mọi client sync trong registry (sau khi đổi API key / cấu hình pool). Client async bị bỏ khỏi registry."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+        _async_clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+def get_async_openrouter_client(
+    base_url: Optional[str] = None,
+    api_key: Optional[str] = None,
+) -> AsyncOpenAI:
+    """AsyncOpenAI client dùng chung trong event loop hiện tại (httpx.AsyncClient gắn với loop nên registry tách theo loop)."""
+    loop = asyncio.get_running_loop()
+    base_url, api_key, headers, key = _resolve_client_config(base_url, api_key)
+    with _clients_lock:
+        per_loop = _async_clients.setdefault(loop, {})
+        client = per_loop.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                default_headers=headers or None,
+                timeout=_pool_timeout(),
+                http_client=httpx.AsyncClient(limits=_pool_limits(), timeout=_pool_timeout()),
+            )
+            per_loop[key] = client
+        return client
@@ -145,6 +145,7 @@ Trả về đúng một chuỗi, ví dụ: [CHARACTER] hoặc [RULE]."""
             model=model,
             temperature=0.1,
             max_tokens=50,
+            cache_site="import_category",
         )
         raw = (resp.choices[0].message.content or "").strip()
         for p in prefixes:
@@ -181,6 +182,7 @@ Nhiệm vụ: Viết 1 đoạn tóm tắt ngắn gọn (2-5 câu) cho toàn bộ
             model=model,
             temperature=0.3,
             max_tokens=500,
+            cache_site="arc_summary",
         )
         raw = (resp.choices[0].message.content or "").strip()
         return raw if raw else None
@@ -209,6 +211,7 @@ Chỉ trả về JSON."""
             temperature=0.2,
             max_tokens=500,
             response_format={"type": "json_object"},
+            cache_site="chapter_metadata",
         )
         raw = response.choices[0].message.content
         raw = AIService.clean_json_text(raw)
@@ -582,6 +585,7 @@ Chỉ trả về JSON."""
             temperature=0.2,
             max_tokens=500,
             response_format={"type": "json_object"},
+            cache_site="split_strategy",
         )
         raw = (response.choices[0].message.content or "").strip()
         raw = AIService.clean_json_text(raw)
@@ -3,21 +3,12 @@ import json
 from typing import Any, Dict, List, Optional, Tuple
 
 from config import init_services
+from ai.vector_ops import cosine_sim, greedy_dedupe, score_embeddings
 
 
 def _cosine_sim(a: List[float], b: List[float]) -> float:
     """Cosine similarity giữa hai vector. Trả về 0 nếu invalid."""
-    if not a or not b or len(a) != len(b):
-        return 0.0
-    try:
-        dot = sum(x * y for x, y in zip(a, b))
-        na = sum(x * x for x in a) ** 0.5
-        nb = sum(y * y for y in b) ** 0.5
-        if na <= 0 or nb <= 0:
-            return 0.0
-        return dot / (na * nb)
-    except Exception:
-        return 0.0
+    return cosine_sim(a, b)
 
 
 # Ngưỡng mặc định để lọc trùng khi build context (pgvector): >= threshold thì coi là cùng nội dung, chỉ giữ một
@@ -40,46 +31,8 @@ def filter_context_items_by_embedding(
     """
     if not items or similarity_threshold <= 0:
         return items
-    kept: List[Dict[str, Any]] = []
-    for item in items:
-        emb = item.get(embedding_key)
-        if emb is None:
-            kept.append(item)
-            continue
-        if isinstance(emb, str):
-            try:
-                emb = json.loads(emb)
-            except Exception:
-                kept.append(item)
-                continue
-        if not isinstance(emb, (list, tuple)) or len(emb) == 0:
-            kept.append(item)
-            continue
-        emb_list = list(emb)
-        if not all(isinstance(x, (int, float)) for x in emb_list):
-            kept.append(item)
-            continue
-        too_similar = False
-        for k in kept:
-            ke = k.get(embedding_key)
-            if ke is None:
-                continue
-            if isinstance(ke, str):
-                try:
-                    ke = json.loads(ke)
-                except Exception:
-                    continue
-            if not isinstance(ke, (list, tuple)) or len(ke) != len(emb_list):
-                continue
-            ke_list = list(ke)
-            if not all(isinstance(x, (int, float)) for x in ke_list):
-                continue
-            if _cosine_sim(emb_list, ke_list) >= similarity_threshold:
-                too_similar = True
-                break
-        if not too_similar:
-            kept.append(item)
-    return kept
+    keep_idx = greedy_dedupe([item.get(embedding_key) for item in items], similarity_threshold)
+    return [items[i] for i in keep_idx]
 
 
 def get_archived_bible_ids(project_id: str) -> set:
@@ -617,13 +570,9 @@ def get_relevant_info_rules(
 
         seen_contents = set()
         lines: List[str] = []
-        for row in rows:
-            emb = _parse_embedding_vector(row.get("embedding"))
-            if not emb or len(emb) != len(q_vec):
-                continue
-            sim = _cosine_sim(q_vec, emb)
+        for i, sim in score_embeddings(q_vec, [row.get("embedding") for row in rows]):
             if sim >= threshold:
-                c = (row.get("content") or "").strip()
+                c = (rows[i].get("content") or "").strip()
                 if not c or c in seen_contents:
                     continue
                 seen_contents.add(c)
@@ -738,6 +687,59 @@ def get_entity_relations(entity_id: Any, project_id: str) -> str:
     return "\n".join(lines) if lines else ""
 
 
+def search_rows_via_vector_index(
+    project_id: str,
+    kind: str,
+    query_embedding: Any,
+    select_cols: str,
+    k: int,
+    min_sim: Optional[float] = None,
+    where: Optional[Dict[str, Any]] = None,
+    attach_vectors: bool = True,
+) -> Optional[List[Tuple[float, Dict[str, Any]]]]:
+    """
+    Top-k qua index vector trong bộ nhớ (ai/vector_index.py), sau đó chỉ tải payload theo id.
+    Trả [(sim, row)] giảm dần (attach_vectors: row kèm "embedding" = vector trong index để dedupe);
+    None nếu index chưa sẵn sàng → caller dùng đường cũ.
+    """
+    from ai.vector_index import INDEX_SPECS, get_vector_index
+
+    index = get_vector_index(project_id, kind)
+    if index is None:
+        return None
+    services = init_services()
+    if not services:
+        return None
+    table = services["supabase"].table
+    by_id: Dict[str, Dict[str, Any]] = {}
+    # Dòng đã bị xóa ngoài luồng mark_vector_rows_dirty → gỡ khỏi index rồi tìm lại một lần cho đủ k.
+    for _attempt in range(2):
+        hits = index.search(query_embedding, k=k, min_sim=min_sim, where=where)
+        ids = [rid for rid, _ in hits]
+        need = [rid for rid in ids if str(rid) not in by_id]
+        if not need:
+            break
+        r = table(INDEX_SPECS[kind]["table"]).select(select_cols).eq("story_id", project_id).in_("id", need).execute()
+        by_id.update({str(row.get("id")): row for row in (r.data or [])})
+        missing = [rid for rid in need if str(rid) not in by_id]
+        if not missing:
+            break
+        index.remove(missing)
+    if not hits:
+        return []
+    vectors = index.get_vectors(ids) if attach_vectors else {}
+    out = []
+    for rid, sim in hits:
+        row = by_id.get(str(rid))
+        if row is None:
+            continue
+        row = dict(row)
+        if str(rid) in vectors:
+            row["embedding"] = vectors[str(rid)]
+        out.append((sim, row))
+    return out
+
+
 def get_top_relations_by_query(
     project_id: str,
     query_text: str,
@@ -758,13 +760,25 @@ def get_top_relations_by_query(
         if not services:
             return ""
         supabase = services["supabase"]
-        q = supabase.table("entity_relations").select(
-            "id, source_entity_id, target_entity_id, relation_type, description, source_chapter, embedding"
-        ).eq("story_id", project_id).not_.is_("embedding", "null").limit(max_relations)
-        if chapter_numbers is not None and len(chapter_numbers) > 0:
-            q = q.in_("source_chapter", list(chapter_numbers))
-        r = q.execute()
-        rows = list(r.data or [])
+        scored = search_rows_via_vector_index(
+            project_id,
+            "relations",
+            qvec,
+            "id, source_entity_id, target_entity_id, relation_type, description, source_chapter",
+            k=max_relations,
+            min_sim=RELATION_MIN_SIM_FOR_CONTEXT,
+            where={"source_chapter": list(chapter_numbers)} if chapter_numbers else None,
+        )
+        if scored is not None:
+            rows = [row for _, row in scored]
+        else:
+            q = supabase.table("entity_relations").select(
+                "id, source_entity_id, target_entity_id, relation_type, description, source_chapter, embedding"
+            ).eq("story_id", project_id).not_.is_("embedding", "null").limit(max_relations)
+            if chapter_numbers is not None and len(chapter_numbers) > 0:
+                q = q.in_("source_chapter", list(chapter_numbers))
+            r = q.execute()
+            rows = list(r.data or [])
         if not rows:
             return ""
         id_to_name = {}
@@ -778,17 +792,8 @@ def get_top_relations_by_query(
             if sb.data:
                 for x in sb.data:
                     id_to_name[x.get("id")] = (x.get("entity_name") or "").strip()
-        scored = []
-        for row in rows:
-            emb = row.get("embedding")
-            if isinstance(emb, str):
-                try:
-                    emb = json.loads(emb)
-                except Exception:
-                    emb = None
-            if isinstance(emb, list) and len(emb) == len(qvec):
-                sim = _cosine_sim(emb, qvec)
-                scored.append((sim, row))
+        if scored is None:
+            scored = [(sim, rows[i]) for i, sim in score_embeddings(qvec, [row.get("embedding") for row in rows])]
         if not scored:
             return ""
         scored.sort(key=lambda x: -x[0])
@@ -833,28 +838,33 @@ def get_top_timeline_by_query(
         if not services:
             return ""
         supabase = services["supabase"]
-        q = supabase.table("timeline_events").select(
-            "id, title, description, raw_date, event_type, chapter_id, arc_id, embedding"
-        ).eq("story_id", project_id).not_.is_("embedding", "null").limit(max_events)
+        where = None
         if chapter_ids:
-            q = q.in_("chapter_id", chapter_ids[:500])
-        if arc_ids and not chapter_ids:
-            q = q.in_("arc_id", list(arc_ids))
-        r = q.execute()
-        rows = list(r.data or [])
-        if not rows:
-            return ""
-        scored = []
-        for row in rows:
-            emb = row.get("embedding")
-            if isinstance(emb, str):
-                try:
-                    emb = json.loads(emb)
-                except Exception:
-                    emb = None
-            if isinstance(emb, list) and len(emb) == len(qvec):
-                sim = _cosine_sim(emb, qvec)
-                scored.append((sim, row))
+            where = {"chapter_id": chapter_ids[:500]}
+        elif arc_ids:
+            where = {"arc_id": list(arc_ids)}
+        scored = search_rows_via_vector_index(
+            project_id,
+            "timeline",
+            qvec,
+            "id, title, description, raw_date, event_type, chapter_id, arc_id",
+            k=max_events,
+            min_sim=TIMELINE_MIN_SIM_FOR_CONTEXT,
+            where=where,
+        )
+        if scored is None:
+            q = supabase.table("timeline_events").select(
+                "id, title, description, raw_date, event_type, chapter_id, arc_id, embedding"
+            ).eq("story_id", project_id).not_.is_("embedding", "null").limit(max_events)
+            if chapter_ids:
+                q = q.in_("chapter_id", chapter_ids[:500])
+            if arc_ids and not chapter_ids:
+                q = q.in_("arc_id", list(arc_ids))
+            r = q.execute()
+            rows = list(r.data or [])
+            if not rows:
+                return ""
+            scored = [(sim, rows[i]) for i, sim in score_embeddings(qvec, [row.get("embedding") for row in rows])]
         if not scored:
             return ""
         scored.sort(key=lambda x: -x[0])
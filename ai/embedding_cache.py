@@ -0,0 +1,242 @@
+# ai/embedding_cache.py - Cache embedding theo nội dung (model + hash text chuẩn hóa): LRU trong process + SQLite cục bộ
+"""
+Cùng một câu hỏi / đoạn text được embed nhiều lần (semantic intent, build context, rules, relation, timeline,
+chunk search, backfill). Cache này đứng trước AIService.get_embedding / get_embeddings_batch:
+
+- Khóa: sha256(model + text chuẩn hóa NFC, gộp khoảng trắng). Chuẩn hóa chỉ dùng cho khóa — text gửi API giữ nguyên.
+- Tầng 1: OrderedDict LRU trong process (Config.EMBEDDING_CACHE_MEMORY_ITEMS), vector giữ dạng bytes float32 (~4 byte/chiều
+  thay vì ~32 byte/float Python); mỗi lần get trả list mới — caller sửa list không làm hỏng cache.
+- Tầng 2: SQLite trong Config.LOCAL_CACHE_DIR, vector lưu float32; hết hạn theo TTL, vượt số dòng thì xóa dòng dùng lâu nhất.
+- Bộ đếm hit/miss: get_embedding_cache().stats().
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+from config import Config
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_embedding_text(text: str) -> str:
+    """Chuẩn hóa text để tính khóa cache: NFC, gộp khoảng trắng, strip (text gửi API không đổi)."""
+    if not text or not isinstance(text, str):
+        return ""
+    return _WS_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def embedding_cache_key(model: str, normalized_text: str) -> str:
+    return hashlib.sha256(f"{model}\n{normalized_text}".encode("utf-8")).hexdigest()
+
+
+def _pack(vec: Sequence[float]) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    a = array("f")
+    a.frombytes(blob)
+    return a.tolist()
+
+
+class EmbeddingCache:
+    """Cache 2 tầng (LRU + SQLite). An toàn khi dùng từ nhiều thread."""
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        memory_items: int = 2048,
+        ttl_sec: float = 30 * 86400,
+        max_rows: int = 100000,
+    ):
+        self.memory_items = max(0, int(memory_items))
+        self.ttl_sec = float(ttl_sec)
+        self.max_rows = max(1, int(max_rows))
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._puts_since_trim = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        if db_path:
+            try:
+                os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+                conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS embedding_cache ("
+                    " key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL, vec BLOB NOT NULL,"
+                    " created_at REAL NOT NULL, last_access REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_access ON embedding_cache(last_access)")
+                conn.commit()
+                self._conn = conn
+            except Exception as e:
+                print(f"EmbeddingCache: không mở được SQLite ({db_path}): {e}")
+                self._conn = None
+
+    # ---- tầng nhớ (vector dạng bytes float32) ----
+    def _mem_get(self, key: str, now: float) -> Optional[bytes]:
+        item = self._mem.get(key)
+        if item is None:
+            return None
+        created_at, blob = item
+        if now - created_at > self.ttl_sec:
+            self._mem.pop(key, None)
+            return None
+        self._mem.move_to_end(key)
+        return blob
+
+    def _mem_put(self, key: str, blob: bytes, created_at: float) -> None:
+        if self.memory_items <= 0:
+            return
+        self._mem[key] = (created_at, blob)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.memory_items:
+            self._mem.popitem(last=False)
+
+    # ---- API ----
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Tra cache cho nhiều text (đã hoặc chưa chuẩn hóa). Trả list cùng thứ tự; miss là None."""
+        now = time.time()
+        keys = [embedding_cache_key(model, normalize_embedding_text(t)) for t in texts]
+        out: List[Optional[List[float]]] = [None] * len(keys)
+        pending: Dict[str, List[int]] = {}
+        with self._lock:
+            for i, k in enumerate(keys):
+                blob = self._mem_get(k, now)
+                if blob is not None:
+                    out[i] = _unpack(blob)
+                    self.counters["memory_hits"] += 1
+                else:
+                    pending.setdefault(k, []).append(i)
+            if pending and self._conn is not None:
+                try:
+                    found = self._disk_get(list(pending.keys()), now)
+                except Exception as e:
+                    print(f"EmbeddingCache read error: {e}")
+                    found = {}
+                for k, (created_at, blob) in found.items():
+                    self._mem_put(k, blob, created_at)
+                    for i in pending.pop(k):
+                        out[i] = _unpack(blob)
+                        self.counters["disk_hits"] += 1
+            self.counters["misses"] += sum(len(v) for v in pending.values())
+        return out
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Optional[Sequence[float]]]) -> None:
+        """Ghi vector vào cả hai tầng. Bỏ qua phần tử vector None."""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for t, vec in zip(texts, vectors):
+                if not vec:
+                    continue
+                k = embedding_cache_key(model, normalize_embedding_text(t))
+                blob = _pack(vec)
+                self._mem_put(k, blob, now)
+                rows.append((k, model, len(vec), blob, now, now))
+            if rows and self._conn is not None:
+                try:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO embedding_cache (key, model, dim, vec, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+                    self._conn.commit()
+                    self._puts_since_trim += len(rows)
+                    if self._puts_since_trim >= 500:
+                        self._puts_since_trim = 0
+                        self._trim_disk(now)
+                except Exception as e:
+                    print(f"EmbeddingCache write error: {e}")
+            self.counters["writes"] += len(rows)
+
+    def put(self, model: str, text: str, vector: Optional[Sequence[float]]) -> None:
+        self.put_many(model, [text], [vector])
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            s = dict(self.counters)
+            s["memory_items"] = len(self._mem)
+        lookups = s["memory_hits"] + s["disk_hits"] + s["misses"]
+        s["hit_rate"] = round((s["memory_hits"] + s["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return s
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+            if self._conn is not None:
+                try:
+                    self._conn.execute("DELETE FROM embedding_cache")
+                    self._conn.commit()
+                except Exception:
+                    pass
+
+    # ---- tầng SQLite (gọi khi đang giữ self._lock) ----
+    def _disk_get(self, keys: List[str], now: float) -> Dict[str, tuple]:
+        found: Dict[str, tuple] = {}
+        expired: List[str] = []
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            cur = self._conn.execute(
+                f"SELECT key, vec, created_at FROM embedding_cache WHERE key IN ({placeholders})", batch
+            )
+            for key, blob, created_at in cur.fetchall():
+                if now - created_at > self.ttl_sec:
+                    expired.append(key)
+                else:
+                    found[key] = (created_at, bytes(blob))
+        if found:
+            self._conn.executemany("UPDATE embedding_cache SET last_access = ? WHERE key = ?", [(now, k) for k in found])
+        if expired:
+            self._conn.executemany("DELETE FROM embedding_cache WHERE key = ?", [(k,) for k in expired])
+            self.counters["evictions"] += len(expired)
+        if found or expired:
+            self._conn.commit()
+        return found
+
+    def _trim_disk(self, now: float) -> None:
+        cur = self._conn.execute("DELETE FROM embedding_cache WHERE created_at < ?", (now - self.ttl_sec,))
+        removed = cur.rowcount or 0
+        total = self._conn.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        if total > self.max_rows:
+            cur = self._conn.execute(
+                "DELETE FROM embedding_cache WHERE key IN (SELECT key FROM embedding_cache ORDER BY last_access LIMIT ?)",
+                (total - self.max_rows,),
+            )
+            removed += cur.rowcount or 0
+        self._conn.commit()
+        self.counters["evictions"] += removed
+
+
+_cache_instance: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Cache dùng chung của process (None nếu Config.EMBEDDING_CACHE_ENABLED = False)."""
+    global _cache_instance
+    if not getattr(Config, "EMBEDDING_CACHE_ENABLED", True):
+        return None
+    if _cache_instance is not None:
+        return _cache_instance
+    with _cache_lock:
+        if _cache_instance is None:
+            cache_dir = getattr(Config, "LOCAL_CACHE_DIR", "") or ""
+            _cache_instance = EmbeddingCache(
+                db_path=os.path.join(cache_dir, "embeddings.sqlite") if cache_dir else None,
+                memory_items=getattr(Config, "EMBEDDING_CACHE_MEMORY_ITEMS", 2048),
+                ttl_sec=getattr(Config, "EMBEDDING_CACHE_TTL_SEC", 30 * 86400),
+                max_rows=getattr(Config, "EMBEDDING_CACHE_MAX_ROWS", 100000),
+            )
+        return _cache_instance
@@ -1,12 +1,13 @@
 # ai/hybrid_search.py - HybridSearch, check_semantic_intent, search_chunks_vector
-import json
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional
 
 from config import init_services
 
 from ai.service import AIService
-from ai.context_helpers import get_archived_bible_ids, _parse_embedding_vector, _cosine_sim
+from ai.context_helpers import get_archived_bible_ids, _parse_embedding_vector, search_rows_via_vector_index
+from ai.semantic_intent_matcher import get_semantic_intent_matcher
+from ai.vector_ops import top_k as top_k_similar
 from ai.utils import (
     _safe_float,
     _rerank_by_score,
@@ -249,59 +250,17 @@ def check_semantic_intent(
     threshold: float = 0.90,
     query_embedding: Optional[List[float]] = None,
 ) -> Optional[Dict]:
+    """Mẫu Semantic Intent đã duyệt khớp nhất với câu hỏi (similarity = (cosine+1)/2 >= ngưỡng), qua matcher cache theo project."""
     if not query_text or not project_id:
         return None
     try:
-        services = init_services()
-        if not services:
-            return None
-        supabase = services["supabase"]
-        try:
-            supabase.table("semantic_intent").select("id").limit(1).execute()
-        except Exception:
+        matcher = get_semantic_intent_matcher(project_id)
+        if matcher is None or len(matcher) == 0:
             return None
-        try:
-            r = supabase.table("settings").select("value").eq("key", "semantic_intent_threshold").execute()
-            if r.data and r.data[0]:
-                t = r.data[0].get("value")
-                threshold = max(0.85, min(1.0, float(t) / 100.0)) if t is not None else threshold
-        except Exception:
-            pass
         query_vec = query_embedding if query_embedding is not None else AIService.get_embedding(query_text)
         if not query_vec:
             return None
-        rows = (
-            supabase.table("semantic_intent")
-            .select("id, question_sample, intent, related_data, embedding")
-            .eq("story_id", project_id)
-            .eq("approve", True)
-            .execute()
-        )
-        data = rows.data or []
-        best_match = None
-        best_sim = 0.0
-        for row in data:
-            emb = row.get("embedding")
-            if emb is None:
-                continue
-            if isinstance(emb, str):
-                try:
-                    emb = json.loads(emb)
-                except Exception:
-                    continue
-            try:
-                import math
-                dot = sum(a * b for a, b in zip(query_vec, emb))
-                na = math.sqrt(sum(a * a for a in query_vec))
-                nb = math.sqrt(sum(b * b for b in emb))
-                sim = dot / (na * nb) if na and nb else 0
-                sim = (sim + 1) / 2
-                if sim >= threshold and sim > best_sim:
-                    best_sim = sim
-                    best_match = {**row, "similarity": sim}
-            except Exception:
-                pass
-        return best_match
+        return matcher.match(query_vec, threshold=threshold)
     except Exception as e:
         print(f"check_semantic_intent error: {e}")
         return None
@@ -378,6 +337,17 @@ def search_chunks_vector_in_candidates(
         qvec_parsed = _parse_embedding_vector(qvec)
         if not qvec_parsed:
             return []
+        indexed = search_rows_via_vector_index(
+            project_id,
+            "chunks",
+            qvec_parsed,
+            "id, chapter_id, arc_id, content, raw_content, meta_json",
+            k=top_k,
+            min_sim=min_similarity,
+            where={"id": chunk_ids},
+        )
+        if indexed is not None:
+            return [row for _sim, row in indexed]
         # Lấy embedding cho các chunk candidate
         try:
             r = (
@@ -392,25 +362,9 @@ def search_chunks_vector_in_candidates(
             rows = []
         if not rows:
             return []
-        scored: List[Tuple[float, Dict]] = []
-        for row in rows:
-            emb = _parse_embedding_vector(row.get("embedding"))
-            if not emb or len(emb) != len(qvec_parsed):
-                continue
-            sim = _cosine_sim(qvec_parsed, emb)
-            scored.append((sim, row))
-        if not scored:
-            return []
-        scored.sort(key=lambda x: -x[0])
-        # Lọc theo ngưỡng min_similarity để tránh lấy chunk nhiễu
-        out: List[Dict] = []
-        for sim, row in scored:
-            if sim < min_similarity:
-                continue
-            out.append(row)
-            if len(out) >= top_k:
-                break
-        return out
+        # Xếp hạng + lọc theo ngưỡng min_similarity để tránh lấy chunk nhiễu
+        ranked = top_k_similar(qvec_parsed, [row.get("embedding") for row in rows], k=top_k, min_sim=min_similarity)
+        return [rows[i] for i, _sim in ranked]
     except Exception as e:
         print(f"search_chunks_vector_in_candidates error: {e}")
         return []
@@ -0,0 +1,309 @@
+# ai/intent_classifier.py - Phân loại intent cục bộ (nearest-centroid trên embedding) trước khi gọi LLM router
+"""
+Mỗi lượt chat (không phải lệnh @@, không khớp Semantic Intent) tốn một lệnh LLM cho SmartAIRouter.intent_only_classifier,
+kể cả câu rất dễ phân loại. Module này đặt một bộ phân loại cục bộ phía trước:
+
+- Dữ liệu huấn luyện mỗi project: chat_turn_logs có query_text + router_intent do LLM router gán (intent_source = 'llm',
+  migration V19) và các mẫu semantic_intent đã duyệt có intent hợp lệ. Embedding lấy qua AIService.get_embeddings_batch
+  (embedding cache → chỉ câu mới mới gọi API).
+- Mô hình: centroid (trung bình đã chuẩn hóa) mỗi intent; điểm = cosine tới từng centroid. Độ tin cậy = softmax(cosine / T),
+  T hiệu chỉnh (temperature scaling) bằng leave-one-out trên chính tập huấn luyện → xác suất sát tỷ lệ đúng thực tế.
+- classify_intent_locally: trả step1 cùng dạng intent_only_classifier khi độ tin cậy >= Config.LOCAL_INTENT_MIN_CONFIDENCE;
+  câu có dấu hiệu đặt luật mới ("từ giờ", "hãy nhớ"...) luôn để LLM xử lý (cần trích new_rules). Không có relevant_rules
+  (bước 2 context_planner vẫn chọn luật). Có lịch sử hội thoại gần đây → để LLM viết lại câu theo ngữ cảnh.
+- Huấn luyện ở thread nền (lần đầu và khi hết TTL), không chặn lượt chat; chưa có mô hình → LLM router.
+- Thống kê trong process (local_intent_stats): số lượt bỏ qua LLM, thời gian / lệnh LLM router tiết kiệm ước lượng
+  theo độ trễ trung bình các lượt vẫn gọi LLM.
+"""
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import Config, init_services
+from ai.vector_ops import normalize_rows, parse_vector, to_matrix
+
+# Intent mà bộ cục bộ được phép trả (ask_user_clarification cần câu hỏi lại do LLM viết → luôn để LLM).
+LOCAL_INTENTS = frozenset({
+    "web_search",
+    "chat_casual",
+    "suggest_v7",
+    "search_context",
+    "unified",
+    "check_chapter_logic",
+    "analyze_pacing",
+})
+
+# Câu có vẻ đang đặt luật mới → cần LLM trích new_rules.
+_RULE_CUE_RE = re.compile(
+    r"(từ giờ|tu gio|từ nay|hãy nhớ|hay nho|ghi nhớ|luật là|quy tắc|không được|đừng bao giờ|luôn luôn|nghiêm khắc)",
+    re.IGNORECASE,
+)
+
+# Nhiệt độ thử khi hiệu chỉnh (cosine chênh nhau rất nhỏ → T nhỏ).
+_TEMPERATURES = np.geomspace(0.002, 1.0, 60)
+# Label smoothing khi chọn T: dữ liệu huấn luyện tách rời hoàn toàn thì NLL thuần đẩy T → 0 (mọi câu đều tin cậy ~100%,
+# kể cả câu lưng chừng giữa hai intent); làm mịn nhãn giữ độ tin cậy tối đa quanh 1 - ε.
+_LABEL_SMOOTHING = 0.03
+_FAILED_RETRY_SEC = 120
+
+
+class NearestCentroidIntentClassifier:
+    """Centroid embedding mỗi intent + nhiệt độ softmax đã hiệu chỉnh (leave-one-out)."""
+
+    def __init__(self, embeddings: Sequence[Any], labels: Sequence[str], min_samples: int = 5):
+        matrix, idx = to_matrix(list(embeddings))
+        labels = [labels[int(i)] for i in idx]
+        counts = Counter(labels)
+        self.intents: List[str] = sorted(k for k, n in counts.items() if n >= max(2, min_samples))
+        self.temperature = 1.0
+        self.loo_accuracy: Optional[float] = None
+        self.n_samples = 0
+        self.centroids = np.zeros((0, matrix.shape[1] if matrix.size else 0), dtype=np.float32)
+        if len(self.intents) < 2:
+            return
+        keep = [i for i, lab in enumerate(labels) if lab in self.intents]
+        x = normalize_rows(matrix[keep])
+        y = np.array([self.intents.index(labels[i]) for i in keep])
+        sums = np.stack([x[y == c].sum(axis=0) for c in range(len(self.intents))])
+        self.centroids = normalize_rows(sums)
+        self.n_samples = len(y)
+        self._calibrate(x, y, sums)
+
+    def _calibrate(self, x: np.ndarray, y: np.ndarray, sums: np.ndarray) -> None:
+        """Cosine leave-one-out (centroid lớp của chính mẫu bỏ mẫu đó ra) → chọn T cực tiểu NLL (nhãn làm mịn)."""
+        dots = x @ sums.T
+        sum_norms = np.linalg.norm(sums, axis=1)
+        scores = dots / np.maximum(sum_norms, 1e-12)
+        rows = np.arange(len(y))
+        own_dot = dots[rows, y] - 1.0  # x đã chuẩn hóa: x·x = 1
+        own_norm = np.sqrt(np.maximum(sum_norms[y] ** 2 - 2.0 * dots[rows, y] + 1.0, 0.0))
+        counts = np.bincount(y, minlength=len(self.intents))
+        valid = (counts[y] > 1) & (own_norm > 1e-6)
+        scores[rows[valid], y[valid]] = own_dot[valid] / own_norm[valid]
+        scores, y = scores[valid], y[valid]
+        if not len(y):
+            return
+        self.loo_accuracy = float(np.mean(np.argmax(scores, axis=1) == y))
+        k = len(self.intents)
+        targets = np.full(scores.shape, _LABEL_SMOOTHING / (k - 1))
+        targets[np.arange(len(y)), y] = 1.0 - _LABEL_SMOOTHING
+        best_nll = None
+        for t in _TEMPERATURES:
+            logits = scores / t
+            logits -= logits.max(axis=1, keepdims=True)
+            log_probs = logits - np.log(np.exp(logits).sum(axis=1, keepdims=True))
+            nll = -float(np.mean((targets * log_probs).sum(axis=1)))
+            if best_nll is None or nll < best_nll:
+                best_nll, self.temperature = nll, float(t)
+
+    def __len__(self) -> int:
+        return self.n_samples
+
+    def predict(self, query_vec: Any) -> Optional[Tuple[str, float]]:
+        """(intent, độ tin cậy đã hiệu chỉnh) hoặc None nếu mô hình rỗng / vector lỗi."""
+        if len(self.intents) < 2:
+            return None
+        q = parse_vector(query_vec, self.centroids.shape[1])
+        if q is None:
+            return None
+        qn = float(np.linalg.norm(q))
+        if qn <= 0:
+            return None
+        logits = (self.centroids @ (q / qn)) / self.temperature
+        logits -= logits.max()
+        probs = np.exp(logits) / np.exp(logits).sum()
+        best = int(np.argmax(probs))
+        return self.intents[best], float(probs[best])
+
+
+def _load_training_rows(supabase, project_id: str) -> Tuple[List[str], List[str], List[Any]]:
+    """(texts cần embed, nhãn của chúng, [(embedding có sẵn, nhãn)])."""
+    max_rows = int(getattr(Config, "LOCAL_INTENT_TRAIN_MAX_ROWS", 1000))
+    texts: List[str] = []
+    labels: List[str] = []
+    try:
+        r = (
+            supabase.table("chat_turn_logs").select("query_text, router_intent")
+            .eq("story_id", project_id).eq("intent_source", "llm")
+            .order("created_at", desc=True).limit(max_rows).execute()
+        )
+        seen = set()
+        for row in r.data or []:
+            text = (row.get("query_text") or "").strip()
+            label = (row.get("router_intent") or "").strip()
+            if text and label in LOCAL_INTENTS and text not in seen:
+                seen.add(text)
+                texts.append(text)
+                labels.append(label)
+    except Exception as e:
+        # Chưa chạy migration V19 (chưa có query_text / router_intent / intent_source).
+        print(f"LocalIntentClassifier: không đọc được chat_turn_logs: {e}")
+    pre_embedded: List[Any] = []
+    try:
+        r = (
+            supabase.table("semantic_intent").select("intent, embedding")
+            .eq("story_id", project_id).eq("approve", True)
+            .not_.is_("embedding", "null").limit(max_rows).execute()
+        )
+        for row in r.data or []:
+            label = (row.get("intent") or "").strip()
+            if label in LOCAL_INTENTS:
+                pre_embedded.append((row.get("embedding"), label))
+    except Exception:
+        pass
+    return texts, labels, pre_embedded
+
+
+def build_intent_classifier(supabase, project_id: str) -> NearestCentroidIntentClassifier:
+    from ai.service import AIService
+
+    texts, labels, pre_embedded = _load_training_rows(supabase, project_id)
+    embeddings: List[Any] = list(AIService.get_embeddings_batch(texts)) if texts else []
+    embeddings += [e for e, _ in pre_embedded]
+    labels = labels + [lab for _, lab in pre_embedded]
+    return NearestCentroidIntentClassifier(
+        embeddings, labels, min_samples=int(getattr(Config, "LOCAL_INTENT_MIN_SAMPLES_PER_INTENT", 5))
+    )
+
+
+_classifiers: Dict[str, Tuple[float, Optional[NearestCentroidIntentClassifier]]] = {}
+_classifiers_lock = threading.Lock()
+_training: set = set()
+
+
+def _train_classifier(key: str) -> None:
+    """Huấn luyện (đọc log + embed, có thể vài giây) rồi thay mô hình trong cache; chạy trong thread nền."""
+    ttl = float(getattr(Config, "LOCAL_INTENT_CLASSIFIER_TTL_SEC", 1800))
+    clf = None
+    expires_at = time.time() + min(ttl, _FAILED_RETRY_SEC)
+    try:
+        services = init_services()
+        if services:
+            clf = build_intent_classifier(services["supabase"], key)
+            expires_at = time.time() + ttl
+    except Exception as e:
+        print(f"LocalIntentClassifier build error: {e}")
+    finally:
+        with _classifiers_lock:
+            _classifiers[key] = (expires_at, clf)
+            _training.discard(key)
+
+
+def _start_background_training(key: str) -> None:
+    threading.Thread(target=_train_classifier, args=(key,), name="intent-classifier", daemon=True).start()
+
+
+def get_intent_classifier(project_id: str) -> Optional[NearestCentroidIntentClassifier]:
+    """
+    Bộ phân loại của project, không bao giờ huấn luyện trong lượt chat: chưa có / hết
+    Config.LOCAL_INTENT_CLASSIFIER_TTL_SEC → huấn luyện ở thread nền. Trong lúc đó trả mô hình cũ (nếu có),
+    lần đầu trả None → caller gọi LLM router như cũ.
+    """
+    if not project_id:
+        return None
+    key = str(project_id)
+    with _classifiers_lock:
+        entry = _classifiers.get(key)
+        current = entry[1] if entry else None
+        if entry is not None and time.time() < entry[0]:
+            return current
+        start = key not in _training
+        if start:
+            _training.add(key)
+    if start:
+        _start_background_training(key)
+    return current
+
+
+def invalidate_intent_classifier(project_id: Optional[str] = None) -> None:
+    with _classifiers_lock:
+        if project_id is None:
+            _classifiers.clear()
+        else:
+            _classifiers.pop(str(project_id), None)
+
+
+_stats_lock = threading.Lock()
+_stats = {"local_hits": 0, "llm_calls": 0, "llm_latency_sec": 0.0, "local_latency_sec": 0.0}
+
+
+def record_llm_router_call(latency_sec: float) -> None:
+    """Ghi một lượt vẫn phải gọi LLM router (để ước lượng thời gian tiết kiệm khi bỏ qua)."""
+    with _stats_lock:
+        _stats["llm_calls"] += 1
+        _stats["llm_latency_sec"] += max(0.0, float(latency_sec))
+
+
+def local_intent_stats() -> Dict[str, Any]:
+    """Số lượt bỏ qua LLM router, tỷ lệ, thời gian tiết kiệm ước lượng (process hiện tại)."""
+    with _stats_lock:
+        s = dict(_stats)
+    total = s["local_hits"] + s["llm_calls"]
+    avg_llm = s["llm_latency_sec"] / s["llm_calls"] if s["llm_calls"] else 0.0
+    avg_local = s["local_latency_sec"] / s["local_hits"] if s["local_hits"] else 0.0
+    return {
+        "local_hits": s["local_hits"],
+        "llm_calls": s["llm_calls"],
+        "hit_rate": s["local_hits"] / total if total else 0.0,
+        "avg_llm_latency_sec": avg_llm,
+        "avg_local_latency_sec": avg_local,
+        "saved_llm_calls": s["local_hits"],
+        "saved_latency_sec": max(0.0, avg_llm - avg_local) * s["local_hits"],
+    }
+
+
+def classify_intent_locally(
+    user_prompt: str,
+    project_id: Optional[str],
+    query_embedding: Any = None,
+    recent_history_text: str = "",
+) -> Optional[Dict[str, Any]]:
+    """
+    step1 (cùng dạng SmartAIRouter.intent_only_classifier, thêm intent_source="local" và confidence) nếu bộ cục bộ
+    đủ tự tin; None → gọi LLM router như cũ.
+    Có lịch sử hội thoại gần đây → None: câu nối tiếp ("còn cô ấy thì sao?") cần LLM viết lại rewritten_query
+    theo ngữ cảnh, bộ cục bộ chỉ trả nguyên câu.
+    """
+    if not getattr(Config, "LOCAL_INTENT_CLASSIFIER_ENABLED", True) or not project_id:
+        return None
+    if (recent_history_text or "").strip():
+        return None
+    prompt = (user_prompt or "").strip()
+    if not prompt or _RULE_CUE_RE.search(prompt):
+        return None
+    clf = get_intent_classifier(project_id)
+    if clf is None or not clf.intents:
+        return None
+    started = time.perf_counter()
+    if query_embedding is None:
+        from ai.service import AIService
+
+        query_embedding = AIService.get_embedding(prompt)
+    pred = clf.predict(query_embedding) if query_embedding is not None else None
+    if pred is None:
+        return None
+    intent, confidence = pred
+    if confidence < float(getattr(Config, "LOCAL_INTENT_MIN_CONFIDENCE", 0.9)):
+        return None
+    # Cùng guardrail với LLM router: unified chỉ khi user ra lệnh rõ.
+    if intent == "unified" and not any(p in prompt.lower() for p in ("unified", "chạy unified", "run unified")):
+        intent = "search_context"
+    from ai.router import INTENTS_NO_DATA
+
+    with _stats_lock:
+        _stats["local_hits"] += 1
+        _stats["local_latency_sec"] += time.perf_counter() - started
+    return {
+        "intent": intent,
+        "needs_data": intent not in INTENTS_NO_DATA,
+        "rewritten_query": prompt,
+        "clarification_question": "",
+        "relevant_rules": "",
+        "new_rules": [],
+        "intent_source": "local",
+        "confidence": confidence,
+    }
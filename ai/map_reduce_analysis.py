@@ -0,0 +1,455 @@
+# ai/map_reduce_analysis.py - Map-reduce cho multi_chapter_analysis trên khoảng chương lớn (vd. "chương 1–200")
+"""
+Thay cho việc ghép context từng đoạn 10 chương rồi cắt theo token_limit:
+
+- Chia đoạn theo lưới cố định Config.MULTI_CHAPTER_MAP_CHAPTERS chương (1–10, 11–20, ...; khoảng 15–42 → 15–20,
+  21–30, 31–40, 41–42) để các câu hỏi khác nhau trên cùng vùng chương dùng lại đoạn giữa; đoạn vượt ngân sách input
+  map (Config.MULTI_CHAPTER_MAP_INPUT_TOKENS) thì tách tiếp theo token, chương một mình vượt thì cắt bớt.
+- Map: mỗi đoạn một lệnh gọi tool model (tối đa Config.MULTI_CHAPTER_MAP_MAX_INFLIGHT song song) trả JSON có cấu trúc:
+  tóm tắt / sự kiện / nhân vật từng chương và mạch truyện còn mở. Prompt map chỉ chứa nội dung chương (không có câu hỏi,
+  persona) → response cache (cache_site "multi_chapter_map", khóa theo nội dung) cho câu hỏi tiếp theo trên cùng khoảng
+  chương dùng lại kết quả map; chương sửa nội dung thì khóa đổi, tự map lại.
+- Reduce: cây gộp theo câu hỏi. Gom các ghi chú liền kề vừa Config.MULTI_CHAPTER_REDUCE_INPUT_TOKENS (ít nhất 2 / nhóm)
+  thành một lệnh gọi, lặp từng tầng đến khi tổng vừa phần context dành cho model trả lời
+  (token_limit × Config.MULTI_CHAPTER_FINAL_CONTEXT_SHARE). Ghi chú map đã vừa thì không reduce.
+- Lỗi mạng / rate limit đã được AIService.call_openrouter (và client openai) thử lại; ở đây chỉ thử lại một lần khi
+  model trả rỗng hoặc JSON map hỏng. Mọi lệnh (map, reduce, thử lại) tính vào CallBudget của lượt chat
+  (Config.get_max_internal_llm_calls_per_turn); hết lượt thì bớt đoạn map / reduce bằng cách nối và cắt ghi chú.
+"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import Config, init_services
+from core.batch_planner import estimate_chapter_tokens
+
+MAP_CACHE_SITE = "multi_chapter_map"
+
+_MAP_SYSTEM_PROMPT = (
+    "Bạn là trợ lý phân tích truyện. Đọc các chương được cung cấp và ghi chú lại nội dung một cách khách quan, "
+    "đầy đủ để sau này trả lời mọi câu hỏi về các chương này (cốt truyện, nhân vật, quan hệ, mốc thời gian, chi tiết logic). "
+    "Chỉ dựa trên nội dung chương, không suy đoán ngoài văn bản."
+)
+
+_MAP_OUTPUT_SPEC = """Trả về ĐÚNG MỘT JSON (chỉ JSON):
+{ "chapters": [ { "chapter": <số chương>, "summary": "tóm tắt 3-6 câu", "events": ["sự kiện chính"], "characters": ["nhân vật xuất hiện (vai trò / thay đổi)"] } ],
+  "open_threads": ["mạch truyện / bí ẩn còn bỏ ngỏ ở cuối đoạn"] }
+Mỗi chương trong đoạn có đúng một phần tử trong "chapters", theo thứ tự số chương."""
+
+
+def _cfg(name: str, default: Any) -> Any:
+    return getattr(Config, name, default)
+
+
+def _tokens(text: str) -> int:
+    return estimate_chapter_tokens(text)
+
+
+def grid_segments(start: int, end: int, width: int) -> List[Tuple[int, int]]:
+    """Các ô lưới [k*width+1, (k+1)*width] giao với [start, end] (giữ biên đoạn ổn định giữa các câu hỏi)."""
+    width = max(1, int(width))
+    start, end = min(start, end), max(start, end)
+    segments: List[Tuple[int, int]] = []
+    cur = start
+    while cur <= end:
+        cell_end = ((cur - 1) // width + 1) * width
+        seg_end = min(cell_end, end)
+        segments.append((cur, seg_end))
+        cur = seg_end + 1
+    return segments
+
+
+def plan_map_segments(chapters: List[Dict], start: int, end: int, width: int, input_tokens: int) -> List[List[Dict]]:
+    """
+    Nhóm các chương (đã sắp theo chapter_number, có content) thành đoạn map: theo ô lưới, trong ô tách tiếp
+    khi tổng token vượt input_tokens. Chương rỗng bị bỏ qua.
+    """
+    by_cell: Dict[Tuple[int, int], List[Dict]] = {cell: [] for cell in grid_segments(start, end, width)}
+    cells = list(by_cell)
+    for row in chapters:
+        if not (row.get("content") or "").strip():
+            continue
+        num = int(row.get("chapter_number"))
+        for cell in cells:
+            if cell[0] <= num <= cell[1]:
+                by_cell[cell].append(row)
+                break
+    segments: List[List[Dict]] = []
+    for cell in cells:
+        current: List[Dict] = []
+        load = 0
+        for row in by_cell[cell]:
+            tok = estimate_chapter_tokens(row.get("content"))
+            if current and load + tok > input_tokens:
+                segments.append(current)
+                current, load = [], 0
+            current.append(row)
+            load += tok
+        if current:
+            segments.append(current)
+    return segments
+
+
+def _segment_range(rows: List[Dict]) -> Tuple[int, int]:
+    return int(rows[0]["chapter_number"]), int(rows[-1]["chapter_number"])
+
+
+def _map_messages(rows: List[Dict], input_tokens: int) -> List[Dict]:
+    """Prompt map: chỉ phụ thuộc nội dung chương (để response cache dùng lại giữa các câu hỏi)."""
+    max_chars = max(1, input_tokens) * 4
+    parts: List[str] = []
+    for row in rows:
+        num = row.get("chapter_number")
+        title = (row.get("title") or "").strip() or f"Chương {num}"
+        content = (row.get("content") or "").strip()
+        if len(content) > max_chars:
+            content = content[:max_chars] + "\n[...cắt bớt phần cuối chương do quá dài]"
+        parts.append(f"=== CHƯƠNG {num}: {title} ===\n{content}")
+    seg_start, seg_end = _segment_range(rows)
+    user_content = (
+        f"Các chương {seg_start}-{seg_end}:\n\n" + "\n\n".join(parts) + "\n\n" + _MAP_OUTPUT_SPEC
+    )
+    return [
+        {"role": "system", "content": _MAP_SYSTEM_PROMPT},
+        {"role": "user", "content": user_content},
+    ]
+
+
+def render_map_notes(rows: List[Dict], raw: str) -> str:
+    """Ghi chú map (JSON) → văn bản gọn có số chương để reduce / model trả lời trích dẫn; JSON lỗi → giữ nguyên văn bản."""
+    seg_start, seg_end = _segment_range(rows)
+    header = f"### Chương {seg_start}–{seg_end}"
+    try:
+        from ai.service import AIService
+
+        data = json.loads(AIService.clean_json_text(raw or "{}"))
+    except Exception:
+        data = None
+    if not isinstance(data, dict) or not isinstance(data.get("chapters"), list):
+        return f"{header}\n{(raw or '').strip()}"
+    titles = {str(r.get("chapter_number")): (r.get("title") or "").strip() for r in rows}
+    lines = [header]
+    for ch in data["chapters"]:
+        if not isinstance(ch, dict):
+            continue
+        num = str(ch.get("chapter", "")).strip()
+        title = titles.get(num, "")
+        lines.append(f"- Chương {num}{' — ' + title if title else ''}: {str(ch.get('summary') or '').strip()}")
+        events = [str(e).strip() for e in (ch.get("events") or []) if str(e).strip()]
+        if events:
+            lines.append(f"  Sự kiện: {'; '.join(events)}")
+        characters = [str(c).strip() for c in (ch.get("characters") or []) if str(c).strip()]
+        if characters:
+            lines.append(f"  Nhân vật: {', '.join(characters)}")
+    threads = [str(t).strip() for t in (data.get("open_threads") or []) if str(t).strip()]
+    if threads:
+        lines.append(f"Mạch truyện còn mở: {'; '.join(threads)}")
+    return "\n".join(lines)
+
+
+class CallBudget:
+    """Số lệnh LLM nội bộ (map + reduce + thử lại) của một lượt chat; max_calls 0 = không giới hạn. An toàn đa luồng."""
+
+    def __init__(self, max_calls: int = 0):
+        self.max_calls = max(0, int(max_calls or 0))
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        with self._lock:
+            if self.max_calls and self.used >= self.max_calls:
+                return False
+            self.used += 1
+            return True
+
+    def refund(self) -> None:
+        """Response cache trả về: không tốn lệnh thật."""
+        with self._lock:
+            self.used = max(0, self.used - 1)
+
+    def remaining(self) -> Optional[int]:
+        with self._lock:
+            return max(0, self.max_calls - self.used) if self.max_calls else None
+
+    def label(self) -> str:
+        return f"{self.used}/{self.max_calls}" if self.max_calls else str(self.used)
+
+
+def _valid_json(text: str) -> bool:
+    from ai.service import AIService
+
+    try:
+        return isinstance(json.loads(AIService.clean_json_text(text)), dict)
+    except Exception:
+        return False
+
+
+def _call_text(
+    messages: List[Dict],
+    model: str,
+    max_tokens: int,
+    budget: Optional[CallBudget] = None,
+    expect_json: bool = False,
+    **kwargs,
+) -> Tuple[str, bool]:
+    """
+    Gọi LLM; lỗi ném ra ngay (call_openrouter đã tự thử lại). Chỉ thử lại một lần khi nội dung rỗng / JSON hỏng:
+    lần thử lại bỏ qua response cache (bản hỏng có thể đã được cache) và ghi đè cache khi được kết quả tốt.
+    Trả về (nội dung, lấy từ response cache).
+    """
+    from ai.service import AIService
+
+    content = ""
+    cache_site = kwargs.get("cache_site")
+    for attempt in range(2):
+        if budget is not None and not budget.take():
+            raise RuntimeError("hết lượt gọi LLM nội bộ cho lượt này")
+        if attempt:
+            kwargs.pop("cache_site", None)
+        resp = AIService.call_openrouter(
+            messages=messages,
+            model=model,
+            temperature=0,
+            max_tokens=max_tokens,
+            **kwargs,
+        )
+        cached = getattr(resp, "cached", False) is True
+        if cached and budget is not None:
+            budget.refund()
+        content = (resp.choices[0].message.content or "").strip()
+        if content and (not expect_json or _valid_json(content)):
+            if attempt and cache_site:
+                _overwrite_cached(cache_site, model, messages, max_tokens, kwargs.get("response_format"), resp)
+            return content, cached
+    if content:
+        return content, False
+    raise RuntimeError("LLM trả về rỗng")
+
+
+def _overwrite_cached(cache_site: str, model: str, messages: List[Dict], max_tokens: int, response_format, resp) -> None:
+    try:
+        from ai.response_cache import is_cacheable_call, response_cache_key, store_cached_response
+
+        if is_cacheable_call(cache_site, 0, False):
+            key = response_cache_key(model, messages, 0, max_tokens, response_format)
+            store_cached_response(key, cache_site, model, resp)
+    except Exception as e:
+        print(f"map_reduce cache overwrite error: {e}")
+
+
+def map_segment(rows: List[Dict], model: str, input_tokens: int, budget: Optional[CallBudget] = None) -> Dict[str, Any]:
+    """Map một đoạn; lỗi thì ghi chú lỗi (không dừng cả phân tích)."""
+    seg_range = _segment_range(rows)
+    try:
+        raw, cached = _call_text(
+            _map_messages(rows, input_tokens),
+            model,
+            int(_cfg("MULTI_CHAPTER_MAP_OUTPUT_TOKENS", 4000)),
+            budget=budget,
+            expect_json=True,
+            response_format={"type": "json_object"},
+            cache_site=MAP_CACHE_SITE,
+        )
+        return {"range": seg_range, "text": render_map_notes(rows, raw), "cached": cached, "error": None}
+    except Exception as ex:
+        print(f"map_reduce map error ({seg_range[0]}-{seg_range[1]}): {ex}")
+        text = f"### Chương {seg_range[0]}–{seg_range[1]}\n(Lỗi khi phân tích đoạn chương này: {ex})"
+        return {"range": seg_range, "text": text, "cached": False, "error": str(ex)}
+
+
+def group_for_reduce(nodes: List[Dict], input_tokens: int) -> List[List[Dict]]:
+    """Gom ghi chú liền kề theo ngân sách input của một lệnh reduce; mỗi nhóm ít nhất 2 ghi chú (khi còn >= 2)."""
+    groups: List[List[Dict]] = []
+    current: List[Dict] = []
+    load = 0
+    for node in nodes:
+        tok = _tokens(node["text"])
+        if len(current) >= 2 and load + tok > input_tokens:
+            groups.append(current)
+            current, load = [], 0
+        current.append(node)
+        load += tok
+    if current:
+        if len(current) == 1 and groups:
+            groups[-1].extend(current)
+        else:
+            groups.append(current)
+    return groups
+
+
+def _reduce_messages(question: str, group: List[Dict], input_tokens: int, output_tokens: int) -> List[Dict]:
+    per_node_chars = max(1, input_tokens // max(1, len(group))) * 4
+    notes = []
+    for node in group:
+        text = node["text"]
+        if len(text) > per_node_chars:
+            text = text[:per_node_chars] + "\n[...cắt bớt]"
+        notes.append(text)
+    g_start, g_end = group[0]["range"][0], group[-1]["range"][1]
+    system_content = (
+        "Bạn gộp ghi chú phân tích của nhiều đoạn chương liền nhau thành MỘT ghi chú ngắn hơn, phục vụ câu hỏi của user. "
+        "Giữ lại mọi chi tiết liên quan tới câu hỏi (kèm số chương làm dẫn chứng), lược bỏ phần không liên quan, "
+        "giữ đúng thứ tự thời gian; không tự trả lời ngoài những gì ghi chú có."
+    )
+    user_content = (
+        f"CÂU HỎI CỦA USER:\n{question}\n\n"
+        f"GHI CHÚ CÁC ĐOẠN (chương {g_start}-{g_end}):\n\n" + "\n\n".join(notes) + "\n\n"
+        f"Viết ghi chú gộp cho chương {g_start}-{g_end}, mở đầu bằng dòng \"### Chương {g_start}–{g_end}\", "
+        f"tối đa khoảng {output_tokens} token."
+    )
+    return [
+        {"role": "system", "content": system_content},
+        {"role": "user", "content": user_content},
+    ]
+
+
+def reduce_group(
+    question: str,
+    group: List[Dict],
+    model: str,
+    input_tokens: int,
+    output_tokens: int,
+    budget: Optional[CallBudget] = None,
+) -> Dict[str, Any]:
+    """Gộp một nhóm ghi chú; lỗi / hết lượt → nối ghi chú và cắt theo output_tokens (vẫn giảm số nút)."""
+    g_range = (group[0]["range"][0], group[-1]["range"][1])
+    header = f"### Chương {g_range[0]}–{g_range[1]}"
+    try:
+        text, _cached = _call_text(
+            _reduce_messages(question, group, input_tokens, output_tokens), model, output_tokens, budget=budget
+        )
+        if not text.lstrip().startswith("###"):
+            text = f"{header}\n{text}"
+    except Exception as ex:
+        print(f"map_reduce reduce error ({g_range[0]}-{g_range[1]}): {ex}")
+        text = f"{header}\n" + "\n\n".join(n["text"] for n in group)
+        text = text[: output_tokens * 4]
+    return {"range": g_range, "text": text}
+
+
+def reduce_tree(
+    question: str,
+    nodes: List[Dict],
+    final_tokens: int,
+    input_tokens: int,
+    reduce_fn: Callable[[List[Dict]], Dict[str, Any]],
+    max_inflight: int = 4,
+) -> Tuple[List[Dict], int, int]:
+    """
+    Gộp từng tầng đến khi tổng token <= final_tokens (hoặc còn 1 nút). Các nhóm cùng tầng chạy song song.
+    Trả về (các nút còn lại theo thứ tự chương, số tầng, số lệnh reduce).
+    """
+    levels = 0
+    calls = 0
+    while len(nodes) > 1 and sum(_tokens(n["text"]) for n in nodes) > final_tokens:
+        groups = group_for_reduce(nodes, input_tokens)
+        workers = max(1, min(int(max_inflight), len(groups)))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mr-reduce") as pool:
+                nodes = list(pool.map(reduce_fn, groups))
+        else:
+            nodes = [reduce_fn(g) for g in groups]
+        calls += len(groups)
+        levels += 1
+    total = sum(_tokens(n["text"]) for n in nodes)
+    if nodes and total > final_tokens:
+        per_node_chars = max(1, final_tokens // len(nodes)) * 4
+        nodes = [dict(n, text=n["text"][:per_node_chars]) for n in nodes]
+    return nodes, levels, calls
+
+
+def _load_chapters(supabase, project_id: str, start: int, end: int) -> List[Dict]:
+    r = (
+        supabase.table("chapters").select("chapter_number, title, content")
+        .eq("story_id", project_id).gte("chapter_number", start).lte("chapter_number", end)
+        .order("chapter_number").execute()
+    )
+    return [row for row in (r.data or []) if row.get("chapter_number") is not None]
+
+
+def run_map_reduce(
+    project_id: str,
+    start: int,
+    end: int,
+    question: str,
+    token_limit: int,
+    model: str,
+    supabase=None,
+    call_budget: Optional[CallBudget] = None,
+) -> Dict[str, Any]:
+    """
+    Phân tích khoảng chương [start, end] cho câu hỏi. Trả về text (ghi chú cuối, vừa phần context của model trả lời),
+    segments, map_cached, map_errors, reduce_calls, levels, skipped (khoảng chương chưa map do vượt MULTI_CHAPTER_MAX_SEGMENTS
+    hoặc call_budget), llm_calls (lệnh LLM thật đã gọi trong lần này, không tính response cache).
+    """
+    start, end = min(start, end), max(start, end)
+    budget = call_budget if call_budget is not None else CallBudget()
+    used_before = budget.used
+    out: Dict[str, Any] = {
+        "text": "", "segments": 0, "map_cached": 0, "map_errors": 0, "reduce_calls": 0, "levels": 0, "skipped": None,
+        "llm_calls": 0,
+    }
+    if supabase is None:
+        services = init_services()
+        if not services:
+            out["text"] = "(Không kết nối được database để đọc chương.)"
+            return out
+        supabase = services["supabase"]
+    try:
+        chapters = _load_chapters(supabase, project_id, start, end)
+    except Exception as e:
+        print(f"map_reduce load chapters error: {e}")
+        chapters = []
+
+    map_input = int(_cfg("MULTI_CHAPTER_MAP_INPUT_TOKENS", 30000))
+    segments = plan_map_segments(chapters, start, end, int(_cfg("MULTI_CHAPTER_MAP_CHAPTERS", 10)), map_input)
+    if not segments:
+        out["text"] = f"(Không có chương nào có nội dung trong khoảng {start}-{end}.)"
+        return out
+    max_segments = int(_cfg("MULTI_CHAPTER_MAX_SEGMENTS", 40))
+    remaining = budget.remaining()
+    if remaining is not None:
+        # Chừa khoảng 1/4 số lượt còn lại cho reduce.
+        by_budget = remaining - max(1, remaining // 4) if remaining > 1 else remaining
+        max_segments = min(max_segments, by_budget) if max_segments > 0 else by_budget
+        if max_segments <= 0:
+            out["text"] = f"(Bỏ qua khoảng chương {start}-{end}: đã hết lượt gọi LLM nội bộ cho lượt này.)"
+            return out
+    if max_segments > 0 and len(segments) > max_segments:
+        out["skipped"] = (_segment_range(segments[max_segments])[0], end)
+        segments = segments[:max_segments]
+    out["segments"] = len(segments)
+
+    max_inflight = max(1, int(_cfg("MULTI_CHAPTER_MAP_MAX_INFLIGHT", 4)))
+    workers = min(max_inflight, len(segments))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mr-map") as pool:
+            mapped = list(pool.map(lambda rows: map_segment(rows, model, map_input, budget), segments))
+    else:
+        mapped = [map_segment(rows, model, map_input, budget) for rows in segments]
+    out["map_cached"] = sum(1 for m in mapped if m["cached"])
+    out["map_errors"] = sum(1 for m in mapped if m["error"])
+
+    reduce_input = int(_cfg("MULTI_CHAPTER_REDUCE_INPUT_TOKENS", 40000))
+    reduce_output = int(_cfg("MULTI_CHAPTER_REDUCE_OUTPUT_TOKENS", 3000))
+    final_tokens = max(reduce_output, int(token_limit * float(_cfg("MULTI_CHAPTER_FINAL_CONTEXT_SHARE", 0.5))))
+    nodes, levels, calls = reduce_tree(
+        question,
+        [{"range": m["range"], "text": m["text"]} for m in mapped],
+        final_tokens,
+        reduce_input,
+        lambda group: reduce_group(question, group, model, reduce_input, reduce_output, budget),
+        max_inflight=max_inflight,
+    )
+    out["levels"] = levels
+    out["reduce_calls"] = calls
+    out["llm_calls"] = budget.used - used_before
+    text = "\n\n".join(n["text"] for n in nodes)
+    if out["skipped"]:
+        text += (
+            f"\n\n(Chương {out['skipped'][0]}-{out['skipped'][1]} chưa được phân tích: vượt giới hạn "
+            f"{max_segments} đoạn mỗi lượt.)"
+        )
+    out["text"] = text
+    return out
@@ -0,0 +1,102 @@
+# ai/near_duplicates.py - Gom cụm near-duplicate theo embedding (ma trận chuẩn hóa, nhân theo khối, LSH tùy chọn)
+"""
+Dùng cho global_data_sync (Bible / chunks / timeline / relations trong phạm vi 1 chương):
+
+- near_duplicate_clusters(): trả về cụm (thành phần liên thông của quan hệ cosine >= threshold), không phải từng cặp,
+  để caller gán parent / giữ bản gốc một lần cho cả cụm. Mỗi cụm là các chỉ số gốc tăng dần; phần tử đầu là bản gốc.
+- n nhỏ: ma trận đã chuẩn hóa L2 nhân với chính nó theo khối dòng (chỉ xét tam giác trên) → chính xác.
+- n >= lsh_min_rows: random-projection LSH (dấu của n_bits siêu phẳng ngẫu nhiên, n_tables bảng) chia bucket trước,
+  chỉ tính cosine đầy đủ trong từng bucket. Cặp rất giống gần như chắc chắn rơi chung bucket ở ít nhất một bảng;
+  bỏ sót hiếm hoi thường vẫn được nối qua thành viên khác của cụm.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from ai.vector_ops import normalize_rows, to_matrix
+
+# Số dòng mỗi khối khi nhân ma trận n×n (giới hạn bộ nhớ: khối × n × 4 byte).
+_BLOCK_ROWS = 1024
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = np.arange(n, dtype=np.int64)
+
+    def find(self, i: int) -> int:
+        root = i
+        while self.parent[root] != root:
+            root = int(self.parent[root])
+        while self.parent[i] != root:
+            self.parent[i], i = root, int(self.parent[i])
+        return root
+
+    def union_pairs(self, rows: np.ndarray, cols: np.ndarray) -> None:
+        for a, b in zip(rows.tolist(), cols.tolist()):
+            ra, rb = self.find(a), self.find(b)
+            if ra != rb:
+                # Gốc luôn là chỉ số nhỏ hơn → phần tử đầu cụm là bản sớm nhất.
+                if ra < rb:
+                    self.parent[rb] = ra
+                else:
+                    self.parent[ra] = rb
+
+
+def _link_exact(normed: np.ndarray, threshold: float, uf: _UnionFind, members: Optional[np.ndarray] = None) -> None:
+    """Nối mọi cặp (i < j) trong members (mặc định: tất cả) có cosine >= threshold."""
+    sub = normed if members is None else normed[members]
+    m = sub.shape[0]
+    for start in range(0, m, _BLOCK_ROWS):
+        block = sub[start:start + _BLOCK_ROWS] @ sub[start:].T
+        # Chỉ tam giác trên: cột c ứng với dòng start + c, cần > dòng hiện tại.
+        rows, cols = np.nonzero(np.triu(block >= threshold, k=1))
+        if rows.size:
+            rows, cols = rows + start, cols + start
+            if members is not None:
+                rows, cols = members[rows], members[cols]
+            uf.union_pairs(rows, cols)
+
+
+def _lsh_buckets(normed: np.ndarray, n_bits: int, n_tables: int, seed: int) -> List[np.ndarray]:
+    """Các bucket (mảng chỉ số, >= 2 phần tử) của mọi bảng LSH siêu phẳng ngẫu nhiên."""
+    rng = np.random.default_rng(seed)
+    weights = 1 << np.arange(n_bits, dtype=np.int64)
+    buckets: List[np.ndarray] = []
+    for _ in range(n_tables):
+        planes = rng.standard_normal((normed.shape[1], n_bits)).astype(np.float32)
+        codes = ((normed @ planes) >= 0).astype(np.int64) @ weights
+        order = np.argsort(codes, kind="stable")
+        bounds = np.flatnonzero(np.diff(codes[order])) + 1
+        for part in np.split(order, bounds):
+            if part.size > 1:
+                buckets.append(np.sort(part))
+    return buckets
+
+
+def near_duplicate_clusters(
+    embeddings: Sequence[Any],
+    threshold: float,
+    lsh_min_rows: Optional[int] = None,
+    lsh_bits: int = 6,
+    lsh_tables: int = 12,
+    seed: int = 0,
+) -> List[List[int]]:
+    """
+    Cụm near-duplicate (>= 2 phần tử) theo chỉ số gốc của embeddings, cụm sắp theo phần tử đầu.
+    Embedding lỗi / khác chiều embedding hợp lệ đầu tiên bị bỏ qua. lsh_min_rows None hoặc <= 0 = luôn tính chính xác.
+    """
+    matrix, idx = to_matrix(embeddings)
+    n = int(idx.size)
+    if n < 2:
+        return []
+    normed = normalize_rows(matrix)
+    uf = _UnionFind(n)
+    if lsh_min_rows and lsh_min_rows > 0 and n >= lsh_min_rows:
+        for members in _lsh_buckets(normed, max(1, int(lsh_bits)), max(1, int(lsh_tables)), seed):
+            _link_exact(normed, threshold, uf, members)
+    else:
+        _link_exact(normed, threshold, uf)
+    groups: Dict[int, List[int]] = {}
+    for i in range(n):
+        groups.setdefault(uf.find(i), []).append(int(idx[i]))
+    return sorted((g for g in groups.values() if len(g) > 1), key=lambda g: g[0])
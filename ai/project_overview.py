@@ -0,0 +1,97 @@
+# ai/project_overview.py - Snapshot tổng quan project (arcs, chương, bible index, số lượng) có version, dùng chung router/planner
+"""
+Mỗi lượt chat router (intent_only_classifier) và planner (context_planner / get_plan_v7_light) đều cần tổng quan project.
+Thay vì dựng lại mỗi lần (stories, arcs, chapters, story_bible, 3 count), mỗi project giữ một snapshot trong process:
+
+- Dựng bằng ai.utils.build_project_overview (một query chapters cho mọi arc), bible index lưu đầy đủ, cắt token khi đọc.
+- Version: bảng project_overview_versions (V18), trigger tăng version khi chapters / arcs / story_bible đổi
+  (bỏ qua cột lookup_count của bible). Trong Config.PROJECT_OVERVIEW_VERSION_CHECK_SEC giây sau lần kiểm tra trước
+  (cùng lượt chat) dùng thẳng snapshot, không gọi DB; sau đó một query đọc version, khớp thì dùng tiếp.
+- Dựng lại khi version đổi, khi quá Config.PROJECT_OVERVIEW_MAX_AGE_SEC (số relation / timeline / chunks, thứ tự
+  lookup_count), hoặc khi invalidate_project_overview được gọi. DB chưa chạy V18: snapshot sống
+  Config.PROJECT_OVERVIEW_TTL_NO_VERSION_SEC giây.
+"""
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from config import Config, init_services
+
+# Đọc version lỗi (chưa có bảng V18) → không thử lại trong chừng này giây.
+_VERSION_RETRY_SEC = 300
+
+# project_id → (version, built_at, checked_at, data)
+_snapshots: Dict[str, Tuple[Optional[int], float, float, Dict[str, Any]]] = {}
+_snapshots_lock = threading.Lock()
+_load_locks: Dict[str, threading.Lock] = {}
+_version_unsupported_until = 0.0
+
+
+def _read_version(supabase, project_id: str) -> Optional[int]:
+    """Version hiện tại của project (0 nếu chưa có dòng); None nếu DB chưa có bảng project_overview_versions."""
+    global _version_unsupported_until
+    if time.monotonic() < _version_unsupported_until:
+        return None
+    try:
+        r = (
+            supabase.table("project_overview_versions").select("version")
+            .eq("story_id", project_id).limit(1).execute()
+        )
+    except Exception:
+        _version_unsupported_until = time.monotonic() + _VERSION_RETRY_SEC
+        return None
+    rows = r.data or []
+    return int(rows[0].get("version") or 0) if rows else 0
+
+
+def _is_fresh(entry, now: float) -> bool:
+    version, built_at, _checked_at, _data = entry
+    if version is None:
+        return now - built_at < float(getattr(Config, "PROJECT_OVERVIEW_TTL_NO_VERSION_SEC", 30))
+    return now - built_at < float(getattr(Config, "PROJECT_OVERVIEW_MAX_AGE_SEC", 600))
+
+
+def get_project_overview_snapshot(project_id: str) -> Optional[Dict[str, Any]]:
+    """Snapshot tổng quan của project (dựng lại nếu version đổi / hết hạn); None nếu không kết nối được DB."""
+    if not project_id:
+        return None
+    key = str(project_id)
+    check_sec = float(getattr(Config, "PROJECT_OVERVIEW_VERSION_CHECK_SEC", 5))
+    now = time.monotonic()
+    with _snapshots_lock:
+        entry = _snapshots.get(key)
+        if entry is not None and now - entry[2] < check_sec and _is_fresh(entry, now):
+            return entry[3]
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+    with load_lock:
+        now = time.monotonic()
+        with _snapshots_lock:
+            entry = _snapshots.get(key)
+        if entry is not None and now - entry[2] < check_sec and _is_fresh(entry, now):
+            return entry[3]
+        services = init_services()
+        if not services:
+            return entry[3] if entry is not None else None
+        supabase = services["supabase"]
+        # Đọc version trước khi dựng: thay đổi xảy ra trong lúc dựng sẽ làm version lớn hơn → lần sau dựng lại.
+        version = _read_version(supabase, key)
+        if entry is not None and version == entry[0] and _is_fresh(entry, now):
+            with _snapshots_lock:
+                _snapshots[key] = (version, entry[1], now, entry[3])
+            return entry[3]
+        from ai.utils import build_project_overview
+
+        data = build_project_overview(supabase, key)
+        data["overview_version"] = version
+        with _snapshots_lock:
+            _snapshots[key] = (version, now, now, data)
+        return data
+
+
+def invalidate_project_overview(project_id: Optional[str] = None) -> None:
+    """Bỏ snapshot của project (None = mọi project); lần đọc sau sẽ dựng lại."""
+    with _snapshots_lock:
+        if project_id is None:
+            _snapshots.clear()
+        else:
+            _snapshots.pop(str(project_id), None)
@@ -0,0 +1,164 @@
+# ai/rate_limiter.py - Giới hạn tốc độ thích ứng (token bucket + AIMD) theo model cho lệnh gọi OpenRouter
+"""
+Thay cho khoảng nghỉ cố định 7 giây (DATA_OPERATION_DELAY_SEC cũ) giữa các batch khi xử lý nhiều chương:
+
+- Mỗi model một AdaptiveRateLimiter (dùng chung trong process: chat, data_operation_jobs, worker background_jobs,
+  unified analyze — tất cả đi qua AIService.call_openrouter / AsyncAIService.acall_openrouter).
+- reserve(): đặt chỗ cho 1 request theo token bucket (cho phép burst Config.RATE_LIMIT_BURST), trả về số giây cần chờ.
+- AIMD: mỗi lần thành công tăng tốc độ thêm Config.RATE_LIMIT_INCREASE_RPS (tới RATE_LIMIT_MAX_RPS);
+  429 → nhân Config.RATE_LIMIT_DECREASE_FACTOR và tạm dừng theo Retry-After; 5xx → giảm nhẹ hơn.
+- snapshot_rate_limiters(): trạng thái hiện tại (hiện ở tab Background Jobs).
+"""
+import email.utils
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import Config
+
+# 5xx giảm tốc nhẹ hơn 429 (lỗi phía provider chưa chắc do quá tải).
+_SERVER_ERROR_DECREASE = 0.8
+
+
+def _cfg(name: str, default: float) -> float:
+    return float(getattr(Config, name, default))
+
+
+class AdaptiveRateLimiter:
+    """Token bucket (dạng lịch đặt chỗ) với tốc độ điều chỉnh kiểu AIMD. An toàn đa thread."""
+
+    def __init__(
+        self,
+        key: str,
+        initial_rps: Optional[float] = None,
+        min_rps: Optional[float] = None,
+        max_rps: Optional[float] = None,
+        burst: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.key = key
+        self.min_rps = min_rps if min_rps is not None else _cfg("RATE_LIMIT_MIN_RPS", 0.05)
+        self.max_rps = max_rps if max_rps is not None else _cfg("RATE_LIMIT_MAX_RPS", 10.0)
+        rate = initial_rps if initial_rps is not None else _cfg("RATE_LIMIT_INITIAL_RPS", 1.0)
+        self.rate = min(self.max_rps, max(self.min_rps, rate))
+        self.burst = max(1, int(burst if burst is not None else _cfg("RATE_LIMIT_BURST", 3)))
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._next_slot = clock()
+        self._blocked_until = 0.0
+        self.stats = {"requests": 0, "successes": 0, "throttled": 0, "server_errors": 0, "wait_sec": 0.0}
+
+    def reserve(self) -> float:
+        """Đặt chỗ cho một request; trả về số giây phải chờ trước khi gửi (0 nếu gửi ngay được)."""
+        with self._lock:
+            now = self._clock()
+            interval = 1.0 / self.rate
+            # Tối đa (burst - 1) request "tín dụng" khi rảnh lâu.
+            start = max(self._next_slot, now - (self.burst - 1) * interval, self._blocked_until)
+            self._next_slot = start + interval
+            wait = max(0.0, start - now)
+            self.stats["requests"] += 1
+            self.stats["wait_sec"] += wait
+            return wait
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.stats["successes"] += 1
+            self.rate = min(self.max_rps, self.rate + _cfg("RATE_LIMIT_INCREASE_RPS", 0.1))
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        """429: giảm tốc theo cấp số nhân và dừng gửi tới khi hết Retry-After (hoặc 1 khoảng theo tốc độ mới)."""
+        with self._lock:
+            self.stats["throttled"] += 1
+            self.rate = max(self.min_rps, self.rate * _cfg("RATE_LIMIT_DECREASE_FACTOR", 0.5))
+            pause = retry_after if retry_after is not None and retry_after > 0 else 1.0 / self.rate
+            pause = min(pause, _cfg("RATE_LIMIT_MAX_WAIT_SEC", 120))
+            now = self._clock()
+            self._blocked_until = max(self._blocked_until, now + pause)
+            self._next_slot = max(self._next_slot, self._blocked_until)
+
+    def on_server_error(self) -> None:
+        with self._lock:
+            self.stats["server_errors"] += 1
+            self.rate = max(self.min_rps, self.rate * _SERVER_ERROR_DECREASE)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "key": self.key,
+                "rate_rps": round(self.rate, 3),
+                "blocked_for_sec": round(max(0.0, self._blocked_until - self._clock()), 1),
+                **{k: (round(v, 1) if isinstance(v, float) else v) for k, v in self.stats.items()},
+            }
+
+
+_limiters: Dict[str, AdaptiveRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model: str) -> Optional[AdaptiveRateLimiter]:
+    """Limiter của model (tạo khi cần); None nếu Config.RATE_LIMIT_ENABLED tắt."""
+    if not getattr(Config, "RATE_LIMIT_ENABLED", True):
+        return None
+    key = model or "default"
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = AdaptiveRateLimiter(key)
+            _limiters[key] = limiter
+        return limiter
+
+
+def snapshot_rate_limiters() -> List[Dict[str, Any]]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [lim.snapshot() for lim in limiters]
+
+
+def _parse_retry_after(value: Any) -> Optional[float]:
+    """Header Retry-After: số giây hoặc HTTP-date."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        dt = email.utils.parsedate_to_datetime(str(value))
+        return max(0.0, dt.timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def classify_error(exc: BaseException) -> Tuple[Optional[str], Optional[float]]:
+    """("throttle" | "server" | None, retry_after giây) từ lỗi của openai/httpx client."""
+    response = getattr(exc, "response", None)
+    status = getattr(exc, "status_code", None) or getattr(response, "status_code", None)
+    retry_after = None
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        try:
+            retry_after = _parse_retry_after(headers.get("retry-after"))
+        except Exception:
+            retry_after = None
+    try:
+        status = int(status) if status is not None else None
+    except (TypeError, ValueError):
+        status = None
+    if status == 429:
+        return "throttle", retry_after
+    if status is not None and 500 <= status < 600:
+        return "server", retry_after
+    return None, None
+
+
+def record_error(limiter: Optional[AdaptiveRateLimiter], exc: BaseException) -> bool:
+    """Báo lỗi cho limiter; True nếu là lỗi tạm thời (429/5xx) nên thử lại. Limiter tắt → không thử lại (như cũ)."""
+    kind, retry_after = classify_error(exc)
+    if limiter is None or kind is None:
+        return False
+    if kind == "throttle":
+        limiter.on_throttle(retry_after)
+    else:
+        limiter.on_server_error()
+    return True
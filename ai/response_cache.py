@@ -0,0 +1,237 @@
+# ai/response_cache.py - Cache phản hồi LLM tất định cho các lệnh gọi công cụ (router, planner, unified extract, metadata...)
+"""
+Opt-in: chỉ dùng khi call site được bật trong Config.LLM_RESPONSE_CACHE_SITES (mặc định chỉ multi_chapter_map;
+AIService.call_openrouter(..., cache_site="...")), không stream, và
+temperature <= Config.LLM_RESPONSE_CACHE_MAX_TEMPERATURE. Khóa = sha256(model, messages, temperature,
+max_tokens, response_format). Lưu SQLite trong Config.LOCAL_CACHE_DIR (TTL + giới hạn số dòng).
+
+Mỗi dòng giữ usage của lần gọi thật nên khi hit tính được số tiền đã tiết kiệm (hiển thị ở tab Cost).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from config import Config
+
+
+def response_cache_key(
+    model: str,
+    messages: List[Dict],
+    temperature: float,
+    max_tokens: int,
+    response_format: Optional[Dict],
+) -> str:
+    payload = json.dumps(
+        {
+            "model": model,
+            "messages": messages,
+            "temperature": round(float(temperature or 0.0), 4),
+            "max_tokens": int(max_tokens or 0),
+            "response_format": response_format,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_cacheable_call(cache_site: Optional[str], temperature: float, stream: bool) -> bool:
+    """True nếu lệnh gọi này được phép dùng response cache (cờ tổng + cờ theo call site + ngưỡng temperature)."""
+    if not cache_site or stream:
+        return False
+    if not getattr(Config, "LLM_RESPONSE_CACHE_ENABLED", False):
+        return False
+    sites = getattr(Config, "LLM_RESPONSE_CACHE_SITES", None) or {}
+    if not sites.get(cache_site, False):
+        return False
+    try:
+        return float(temperature) <= float(getattr(Config, "LLM_RESPONSE_CACHE_MAX_TEMPERATURE", 0.3))
+    except (TypeError, ValueError):
+        return False
+
+
+def cached_response(content: str, prompt_tokens: int, completion_tokens: int) -> Any:
+    """Đối tượng giống response của OpenAI client (choices[0].message.content, usage) để call site dùng như cũ."""
+    message = SimpleNamespace(content=content, role="assistant")
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=message, finish_reason="stop", index=0)],
+        usage=SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        ),
+        cached=True,
+    )
+
+
+class ResponseCache:
+    """Kho SQLite cho phản hồi LLM. An toàn khi dùng từ nhiều thread."""
+
+    def __init__(self, db_path: str, ttl_sec: float = 14 * 86400, max_rows: int = 20000):
+        self.ttl_sec = float(ttl_sec)
+        self.max_rows = max(1, int(max_rows))
+        self._lock = threading.Lock()
+        self._puts_since_trim = 0
+        self.counters = {"hits": 0, "misses": 0, "writes": 0}
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_response_cache ("
+            " key TEXT PRIMARY KEY, site TEXT NOT NULL, model TEXT NOT NULL, content TEXT NOT NULL,"
+            " prompt_tokens INTEGER NOT NULL DEFAULT 0, completion_tokens INTEGER NOT NULL DEFAULT 0,"
+            " cost REAL NOT NULL DEFAULT 0, hit_count INTEGER NOT NULL DEFAULT 0, saved REAL NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_response_cache_last_access ON llm_response_cache(last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Trả về response giả lập khi hit (tăng hit_count và số tiền tiết kiệm), None khi miss/hết hạn."""
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT content, prompt_tokens, completion_tokens, cost, created_at FROM llm_response_cache WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is None:
+                    self.counters["misses"] += 1
+                    return None
+                content, p_tok, c_tok, cost, created_at = row
+                if now - created_at > self.ttl_sec:
+                    self._conn.execute("DELETE FROM llm_response_cache WHERE key = ?", (key,))
+                    self._conn.commit()
+                    self.counters["misses"] += 1
+                    return None
+                self._conn.execute(
+                    "UPDATE llm_response_cache SET hit_count = hit_count + 1, saved = saved + cost, last_access = ? WHERE key = ?",
+                    (now, key),
+                )
+                self._conn.commit()
+                self.counters["hits"] += 1
+                return cached_response(content, int(p_tok or 0), int(c_tok or 0))
+            except Exception as e:
+                print(f"ResponseCache read error: {e}")
+                return None
+
+    def put(self, key: str, site: str, model: str, content: str, prompt_tokens: int, completion_tokens: int, cost: float) -> None:
+        if content is None:
+            return
+        now = time.time()
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_response_cache"
+                    " (key, site, model, content, prompt_tokens, completion_tokens, cost, hit_count, saved, created_at, last_access)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, 0, 0, ?, ?)",
+                    (key, site, model, content, int(prompt_tokens or 0), int(completion_tokens or 0), float(cost or 0.0), now, now),
+                )
+                self._conn.commit()
+                self.counters["writes"] += 1
+                self._puts_since_trim += 1
+                if self._puts_since_trim >= 200:
+                    self._puts_since_trim = 0
+                    self._trim(now)
+            except Exception as e:
+                print(f"ResponseCache write error: {e}")
+
+    def _trim(self, now: float) -> None:
+        self._conn.execute("DELETE FROM llm_response_cache WHERE created_at < ?", (now - self.ttl_sec,))
+        total = self._conn.execute("SELECT COUNT(*) FROM llm_response_cache").fetchone()[0]
+        if total > self.max_rows:
+            self._conn.execute(
+                "DELETE FROM llm_response_cache WHERE key IN (SELECT key FROM llm_response_cache ORDER BY last_access LIMIT ?)",
+                (total - self.max_rows,),
+            )
+        self._conn.commit()
+
+    def stats_by_site(self) -> List[Dict[str, Any]]:
+        """Thống kê lưu trữ theo call site: entries, hits, saved (USD)."""
+        with self._lock:
+            try:
+                rows = self._conn.execute(
+                    "SELECT site, COUNT(*), COALESCE(SUM(hit_count), 0), COALESCE(SUM(saved), 0) FROM llm_response_cache GROUP BY site ORDER BY site"
+                ).fetchall()
+            except Exception:
+                rows = []
+        return [{"site": r[0], "entries": int(r[1]), "hits": int(r[2]), "saved": float(r[3])} for r in rows]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_response_cache")
+            self._conn.commit()
+
+
+_cache_instance: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """ResponseCache dùng chung của process; None nếu tắt hoặc không mở được SQLite."""
+    global _cache_instance
+    if not getattr(Config, "LLM_RESPONSE_CACHE_ENABLED", False):
+        return None
+    if _cache_instance is not None:
+        return _cache_instance
+    with _cache_lock:
+        if _cache_instance is None:
+            cache_dir = getattr(Config, "LOCAL_CACHE_DIR", "") or ""
+            if not cache_dir:
+                return None
+            try:
+                _cache_instance = ResponseCache(
+                    os.path.join(cache_dir, "llm_responses.sqlite"),
+                    ttl_sec=getattr(Config, "LLM_RESPONSE_CACHE_TTL_SEC", 14 * 86400),
+                    max_rows=getattr(Config, "LLM_RESPONSE_CACHE_MAX_ROWS", 20000),
+                )
+            except Exception as e:
+                print(f"ResponseCache: không mở được SQLite: {e}")
+                return None
+        return _cache_instance
+
+
+def lookup_cached_response(
+    cache_site: Optional[str],
+    model: str,
+    messages: List[Dict],
+    temperature: float,
+    max_tokens: int,
+    response_format: Optional[Dict],
+    stream: bool,
+):
+    """Trả về (key, response). key None = lệnh gọi không được cache; response None = miss."""
+    if not is_cacheable_call(cache_site, temperature, stream):
+        return None, None
+    cache = get_response_cache()
+    if cache is None:
+        return None, None
+    key = response_cache_key(model, messages, temperature, max_tokens, response_format)
+    return key, cache.get(key)
+
+
+def store_cached_response(key: Optional[str], cache_site: str, model: str, response: Any) -> None:
+    """Lưu nội dung + usage của response thật vào cache (bỏ qua khi key None hoặc response rỗng)."""
+    if not key:
+        return
+    cache = get_response_cache()
+    if cache is None:
+        return
+    try:
+        content = response.choices[0].message.content
+    except Exception:
+        return
+    if not content:
+        return
+    usage = getattr(response, "usage", None)
+    p_tok = int(getattr(usage, "prompt_tokens", 0) or 0) if usage is not None else 0
+    c_tok = int(getattr(usage, "completion_tokens", 0) or 0) if usage is not None else 0
+    from ai.service import AIService
+    cost = AIService.calculate_cost(p_tok, c_tok, model)
+    cache.put(key, cache_site, model, content, p_tok, c_tok, cost)
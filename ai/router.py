@@ -227,6 +227,7 @@ Trả về JSON với đủ key:
                 temperature=0.1,
                 max_tokens=500,
                 response_format={"type": "json_object"},
+                cache_site="router_intent",
             )
             content = response.choices[0].message.content
             content = AIService.clean_json_text(content)
@@ -385,6 +386,7 @@ INPUT USER: "{user_prompt}"
                 temperature=0.1,
                 max_tokens=600,
                 response_format={"type": "json_object"},
+                cache_site="router_context_planner",
             )
             content = response.choices[0].message.content
             content = AIService.clean_json_text(content)
@@ -602,7 +604,8 @@ Bạn là AI Điều Phối Viên (Router) cho hệ thống V7-Universal. Nhiệ
                 model=_get_default_tool_model(),
                 temperature=0.1,
                 max_tokens=500,
-                response_format={"type": "json_object"}
+                response_format={"type": "json_object"},
+                cache_site="router_v2",
             )
             content = response.choices[0].message.content
             content = AIService.clean_json_text(content)
@@ -740,6 +743,7 @@ Chỉ trả về JSON."""
                 temperature=0.1,
                 max_tokens=800,
                 response_format={"type": "json_object"},
+                cache_site="router_plan_v7",
             )
             content = response.choices[0].message.content
             content = AIService.clean_json_text(content)
@@ -1011,6 +1015,7 @@ LƯU Ý:
                 temperature=0.1,
                 max_tokens=700,
                 response_format={"type": "json_object"},
+                cache_site="router_plan_v7_light",
             )
             content = response.choices[0].message.content
             content = AIService.clean_json_text(content)
@@ -0,0 +1,153 @@
+# ai/semantic_intent_matcher.py - Bộ khớp Semantic Intent có cache theo project (ma trận embedding + ngưỡng)
+"""
+check_semantic_intent chạy ở mọi câu chat. Thay vì mỗi lượt probe bảng, đọc lại ngưỡng trong settings, tải toàn bộ mẫu
+đã duyệt kèm embedding rồi lặp Python, mỗi project giữ một SemanticIntentMatcher:
+
+- Ma trận embedding đã chuẩn hóa (float32) + payload (id, question_sample, intent, related_data) + ngưỡng từ settings.
+- match(query_vec): một phép nhân ma trận-vector, không gọi DB.
+- Nạp lại khi hết Config.SEMANTIC_INTENT_MATCHER_TTL_SEC hoặc khi invalidate_semantic_intent_matcher được gọi
+  (views/semantic_intent_view.py sửa/xóa/duyệt/lưu ngưỡng, run_semantic_intent_embedding_backfill).
+"""
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config, init_services
+from ai.vector_ops import normalize_rows, parse_vector, to_matrix
+
+# Nạp lỗi (bảng chưa có, mất mạng) → thử lại sau chừng này giây thay vì mỗi lượt chat.
+_FAILED_RETRY_SEC = 60
+_PAGE_SIZE = 500
+
+
+def _threshold_from_setting(value: Any) -> Optional[float]:
+    """Giá trị settings 'semantic_intent_threshold' (phần trăm) → ngưỡng 0.85–1.0; None nếu trống/lỗi."""
+    if value is None:
+        return None
+    try:
+        return max(0.85, min(1.0, float(value) / 100.0))
+    except (TypeError, ValueError):
+        return None
+
+
+class SemanticIntentMatcher:
+    """Ma trận embedding các mẫu Semantic Intent đã duyệt của một project + ngưỡng đã đọc từ settings."""
+
+    def __init__(self, project_id: str, rows: List[Dict[str, Any]], threshold: Optional[float] = None):
+        self.project_id = project_id
+        matrix, idx = to_matrix([r.get("embedding") for r in rows])
+        self.matrix = normalize_rows(matrix)
+        self.rows = [{k: v for k, v in rows[int(i)].items() if k != "embedding"} for i in idx]
+        self.threshold = threshold
+        self.loaded_at = time.time()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @classmethod
+    def load(cls, project_id: str, supabase) -> "SemanticIntentMatcher":
+        threshold = None
+        try:
+            r = supabase.table("settings").select("value").eq("key", "semantic_intent_threshold").execute()
+            if r.data and r.data[0]:
+                threshold = _threshold_from_setting(r.data[0].get("value"))
+        except Exception:
+            pass
+        rows: List[Dict[str, Any]] = []
+        start = 0
+        while True:
+            r = (
+                supabase.table("semantic_intent")
+                .select("id, question_sample, intent, related_data, embedding")
+                .eq("story_id", project_id)
+                .eq("approve", True)
+                .not_.is_("embedding", "null")
+                .order("id")
+                .range(start, start + _PAGE_SIZE - 1)
+                .execute()
+            )
+            batch = list(r.data or [])
+            rows.extend(batch)
+            if len(batch) < _PAGE_SIZE:
+                break
+            start += _PAGE_SIZE
+        return cls(project_id, rows, threshold)
+
+    def match(self, query_vec: Any, threshold: float = 0.90) -> Optional[Dict[str, Any]]:
+        """
+        Mẫu gần nhất với query (similarity = (cosine+1)/2, bằng nhau lấy mẫu đầu tiên) nếu >= ngưỡng; None nếu không có.
+        Ngưỡng trong settings (nếu có) ghi đè tham số threshold.
+        """
+        if self.threshold is not None:
+            threshold = self.threshold
+        if not self.rows:
+            return None
+        q = parse_vector(query_vec, self.matrix.shape[1])
+        if q is None:
+            return None
+        qn = float(np.linalg.norm(q))
+        if qn <= 0:
+            return None
+        sims = self.matrix @ (q / qn)
+        best = int(np.argmax(sims))
+        sim = (float(sims[best]) + 1) / 2
+        if sim < threshold:
+            return None
+        return {**self.rows[best], "similarity": sim}
+
+
+_matchers: Dict[str, Tuple[float, Optional[SemanticIntentMatcher]]] = {}
+_matchers_lock = threading.Lock()
+_load_locks: Dict[str, threading.Lock] = {}
+
+
+def get_semantic_intent_matcher(project_id: str) -> Optional[SemanticIntentMatcher]:
+    """Matcher còn hạn của project (nạp đồng bộ nếu chưa có / hết hạn); None nếu không nạp được."""
+    if not project_id:
+        return None
+    ttl = float(getattr(Config, "SEMANTIC_INTENT_MATCHER_TTL_SEC", 600))
+    key = str(project_id)
+
+    def _cached():
+        entry = _matchers.get(key)
+        if entry is None:
+            return False, None
+        expires_at, matcher = entry
+        if time.time() >= expires_at:
+            return False, None
+        return True, matcher
+
+    with _matchers_lock:
+        hit, matcher = _cached()
+        if hit:
+            return matcher
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+    with load_lock:
+        with _matchers_lock:
+            hit, matcher = _cached()
+            if hit:
+                return matcher
+        try:
+            services = init_services()
+            if not services:
+                return None
+            matcher = SemanticIntentMatcher.load(key, services["supabase"])
+            expires_at = time.time() + ttl
+        except Exception as e:
+            print(f"SemanticIntentMatcher load error: {e}")
+            matcher = None
+            expires_at = time.time() + min(ttl, _FAILED_RETRY_SEC)
+        with _matchers_lock:
+            _matchers[key] = (expires_at, matcher)
+        return matcher
+
+
+def invalidate_semantic_intent_matcher(project_id: Optional[str] = None) -> None:
+    """Bỏ matcher của project (None = mọi project, ví dụ khi đổi ngưỡng chung); lần khớp sau sẽ nạp lại."""
+    with _matchers_lock:
+        if project_id is None:
+            _matchers.clear()
+        else:
+            _matchers.pop(str(project_id), None)
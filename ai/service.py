@@ -1,9 +1,14 @@
 # ai/service.py - AIService và model mặc định cho công cụ
+import time
+
 import streamlit as st
-from openai import OpenAI
 from typing import Any, Dict, List, Optional
 
 from config import Config
+from ai.client_pool import get_openrouter_client
+from ai.embedding_cache import get_embedding_cache
+from ai.rate_limiter import get_rate_limiter, record_error
+from ai.response_cache import lookup_cached_response, store_cached_response
 
 
 def _get_default_tool_model() -> str:
@@ -22,14 +27,7 @@ class AIService:
     @st.cache_data(ttl=3600)
     def get_available_models():
         """Lấy danh sách model có sẵn từ OpenRouter"""
-        try:
-            client = OpenAI(
-                base_url=Config.OPENROUTER_BASE_URL,
-                api_key=Config.OPENROUTER_API_KEY
-            )
-            return Config.AVAILABLE_MODELS
-        except Exception:
-            return Config.AVAILABLE_MODELS
+        return Config.AVAILABLE_MODELS
 
     @staticmethod
     def call_openrouter(
@@ -38,60 +36,83 @@ class AIService:
         temperature: float = 0.7,
         max_tokens: int = 8000,
         stream: bool = False,
-        response_format: Optional[Dict] = None
+        response_format: Optional[Dict] = None,
+        cache_site: Optional[str] = None,
     ) -> Any:
-        """Gọi OpenRouter API sử dụng OpenAI client"""
-        try:
-            client = OpenAI(
-                base_url=Config.OPENROUTER_BASE_URL,
-                api_key=Config.OPENROUTER_API_KEY,
-                default_headers={
-                    "HTTP-Referer": "https://v-universe.streamlit.app",
-                    "X-Title": "V-Universe AI Hub"
-                }
-            )
-
-            # OpenRouter: ưu tiên throughput (provider.sort) khi gọi model
-            extra = {"provider": {"sort": "throughput"}}
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stream=stream,
-                response_format=response_format,
-                extra_body=extra,
-            )
-
-            return response
-        except Exception as e:
-            raise Exception(f"OpenRouter API error: {str(e)}")
+        """Gọi OpenRouter API sử dụng OpenAI client.
+        cache_site: tên call site (xem Config.LLM_RESPONSE_CACHE_SITES) để dùng response cache khi temperature thấp."""
+        cache_key, cached = lookup_cached_response(
+            cache_site, model, messages, temperature, max_tokens, response_format, stream
+        )
+        if cached is not None:
+            return cached
+        limiter = get_rate_limiter(model)
+        max_retries = int(getattr(Config, "RATE_LIMIT_MAX_RETRIES", 2))
+        max_wait = float(getattr(Config, "RATE_LIMIT_MAX_WAIT_SEC", 120))
+        attempt = 0
+        while True:
+            try:
+                client = get_openrouter_client()
+                if limiter is not None:
+                    wait = limiter.reserve()
+                    if wait > 0:
+                        time.sleep(min(wait, max_wait))
+
+                # OpenRouter: ưu tiên throughput (provider.sort) khi gọi model
+                extra = {"provider": {"sort": "throughput"}}
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=stream,
+                    response_format=response_format,
+                    extra_body=extra,
+                )
+                if limiter is not None:
+                    limiter.on_success()
+
+                if cache_key:
+                    store_cached_response(cache_key, cache_site, model, response)
+                return response
+            except Exception as e:
+                # 429 / 5xx: limiter giảm tốc (tôn trọng Retry-After) rồi thử lại; lỗi khác ném ra như cũ.
+                if record_error(limiter, e) and attempt < max_retries:
+                    attempt += 1
+                    continue
+                raise Exception(f"OpenRouter API error: {str(e)}")
 
     @staticmethod
     def get_embedding(text: str) -> Optional[List[float]]:
-        """Lấy embedding từ OpenRouter"""
+        """Lấy embedding từ OpenRouter (qua embedding cache nếu bật)."""
         if not text or not isinstance(text, str) or not text.strip():
             return None
+        cache = get_embedding_cache()
+        if cache is not None:
+            cached = cache.get(Config.EMBEDDING_MODEL, text)
+            if cached is not None:
+                return cached
 
         try:
-            client = OpenAI(
-                base_url=Config.OPENROUTER_BASE_URL,
-                api_key=Config.OPENROUTER_API_KEY
-            )
+            client = get_openrouter_client()
 
             response = client.embeddings.create(
                 model=Config.EMBEDDING_MODEL,
                 input=text
             )
 
-            return response.data[0].embedding
+            embedding = response.data[0].embedding
+            if cache is not None and embedding:
+                cache.put(Config.EMBEDDING_MODEL, text, embedding)
+            return embedding
         except Exception as e:
             print(f"Embedding error: {e}")
             return None
 
     @staticmethod
     def get_embeddings_batch(texts: List[str], batch_size: int = 100) -> List[Optional[List[float]]]:
-        """Lấy embedding hàng loạt (nhiều text trong ít request). Trả về list cùng thứ tự với texts; phần tử lỗi là None."""
+        """Lấy embedding hàng loạt (nhiều text trong ít request). Trả về list cùng thứ tự với texts; phần tử lỗi là None.
+        Text đã có trong embedding cache không gửi lên API."""
         if not texts:
             return []
         out: List[Optional[List[float]]] = [None] * len(texts)
@@ -103,11 +124,22 @@ class AIService:
                 valid_texts.append(t.strip())
         if not valid_texts:
             return out
+        cache = get_embedding_cache()
+        if cache is not None:
+            cached = cache.get_many(Config.EMBEDDING_MODEL, valid_texts)
+            miss_indices: List[int] = []
+            miss_texts: List[str] = []
+            for idx, text, vec in zip(valid_indices, valid_texts, cached):
+                if vec is not None:
+                    out[idx] = vec
+                else:
+                    miss_indices.append(idx)
+                    miss_texts.append(text)
+            valid_indices, valid_texts = miss_indices, miss_texts
+            if not valid_texts:
+                return out
         try:
-            client = OpenAI(
-                base_url=Config.OPENROUTER_BASE_URL,
-                api_key=Config.OPENROUTER_API_KEY
-            )
+            client = get_openrouter_client()
             for start in range(0, len(valid_texts), batch_size):
                 chunk = valid_texts[start:start + batch_size]
                 chunk_indices = valid_indices[start:start + batch_size]
@@ -119,6 +151,8 @@ class AIService:
                     idx = chunk_indices[j] if j < len(chunk_indices) else start + j
                     if idx < len(out) and emb_obj.embedding is not None:
                         out[idx] = emb_obj.embedding
+                if cache is not None:
+                    cache.put_many(Config.EMBEDDING_MODEL, chunk, [out[i] for i in chunk_indices])
         except Exception as e:
             print(f"Embedding batch error: {e}")
         return out
@@ -224,39 +224,14 @@ def format_bible_context_by_sections(raw_list: List[Dict]) -> str:
 
 
 def get_chapter_list_for_router(project_id: str) -> str:
+    """Danh sách "số - tiêu đề" các chương; đọc từ snapshot tổng quan (ai/project_overview.py)."""
     if not project_id:
         return "(Trống)"
-    try:
-        services = init_services()
-        if not services:
-            return "(Trống)"
-        r = (
-            services["supabase"]
-            .table("chapters")
-            .select("chapter_number, title")
-            .eq("story_id", project_id)
-            .order("chapter_number")
-            .execute()
-        )
-        rows = list(r.data) if r.data else []
-        if not rows:
-            return "(Trống)"
-        parts = []
-        for row in rows:
-            num = row.get("chapter_number") or 0
-            title = (row.get("title") or "").strip() or f"Chương {num}"
-            parts.append(f"{num} - {title}")
-        return ", ".join(parts)
-    except Exception:
-        return "(Trống)"
+    return get_project_overview(project_id, bible_max_tokens=0).get("chapter_list_str") or "(Trống)"
 
 
-def get_project_overview(project_id: str, bible_max_tokens: int = 2000) -> Dict[str, Any]:
-    """
-    Bức tranh tổng quan DB cho Context Planner (bước 2): project name, arcs, chapters, bible index,
-    số lượng relation / timeline / chunks.
-    """
-    out = {
+def _empty_project_overview() -> Dict[str, Any]:
+    return {
         "project_name": "",
         "arcs_summary": "(Trống)",
         "arc_chapters_summary": "(Trống)",
@@ -266,39 +241,60 @@ def get_project_overview(project_id: str, bible_max_tokens: int = 2000) -> Dict[
         "timeline_summary": "0 sự kiện",
         "chunks_summary": "0 chunks",
     }
-    if not project_id:
+
+
+def build_project_overview(supabase, project_id: str) -> Dict[str, Any]:
+    """
+    Dựng tổng quan DB (không cache): project name, arcs + chương từng arc, danh sách chương, bible index đầy đủ
+    (chưa cắt theo token), số relation / timeline / chunks. Một query chapters dùng chung cho mọi arc.
+    """
+    out = _empty_project_overview()
+    if not project_id or not supabase:
         return out
     try:
-        services = init_services()
-        if not services:
-            return out
-        supabase = services["supabase"]
         # Project name (stories table hiện không còn cột 'name' → chỉ select 'title' để tránh lỗi 42703)
         r = supabase.table("stories").select("title").eq("id", project_id).limit(1).execute()
         if r.data and len(r.data) > 0:
             row = r.data[0]
             out["project_name"] = (row.get("name") or row.get("title") or "").strip() or "(Không tên)"
+        try:
+            cr = (
+                supabase.table("chapters").select("chapter_number, title, arc_id")
+                .eq("story_id", project_id).order("chapter_number").execute()
+            )
+            chapters = list(cr.data or [])
+            chapters_ok = True
+        except Exception:
+            chapters, chapters_ok = [], False
+        if chapters:
+            parts = []
+            for row in chapters:
+                num = row.get("chapter_number") or 0
+                title = (row.get("title") or "").strip() or f"Chương {num}"
+                parts.append(f"{num} - {title}")
+            out["chapter_list_str"] = ", ".join(parts)
         # Arcs + chương thuộc từng arc (để prompt khoanh vùng khi user hỏi về arc)
         ar = supabase.table("arcs").select("id, name, sort_order").eq("story_id", project_id).order("sort_order").execute()
         if ar.data:
+            nums_by_arc: Dict[Any, List[str]] = defaultdict(list)
+            for row in chapters:
+                if row.get("arc_id") is not None and row.get("chapter_number") is not None:
+                    nums_by_arc[str(row["arc_id"])].append(str(row["chapter_number"]))
             arc_names = []
             arc_chapters_parts = []
             for a in ar.data:
                 name = (a.get("name") or a.get("title") or "").strip() or "Arc"
                 arc_names.append(name)
-                arc_id = a.get("id")
-                if arc_id:
-                    try:
-                        ch = supabase.table("chapters").select("chapter_number").eq("story_id", project_id).eq("arc_id", arc_id).order("chapter_number").execute()
-                        nums = [str(row.get("chapter_number")) for row in (ch.data or []) if row.get("chapter_number") is not None]
-                        arc_chapters_parts.append(f"{name}: chương {', '.join(nums)}" if nums else f"{name}: (chưa gán chương)")
-                    except Exception:
-                        arc_chapters_parts.append(f"{name}: (lỗi truy vấn)")
+                if not a.get("id"):
+                    continue
+                if not chapters_ok:
+                    arc_chapters_parts.append(f"{name}: (lỗi truy vấn)")
+                    continue
+                nums = nums_by_arc.get(str(a["id"])) or []
+                arc_chapters_parts.append(f"{name}: chương {', '.join(nums)}" if nums else f"{name}: (chưa gán chương)")
             out["arcs_summary"] = ", ".join(arc_names) if arc_names else "(Trống)"
             out["arc_chapters_summary"] = ". ".join(arc_chapters_parts) if arc_chapters_parts else "(Trống)"
-        # Chapters & Bible (dùng hàm có sẵn)
-        out["chapter_list_str"] = get_chapter_list_for_router(project_id)
-        out["bible_index"] = get_bible_index(project_id, max_tokens=bible_max_tokens)
+        out["bible_index"] = _build_bible_index(supabase, project_id)
         # Counts: entity_relations, timeline_events, chunks
         try:
             rel = supabase.table("entity_relations").select("id", count="exact").eq("story_id", project_id).limit(0).execute()
@@ -320,6 +316,21 @@ def get_project_overview(project_id: str, bible_max_tokens: int = 2000) -> Dict[
     return out
 
 
+def get_project_overview(project_id: str, bible_max_tokens: int = 2000) -> Dict[str, Any]:
+    """
+    Bức tranh tổng quan DB cho Context Planner (bước 2): project name, arcs, chapters, bible index,
+    số lượng relation / timeline / chunks. Đọc từ snapshot có version (ai/project_overview.py),
+    bible index cắt theo bible_max_tokens.
+    """
+    if not project_id:
+        return _empty_project_overview()
+    from ai.project_overview import get_project_overview_snapshot
+
+    out = dict(get_project_overview_snapshot(project_id) or _empty_project_overview())
+    out["bible_index"] = _cap_bible_index(out.get("bible_index") or "", bible_max_tokens)
+    return out
+
+
 def parse_chapter_range_from_query(query: str) -> Optional[Tuple[int, int]]:
     if not query or not isinstance(query, str) or not query.strip():
         return None
@@ -346,30 +357,38 @@ def parse_chapter_range_from_query(query: str) -> Optional[Tuple[int, int]]:
 
 
 def get_bible_index(story_id: str, max_tokens: int = 2000) -> str:
+    """Top 100 entity (lookup_count + importance_bias) kèm tên gốc; đọc từ snapshot tổng quan, cắt theo max_tokens."""
     if not story_id:
         return ""
+    return get_project_overview(story_id, bible_max_tokens=max_tokens).get("bible_index") or ""
+
+
+def _cap_bible_index(text: str, max_tokens: int) -> str:
+    if text and _estimate_tokens(text) > max_tokens:
+        return text[: max(100, max_tokens * 4)]
+    return text
+
+
+def _build_bible_index(supabase, story_id: str) -> str:
+    """Bible index đầy đủ (chưa cắt theo token) cho snapshot tổng quan."""
     try:
-        services = init_services()
-        if not services:
-            return ""
-        supabase = services["supabase"]
+        rows = (
+            supabase.table("story_bible")
+            .select("entity_name, lookup_count, importance_bias, parent_id")
+            .eq("story_id", story_id)
+            .execute()
+        )
+    except Exception:
         try:
             rows = (
                 supabase.table("story_bible")
-                .select("entity_name, lookup_count, importance_bias, parent_id")
+                .select("entity_name, lookup_count, importance_bias")
                 .eq("story_id", story_id)
                 .execute()
             )
         except Exception:
-            try:
-                rows = (
-                    supabase.table("story_bible")
-                    .select("entity_name, lookup_count, importance_bias")
-                    .eq("story_id", story_id)
-                    .execute()
-                )
-            except Exception:
-                return ""
+            return ""
+    try:
         data = list(rows.data) if rows.data else []
         for r in data:
             r.setdefault("parent_id", None)
@@ -409,10 +428,7 @@ def get_bible_index(story_id: str, max_tokens: int = 2000) -> str:
             if pid is not None and parent_names.get(pid):
                 line += f" (gốc: {parent_names[pid]})"
             lines.append(line)
-        out = "\n".join(lines) if lines else ""
-        if _estimate_tokens(out) > max_tokens:
-            out = out[: max(100, max_tokens * 4)]
-        return out
+        return "\n".join(lines) if lines else ""
     except Exception as e:
         print(f"get_bible_index error: {e}")
         return ""
@@ -0,0 +1,368 @@
+# ai/vector_index.py - Index vector trong bộ nhớ theo project (chunks, relations, timeline)
+"""
+Thay vì mỗi câu hỏi kéo hàng chục dòng kèm embedding 4096 chiều qua PostgREST rồi chấm điểm bằng Python,
+mỗi (project, loại dữ liệu) có một ma trận float32 đã chuẩn hóa giữ trong process:
+
+- Nạp lười: lần đầu cần thì nạp nền (thread daemon); trong lúc chưa sẵn sàng caller dùng đường cũ.
+- Cập nhật tăng dần: mark_vector_rows_dirty(table, ids) sau khi ghi/xóa embedding (backfill, unified analyze,
+  sửa tay) → lần search kế tiếp chỉ tải lại đúng các id đó. Hết Config.VECTOR_INDEX_TTL_SEC thì nạp lại toàn bộ.
+- search(query, k, min_sim, where): top-k cosine với bộ lọc phạm vi theo cột (chapter_id, source_chapter, arc_id, id).
+  Bảng lớn (>= Config.VECTOR_INDEX_IVF_MIN_ROWS) chia cụm kiểu IVF (k-means NumPy) và chỉ quét nprobe cụm gần nhất.
+- Payload dòng (content, title...) do caller lấy theo id sau khi có top-k.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import Config
+from ai.vector_ops import normalize_rows, parse_vector, to_matrix
+
+# Mỗi loại index: bảng nguồn, cột phạm vi giữ kèm vector, điều kiện lọc cố định.
+INDEX_SPECS: Dict[str, Dict[str, Any]] = {
+    "chunks": {"table": "chunks", "scope_columns": ("chapter_id", "arc_id"), "filters": {}},
+    "relations": {"table": "entity_relations", "scope_columns": ("source_chapter",), "filters": {}},
+    "timeline": {"table": "timeline_events", "scope_columns": ("chapter_id", "arc_id"), "filters": {}},
+}
+
+FetchFn = Callable[[str, Dict[str, Any], Optional[List[Any]]], List[Dict[str, Any]]]
+
+
+def _supabase_fetch(project_id: str, spec: Dict[str, Any], ids: Optional[List[Any]] = None) -> List[Dict[str, Any]]:
+    """Tải (id, embedding, cột phạm vi) từ Supabase: toàn bộ dòng đã có embedding của project, hoặc chỉ các id cho trước."""
+    from config import init_services
+
+    services = init_services()
+    if not services:
+        raise RuntimeError("Supabase chưa sẵn sàng")
+    supabase = services["supabase"]
+    cols = ", ".join(("id", "embedding") + tuple(spec["scope_columns"]) + tuple(spec["filters"].keys()))
+
+    def _base():
+        q = supabase.table(spec["table"]).select(cols).eq("story_id", project_id)
+        for col, val in spec["filters"].items():
+            q = q.eq(col, val)
+        return q
+
+    rows: List[Dict[str, Any]] = []
+    if ids is not None:
+        for start in range(0, len(ids), 200):
+            r = _base().in_("id", [str(i) for i in ids[start:start + 200]]).execute()
+            rows.extend(r.data or [])
+        return rows
+    page = max(50, int(getattr(Config, "VECTOR_INDEX_PAGE_SIZE", 500)))
+    start = 0
+    while True:
+        r = _base().not_.is_("embedding", "null").order("id").range(start, start + page - 1).execute()
+        batch = list(r.data or [])
+        rows.extend(batch)
+        if len(batch) < page:
+            return rows
+        start += page
+
+
+class ProjectVectorIndex:
+    """Index phẳng float32 (tùy chọn chia cụm IVF) cho một loại dữ liệu của một project. An toàn đa thread."""
+
+    def __init__(self, project_id: str, kind: str, fetch_fn: Optional[FetchFn] = None):
+        if kind not in INDEX_SPECS:
+            raise ValueError(f"Loại index không hợp lệ: {kind}")
+        self.project_id = project_id
+        self.kind = kind
+        self.spec = INDEX_SPECS[kind]
+        self._fetch = fetch_fn or _supabase_fetch
+        self._lock = threading.RLock()
+        self._ids: List[Any] = []
+        self._row_of: Dict[str, int] = {}
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._scope: Dict[str, List[Any]] = {c: [] for c in self.spec["scope_columns"]}
+        self._dirty: set = set()
+        self._centroids: Optional[np.ndarray] = None
+        self._assign: Optional[np.ndarray] = None
+        self.loaded_at: Optional[float] = None
+        self.loading = False
+        self.failed_at: Optional[float] = None
+        self.stats = {"loads": 0, "refreshed_rows": 0, "searches": 0}
+
+    # ---- trạng thái ----
+    @property
+    def ready(self) -> bool:
+        if self.loaded_at is None:
+            return False
+        ttl = float(getattr(Config, "VECTOR_INDEX_TTL_SEC", 900))
+        return ttl <= 0 or (time.time() - self.loaded_at) < ttl
+
+    def __len__(self) -> int:
+        return int(self._alive.sum())
+
+    # ---- nạp / cập nhật ----
+    def load(self) -> bool:
+        """Nạp toàn bộ (đồng bộ). False nếu lỗi hoặc vượt Config.VECTOR_INDEX_MAX_ROWS (caller dùng đường cũ)."""
+        with self._lock:
+            self.loading = True
+            # Id đánh dấu trước lần tải này được tải toàn bộ phủ; id đánh dấu trong lúc tải vẫn giữ lại để refresh sau.
+            covered = set(self._dirty)
+            self._dirty.clear()
+        try:
+            rows = self._fetch(self.project_id, self.spec, None)
+            max_rows = int(getattr(Config, "VECTOR_INDEX_MAX_ROWS", 10000))
+            if max_rows and len(rows) > max_rows:
+                print(f"VectorIndex[{self.kind}] {self.project_id}: {len(rows)} dòng > VECTOR_INDEX_MAX_ROWS, bỏ qua index")
+                with self._lock:
+                    self._dirty |= covered
+                    self.failed_at = time.time()
+                return False
+            matrix, idx = to_matrix([r.get("embedding") for r in rows])
+            kept = [rows[int(i)] for i in idx]
+            with self._lock:
+                self._ids = [r.get("id") for r in kept]
+                self._row_of = {str(rid): i for i, rid in enumerate(self._ids)}
+                self._matrix = normalize_rows(matrix)
+                self._alive = np.ones(len(kept), dtype=bool)
+                self._scope = {c: [r.get(c) for r in kept] for c in self.spec["scope_columns"]}
+                self._build_partitions()
+                self.loaded_at = time.time()
+                self.failed_at = None
+                self.stats["loads"] += 1
+            return True
+        except Exception as e:
+            print(f"VectorIndex[{self.kind}] load error: {e}")
+            with self._lock:
+                self._dirty |= covered
+                self.failed_at = time.time()
+            return False
+        finally:
+            with self._lock:
+                self.loading = False
+
+    def mark_dirty(self, ids: Iterable[Any]) -> None:
+        with self._lock:
+            self._dirty.update(str(i) for i in ids if i is not None)
+
+    def remove(self, ids: Iterable[Any]) -> None:
+        with self._lock:
+            for rid in ids:
+                row = self._row_of.pop(str(rid), None)
+                if row is not None:
+                    self._alive[row] = False
+            self._maybe_compact()
+
+    def upsert_rows(self, rows: Sequence[Dict[str, Any]]) -> None:
+        """Thêm/ghi đè các dòng {id, embedding, cột phạm vi...}; dòng không có embedding hợp lệ bị gỡ khỏi index."""
+        # Cùng id xuất hiện nhiều lần trong lô → lấy dòng sau cùng (mỗi id chỉ ghi một hàng).
+        latest: Dict[str, Dict[str, Any]] = {}
+        for r in rows:
+            if r.get("id") is not None:
+                latest[str(r.get("id"))] = r
+        with self._lock:
+            dim = self._matrix.shape[1] if self._matrix.size else None
+            base = len(self._ids)
+            new_vecs: List[np.ndarray] = []
+            dropped: List[Any] = []
+            for key, r in latest.items():
+                rid = r.get("id")
+                vec = parse_vector(r.get("embedding"), dim)
+                if vec is None:
+                    dropped.append(rid)
+                    continue
+                if dim is None:
+                    dim = vec.size
+                    self._matrix = np.zeros((0, dim), dtype=np.float32)
+                vec = normalize_rows(vec.reshape(1, -1))[0]
+                row = self._row_of.get(key)
+                if row is not None:
+                    self._matrix[row] = vec
+                    for c in self._scope:
+                        self._scope[c][row] = r.get(c)
+                    if self._assign is not None:
+                        self._assign[row] = self._nearest_centroid(vec)
+                    continue
+                self._row_of[key] = base + len(new_vecs)
+                self._ids.append(rid)
+                for c in self._scope:
+                    self._scope[c].append(r.get(c))
+                new_vecs.append(vec)
+            if new_vecs:
+                block = np.vstack(new_vecs).astype(np.float32)
+                self._matrix = np.vstack([self._matrix, block]) if self._matrix.size else block
+                self._alive = np.concatenate([self._alive, np.ones(len(new_vecs), dtype=bool)])
+                if self._assign is not None:
+                    self._assign = np.concatenate([self._assign, np.array([self._nearest_centroid(v) for v in block], dtype=np.int64)])
+            if dropped:
+                # Sau khi ma trận đã đủ hàng mới: remove() có thể nén lại (compact) an toàn.
+                self.remove(dropped)
+
+    def _refresh_dirty(self) -> None:
+        with self._lock:
+            dirty = list(self._dirty)
+            self._dirty.clear()
+        if not dirty:
+            return
+        try:
+            rows = self._fetch(self.project_id, self.spec, dirty)
+        except Exception as e:
+            print(f"VectorIndex[{self.kind}] refresh error: {e}")
+            self.mark_dirty(dirty)
+            return
+        found = {str(r.get("id")) for r in rows}
+        self.remove([rid for rid in dirty if rid not in found])
+        self.upsert_rows(rows)
+        self.stats["refreshed_rows"] += len(dirty)
+
+    def _maybe_compact(self) -> None:
+        dead = len(self._alive) - int(self._alive.sum())
+        if dead < 64 or dead < 0.2 * len(self._alive):
+            return
+        keep = np.flatnonzero(self._alive)
+        self._ids = [self._ids[i] for i in keep]
+        self._matrix = self._matrix[keep]
+        self._scope = {c: [vals[i] for i in keep] for c, vals in self._scope.items()}
+        self._alive = np.ones(len(keep), dtype=bool)
+        self._row_of = {str(rid): i for i, rid in enumerate(self._ids)}
+        if self._assign is not None:
+            self._assign = self._assign[keep]
+
+    # ---- chia cụm IVF ----
+    def _build_partitions(self) -> None:
+        n = self._matrix.shape[0]
+        min_rows = int(getattr(Config, "VECTOR_INDEX_IVF_MIN_ROWS", 5000))
+        if min_rows <= 0 or n < min_rows:
+            self._centroids, self._assign = None, None
+            return
+        nlist = max(8, int(np.sqrt(n)))
+        rng = np.random.default_rng(0)
+        sample = self._matrix[rng.choice(n, size=min(n, nlist * 40), replace=False)]
+        centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+        for _ in range(8):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[labels == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = normalize_rows(centroids)
+        assign = np.empty(n, dtype=np.int64)
+        for start in range(0, n, 4096):
+            assign[start:start + 4096] = np.argmax(self._matrix[start:start + 4096] @ centroids.T, axis=1)
+        self._centroids, self._assign = centroids, assign
+
+    def _nearest_centroid(self, vec: np.ndarray) -> int:
+        return int(np.argmax(self._centroids @ vec)) if self._centroids is not None else 0
+
+    # ---- truy vấn ----
+    def _candidate_mask(self, where: Optional[Dict[str, Iterable[Any]]]) -> np.ndarray:
+        mask = self._alive.copy()
+        for col, allowed in (where or {}).items():
+            if allowed is None:
+                continue
+            allowed_set = {str(v) for v in allowed}
+            values = self._ids if col == "id" else self._scope.get(col)
+            if values is None:
+                raise KeyError(f"VectorIndex[{self.kind}] không có cột phạm vi {col}")
+            mask &= np.fromiter((str(v) in allowed_set for v in values), dtype=bool, count=len(values))
+        return mask
+
+    def search(
+        self,
+        query: Any,
+        k: int = 10,
+        min_sim: Optional[float] = None,
+        where: Optional[Dict[str, Iterable[Any]]] = None,
+    ) -> List[Tuple[Any, float]]:
+        """Top-k (id, cosine) giảm dần; where: {cột: tập giá trị cho phép} (cột trong scope_columns hoặc 'id')."""
+        self._refresh_dirty()
+        q = parse_vector(query)
+        with self._lock:
+            self.stats["searches"] += 1
+            if q is None or self._matrix.size == 0 or q.size != self._matrix.shape[1]:
+                return []
+            qn = float(np.linalg.norm(q))
+            if qn <= 0:
+                return []
+            q = q / qn
+            mask = self._candidate_mask(where)
+            rows = np.flatnonzero(mask)
+            if self._centroids is not None and rows.size > k * 4:
+                nprobe = max(1, int(getattr(Config, "VECTOR_INDEX_IVF_NPROBE", 8)))
+                probe = np.argsort(-(self._centroids @ q))[:nprobe]
+                probed = rows[np.isin(self._assign[rows], probe)]
+                if probed.size >= k:
+                    rows = probed
+            if rows.size == 0:
+                return []
+            sims = self._matrix[rows] @ q
+            if min_sim is not None:
+                keep = sims >= min_sim
+                rows, sims = rows[keep], sims[keep]
+            order = np.argsort(-sims, kind="stable")[: max(0, int(k))]
+            return [(self._ids[rows[o]], float(sims[o])) for o in order]
+
+    def get_vectors(self, ids: Iterable[Any]) -> Dict[str, np.ndarray]:
+        """Vector (đã chuẩn hóa) của các id có trong index, khóa str(id)."""
+        with self._lock:
+            out = {}
+            for rid in ids:
+                row = self._row_of.get(str(rid))
+                if row is not None and self._alive[row]:
+                    out[str(rid)] = self._matrix[row]
+            return out
+
+
+_indexes: Dict[Tuple[str, str], ProjectVectorIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _start_background_load(index: ProjectVectorIndex) -> None:
+    threading.Thread(
+        target=index.load,
+        name=f"vector-index-{index.kind}",
+        daemon=True,
+    ).start()
+
+
+def get_vector_index(project_id: str, kind: str, wait: bool = False) -> Optional[ProjectVectorIndex]:
+    """
+    Index sẵn sàng của (project, kind), hoặc None (tắt / đang nạp / lỗi gần đây) để caller dùng đường cũ.
+    wait=True: nạp đồng bộ nếu chưa sẵn sàng (dùng trong job nền, test).
+    """
+    if not project_id or not getattr(Config, "VECTOR_INDEX_ENABLED", True):
+        return None
+    key = (str(project_id), kind)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = ProjectVectorIndex(str(project_id), kind)
+            _indexes[key] = index
+    if index.ready:
+        return index
+    retry_sec = float(getattr(Config, "VECTOR_INDEX_RETRY_SEC", 300))
+    if index.failed_at is not None and time.time() - index.failed_at < retry_sec:
+        return None
+    if wait:
+        return index if index.load() else None
+    with index._lock:
+        if index.loading:
+            return None
+        index.loading = True
+    _start_background_load(index)
+    return None
+
+
+def mark_vector_rows_dirty(table: str, ids: Iterable[Any]) -> None:
+    """Báo embedding của các dòng (theo tên bảng) vừa ghi/xóa; mọi index đã nạp của bảng đó sẽ tải lại đúng các id này."""
+    ids = [i for i in ids if i is not None]
+    if not ids:
+        return
+    with _indexes_lock:
+        targets = [ix for ix in _indexes.values() if ix.spec["table"] == table]
+    for ix in targets:
+        ix.mark_dirty(ids)
+
+
+def invalidate_vector_index(project_id: Optional[str] = None, kind: Optional[str] = None) -> None:
+    """Bỏ index (theo project và/hoặc loại); lần dùng sau sẽ nạp lại toàn bộ."""
+    with _indexes_lock:
+        for key in list(_indexes.keys()):
+            if (project_id is None or key[0] == str(project_id)) and (kind is None or key[1] == kind):
+                _indexes.pop(key, None)
@@ -0,0 +1,188 @@
+# ai/vector_ops.py - Kernel similarity dùng chung (NumPy float32): parse embedding một lần, cosine theo lô, top-k, lọc trùng
+"""
+Mọi chỗ chấm điểm vector phía Python (context_helpers, hybrid_search, global_data_sync) đi qua module này
+thay vì vòng lặp thuần Python trên từng phần tử của vector 4096 chiều.
+
+- parse_vector: list/tuple/chuỗi JSON '[...]'/ndarray → np.float32 (None nếu không hợp lệ).
+- to_matrix: nhiều embedding → ma trận (n, d) float32 + chỉ số dòng gốc hợp lệ (bỏ dòng lỗi / sai chiều).
+- cosine_scores / top_k: cosine giữa 1 query và cả ma trận trong một phép nhân.
+- greedy_dedupe / best_earlier_match: lọc near-duplicate tham lam (giữ thứ tự) trên ma trận similarity theo khối.
+"""
+import json
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Số dòng mỗi khối khi tính ma trận similarity n×n (giới hạn bộ nhớ: khối × n × 4 byte).
+_BLOCK_ROWS = 1024
+
+
+def parse_vector(raw: Any, dim: Optional[int] = None) -> Optional[np.ndarray]:
+    """Chuẩn hóa một embedding (list/tuple, chuỗi '[0.1,...]', ndarray) về vector float32 1 chiều; None nếu lỗi/rỗng/sai chiều."""
+    if raw is None:
+        return None
+    try:
+        if isinstance(raw, str):
+            txt = raw.strip()
+            if not txt:
+                return None
+            try:
+                raw = json.loads(txt)
+            except Exception:
+                if txt.startswith("[") and txt.endswith("]"):
+                    txt = txt[1:-1]
+                raw = [float(p) for p in txt.split(",") if p.strip()]
+        if isinstance(raw, np.ndarray):
+            vec = raw.astype(np.float32, copy=False).ravel()
+        else:
+            if not isinstance(raw, (list, tuple)) or not raw:
+                return None
+            vec = np.asarray(raw, dtype=np.float32)
+        if vec.ndim != 1 or vec.size == 0:
+            return None
+        if dim is not None and vec.size != dim:
+            return None
+        if not np.all(np.isfinite(vec)):
+            return None
+        return vec
+    except (TypeError, ValueError):
+        return None
+
+
+def to_matrix(embeddings: Sequence[Any], dim: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parse danh sách embedding thành ma trận (m, d) float32 cùng mảng chỉ số gốc (m,).
+    dim None: lấy chiều của embedding hợp lệ đầu tiên; dòng khác chiều bị bỏ.
+    """
+    rows: List[np.ndarray] = []
+    idx: List[int] = []
+    for i, raw in enumerate(embeddings):
+        vec = parse_vector(raw, dim)
+        if vec is None:
+            continue
+        if dim is None:
+            dim = vec.size
+        rows.append(vec)
+        idx.append(i)
+    if not rows:
+        return np.zeros((0, dim or 0), dtype=np.float32), np.zeros(0, dtype=np.int64)
+    return np.vstack(rows), np.asarray(idx, dtype=np.int64)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Chuẩn hóa L2 từng dòng; dòng norm 0 giữ nguyên 0 (cosine với nó = 0)."""
+    if matrix.size == 0:
+        return matrix
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms <= 0] = 1.0
+    return matrix / norms
+
+
+def cosine_sim(a: Any, b: Any) -> float:
+    """Cosine giữa hai vector; 0.0 nếu không hợp lệ, khác chiều hoặc norm 0."""
+    va = parse_vector(a)
+    vb = parse_vector(b)
+    if va is None or vb is None or va.size != vb.size:
+        return 0.0
+    na = float(np.linalg.norm(va))
+    nb = float(np.linalg.norm(vb))
+    if na <= 0 or nb <= 0:
+        return 0.0
+    return float(np.dot(va, vb) / (na * nb))
+
+
+def cosine_scores(query: Any, matrix: np.ndarray) -> np.ndarray:
+    """Cosine giữa query và từng dòng của matrix (m, d). Query lỗi/khác chiều → mảng rỗng."""
+    q = parse_vector(query)
+    if q is None or matrix.ndim != 2 or matrix.shape[0] == 0 or matrix.shape[1] != q.size:
+        return np.zeros(0, dtype=np.float32)
+    qn = float(np.linalg.norm(q))
+    if qn <= 0:
+        return np.zeros(matrix.shape[0], dtype=np.float32)
+    return normalize_rows(matrix) @ (q / qn)
+
+
+def score_embeddings(query: Any, embeddings: Sequence[Any]) -> List[Tuple[int, float]]:
+    """Cosine giữa query và từng embedding (bỏ embedding lỗi / khác chiều query). Trả [(chỉ số gốc, sim)] theo thứ tự gốc."""
+    q = parse_vector(query)
+    if q is None:
+        return []
+    matrix, idx = to_matrix(embeddings, dim=q.size)
+    if idx.size == 0:
+        return []
+    sims = cosine_scores(q, matrix)
+    return [(int(i), float(s)) for i, s in zip(idx, sims)]
+
+
+def top_k(
+    query: Any,
+    embeddings: Sequence[Any],
+    k: Optional[int] = None,
+    min_sim: Optional[float] = None,
+) -> List[Tuple[int, float]]:
+    """Top-k embedding gần query nhất: [(chỉ số gốc, sim)] giảm dần theo sim; bằng nhau giữ thứ tự gốc."""
+    scored = score_embeddings(query, embeddings)
+    if not scored:
+        return []
+    idx = np.fromiter((i for i, _ in scored), dtype=np.int64, count=len(scored))
+    sims = np.fromiter((s for _, s in scored), dtype=np.float64, count=len(scored))
+    if min_sim is not None:
+        keep = sims >= min_sim
+        idx, sims = idx[keep], sims[keep]
+    order = np.argsort(-sims, kind="stable")
+    if k is not None:
+        order = order[: max(0, int(k))]
+    return [(int(idx[o]), float(sims[o])) for o in order]
+
+
+def greedy_dedupe(embeddings: Sequence[Any], threshold: float) -> List[int]:
+    """
+    Lọc near-duplicate tham lam theo thứ tự: phần tử được giữ nếu cosine với mọi phần tử đã giữ trước nó < threshold.
+    Phần tử không có embedding hợp lệ luôn được giữ; chỉ so với phần tử cùng số chiều. Trả về chỉ số gốc được giữ (tăng dần).
+    """
+    n = len(embeddings)
+    if n == 0 or threshold <= 0:
+        return list(range(n))
+    vecs = [parse_vector(e) for e in embeddings]
+    dropped = np.zeros(n, dtype=bool)
+    by_dim: dict = {}
+    for i, v in enumerate(vecs):
+        if v is not None:
+            by_dim.setdefault(v.size, []).append(i)
+    for members in by_dim.values():
+        if len(members) < 2:
+            continue
+        matrix = normalize_rows(np.vstack([vecs[i] for i in members]))
+        kept = np.zeros(len(members), dtype=bool)
+        for start in range(0, len(members), _BLOCK_ROWS):
+            block = matrix[start:start + _BLOCK_ROWS] @ matrix[: start + _BLOCK_ROWS].T
+            for r in range(block.shape[0]):
+                i = start + r
+                if i and np.any(block[r, :i][kept[:i]] >= threshold):
+                    dropped[members[i]] = True
+                else:
+                    kept[i] = True
+    return [i for i in range(n) if not dropped[i]]
+
+
+def best_earlier_match(matrix: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Với mỗi dòng i của matrix (m, d): chỉ số j < i có cosine cao nhất và >= threshold (bằng nhau lấy j lớn nhất), -1 nếu không có.
+    Dùng cho gán parent trong một nhóm (ví dụ cùng chương) đã sắp xếp ổn định.
+    """
+    m = matrix.shape[0]
+    out = np.full(m, -1, dtype=np.int64)
+    if m < 2:
+        return out
+    normed = normalize_rows(matrix.astype(np.float32, copy=False))
+    for start in range(1, m, _BLOCK_ROWS):
+        stop = min(m, start + _BLOCK_ROWS)
+        block = normed[start:stop] @ normed[:stop].T
+        for r in range(block.shape[0]):
+            i = start + r
+            sims = block[r, :i]
+            j_rev = int(np.argmax(sims[::-1]))
+            j = i - 1 - j_rev
+            if sims[j] >= threshold:
+                out[i] = j
+    return out
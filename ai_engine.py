@@ -1,7 +1,10 @@
 # ai_engine.py - Router, Context, Rule Mining (AIService + context_helpers đã tách ra ai/)
 import json
 import re
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from typing import Dict, List, Optional, Tuple, Any
 
@@ -63,6 +66,59 @@ except ImportError:
     ArcService = None
     ReverseLookupAssembler = None
 
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except ImportError:
+    add_script_run_ctx = None
+    get_script_run_ctx = None
+
+
+def _run_context_fetchers(fetchers: List[Tuple[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, float], float]:
+    """
+    Chạy các hàm lấy context độc lập (chunk/bible/relation/timeline), song song trên thread pool nếu
+    Config.CONTEXT_GATHER_PARALLEL. Trả về (kết quả theo tên nguồn, thời gian từng nguồn (ms), tổng thời gian (ms)).
+    Nguồn lỗi trả về None (đã log). Thứ tự ghép do caller quyết định nên output không phụ thuộc nguồn nào xong trước.
+    """
+    results: Dict[str, Any] = {}
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+
+    def _timed(name: str, fn: Any) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return fn()
+        except Exception as e:
+            print(f"context gather [{name}] error: {e}")
+            return None
+        finally:
+            timings[name] = round((time.perf_counter() - t0) * 1000, 1)
+
+    max_workers = int(getattr(Config, "CONTEXT_GATHER_MAX_WORKERS", 4) or 1)
+    if len(fetchers) <= 1 or max_workers <= 1 or not getattr(Config, "CONTEXT_GATHER_PARALLEL", True):
+        for name, fn in fetchers:
+            results[name] = _timed(name, fn)
+    else:
+        script_ctx = get_script_run_ctx() if get_script_run_ctx else None
+
+        def _worker(name: str, fn: Any) -> Any:
+            # Gắn ScriptRunContext của phiên hiện tại để st.cache_* trong thread con không cảnh báo.
+            if script_ctx is not None and add_script_run_ctx:
+                add_script_run_ctx(threading.current_thread(), script_ctx)
+            return _timed(name, fn)
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(fetchers)), thread_name_prefix="ctx-gather") as pool:
+            futures = [(name, pool.submit(_worker, name, fn)) for name, fn in fetchers]
+            for name, fut in futures:
+                results[name] = fut.result()
+    timings = {name: timings[name] for name, _fn in fetchers if name in timings}
+    return results, timings, round((time.perf_counter() - started) * 1000, 1)
+
+
+def format_gather_timings(timings: Dict[str, float], wall_ms: float) -> str:
+    """Dòng nguồn debug: thời gian từng nguồn context và tổng thời gian gather."""
+    parts = [f"{name} {ms:.0f}ms" for name, ms in timings.items()]
+    return "⏱️ Gather: " + " · ".join(parts) + f" (tổng {wall_ms:.0f}ms)"
+
 
 # ---------- Intent context handlers (dispatch by INTENT_HANDLER_MAP) ----------
 def _intent_handle_clarification(router_result: Dict, ctx: Dict) -> None:
@@ -325,10 +381,17 @@ def _intent_handle_llm_with_context(router_result: Dict, ctx: Dict) -> None:
         if p and str(p).strip().upper().replace(" ", "_") in valid_keys
     ] if valid_keys else raw_inferred
 
+    # Embedding câu hỏi tính một lần, dùng chung cho mọi nguồn (không để từng nguồn tự embed lại).
+    if query_emb is None and query_for_vec:
+        query_emb = AIService.get_embedding(query_for_vec)
+        ctx["query_embedding"] = query_emb
+
     # Thứ tự ưu tiên: chunk → bible → relation → timeline (không load full chapter ở đây; full chapter chỉ khi fallback)
+    # Bước fetch của từng nguồn độc lập nhau (Supabase + vector + LLM re-rank) nên chạy song song;
+    # bước ghép bên dưới vẫn đi đúng thứ tự trên và kiểm tra _over_budget() trước mỗi nguồn như cũ.
+
     # 1) Chunk (vector, scope) + LLM re-rank
-    if "chunk" in context_needs and not _over_budget():
-        chunk_ctx_added = False
+    def _fetch_chunk() -> Dict[str, Any]:
         # Ưu tiên câu query semantic cho chunk; sau đó tới từ khóa do planner suy ra; fallback về rewritten_query
         if semantic_chunk_query:
             query_for_chunk = semantic_chunk_query[:300]
@@ -406,7 +469,7 @@ def _intent_handle_llm_with_context(router_result: Dict, ctx: Dict) -> None:
                 llm_selected_chunk_ids = []
 
         chunk_rows = filter_context_items_by_embedding(chunk_rows)
-        chunk_chapter_nums = set()
+        out: Dict[str, Any] = {"chunk_rows": chunk_rows, "ordered_ids": [], "chunk_ctx": "", "chunk_sources": [], "chunk_tokens": 0}
         if chunk_rows and ReverseLookupAssembler:
             # Kết hợp: (1) danh sách chunk do LLM chọn, (2) danh sách chunk từ vector search,
             # rồi loại trùng lặp để ra thứ tự ưu tiên cuối cùng.
@@ -467,57 +530,14 @@ def _intent_handle_llm_with_context(router_result: Dict, ctx: Dict) -> None:
                 chunk_ctx, chunk_sources, chunk_tokens = ContextManager.build_context_with_chunk_reverse_lookup(
                     project_id, ordered_ids, current_arc_id, token_limit=CHUNK_MAX_TOKENS
                 )
-                # Luôn đánh dấu các chunk_id đã dùng (kể cả khi chunk_ctx rỗng) để timeline không nạp lại.
-                used_chunk_ids_main.update(ordered_ids)
-                if chunk_ctx:
-                    for c in chunk_rows:
-                        ch = c.get("chapter_id")
-                        if ch and c.get("meta_json"):
-                            try:
-                                import json as _j
-
-                                m = _j.loads(c["meta_json"]) if isinstance(c["meta_json"], str) else c["meta_json"]
-                                ch_num = m.get("chapter_number") or m.get("chapter")
-                                if ch_num is not None:
-                                    chunk_chapter_nums.add(int(ch_num))
-                            except Exception:
-                                pass
-                    # Nếu có thêm chunk theo chương mục tiêu, đảm bảo chapter_numbers phản ánh đúng để router/planner biết đã có semantic cho các chương đó.
-                    if range_bounds_bible:
-                        try:
-                            start_rb, end_rb = int(range_bounds_bible[0]), int(range_bounds_bible[1])
-                            for n in range(start_rb, end_rb + 1):
-                                chunk_chapter_nums.add(int(n))
-                        except (TypeError, ValueError, IndexError):
-                            pass
-                    context_parts.append(chunk_ctx)
-                    total_tokens += chunk_tokens
-                    sources.extend(chunk_sources)
-                    sources.append("📦 Chunks")
-                    context_parts_meta.append(
-                        {
-                            "source": "chunk",
-                            "chapter_numbers": list(chunk_chapter_nums) or chapter_numbers[:10],
-                            "text": chunk_ctx,
-                        }
-                    )
-                    chunk_ctx_added = True
-
-        # Nếu không chọn được bất kỳ chunk nào đủ liên quan, đừng để trống — ghi rõ vào context để LLM hiểu trạng thái dữ liệu.
-        if not chunk_ctx_added:
-            no_chunk_note = (
-                "[CHUNK SEARCH]: Không tìm được chunk nào đủ liên quan trực tiếp tới câu hỏi trong bước gather. "
-                "Nếu vẫn còn Bible/Timeline/Relation hoặc thông tin khác, hãy ưu tiên dựa vào chúng. "
-                "Nếu sau đó vẫn không đủ căn cứ, hãy nói rõ rằng không tìm thấy thông tin phù hợp trong dữ liệu hiện có và **không được bịa thêm nội dung**."
-            )
-            context_parts.append(no_chunk_note)
-            total_tokens += AIService.estimate_tokens(no_chunk_note)
-            context_parts_meta.append({"source": "chunk", "chapter_numbers": [], "text": no_chunk_note})
+                out.update(ordered_ids=ordered_ids, chunk_ctx=chunk_ctx, chunk_sources=chunk_sources, chunk_tokens=chunk_tokens)
+        return out
 
     # 2) Bible (vector, scope)
-    if ("bible" in context_needs or "relation" in context_needs) and not _over_budget():
+    def _fetch_bible() -> Dict[str, Any]:
         bible_context = ""
         bible_chapter_nums = set()
+        lookup_ids: List[Any] = []
         for entity in target_bible_entities[:5]:
             raw_list = HybridSearch.smart_search_hybrid_raw(
                 entity, project_id, top_k=7, inferred_prefixes=inferred_prefixes,
@@ -531,13 +551,7 @@ def _intent_handle_llm_with_context(router_result: Dict, ctx: Dict) -> None:
                 for r in raw_list:
                     if r.get("source_chapter") is not None:
                         bible_chapter_nums.add(int(r["source_chapter"]))
-                for item in raw_list:
-                    try:
-                        eid = item.get("id")
-                        if eid is not None:
-                            HybridSearch.update_lookup_stats(eid)
-                    except Exception:
-                        pass
+                lookup_ids.extend(item.get("id") for item in raw_list if item.get("id") is not None)
                 main_id = raw_list[0].get("id") if raw_list else None
                 rel_block = ""
                 if main_id:
@@ -560,13 +574,7 @@ def _intent_handle_llm_with_context(router_result: Dict, ctx: Dict) -> None:
                 for r in raw_list:
                     if r.get("source_chapter") is not None:
                         bible_chapter_nums.add(int(r["source_chapter"]))
-                for item in raw_list:
-                    try:
-                        eid = item.get("id")
-                        if eid is not None:
-                            HybridSearch.update_lookup_stats(eid)
-                    except Exception:
-                        pass
+                lookup_ids.extend(item.get("id") for item in raw_list if item.get("id") is not None)
                 main_id = raw_list[0].get("id") if raw_list else None
                 rel_block = ""
                 if main_id:
@@ -575,12 +583,179 @@ def _intent_handle_llm_with_context(router_result: Dict, ctx: Dict) -> None:
                         rel_block = f"> [RELATION]:\n{rel_text}\n\n"
                 part = format_bible_context_by_sections(raw_list)
                 bible_context = f"\n--- KNOWLEDGE BASE ---\n{rel_block}{part}\n"
+        return {"text": bible_context, "chapter_numbers": list(bible_chapter_nums), "lookup_ids": lookup_ids}
+
+    # 3) Relation (vector, scope)
+    def _fetch_relation() -> str:
+        # Ưu tiên query semantic cho relation; sau đó tới entity chính do planner suy ra; fallback về rewritten_query
+        if semantic_relation_query:
+            rel_query = semantic_relation_query[:300]
+        elif target_relation_entities:
+            rel_query = " ; ".join(str(e) for e in target_relation_entities if e)[:300]
+        else:
+            rel_query = query_for_vec or "quan hệ"
+        return get_top_relations_by_query(
+            project_id, rel_query,
+            top_k=RELATION_TOP_K,
+            query_embedding=query_emb,
+            chapter_numbers=chapter_numbers if arc_ids else None,
+            max_relations=RELATION_MAX_ITEMS,
+        )
+
+    # 4) Timeline (vector + list, scope)
+    def _fetch_timeline() -> Dict[str, Any]:
+        events = get_timeline_events(
+            project_id,
+            limit=TIMELINE_MAX_ITEMS,
+            chapter_range=range_bounds_bible,
+            arc_id=current_arc_id if not arc_ids else None,
+            chapter_ids=chapter_ids if chapter_ids else None,
+            arc_ids=arc_ids if arc_ids else None,
+        )
+        events = filter_context_items_by_embedding(events)
+        if not events:
+            # Ưu tiên từ khóa timeline do planner suy ra; fallback về rewritten_query
+            if target_timeline_keywords:
+                tl_query = " ; ".join(str(k) for k in target_timeline_keywords if k)[:300]
+            else:
+                tl_query = query_for_vec or "sự kiện"
+            tl_vec = get_top_timeline_by_query(
+                project_id, tl_query,
+                top_k=TIMELINE_VECTOR_TOP_K,
+                query_embedding=query_emb,
+                chapter_ids=chapter_ids[:500] if chapter_ids else None,
+                arc_ids=arc_ids if arc_ids else None,
+                max_events=80,
+            )
+            return {"events": [], "block": "", "vector_text": tl_vec or ""}
+
+        # Khi intent là analyze_pacing: tính thống kê pacing đơn giản dựa trên timeline.
+        pacing_block = ""
+        if intent == "analyze_pacing":
+            total_ev = len(events)
+            type_counts: Dict[str, int] = {}
+            for e in events:
+                et = (e.get("event_type") or "event").strip() or "event"
+                type_counts[et] = type_counts.get(et, 0) + 1
+            thirds = {"start": 0, "middle": 0, "end": 0}
+            for idx, _e in enumerate(events):
+                pos = (idx + 1) / total_ev
+                if pos <= 1 / 3:
+                    thirds["start"] += 1
+                elif pos <= 2 / 3:
+                    thirds["middle"] += 1
+                else:
+                    thirds["end"] += 1
+            type_parts = [f"{k}={v}" for k, v in type_counts.items()]
+            pacing_lines = [
+                "[PACING TIMELINE SUMMARY]",
+                f"- Tổng số sự kiện: {total_ev}",
+                f"- Phân bố theo loại: " + (", ".join(type_parts) if type_parts else "không phân loại"),
+                f"- Phân bố theo đoạn chương (ước lượng theo thứ tự sự kiện):",
+                f"  • Đầu chương: {thirds['start']} sự kiện",
+                f"  • Giữa chương: {thirds['middle']} sự kiện",
+                f"  • Cuối chương: {thirds['end']} sự kiện",
+            ]
+            pacing_block = "\n".join(pacing_lines)
+
+        lines = []
+        if pacing_block:
+            lines.append(pacing_block)
+            lines.append("")  # dòng trống ngăn cách
+        lines.append("[TIMELINE EVENTS - Thứ tự sự kiện / mốc thời gian]")
+        for e in events:
+            order = e.get("event_order", 0)
+            title = e.get("title", "")
+            desc = (e.get("description") or "")[:400]
+            raw_date = e.get("raw_date", "")
+            etype = e.get("event_type", "event")
+            lines.append(
+                f"- #{order} [{etype}] {title}"
+                + (f" (Thời điểm: {raw_date})" if raw_date else "")
+                + f"\n  {desc}"
+            )
+        return {"events": events, "block": "\n".join(lines), "vector_text": ""}
+
+    fetchers: List[Tuple[str, Any]] = []
+    if not _over_budget():
+        if "chunk" in context_needs:
+            fetchers.append(("chunk", _fetch_chunk))
+        if "bible" in context_needs or "relation" in context_needs:
+            fetchers.append(("bible", _fetch_bible))
+        if "relation" in context_needs:
+            fetchers.append(("relation", _fetch_relation))
+        if "timeline" in context_needs:
+            fetchers.append(("timeline", _fetch_timeline))
+    fetched, source_timings, gather_wall_ms = _run_context_fetchers(fetchers)
+    ctx["source_timings"] = dict(source_timings, total=gather_wall_ms)
+
+    # Ghép theo thứ tự cố định chunk → bible → relation → timeline.
+    if "chunk" in fetched and not _over_budget():
+        chunk_ctx_added = False
+        chunk_res = fetched.get("chunk") or {}
+        chunk_rows = chunk_res.get("chunk_rows") or []
+        ordered_ids = chunk_res.get("ordered_ids") or []
+        chunk_ctx = chunk_res.get("chunk_ctx") or ""
+        chunk_chapter_nums = set()
+        if ordered_ids:
+            # Luôn đánh dấu các chunk_id đã dùng (kể cả khi chunk_ctx rỗng) để timeline không nạp lại.
+            used_chunk_ids_main.update(ordered_ids)
+        if chunk_ctx:
+            for c in chunk_rows:
+                ch = c.get("chapter_id")
+                if ch and c.get("meta_json"):
+                    try:
+                        m = json.loads(c["meta_json"]) if isinstance(c["meta_json"], str) else c["meta_json"]
+                        ch_num = m.get("chapter_number") or m.get("chapter")
+                        if ch_num is not None:
+                            chunk_chapter_nums.add(int(ch_num))
+                    except Exception:
+                        pass
+            # Nếu có thêm chunk theo chương mục tiêu, đảm bảo chapter_numbers phản ánh đúng để router/planner biết đã có semantic cho các chương đó.
+            if range_bounds_bible:
+                try:
+                    start_rb, end_rb = int(range_bounds_bible[0]), int(range_bounds_bible[1])
+                    for n in range(start_rb, end_rb + 1):
+                        chunk_chapter_nums.add(int(n))
+                except (TypeError, ValueError, IndexError):
+                    pass
+            context_parts.append(chunk_ctx)
+            total_tokens += chunk_res.get("chunk_tokens") or 0
+            sources.extend(chunk_res.get("chunk_sources") or [])
+            sources.append("📦 Chunks")
+            context_parts_meta.append(
+                {
+                    "source": "chunk",
+                    "chapter_numbers": list(chunk_chapter_nums) or chapter_numbers[:10],
+                    "text": chunk_ctx,
+                }
+            )
+            chunk_ctx_added = True
+
+        # Nếu không chọn được bất kỳ chunk nào đủ liên quan, đừng để trống — ghi rõ vào context để LLM hiểu trạng thái dữ liệu.
+        if not chunk_ctx_added:
+            no_chunk_note = (
+                "[CHUNK SEARCH]: Không tìm được chunk nào đủ liên quan trực tiếp tới câu hỏi trong bước gather. "
+                "Nếu vẫn còn Bible/Timeline/Relation hoặc thông tin khác, hãy ưu tiên dựa vào chúng. "
+                "Nếu sau đó vẫn không đủ căn cứ, hãy nói rõ rằng không tìm thấy thông tin phù hợp trong dữ liệu hiện có và **không được bịa thêm nội dung**."
+            )
+            context_parts.append(no_chunk_note)
+            total_tokens += AIService.estimate_tokens(no_chunk_note)
+            context_parts_meta.append({"source": "chunk", "chapter_numbers": [], "text": no_chunk_note})
+
+    if "bible" in fetched and not _over_budget():
+        bible_res = fetched.get("bible") or {}
+        bible_context = bible_res.get("text") or ""
         if bible_context:
+            for eid in bible_res.get("lookup_ids") or []:
+                try:
+                    HybridSearch.update_lookup_stats(eid)
+                except Exception:
+                    pass
             context_parts.append(bible_context)
             total_tokens += AIService.estimate_tokens(bible_context)
             sources.append("📚 Bible Search")
-            context_parts_meta.append({"source": "bible", "chapter_numbers": list(bible_chapter_nums), "text": bible_context})
-
+            context_parts_meta.append({"source": "bible", "chapter_numbers": bible_res.get("chapter_numbers") or [], "text": bible_context})
         # Reverse lookup từ Bible entity -> chương liên quan -> full content (luồng cũ, phình token).
         # Mặc định TẮT; chỉ bật khi user bật "Auto reverse full chapter (luồng cũ)" trong Settings → V8 & Observability.
         # Luồng mới: chỉ dùng Bible → chunk (get_chunks_for_bible_entities, get_event_action_chunks_for_characters) đã gộp ở bước Chunk.
@@ -668,86 +843,19 @@ def _intent_handle_llm_with_context(router_result: Dict, ctx: Dict) -> None:
         except Exception as e:
             print(f"Reverse lookup error: {e}")
 
-    # 3) Relation (vector, scope)
-    if "relation" in context_needs and not _over_budget():
-        # Ưu tiên query semantic cho relation; sau đó tới entity chính do planner suy ra; fallback về rewritten_query
-        if semantic_relation_query:
-            rel_query = semantic_relation_query[:300]
-        elif target_relation_entities:
-            rel_query = " ; ".join(str(e) for e in target_relation_entities if e)[:300]
-        else:
-            rel_query = query_for_vec or "quan hệ"
-        rel_vec = get_top_relations_by_query(
-            project_id, rel_query,
-            top_k=RELATION_TOP_K,
-            query_embedding=query_emb,
-            chapter_numbers=chapter_numbers if arc_ids else None,
-            max_relations=RELATION_MAX_ITEMS,
-        )
+    if "relation" in fetched and not _over_budget():
+        rel_vec = fetched.get("relation")
         if rel_vec:
             context_parts.append(f"\n--- 🔗 {rel_vec}")
             total_tokens += AIService.estimate_tokens(rel_vec)
             sources.append("🔗 Relations (vector)")
             context_parts_meta.append({"source": "relation", "chapter_numbers": chapter_numbers[:20], "text": rel_vec})
 
-    # 4) Timeline (vector + list, scope)
-    if "timeline" in context_needs and not _over_budget():
-        events = get_timeline_events(
-            project_id,
-            limit=TIMELINE_MAX_ITEMS,
-            chapter_range=range_bounds_bible,
-            arc_id=current_arc_id if not arc_ids else None,
-            chapter_ids=chapter_ids if chapter_ids else None,
-            arc_ids=arc_ids if arc_ids else None,
-        )
-        events = filter_context_items_by_embedding(events)
+    if "timeline" in fetched and not _over_budget():
+        tl_res = fetched.get("timeline") or {}
+        events = tl_res.get("events") or []
         if events:
-            # Khi intent là analyze_pacing: tính thống kê pacing đơn giản dựa trên timeline.
-            pacing_block = ""
-            if intent == "analyze_pacing":
-                total_ev = len(events)
-                type_counts: Dict[str, int] = {}
-                for e in events:
-                    et = (e.get("event_type") or "event").strip() or "event"
-                    type_counts[et] = type_counts.get(et, 0) + 1
-                thirds = {"start": 0, "middle": 0, "end": 0}
-                for idx, _e in enumerate(events):
-                    pos = (idx + 1) / total_ev
-                    if pos <= 1 / 3:
-                        thirds["start"] += 1
-                    elif pos <= 2 / 3:
-                        thirds["middle"] += 1
-                    else:
-                        thirds["end"] += 1
-                type_parts = [f"{k}={v}" for k, v in type_counts.items()]
-                pacing_lines = [
-                    "[PACING TIMELINE SUMMARY]",
-                    f"- Tổng số sự kiện: {total_ev}",
-                    f"- Phân bố theo loại: " + (", ".join(type_parts) if type_parts else "không phân loại"),
-                    f"- Phân bố theo đoạn chương (ước lượng theo thứ tự sự kiện):",
-                    f"  • Đầu chương: {thirds['start']} sự kiện",
-                    f"  • Giữa chương: {thirds['middle']} sự kiện",
-                    f"  • Cuối chương: {thirds['end']} sự kiện",
-                ]
-                pacing_block = "\n".join(pacing_lines)
-
-            lines = []
-            if pacing_block:
-                lines.append(pacing_block)
-                lines.append("")  # dòng trống ngăn cách
-            lines.append("[TIMELINE EVENTS - Thứ tự sự kiện / mốc thời gian]")
-            for e in events:
-                order = e.get("event_order", 0)
-                title = e.get("title", "")
-                desc = (e.get("description") or "")[:400]
-                raw_date = e.get("raw_date", "")
-                etype = e.get("event_type", "event")
-                lines.append(
-                    f"- #{order} [{etype}] {title}"
-                    + (f" (Thời điểm: {raw_date})" if raw_date else "")
-                    + f"\n  {desc}"
-                )
-            block = "\n".join(lines)
+            block = tl_res.get("block") or ""
             context_parts.append(block)
             total_tokens += AIService.estimate_tokens(block)
             sources.append("📅 Timeline Events")
@@ -796,19 +904,7 @@ def _intent_handle_llm_with_context(router_result: Dict, ctx: Dict) -> None:
             except Exception as _e:
                 print(f"timeline->chunk reverse lookup error: {_e}")
         else:
-            # Ưu tiên từ khóa timeline do planner suy ra; fallback về rewritten_query
-            if target_timeline_keywords:
-                tl_query = " ; ".join(str(k) for k in target_timeline_keywords if k)[:300]
-            else:
-                tl_query = query_for_vec or "sự kiện"
-            tl_vec = get_top_timeline_by_query(
-                project_id, tl_query,
-                top_k=TIMELINE_VECTOR_TOP_K,
-                query_embedding=query_emb,
-                chapter_ids=chapter_ids[:500] if chapter_ids else None,
-                arc_ids=arc_ids if arc_ids else None,
-                max_events=80,
-            )
+            tl_vec = tl_res.get("vector_text") or ""
             if tl_vec:
                 context_parts.append(f"\n--- 📅 {tl_vec}")
                 total_tokens += AIService.estimate_tokens(tl_vec)
@@ -818,6 +914,9 @@ def _intent_handle_llm_with_context(router_result: Dict, ctx: Dict) -> None:
                 context_parts.append("[TIMELINE] Chưa có dữ liệu timeline_events. Trả lời dựa trên Bible/chương nếu có.")
                 sources.append("📅 Timeline (empty)")
 
+    if source_timings:
+        sources.append(format_gather_timings(source_timings, gather_wall_ms))
+
     # Kiến trúc giống router: primary = retrieval (chunk, bible, timeline, relation);
     # fallback = load full chương CHỈ KHI chưa có semantic (chunk/bible/relation/timeline)
     # bao phủ đầy đủ tất cả các chương mà user đã đề cập (chapter_range).
@@ -1317,6 +1416,15 @@ TRẢ VỀ JSON:
             print(f"load_chapters_by_range error: {e}")
             return "", []
 
+        try:
+            from ai.chapter_digest import render_chapters_with_digests
+
+            digested = render_chapters_with_digests(supabase, project_id, rows, token_limit)
+            if digested is not None:
+                return digested
+        except Exception as e:
+            print(f"load_chapters_by_range digest error: {e}")
+
         full_text = ""
         loaded_sources = []
         total_tokens = 0
@@ -1390,6 +1498,20 @@ TRẢ VỀ JSON:
                 except Exception:
                     pass
 
+        try:
+            from ai.chapter_digest import render_chapters_with_digests
+
+            focus = [i for i, item in enumerate(rows_with_meta) if item.get("_is_focus")]
+            rest = [i for i in range(len(rows_with_meta) - 1, -1, -1) if i not in focus]
+            digested = render_chapters_with_digests(
+                supabase, project_id, rows_with_meta, token_limit,
+                priority=focus + rest, header="SOURCE FILE/CHAP: ",
+            )
+            if digested is not None:
+                return full_text + digested[0], loaded_sources + digested[1]
+        except Exception as e:
+            print(f"load_full_content digest error: {e}")
+
         for item in rows_with_meta:
             title = item.get("title") or f"Chương {item.get('chapter_number')}"
             content = item.get("content") or ""
@@ -1,8 +1,8 @@
 # config.py - Cấu hình hệ thống, session, và cost
+import os
 import streamlit as st
 import time
 from datetime import datetime
-from openai import OpenAI
 from supabase import create_client
 import extra_streamlit_components as stx
 
@@ -16,6 +16,75 @@ class Config:
     # OpenRouter API Configuration
     OPENROUTER_API_KEY = st.secrets.get("openrouter", {}).get("API_KEY", "")
     OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+    OPENROUTER_DEFAULT_HEADERS = {
+        "HTTP-Referer": "https://v-universe.streamlit.app",
+        "X-Title": "V-Universe AI Hub"
+    }
+    # Connection pool dùng chung cho mọi lệnh gọi OpenRouter (chat + embedding), chia sẻ giữa các thread Streamlit và worker nền.
+    OPENROUTER_POOL_MAX_CONNECTIONS = 32
+    OPENROUTER_POOL_MAX_KEEPALIVE = 16
+    OPENROUTER_POOL_KEEPALIVE_EXPIRY_SEC = 60.0
+    OPENROUTER_CONNECT_TIMEOUT_SEC = 10.0
+    OPENROUTER_READ_TIMEOUT_SEC = 600.0
+    # AsyncAIService: số request đồng thời tối đa mỗi model; ghi đè theo model trong OPENROUTER_MODEL_CONCURRENCY.
+    OPENROUTER_MAX_CONCURRENCY_PER_MODEL = 8
+    OPENROUTER_MODEL_CONCURRENCY = {}
+
+    # Thư mục cache cục bộ (SQLite) cho embedding / response cache. Ghi đè bằng biến môi trường V_UNIVERSE_CACHE_DIR.
+    LOCAL_CACHE_DIR = os.environ.get("V_UNIVERSE_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "v_universe")
+    # Embedding cache (ai/embedding_cache.py): LRU trong process + SQLite, khóa theo (model, hash text chuẩn hóa).
+    EMBEDDING_CACHE_ENABLED = True
+    EMBEDDING_CACHE_MEMORY_ITEMS = 2048
+    EMBEDDING_CACHE_TTL_SEC = 30 * 86400
+    EMBEDDING_CACHE_MAX_ROWS = 100000
+    # Response cache cho lệnh gọi công cụ (ai/response_cache.py): chỉ khi call site truyền cache_site và temperature <= ngưỡng.
+    LLM_RESPONSE_CACHE_ENABLED = True
+    LLM_RESPONSE_CACHE_MAX_TEMPERATURE = 0.3
+    LLM_RESPONSE_CACHE_TTL_SEC = 14 * 86400
+    LLM_RESPONSE_CACHE_MAX_ROWS = 20000
+    # Opt-in theo call site (tên truyền vào AIService.call_openrouter(cache_site=...)): mặc định tắt — router / planner
+    # phải quyết định lại theo dữ liệu mới, arc_summary / chapter_metadata bấm tạo lại phải ra bản mới.
+    # Chỉ multi_chapter_map bật sẵn (ghi chú map khóa theo nội dung chương, map-reduce dùng lại giữa các câu hỏi).
+    LLM_RESPONSE_CACHE_SITES = {
+        "router_intent": False,
+        "router_context_planner": False,
+        "router_v2": False,
+        "router_plan_v7": False,
+        "router_plan_v7_light": False,
+        "unified_extract": False,
+        "chapter_metadata": False,
+        "arc_summary": False,
+        "import_category": False,
+        "split_strategy": False,
+        "multi_chapter_map": True,
+    }
+    # Index vector trong bộ nhớ theo project (ai/vector_index.py): chunks, relations, timeline (Bible tìm qua RPC hybrid_search).
+    # Nạp nền lần đầu (trong lúc nạp dùng đường cũ), cập nhật theo id khi embedding thay đổi, nạp lại toàn bộ sau TTL.
+    VECTOR_INDEX_ENABLED = True
+    VECTOR_INDEX_TTL_SEC = 900
+    # float32: 10000 dòng × 4096 chiều ≈ 160MB mỗi index.
+    VECTOR_INDEX_MAX_ROWS = 10000
+    VECTOR_INDEX_PAGE_SIZE = 500
+    VECTOR_INDEX_RETRY_SEC = 300
+    # Chia cụm IVF (k-means NumPy) khi index >= số dòng này; chỉ quét VECTOR_INDEX_IVF_NPROBE cụm gần query nhất.
+    VECTOR_INDEX_IVF_MIN_ROWS = 5000
+    VECTOR_INDEX_IVF_NPROBE = 8
+    # Matcher Semantic Intent (ai/semantic_intent_matcher.py): ma trận mẫu đã duyệt + ngưỡng, cache theo project.
+    SEMANTIC_INTENT_MATCHER_TTL_SEC = 600
+    # Intent cục bộ (ai/intent_classifier.py): nearest-centroid trên embedding, huấn luyện từ chat_turn_logs (V19) +
+    # semantic_intent đã duyệt; độ tin cậy (đã hiệu chỉnh) >= ngưỡng → bỏ qua LLM intent_only_classifier.
+    LOCAL_INTENT_CLASSIFIER_ENABLED = True
+    LOCAL_INTENT_MIN_CONFIDENCE = 0.9
+    LOCAL_INTENT_MIN_SAMPLES_PER_INTENT = 5
+    LOCAL_INTENT_TRAIN_MAX_ROWS = 1000
+    LOCAL_INTENT_CLASSIFIER_TTL_SEC = 1800
+    # Snapshot tổng quan project cho router/planner (ai/project_overview.py): trong N giây sau lần kiểm tra trước dùng
+    # thẳng snapshot (0 query); sau đó đọc version (V18) rồi chỉ dựng lại khi chapters / arcs / bible đổi.
+    PROJECT_OVERVIEW_VERSION_CHECK_SEC = 5
+    # Dựng lại định kỳ để cập nhật số relation / timeline / chunks và thứ tự lookup_count.
+    PROJECT_OVERVIEW_MAX_AGE_SEC = 600
+    # DB chưa chạy V18 (không có version): snapshot chỉ sống chừng này giây.
+    PROJECT_OVERVIEW_TTL_NO_VERSION_SEC = 30
 
     # Supabase Configuration
     SUPABASE_URL = st.secrets.get("supabase", {}).get("SUPABASE_URL", "")
@@ -83,11 +152,110 @@ class Config:
     CONTEXT_SIZE_TOKENS = {"low": 15000, "medium": 60000, "high": 123000, "max": None}
     # Token tối đa cho một lô Data Analyze (Bible/Chunk...) — tránh lỗi gói tối đa / lag
     DATA_BATCH_MAX_TOKENS = 50000
-    # Độ trễ tối thiểu (giây) giữa hai lệnh gọi API khi xử lý theo khoảng chương — tránh quá tải API (5–10s)
-    DATA_OPERATION_DELAY_SEC = 7
+    # Chia lô theo token (core/batch_planner.py): ngân sách input = min(DATA_BATCH_MAX_TOKENS, context model - output)
+    # trừ phần prompt cố định; số chương / lô bị chặn bởi trần output (max_tokens của lệnh extract) và DATA_BATCH_MAX_CHAPTERS.
+    DATA_BATCH_MODEL_CONTEXT_TOKENS = 128000
+    DATA_BATCH_MAX_OUTPUT_TOKENS = 16000
+    DATA_BATCH_OUTPUT_TOKENS_PER_CHAPTER = 1500
+    DATA_BATCH_PROMPT_OVERHEAD_TOKENS = 1500
+    DATA_BATCH_MAX_CHAPTERS = 20
+    # Limiter tốc độ thích ứng theo model cho mọi lệnh gọi OpenRouter (ai/rate_limiter.py), thay khoảng nghỉ cố định
+    # giữa các batch: token bucket, tăng dần khi thành công (AIMD), giảm + tạm dừng theo Retry-After khi 429 / 5xx.
+    RATE_LIMIT_ENABLED = True
+    RATE_LIMIT_INITIAL_RPS = 1.0
+    RATE_LIMIT_MIN_RPS = 0.05
+    RATE_LIMIT_MAX_RPS = 10.0
+    RATE_LIMIT_BURST = 3
+    RATE_LIMIT_INCREASE_RPS = 0.1
+    RATE_LIMIT_DECREASE_FACTOR = 0.5
+    RATE_LIMIT_MAX_WAIT_SEC = 120
+    RATE_LIMIT_MAX_RETRIES = 2
+    # Worker pool hàng đợi background_jobs (core/job_queue.py). Giới hạn project / loại job tính trên mọi process.
+    JOB_WORKER_MAX_CONCURRENCY = 3
+    JOB_WORKER_MAX_PER_PROJECT = 1
+    # Giới hạn theo job_type (0 / không có = không giới hạn riêng).
+    JOB_WORKER_MAX_PER_TYPE = {"unified_chapter_range": 2, "global_data_sync": 1}
+    # Lease: worker gia hạn mỗi JOB_LEASE_SEC/3 giây; hết hạn → job về lại pending, tối đa JOB_MAX_ATTEMPTS lần nhận.
+    JOB_LEASE_SEC = 300
+    JOB_MAX_ATTEMPTS = 3
+    JOB_QUEUE_POLL_SEC = 2.0
+    # Runner riêng (python -m core.job_runner): đánh thức qua UDP localhost + Postgres LISTEN/NOTIFY (V17), polling fallback.
+    # True = Streamlit chỉ gửi tín hiệu, không tự chạy thread hàng đợi (cần runner riêng đang chạy).
+    JOB_RUNNER_EXTERNAL = False
+    JOB_RUNNER_WAKE_HOST = "127.0.0.1"
+    JOB_RUNNER_WAKE_PORT = 47821  # 0 = tắt kênh UDP
+    # DSN Postgres cho LISTEN (cần psycopg2); trống = chỉ UDP + polling.
+    JOB_RUNNER_DATABASE_URL = st.secrets.get("supabase", {}).get("DATABASE_URL", "")
+    JOB_RUNNER_FALLBACK_POLL_SEC = 30.0
+    # Lane ưu tiên (V16): interactive > normal > bulk. Lane mặc định theo job_type; create_job(priority=...) ghi đè.
+    JOB_PRIORITY_BY_TYPE = {
+        "unified_chapter_analyze": "interactive",
+        "data_analyze_bible": "interactive",
+        "data_analyze_relation": "interactive",
+        "data_analyze_timeline": "interactive",
+        "data_analyze_chunk": "interactive",
+        "data_operation_batch": "normal",
+        "unified_chapter_range": "bulk",
+        "global_data_sync": "bulk",
+    }
+    # Aging: job chờ mỗi N giây được nâng một lane → bulk không bị bỏ đói (0 = tắt).
+    JOB_PRIORITY_AGING_SEC = 600
+    # Số job tối đa mỗi lane chạy cùng lúc trong một process (giữ thread cho lane cao hơn); 0 / không có = không giới hạn.
+    JOB_WORKER_MAX_PER_LANE = {"bulk": 2}
+    # Số job đang chạy tối đa mỗi user (toàn hệ thống); 0 = không giới hạn (vẫn ưu tiên user đang chạy ít job hơn).
+    JOB_WORKER_MAX_PER_USER = 0
+    # Job interactive (ngắn, người dùng đang chờ) không bị chặn bởi JOB_WORKER_MAX_PER_PROJECT.
+    JOB_INTERACTIVE_BYPASS_PROJECT_CAP = True
+    # Tiến độ job dài (progress_current/total/ETA, V15): ghi DB tối đa mỗi N giây; cùng lệnh đọc cờ cancel_requested.
+    JOB_PROGRESS_MIN_INTERVAL_SEC = 5.0
+    # Unified analyze theo khoảng chương: pipeline N lệnh LLM extract song song, save vẫn tuần tự theo thứ tự chương.
+    UNIFIED_RANGE_PIPELINE = True
+    UNIFIED_RANGE_MAX_INFLIGHT = 3
+    # Đồng bộ toàn cục: xóa / update theo lô in_("id", ...) tối đa GLOBAL_SYNC_BULK_CHUNK id mỗi lệnh, gộp update cùng giá trị;
+    # orphan dọn bằng RPC global_sync_cleanup_orphans (V13) nếu có. False = ghi từng dòng như cũ.
+    GLOBAL_SYNC_BULK = True
+    GLOBAL_SYNC_BULK_CHUNK = 200
+    # Sau mỗi Unified analyze thành công: xếp job đồng bộ tăng dần (chỉ dòng / chương đổi sau watermark, V14).
+    GLOBAL_SYNC_AUTO_INCREMENTAL = True
+    # Gom cụm near-duplicate theo embedding (ai/near_duplicates.py): nhóm >= NEAR_DUP_LSH_MIN_ROWS dòng thì chia bucket
+    # bằng LSH siêu phẳng ngẫu nhiên (NEAR_DUP_LSH_TABLES bảng × NEAR_DUP_LSH_BITS bit) trước khi tính cosine; 0 = luôn chính xác.
+    NEAR_DUP_LSH_MIN_ROWS = 2000
+    NEAR_DUP_LSH_BITS = 6
+    NEAR_DUP_LSH_TABLES = 12
+    # Gather context (chunk/bible/relation/timeline) chạy song song trên thread pool; ghép kết quả theo thứ tự cố định.
+    CONTEXT_GATHER_PARALLEL = True
+    CONTEXT_GATHER_MAX_WORKERS = 4
+    # V7 executor (core/executor_v7.py): bước plan không phụ thuộc nhau chạy song song.
+    # V7_SPECULATIVE_STEPS: chạy trước bước phụ thuộc cùng lúc với bước nó phụ thuộc; bước trước thất bại và re-plan
+    # thay / huỷ thì bỏ kết quả (bước gọi LLM như search_context / map-reduce không chạy trước). 1 worker = tuần tự như cũ.
+    V7_PARALLEL_STEPS = True
+    V7_PARALLEL_MAX_WORKERS = 4
+    V7_SPECULATIVE_STEPS = True
+    # multi_chapter_analysis = map-reduce (ai/map_reduce_analysis.py). Map: đoạn theo lưới MULTI_CHAPTER_MAP_CHAPTERS chương
+    # (tách tiếp khi vượt MULTI_CHAPTER_MAP_INPUT_TOKENS), ghi chú JSON không phụ thuộc câu hỏi → response cache dùng lại.
+    # Reduce: gộp từng tầng (mỗi lệnh <= MULTI_CHAPTER_REDUCE_INPUT_TOKENS) đến khi vừa token_limit × MULTI_CHAPTER_FINAL_CONTEXT_SHARE.
+    MULTI_CHAPTER_MAP_CHAPTERS = 10
+    MULTI_CHAPTER_MAP_INPUT_TOKENS = 30000
+    MULTI_CHAPTER_MAP_OUTPUT_TOKENS = 4000
+    MULTI_CHAPTER_MAP_MAX_INFLIGHT = 4
+    MULTI_CHAPTER_MAX_SEGMENTS = 40
+    MULTI_CHAPTER_REDUCE_INPUT_TOKENS = 40000
+    MULTI_CHAPTER_REDUCE_OUTPUT_TOKENS = 3000
+    MULTI_CHAPTER_FINAL_CONTEXT_SHARE = 0.5
+    # Digest chương (ai/chapter_digest.py, bảng V20 chapter_digests): mỗi chương có bản tóm lược theo các cỡ token dưới đây,
+    # khóa theo hash nội dung; dựng nền khi lưu chương (tối đa CHAPTER_DIGEST_MAX_INFLIGHT song song) và sau Unified analyze.
+    # Context theo khoảng chương vượt ngân sách → chọn cỡ digest vừa thay cho cắt toàn văn. "" model = METADATA_MODEL.
+    CHAPTER_DIGEST_ENABLED = True
+    CHAPTER_DIGEST_LEVELS = (100, 400, 1500)
+    CHAPTER_DIGEST_MODEL = ""
+    CHAPTER_DIGEST_MAX_INPUT_TOKENS = 60000
+    CHAPTER_DIGEST_MAX_INFLIGHT = 2
+    CHAPTER_DIGEST_ON_ANALYZE = True
 
     # Giới hạn số lần gọi LLM "chính" mỗi turn (intent, planner, draft, numerical). Verification/check không tính. 0 = không giới hạn.
     DEFAULT_MAX_LLM_CALLS_PER_TURN = 5
+    # Lệnh LLM nội bộ mỗi turn (map + reduce + thử lại của multi_chapter_analysis); không tính vào giới hạn trên.
+    DEFAULT_MAX_INTERNAL_LLM_CALLS_PER_TURN = 60
 
     # Feature flag: bật/tắt fallback đọc full chapter sau khi đã trả lời bằng search_context/check_chapter_logic/analyze_pacing.
     # Mặc định bật cho các câu hỏi review chương / logic / pacing (vẫn có điều kiện thêm trong views.chat).
@@ -109,6 +277,22 @@ class Config:
             pass
         return cls.DEFAULT_MAX_LLM_CALLS_PER_TURN
 
+    @classmethod
+    def get_max_internal_llm_calls_per_turn(cls) -> int:
+        """Số lệnh LLM nội bộ tối đa mỗi turn (map-reduce nhiều chương, gồm cả thử lại). 0 = không giới hạn."""
+        try:
+            services = init_services()
+            if services:
+                r = services["supabase"].table("settings").select("value").eq("key", "max_internal_llm_calls_per_turn").execute()
+                if r.data and r.data[0] is not None:
+                    v = r.data[0].get("value")
+                    if v is not None:
+                        n = int(v) if isinstance(v, (int, float)) else int(str(v).strip() or "0")
+                        return max(0, n)
+        except Exception:
+            pass
+        return cls.DEFAULT_MAX_INTERNAL_LLM_CALLS_PER_TURN
+
     @classmethod
     def get_prefixes(cls) -> list:
         """Lấy danh sách prefix dạng [X] từ DB: ưu tiên bảng bible_prefix_config (get_prefix_setup), rồi settings. Không set cứng; không có dữ liệu thì trả về []."""
@@ -250,14 +434,8 @@ class Config:
 def init_services():
     """Khởi tạo kết nối đến các dịch vụ"""
     try:
-        openai_client = OpenAI(
-            base_url=Config.OPENROUTER_BASE_URL,
-            api_key=Config.OPENROUTER_API_KEY,
-            default_headers={
-                "HTTP-Referer": "https://v-universe.streamlit.app",
-                "X-Title": "V-Universe AI Hub"
-            }
-        )
+        from ai.client_pool import get_openrouter_client
+        openai_client = get_openrouter_client()
         supabase = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
         supabase.table("stories").select("count", count="exact").limit(1).execute()
         return {
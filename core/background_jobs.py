@@ -25,14 +25,19 @@ def create_job(
     label: str,
     payload: Optional[Dict[str, Any]] = None,
     post_to_chat: bool = True,
+    priority: Optional[str] = None,
 ) -> Optional[str]:
-    """Tạo bản ghi job (status=pending). Trả về job_id hoặc None nếu lỗi."""
+    """
+    Tạo bản ghi job (status=pending). Trả về job_id hoặc None nếu lỗi.
+    priority: interactive | normal | bulk; None = theo Config.JOB_PRIORITY_BY_TYPE (core/job_queue.job_lane).
+    """
     try:
         from config import init_services
+        from core.job_queue import LANES, job_lane
         services = init_services()
         if not services:
             return None
-        r = services["supabase"].table("background_jobs").insert({
+        row = {
             "story_id": story_id,
             "user_id": user_id or "",
             "job_type": job_type,
@@ -40,8 +45,17 @@ def create_job(
             "payload": payload or {},
             "status": "pending",
             "post_to_chat": post_to_chat,
-        }).execute()
+        }
+        lane = priority if priority in LANES else job_lane({"job_type": job_type})
+        table = services["supabase"].table("background_jobs")
+        try:
+            r = table.insert({**row, "priority": lane}).execute()
+        except Exception:
+            # DB chưa chạy migration V16 (chưa có cột priority) → lane suy ra từ job_type khi xếp lịch.
+            r = services["supabase"].table("background_jobs").insert(row).execute()
         if r.data and len(r.data) > 0:
+            from core.job_runner import notify_job_runner
+            notify_job_runner()
             return r.data[0].get("id")
     except Exception:
         pass
@@ -60,7 +74,7 @@ def update_job(
         if not services:
             return
         payload = {"status": status}
-        if status in ("completed", "failed"):
+        if status in ("completed", "failed", "cancelled"):
             payload["completed_at"] = datetime.now(tz=timezone.utc).isoformat()
         if status == "running":
             payload["started_at"] = datetime.now(tz=timezone.utc).isoformat()
@@ -68,7 +82,15 @@ def update_job(
             payload["result_summary"] = result_summary
         if error_message is not None:
             payload["error_message"] = error_message[:2000]
-        services["supabase"].table("background_jobs").update(payload).eq("id", job_id).execute()
+        try:
+            services["supabase"].table("background_jobs").update(payload).eq("id", job_id).execute()
+        except Exception:
+            if status != "cancelled":
+                raise
+            # DB chưa có status 'cancelled' (V15) → ghi failed kèm lý do hủy.
+            from core.job_progress import CANCELLED_MESSAGE
+            payload.update({"status": "failed", "error_message": payload.get("error_message") or CANCELLED_MESSAGE})
+            services["supabase"].table("background_jobs").update(payload).eq("id", job_id).execute()
     except Exception:
         pass
 
@@ -77,62 +99,43 @@ _job_runner_lock = threading.Lock()
 _job_runner_running = False
 
 
+def expire_stale_pending_jobs(supabase) -> None:
+    """Auto-expire các job pending quá lâu (ví dụ > 1 ngày) để tránh chạy lại."""
+    try:
+        cutoff = datetime.now(tz=timezone.utc) - timedelta(days=1)
+        supabase.table("background_jobs").update(
+            {
+                "status": "failed",
+                "error_message": "Job quá hạn (> 1 ngày, auto bỏ qua).",
+            }
+        ).eq("status", "pending").lt("created_at", cutoff.isoformat()).execute()
+    except Exception as e:  # pragma: no cover
+        logger.warning("job_queue_loop: expire old pending jobs failed: %s", e)
+
+
 def _job_queue_loop() -> None:
     """
-    Chạy lần lượt các job pending (toàn hệ thống), ưu tiên tính ổn định:
-    - Mỗi lần chỉ chạy 1 job (run_job_worker).
-    - Sau khi job đó completed/failed mới lấy job tiếp theo.
-    - Dừng khi không còn job pending.
+    Xử lý hàng đợi job pending (toàn hệ thống) bằng worker pool (core/job_queue.py):
+    - Nhiều job chạy song song trong giới hạn Config.JOB_WORKER_MAX_CONCURRENCY / _PER_PROJECT / _PER_TYPE.
+    - Nhận job bằng lease (claimed_by, lease_expires_at) nên nhiều process cùng chia hàng đợi an toàn;
+      job của process chết (lease hết hạn) được đưa lại pending.
+    - Dừng khi không còn job pending nhận được và mọi job đang chạy đã xong.
     """
     global _job_runner_running
     try:
         from config import init_services
+        from core.job_queue import JobWorkerPool
 
         services = init_services()
         if not services:
             return
         supabase = services["supabase"]
+        expire_stale_pending_jobs(supabase)
 
-        # Auto-expire các job pending quá lâu (ví dụ > 1 ngày) để tránh chạy lại.
         try:
-            cutoff = datetime.now(tz=timezone.utc) - timedelta(days=1)
-            supabase.table("background_jobs").update(
-                {
-                    "status": "failed",
-                    "error_message": "Job quá hạn (> 1 ngày, auto bỏ qua).",
-                }
-            ).eq("status", "pending").lt("created_at", cutoff.isoformat()).execute()
-        except Exception as e:  # pragma: no cover
-            logger.warning("job_queue_loop: expire old pending jobs failed: %s", e)
-
-        while True:
-            try:
-                r = (
-                    supabase.table("background_jobs")
-                    .select("id")
-                    .eq("status", "pending")
-                    .order("created_at")
-                    .limit(1)
-                    .execute()
-                )
-            except Exception as e:  # pragma: no cover - log rồi dừng vòng queue
-                logger.warning("job_queue_loop: fetch pending job failed: %s", e)
-                break
-
-            rows = list(r.data or [])
-            if not rows:
-                break
-
-            job_id = rows[0].get("id")
-            if not job_id:
-                break
-
-            try:
-                run_job_worker(str(job_id))
-            except Exception as e:  # pragma: no cover - không để crash cả loop
-                logger.warning("job_queue_loop: run_job_worker failed: %s", e)
-                # Tiếp tục sang job kế (nếu có)
-                continue
+            JobWorkerPool(run_job_worker, supabase).run_until_idle()
+        except Exception as e:  # pragma: no cover - log rồi dừng vòng queue
+            logger.warning("job_queue_loop: worker pool stopped: %s", e)
     finally:
         # Khi hết job (hoặc lỗi), đánh dấu runner đã dừng để lần sau có thể khởi động lại.
         global _job_runner_lock
@@ -142,11 +145,21 @@ def _job_queue_loop() -> None:
 
 def ensure_background_job_runner() -> None:
     """
-    Đảm bảo có một thread nền xử lý hàng đợi job:
-    - Nếu đã chạy rồi → không làm gì.
-    - Nếu chưa → khởi động thread chạy _job_queue_loop().
+    Đảm bảo hàng đợi job được xử lý:
+    - Gửi tín hiệu đánh thức cho runner riêng (python -m core.job_runner) nếu có.
+    - Config.JOB_RUNNER_EXTERNAL → chỉ đánh thức, không chạy thread trong process Streamlit.
+    - Thread đã chạy rồi → không làm gì; chưa → khởi động thread chạy _job_queue_loop().
     """
     global _job_runner_running
+    from core.job_runner import notify_job_runner
+
+    notify_job_runner()
+    try:
+        from config import Config
+        if getattr(Config, "JOB_RUNNER_EXTERNAL", False):
+            return
+    except Exception:
+        pass
     with _job_runner_lock:
         if _job_runner_running:
             return
@@ -155,6 +168,60 @@ def ensure_background_job_runner() -> None:
         t.start()
 
 
+_orphans_checked = False
+
+
+def resume_orphaned_jobs(_delay_check: bool = True) -> int:
+    """
+    Gọi khi app khởi động (một lần mỗi process): job running có lease hết hạn (process trước chết giữa chừng,
+    vd. Streamlit restart giết thread daemon) → pending rồi bật runner. unified_chapter_range / data_operation_batch
+    chạy lại từ checkpoint (core/job_llm_store). Job running còn lease → hẹn kiểm tra lại khi lease hết hạn.
+    Trả về số job đưa lại hàng đợi.
+    """
+    global _orphans_checked
+    with _job_runner_lock:
+        if _orphans_checked and _delay_check:
+            return 0
+        _orphans_checked = True
+    try:
+        from config import init_services
+        from core.job_queue import requeue_expired_leases
+
+        services = init_services()
+        if not services:
+            return 0
+        supabase = services["supabase"]
+        try:
+            requeued = requeue_expired_leases(supabase)
+        except Exception:
+            # DB chưa có cột lease (V11): không phân biệt được job mồ côi.
+            return 0
+        r = supabase.table("background_jobs").select("id").eq("status", "pending").limit(1).execute()
+        if r.data:
+            ensure_background_job_runner()
+        if _delay_check:
+            live = (
+                supabase.table("background_jobs").select("lease_expires_at").eq("status", "running")
+                .order("lease_expires_at", desc=True).limit(1).execute()
+            )
+            lease = (live.data or [{}])[0].get("lease_expires_at")
+            if lease:
+                try:
+                    wait = (datetime.fromisoformat(str(lease).replace("Z", "+00:00")) - datetime.now(tz=timezone.utc)).total_seconds()
+                except ValueError:
+                    wait = None
+                if wait is not None and wait > 0:
+                    timer = threading.Timer(wait + 5, resume_orphaned_jobs, kwargs={"_delay_check": False})
+                    timer.daemon = True
+                    timer.start()
+        if requeued:
+            logger.info("resume_orphaned_jobs: đưa lại %s job mồ côi về hàng đợi", requeued)
+        return requeued
+    except Exception as e:
+        logger.warning("resume_orphaned_jobs error: %s", e)
+        return 0
+
+
 def retry_job_with_stored_data(job_id: str) -> Dict[str, Any]:
     """
     Thử lại job bằng dữ liệu LLM đã lưu (không gọi LLM). Gọi trực tiếp từ UI (đồng bộ).
@@ -205,6 +272,10 @@ def retry_job_with_stored_data(job_id: str) -> Dict[str, Any]:
             if not unified_rows:
                 update_job(job_id, "failed", error_message="Không có dữ liệu đã lưu để thử lại.")
                 return {"success": False, "error": "Không có dữ liệu đã lưu.", "retry_still_failed": False}
+            # Chương đã lưu xong (checkpoint) không lưu lại lần nữa.
+            from core.job_llm_store import get_checkpoints, save_checkpoint
+            done_keys = set(get_checkpoints(job_id))
+            unified_rows = [x for x in unified_rows if f"unified:{x.get('step_key')}" not in done_keys]
             failed_chapters = []
             for row in unified_rows:
                 ch = int(row.get("step_key") or 0)
@@ -215,6 +286,8 @@ def retry_job_with_stored_data(job_id: str) -> Dict[str, Any]:
                 if not out.get("success"):
                     failed_chapters.append((ch, out.get("error")))
                     increment_retry_count(job_id, "unified", str(ch))
+                else:
+                    save_checkpoint(job_id, f"unified:{ch}")
             if not failed_chapters:
                 summary = f"Đã thử lại xong {len(unified_rows)} chương."
                 update_job(job_id, "completed", result_summary=summary)
@@ -263,7 +336,7 @@ def list_jobs(
 ) -> List[Dict[str, Any]]:
     """
     Lấy danh sách job của dự án, mới nhất trước, với phân trang ở DB.
-    status_filter: pending | running | completed | failed hoặc None (tất cả).
+    status_filter: pending | running | completed | failed | cancelled hoặc None (tất cả).
     Trả về (jobs, total_jobs, total_pages).
     """
     try:
@@ -338,6 +411,15 @@ def _post_completion_to_chat(project_id: str, user_id: Optional[str], label: str
         pass
 
 
+def _schedule_incremental_sync(project_id: str, user_id: Optional[str]) -> None:
+    """Sau Unified analyze: xếp đồng bộ tăng dần (chỉ chương vừa đổi) cho project."""
+    try:
+        from core.global_data_sync import schedule_incremental_sync
+        schedule_incremental_sync(project_id, user_id)
+    except Exception as e:
+        print(f"schedule_incremental_sync error: {e}")
+
+
 def run_job_worker(job_id: str) -> None:
     """
     Chạy trong thread: lấy job, set status=running, gọi worker theo job_type, cập nhật completed/failed, nếu post_to_chat thì ghi chat.
@@ -407,6 +489,8 @@ def run_job_worker(job_id: str) -> None:
                     increment_retry_count(job_id, "unified", str(chapter_number))
                 if not out.get("error"):
                     update_job(job_id, "failed", error_message="Unified analyze thất bại (không rõ lỗi).")
+            else:
+                _schedule_incremental_sync(story_id, user_id)
         elif job_type == "unified_chapter_range":
             chapter_start = int(payload.get("chapter_start") or payload.get("chapter_range", [0, 0])[0])
             chapter_end = int(payload.get("chapter_end") or (payload.get("chapter_range") or [0, 0])[1])
@@ -418,9 +502,13 @@ def run_job_worker(job_id: str) -> None:
                 job_id=job_id,
                 update_job_fn=update_job,
             )
+            if out.get("ok"):
+                _schedule_incremental_sync(story_id, user_id)
             if post_to_chat:
                 summary = f"Đã xong {out.get('ok', 0)}/{out.get('total', 0)} chương."
-                if out.get("failed"):
+                if out.get("cancelled"):
+                    _post_completion_to_chat(story_id, user_id, label, False, summary, "Đã hủy theo yêu cầu.")
+                elif out.get("failed"):
                     err_detail = "; ".join([f"Chương {ch}" for ch in out.get("failed", [])])
                     _post_completion_to_chat(story_id, user_id, label, False, summary, f"Lỗi: {err_detail}")
                 else:
@@ -431,6 +519,7 @@ def run_job_worker(job_id: str) -> None:
                 project_id=story_id,
                 job_id=job_id,
                 update_job_fn=update_job,
+                mode=payload.get("mode") or "full",
             )
             if out.get("success"):
                 if post_to_chat:
@@ -866,6 +955,23 @@ def is_embedding_backfill_running(kind: Optional[str] = None) -> bool:
 _EMBEDDING_BULK_BATCH = 100
 
 
+# RPC bulk update embedding → bảng tương ứng (để báo index vector trong bộ nhớ tải lại các id vừa ghi).
+_EMBEDDING_RPC_TABLES = {
+    "bulk_update_chunks_embeddings": "chunks",
+    "bulk_update_entity_relations_embeddings": "entity_relations",
+    "bulk_update_timeline_events_embeddings": "timeline_events",
+}
+
+
+def _mark_vector_index_dirty(table: str, ids: List[Any]) -> None:
+    try:
+        from ai.vector_index import mark_vector_rows_dirty
+
+        mark_vector_rows_dirty(table, ids)
+    except Exception as e:
+        logger.debug("mark_vector_rows_dirty %s: %s", table, e)
+
+
 def _bulk_update_embeddings(supabase, rpc_name: str, updates: List[Dict[str, Any]]) -> int:
     """Gọi RPC bulk update embedding; trả về số bản ghi đã cập nhật. Nếu RPC lỗi thì fallback update từng dòng."""
     if not updates:
@@ -874,6 +980,8 @@ def _bulk_update_embeddings(supabase, rpc_name: str, updates: List[Dict[str, Any
         for start in range(0, len(updates), _EMBEDDING_BULK_BATCH):
             batch = updates[start : start + _EMBEDDING_BULK_BATCH]
             supabase.rpc(rpc_name, {"updates": batch}).execute()
+            if rpc_name in _EMBEDDING_RPC_TABLES:
+                _mark_vector_index_dirty(_EMBEDDING_RPC_TABLES[rpc_name], [u.get("id") for u in batch])
         return len(updates)
     except Exception as e:
         logger.warning("RPC %s failed: %s", rpc_name, e)
@@ -900,6 +1008,8 @@ def _fallback_update_embeddings_one_by_one(supabase, table: str, id_key: str, ro
                 count += 1
             except Exception as e:
                 logger.warning("Fallback embedding update failed %s id=%s: %s", table, row.get("id"), e)
+    if count and id_key == "id":
+        _mark_vector_index_dirty(table, [row.get("id") for row in rows])
     return count
 
 
@@ -1121,6 +1231,10 @@ def run_semantic_intent_embedding_backfill(project_id: str, limit: int = 200) ->
                 v = AIService.get_embedding(t) if t else None
                 vectors.append(v)
         updated = _fallback_update_embeddings_one_by_one(supabase, "semantic_intent", "id", rows, vectors)
+        if updated:
+            from ai.semantic_intent_matcher import invalidate_semantic_intent_matcher
+
+            invalidate_semantic_intent_matcher(project_id)
     except Exception as e:
         logger.warning("run_semantic_intent_embedding_backfill failed: %s", e)
     finally:
@@ -0,0 +1,101 @@
+# core/batch_planner.py - Chia lô chương theo token (bin-packing) cho Data Analyze / data operations
+"""
+Thay cho lô cố định MAX_CHAPTERS_PER_BATCH = 7 chương:
+
+- Ước lượng token mỗi chương: đọc cột chapters.token_estimate (V12, cột sinh tự động = độ dài content / 4,
+  cùng công thức AIService.estimate_tokens → tính sẵn lúc lưu chương); DB chưa có cột → ước lượng từ content.
+- plan_token_batches(): first-fit decreasing — xếp chương dài trước vào lô đầu tiên còn chỗ, sao cho mỗi lô
+  không vượt ngân sách input (min(Config.DATA_BATCH_MAX_TOKENS, context model - output) trừ phần prompt) và
+  số chương × token output ước lượng mỗi chương không vượt trần output (Config.DATA_BATCH_MAX_OUTPUT_TOKENS).
+  Chương trong lô và thứ tự các lô vẫn tăng dần theo số chương.
+- Chương một mình đã vượt ngân sách → trả riêng (oversized) để caller báo lỗi / bỏ qua như trước.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import Config
+
+
+def estimate_chapter_tokens(content: Optional[str]) -> int:
+    """Cùng công thức AIService.estimate_tokens (len // 4) — khớp cột sinh chapters.token_estimate."""
+    text = (content or "").strip()
+    return len(text) // 4 if text else 0
+
+
+def batch_limits() -> Dict[str, int]:
+    """Giới hạn một lô: input (đã trừ phần prompt cố định), số chương tối đa theo trần output."""
+    max_output = int(getattr(Config, "DATA_BATCH_MAX_OUTPUT_TOKENS", 16000))
+    context = int(getattr(Config, "DATA_BATCH_MODEL_CONTEXT_TOKENS", 128000))
+    overhead = int(getattr(Config, "DATA_BATCH_PROMPT_OVERHEAD_TOKENS", 1500))
+    input_budget = min(int(getattr(Config, "DATA_BATCH_MAX_TOKENS", 50000)), context - max_output) - overhead
+    per_chapter_out = max(1, int(getattr(Config, "DATA_BATCH_OUTPUT_TOKENS_PER_CHAPTER", 1500)))
+    max_chapters = min(
+        max(1, max_output // per_chapter_out),
+        max(1, int(getattr(Config, "DATA_BATCH_MAX_CHAPTERS", 20))),
+    )
+    return {"input_tokens": max(1, input_budget), "max_chapters": max_chapters}
+
+
+def plan_token_batches(
+    token_by_chapter: Dict[int, int],
+    input_tokens: Optional[int] = None,
+    max_chapters: Optional[int] = None,
+) -> Tuple[List[List[int]], List[int]]:
+    """
+    First-fit decreasing. Trả về (các lô [số chương tăng dần], các chương vượt ngân sách input).
+    Mặc định giới hạn lấy từ batch_limits().
+    """
+    if input_tokens is None or max_chapters is None:
+        limits = batch_limits()
+        input_tokens = limits["input_tokens"] if input_tokens is None else input_tokens
+        max_chapters = limits["max_chapters"] if max_chapters is None else max_chapters
+    max_chapters = max(1, int(max_chapters))
+    oversized = sorted(ch for ch, tok in token_by_chapter.items() if tok > input_tokens)
+    items = sorted(
+        ((ch, tok) for ch, tok in token_by_chapter.items() if tok <= input_tokens),
+        key=lambda x: (-x[1], x[0]),
+    )
+    bins: List[List[int]] = []
+    loads: List[int] = []
+    for ch, tok in items:
+        for i, load in enumerate(loads):
+            if load + tok <= input_tokens and len(bins[i]) < max_chapters:
+                bins[i].append(ch)
+                loads[i] += tok
+                break
+        else:
+            bins.append([ch])
+            loads.append(tok)
+    batches = sorted((sorted(b) for b in bins), key=lambda b: b[0])
+    return batches, oversized
+
+
+def chapter_token_estimates(supabase, project_id: str, chapter_numbers: Iterable[int]) -> Dict[int, int]:
+    """
+    {chapter_number: token ước lượng} cho các chương tồn tại. Đọc cột token_estimate (không tải content);
+    chương thiếu giá trị hoặc DB chưa chạy migration V12 → tính từ content.
+    """
+    nums = sorted({int(n) for n in chapter_numbers})
+    if not nums or not supabase or not project_id:
+        return {}
+    out: Dict[int, int] = {}
+    try:
+        r = supabase.table("chapters").select("chapter_number, token_estimate").eq(
+            "story_id", project_id
+        ).in_("chapter_number", nums).execute()
+        for row in r.data or []:
+            if row.get("chapter_number") is not None and row.get("token_estimate") is not None:
+                out[int(row["chapter_number"])] = int(row["token_estimate"])
+    except Exception:
+        pass
+    missing = [n for n in nums if n not in out]
+    if missing:
+        try:
+            r = supabase.table("chapters").select("chapter_number, content").eq(
+                "story_id", project_id
+            ).in_("chapter_number", missing).execute()
+            for row in r.data or []:
+                if row.get("chapter_number") is not None:
+                    out[int(row["chapter_number"])] = estimate_chapter_tokens(row.get("content"))
+        except Exception as e:
+            print(f"chapter_token_estimates error: {e}")
+    return out
@@ -1,10 +1,9 @@
 # core/data_operation_jobs.py - Chạy thao tác extract/update/delete Bible, Relation, Timeline, Chunking (ngầm) và gửi tin nhắn hoàn thành vào chat V Work.
 """Chạy trong thread sau khi user xác nhận. Ghi audit vào data_operation_log và tin nhắn hoàn thành vào chat_history."""
-import time
 from datetime import datetime, timezone
 from typing import Optional, List, Tuple, Dict, Any
 
-# Tối đa 7 chương / lô (fallback khi không ước lượng được token).
+# Tối đa 7 chương / lô (fallback khi không ước lượng được token; bình thường chia theo core/batch_planner.py).
 MAX_CHAPTERS_PER_BATCH = 7
 # Thứ tự chạy target: Bible trước, Relation cuối để relation dựa trên Bible đã có.
 ORDERED_TARGETS = ["bible", "timeline", "chunking", "relation"]
@@ -173,7 +172,7 @@ def run_data_operation_chunk(
 ) -> List[str]:
     """
     Thực thi cùng một thao tác (op_type, target) cho nhiều chương trong một lô.
-    Fetch tất cả chapter trong chapter_numbers bằng MỘT query, rồi xử lý từng chương (tránh tràn token: gọi với tối đa MAX_CHAPTERS_PER_BATCH chương).
+    Fetch tất cả chapter trong chapter_numbers bằng MỘT query, rồi xử lý từng chương (lô đã chia theo token ở _group_into_chunked_batches; trong lô chia lại theo content thực tế).
     Returns: danh sách mô tả lỗi (rỗng nếu không lỗi).
     """
     if not chapter_numbers:
@@ -210,36 +209,27 @@ def run_data_operation_chunk(
         chapters = (ch_rows.data or []) if ch_rows.data else []
         by_num = {int(c["chapter_number"]): c for c in chapters if c.get("chapter_number") is not None}
 
-        # Chia lô theo token để tránh lỗi gói tối đa / lag (chương vượt giới hạn bỏ qua, xử lý lần sau)
-        try:
-            from config import Config
-            from ai_engine import AIService
-            max_tokens = getattr(Config, "DATA_BATCH_MAX_TOKENS", 50000)
-            token_per_ch = {}
-            for ch_num in chapter_numbers:
-                ch = by_num.get(ch_num)
-                if not ch:
-                    continue
-                content = (ch.get("content") or "").strip()
-                token_per_ch[ch_num] = AIService.estimate_tokens(content) if content else 0
-            sub_batches = []
-            current_batch = []
-            current_tokens = 0
-            for ch_num in chapter_numbers:
-                tok = token_per_ch.get(ch_num, 0)
-                if tok > max_tokens:
-                    failed.append(f"{target} ch.{ch_num}: vượt giới hạn token ({tok}), bỏ qua lần sau.")
-                    continue
-                if current_tokens + tok > max_tokens and current_batch:
-                    sub_batches.append(current_batch)
-                    current_batch = []
-                    current_tokens = 0
-                current_batch.append(ch_num)
-                current_tokens += tok
-            if current_batch:
-                sub_batches.append(current_batch)
-        except Exception:
-            sub_batches = [[ch] for ch in chapter_numbers]
+        # Chia lô theo token (bin-packing, core/batch_planner.py); chương một mình vượt ngân sách bỏ qua, xử lý lần sau.
+        # Xóa không gọi LLM → chỉ cần giữ nguyên lô.
+        if operation_type == "delete":
+            sub_batches = [list(chapter_numbers)]
+        else:
+            try:
+                from core.batch_planner import estimate_chapter_tokens, plan_token_batches
+
+                token_per_ch = {
+                    ch_num: estimate_chapter_tokens(by_num[ch_num].get("content"))
+                    for ch_num in chapter_numbers if ch_num in by_num
+                }
+                sub_batches, oversized = plan_token_batches(token_per_ch)
+                for ch_num in oversized:
+                    failed.append(f"{target} ch.{ch_num}: vượt giới hạn token ({token_per_ch[ch_num]}), bỏ qua lần sau.")
+                # Chương không tìm thấy: để nhánh xử lý bên dưới báo lỗi như cũ.
+                not_found = [ch_num for ch_num in chapter_numbers if ch_num not in by_num]
+                if not_found:
+                    sub_batches.append(not_found)
+            except Exception:
+                sub_batches = [[ch] for ch in chapter_numbers]
 
         for sub in sub_batches:
             if target == "bible" and operation_type in ("extract", "update"):
@@ -291,15 +281,7 @@ def run_data_operation_chunk(
                             failed.append(f"ch.{ch_num}: loại thao tác không hỗ trợ {operation_type}")
                     except Exception as e:
                         failed.append(f"{target} ch.{ch_num}: {str(e)[:150]}")
-            # Độ trễ theo batch (sau mỗi sub_batch), tránh quá tải API
-            if operation_type in ("extract", "update"):
-                try:
-                    from config import Config
-                    delay = getattr(Config, "DATA_OPERATION_DELAY_SEC", 7)
-                    if delay and delay > 0:
-                        time.sleep(delay)
-                except Exception:
-                    pass
+            # Không nghỉ cố định giữa các batch: lệnh gọi LLM tự điều tốc qua limiter theo model (ai/rate_limiter.py).
 
         _update_log_status(supabase, log_id, "failed" if failed else "completed", "; ".join(failed[:3]) if failed else None)
         if post_completion_message and not failed:
@@ -352,10 +334,31 @@ def _post_completion_message(project_id: str, user_id: Optional[str], user_reque
         pass
 
 
-def _group_into_chunked_batches(steps: list, max_per_batch: int = MAX_CHAPTERS_PER_BATCH) -> List[dict]:
+def _step_chapter_numbers(step: dict) -> List[int]:
+    """Danh sách chương của một step (chapter_range [a, b] hoặc chapter_number); rỗng nếu không hợp lệ."""
+    ch_range = step.get("chapter_range")
+    ch_num = step.get("chapter_number")
+    if ch_range and isinstance(ch_range, (list, tuple)) and len(ch_range) >= 2:
+        try:
+            start, end = int(ch_range[0]), int(ch_range[1])
+            start, end = min(start, end), max(start, end)
+            return list(range(start, end + 1))
+        except (ValueError, TypeError):
+            return [int(ch_num)] if ch_num is not None else []
+    if ch_num is not None:
+        return [int(ch_num)]
+    return []
+
+
+def _group_into_chunked_batches(
+    steps: list,
+    max_per_batch: int = MAX_CHAPTERS_PER_BATCH,
+    token_estimates: Optional[Dict[int, int]] = None,
+) -> List[dict]:
     """
-    Gom steps thành các lô tối đa max_per_batch chương. Mỗi phần tử: {"operation_type", "target", "chapter_numbers": [1,2,...,7]}.
-    Khoảng rộng chia tuần tự (lô 1, lô 2, ...).
+    Gom steps thành các lô. Mỗi phần tử: {"operation_type", "target", "chapter_numbers": [...]}.
+    Có token_estimates ({chương: token}) → extract/update chia lô theo token (core.batch_planner.plan_token_batches);
+    không có (hoặc delete) → lô tuần tự tối đa max_per_batch chương.
     """
     batch_items: List[dict] = []
     for step in steps:
@@ -363,18 +366,21 @@ def _group_into_chunked_batches(steps: list, max_per_batch: int = MAX_CHAPTERS_P
             continue
         op_type = step.get("operation_type") or "extract"
         target = step.get("target") or "bible"
-        ch_range = step.get("chapter_range")
-        ch_num = step.get("chapter_number")
-        if ch_range and isinstance(ch_range, (list, tuple)) and len(ch_range) >= 2:
-            try:
-                start, end = int(ch_range[0]), int(ch_range[1])
-                start, end = min(start, end), max(start, end)
-                nums = list(range(start, end + 1))
-            except (ValueError, TypeError):
-                nums = [int(ch_num)] if ch_num is not None else []
-        elif ch_num is not None:
-            nums = [int(ch_num)]
-        else:
+        nums = _step_chapter_numbers(step)
+        if not nums:
+            continue
+        if token_estimates is not None and op_type != "delete":
+            from core.batch_planner import plan_token_batches
+
+            # Chương không có ước lượng (chưa tồn tại) tính 0 token → run_data_operation_chunk báo "không tìm thấy".
+            packed, oversized = plan_token_batches({n: token_estimates.get(n, 0) for n in nums})
+            # Chương quá dài đi riêng một lô để run_data_operation_chunk ghi lỗi cho nó.
+            for chapter_numbers in sorted(packed + [[n] for n in oversized], key=lambda b: b[0]):
+                batch_items.append({
+                    "operation_type": op_type,
+                    "target": target,
+                    "chapter_numbers": chapter_numbers,
+                })
             continue
         for i in range(0, len(nums), max_per_batch):
             batch_items.append({
@@ -385,6 +391,26 @@ def _group_into_chunked_batches(steps: list, max_per_batch: int = MAX_CHAPTERS_P
     return batch_items
 
 
+def _token_estimates_for_steps(project_id: str, steps: list) -> Optional[Dict[int, int]]:
+    """Token ước lượng của mọi chương trong steps (một query); None nếu không đọc được → chia lô cố định."""
+    nums = set()
+    for step in steps:
+        if isinstance(step, dict):
+            nums.update(_step_chapter_numbers(step))
+    if not nums:
+        return None
+    try:
+        from config import init_services
+        from core.batch_planner import chapter_token_estimates
+
+        services = init_services()
+        if not services:
+            return None
+        return chapter_token_estimates(services["supabase"], project_id, nums) or None
+    except Exception:
+        return None
+
+
 def _run_one_target_sequential(
     project_id: str,
     user_id: Optional[str],
@@ -392,11 +418,19 @@ def _run_one_target_sequential(
     target: str,
     list_of_chapter_lists: List[List[int]],
     user_request: str,
+    progress=None,
+    job_id: Optional[str] = None,
 ) -> Tuple[int, List[str]]:
-    """Chạy tuần tự các lô cho một (op_type, target). Returns (total_chapters_done, failed_messages)."""
+    """
+    Chạy tuần tự các lô cho một (op_type, target). Returns (total_chapters_done, failed_messages).
+    progress (JobProgress): cộng tiến độ sau mỗi lô; có yêu cầu hủy → dừng trước lô kế tiếp.
+    job_id: mỗi lô xong ghi checkpoint (kèm lỗi của lô) để job chạy lại bỏ qua.
+    """
     total = 0
     all_failed: List[str] = []
     for chapter_numbers in list_of_chapter_lists:
+        if progress is not None and progress.is_cancelled():
+            break
         total += len(chapter_numbers)
         failed = run_data_operation_chunk(
             project_id=project_id,
@@ -408,9 +442,36 @@ def _run_one_target_sequential(
             post_completion_message=False,
         )
         all_failed.extend(failed)
+        if job_id:
+            from core.job_llm_store import save_checkpoint
+
+            save_checkpoint(
+                job_id,
+                f"op:{op_type}:{target}:{chapter_numbers[0]}-{chapter_numbers[-1]}",
+                {"operation_type": op_type, "target": target, "chapters": list(chapter_numbers), "failed": failed},
+            )
+        if progress is not None:
+            progress.advance(len(chapter_numbers), message=f"{op_type} {target}: chương {chapter_numbers[0]}–{chapter_numbers[-1]}")
     return total, all_failed
 
 
+def _batch_resume_state(job_id: Optional[str]) -> Tuple[Dict[Tuple[str, str], set], List[str]]:
+    """({(op_type, target): chương đã xong}, lỗi đã ghi) từ checkpoint "op:..." của job; job mới → ({}, [])."""
+    done: Dict[Tuple[str, str], set] = {}
+    failed: List[str] = []
+    if not job_id:
+        return done, failed
+    from core.job_llm_store import get_checkpoints
+
+    for key, info in get_checkpoints(job_id).items():
+        if not key.startswith("op:") or not isinstance(info, dict):
+            continue
+        chapters = [int(ch) for ch in info.get("chapters") or []]
+        done.setdefault((info.get("operation_type"), info.get("target")), set()).update(chapters)
+        failed.extend(info.get("failed") or [])
+    return done, failed
+
+
 def run_data_operations_batch(
     project_id: str,
     user_id: Optional[str],
@@ -421,6 +482,7 @@ def run_data_operations_batch(
     """
     Chạy thao tác (extract/update/delete × bible/relation/timeline/chunking) theo LÔ.
     If job_id is passed (from Chat), updates background_jobs for the Background Jobs tab.
+    Có job_id: mỗi lô xong ghi checkpoint; job chạy lại (worker chết giữa chừng) chỉ chạy các lô còn lại.
     Vẫn ghi tin hoàn thành vào chat_history để V Work hiện toast.
     """
     if not steps:
@@ -438,7 +500,7 @@ def run_data_operations_batch(
             update_job(job_id, "running")
         except Exception:
             pass
-    batch_items = _group_into_chunked_batches(steps)
+    batch_items = _group_into_chunked_batches(steps, token_estimates=_token_estimates_for_steps(project_id, steps))
     if not batch_items:
         _post_completion_message(project_id, user_id, user_request, False, "Không có bước hợp lệ (cần chapter_number hoặc chapter_range).")
         if job_id:
@@ -449,24 +511,39 @@ def run_data_operations_batch(
                 pass
         return
 
+    # Job chạy lại (process chết giữa chừng): bỏ chương đã xong theo checkpoint, giữ lỗi đã ghi của lần chạy trước.
+    done_before, all_failed = _batch_resume_state(job_id)
+    resumed = 0
+
     # Gom theo (op_type, target): mỗi key có danh sách các lô chapter_numbers
     grouped: dict = {}
     for item in batch_items:
         key = (item["operation_type"], item["target"])
         if key not in grouped:
             grouped[key] = []
-        grouped[key].append(item["chapter_numbers"])
-
-    all_failed: List[str] = []
-    total_ops = 0
+        done = done_before.get(key, set())
+        chapter_numbers = [ch for ch in item["chapter_numbers"] if ch not in done]
+        resumed += len(item["chapter_numbers"]) - len(chapter_numbers)
+        if chapter_numbers:
+            grouped[key].append(chapter_numbers)
+
+    from core.job_progress import JobProgress
+
+    progress = JobProgress(job_id, sum(len(item["chapter_numbers"]) for item in batch_items))
+    progress.advance(resumed, message=f"Tiếp tục sau {resumed} chương đã xong" if resumed else None)
+    progress.flush()
+    total_ops = resumed
     # Chạy theo thứ tự cố định: bible → timeline → chunking → relation (relation cuối để dựa trên Bible đã có)
     for target in ORDERED_TARGETS:
         for (op_type, t), list_of_chapter_lists in list(grouped.items()):
             if t != target:
                 continue
             try:
+                if progress.is_cancelled():
+                    break
                 count, failed = _run_one_target_sequential(
-                    project_id, user_id, op_type, t, list_of_chapter_lists, user_request
+                    project_id, user_id, op_type, t, list_of_chapter_lists, user_request,
+                    progress=progress, job_id=job_id,
                 )
                 total_ops += count
                 all_failed.extend(failed)
@@ -486,10 +563,16 @@ def run_data_operations_batch(
     if job_id:
         try:
             from core.background_jobs import update_job
+            progress.flush()
             summary = f"{total_ops} thao tác" + (f", {len(all_failed)} lỗi" if all_failed else "")
+            if progress.cancelled and total_ops < progress.total:
+                status = "cancelled"
+                summary = f"Đã hủy sau {total_ops}/{progress.total} chương. " + summary
+            else:
+                status = "failed" if all_failed and total_ops == 0 else "completed"
             update_job(
                 job_id,
-                "failed" if all_failed and total_ops == 0 else "completed",
+                status,
                 result_summary=summary,
                 error_message="; ".join(all_failed[:5]) if all_failed else None,
             )
@@ -1,5 +1,9 @@
-# core/executor_v7.py - V7 Sequential Execution Engine + Dynamic Re-planning
-"""Thực thi plan tuần tự; sau mỗi bước đánh giá outcome và có thể re-plan (thay bước còn lại)."""
+# core/executor_v7.py - V7 Execution Engine (theo dependency, song song) + Dynamic Re-planning
+"""Thực thi plan theo dependency (bước độc lập chạy song song); sau mỗi bước đánh giá outcome và có thể re-plan các bước phụ thuộc."""
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import Dict, List, Tuple, Any, Optional
 
 # Import từ ai_engine khi cần (tránh circular)
@@ -134,6 +138,301 @@ def _normalize_step(step: Dict, step_id: int, user_prompt: str) -> Dict:
     }
 
 
+# Intent không sinh "nguyên liệu" cho bước sau: chỉ ghi nhắc ngắn, không đưa full context vào cumulative.
+INDEPENDENT_INTENTS = ("query_Sql", "web_search", "ask_user_clarification", "chat_casual")
+
+# Intent mà _run_step gọi LLM (map-reduce; SmartAIRouter.context_planner khi dựng router cho search_context):
+# không chạy trước (speculative) — bước bị re-plan huỷ thì lệnh LLM đó phí.
+LLM_STEP_INTENTS = ("multi_chapter_analysis", "search_context", "numerical_calculation")
+
+
+class _LLMBudget:
+    """Bọc llm_budget_ref ([đã gọi, tối đa], tối đa 0 = không giới hạn) để các thread cùng giữ / trả lượt gọi LLM."""
+
+    def __init__(self, ref: Optional[List[int]]):
+        self.ref = ref
+        self._lock = threading.Lock()
+
+    def take(self, n: int = 1) -> int:
+        """Giữ tối đa n lượt gọi LLM; trả về số lượt được cấp (đã cộng vào ref[0])."""
+        with self._lock:
+            if not self.ref:
+                return n
+            if len(self.ref) < 2 or not self.ref[1]:
+                self.ref[0] += n
+                return n
+            granted = max(0, min(n, int(self.ref[1]) - int(self.ref[0])))
+            self.ref[0] += granted
+            return granted
+
+
+class _Deferred:
+    """Future tối giản cho chế độ tuần tự: chỉ chạy khi cần kết quả (bước bị re-plan huỷ thì không chạy)."""
+
+    def __init__(self, fn):
+        self._fn = fn
+        self._done = False
+        self._value = None
+
+    def result(self):
+        if not self._done:
+            self._value = self._fn()
+            self._done = True
+        return self._value
+
+    def cancel(self) -> bool:
+        return not self._done
+
+
+def _script_ctx_attacher():
+    """Hàm gắn ScriptRunContext của phiên Streamlit hiện tại cho thread con (st.cache_* không cảnh báo); None nếu không có."""
+    try:
+        from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+        script_ctx = get_script_run_ctx()
+    except Exception:
+        return None
+    if script_ctx is None:
+        return None
+    return lambda: add_script_run_ctx(threading.current_thread(), script_ctx)
+
+
+def _call_in_ctx(attach, fn):
+    if attach is not None:
+        attach()
+    return fn()
+
+
+def _index_plan(plan: List[Dict]) -> List[Dict]:
+    """Bản sao các bước của plan với step_id duy nhất (thiếu / trùng thì cấp id mới)."""
+    indexed: List[Dict] = []
+    seen = set()
+    for i, step in enumerate(plan or []):
+        if not isinstance(step, dict):
+            continue
+        step = dict(step)
+        try:
+            sid = int(step.get("step_id", i + 1))
+        except (TypeError, ValueError):
+            sid = i + 1
+        if sid in seen:
+            sid = max(seen) + 1
+        step["step_id"] = sid
+        seen.add(sid)
+        indexed.append(step)
+    return indexed
+
+
+def _step_dependencies(step: Dict, known_ids) -> List[int]:
+    """step_id các bước mà step phụ thuộc (dependency: null / số / "step 1" / list); bỏ id không có trong plan."""
+    raw = step.get("dependency")
+    items = raw if isinstance(raw, (list, tuple)) else [raw]
+    own = step.get("step_id")
+    deps: List[int] = []
+    for item in items:
+        if item is None or isinstance(item, bool):
+            continue
+        if isinstance(item, (int, float)):
+            nums = [int(item)]
+        else:
+            nums = [int(x) for x in re.findall(r"\d+", str(item))]
+        for n in nums:
+            if n in known_ids and n != own and n not in deps:
+                deps.append(n)
+    return deps
+
+
+def _dependents_of(step_id: int, steps: List[Dict], known_ids) -> List[Dict]:
+    """Các bước trong steps phụ thuộc (trực tiếp hoặc bắc cầu) vào step_id, giữ thứ tự của steps."""
+    affected = {step_id}
+    changed = True
+    while changed:
+        changed = False
+        for s in steps:
+            sid = s.get("step_id")
+            if sid not in affected and any(d in affected for d in _step_dependencies(s, known_ids)):
+                affected.add(sid)
+                changed = True
+    return [s for s in steps if s.get("step_id") in affected and s.get("step_id") != step_id]
+
+
+def _normalize_replacement(new_plan: List[Dict], first_id: int, user_prompt: str) -> List[Dict]:
+    """Chuẩn hóa plan thay thế từ re-plan: step_id mới liên tiếp từ first_id; dependency giữa các bước mới đổi theo id mới."""
+    steps = [s for s in new_plan if isinstance(s, dict)]
+    id_map: Dict[int, int] = {}
+    for i, s in enumerate(steps):
+        try:
+            id_map.setdefault(int(s.get("step_id")), first_id + i)
+        except (TypeError, ValueError):
+            pass
+    normalized = []
+    for i, s in enumerate(steps):
+        step = _normalize_step(s, first_id + i, user_prompt)
+        deps = [id_map[d] for d in _step_dependencies({"dependency": step["dependency"]}, set(id_map))]
+        step["dependency"] = [d for d in deps if d < first_id + i] or None
+        normalized.append(step)
+    return normalized
+
+
+def _multi_chapter_range(args: Dict) -> Optional[Tuple[int, int]]:
+    ch_range = args.get("chapter_range")
+    if isinstance(ch_range, (list, tuple)) and len(ch_range) >= 2:
+        try:
+            start, end = int(ch_range[0]), int(ch_range[1])
+            return min(start, end), max(start, end)
+        except (ValueError, TypeError):
+            return None
+    return None
+
+
+def _unified_operation(args: Dict) -> Optional[Dict]:
+    """Bước unified (hoặc legacy update_data): job unified_chapter_range cần chạy sau; None nếu thiếu chapter_range."""
+    op_type = args.get("data_operation_type") or "extract"
+    ch_range = args.get("chapter_range")
+    if not ch_range or not isinstance(ch_range, (list, tuple)):
+        return None
+    try:
+        if len(ch_range) >= 2:
+            try:
+                start, end = int(ch_range[0]), int(ch_range[1])
+                start, end = min(start, end), max(start, end)
+                return {"operation_type": op_type, "target": "unified", "chapter_range": [start, end]}
+            except (ValueError, TypeError):
+                pass
+        ch_num = int(ch_range[0])
+        return {"operation_type": op_type, "target": "unified", "chapter_range": [ch_num, ch_num]}
+    except (ValueError, TypeError):
+        return None
+
+
+def _run_multi_chapter(
+    step: Dict,
+    env: Dict[str, Any],
+    ch_range: Tuple[int, int],
+    granted: int,
+) -> Dict[str, Any]:
+    """
+    multi_chapter_analysis: map-reduce trên khoảng chương (ai.map_reduce_analysis); tính 1 lượt llm_budget_ref.
+    Lệnh LLM nội bộ (map / reduce) của mọi bước trong lượt dùng chung env["internal_llm_budget"]
+    (Config.get_max_internal_llm_calls_per_turn); số đã dùng / tối đa ghi vào sources.
+    """
+    step_id = step.get("step_id")
+    intent = "multi_chapter_analysis"
+    start, end = ch_range
+    if granted:
+        from ai.map_reduce_analysis import CallBudget, run_map_reduce
+
+        call_budget = env.get("internal_llm_budget")
+        if call_budget is None:
+            _CM, _AI, Config, _parse, _model = _get_engine()
+            call_budget = env.setdefault("internal_llm_budget", CallBudget(Config.get_max_internal_llm_calls_per_turn()))
+        args = step.get("args") or {}
+        mr = run_map_reduce(
+            env["project_id"],
+            start,
+            end,
+            args.get("query_refined") or env["user_prompt"],
+            env["token_limit"],
+            env["tool_model"],
+            call_budget=call_budget,
+        )
+        ctx_text = (
+            f"[MULTI-CHAPTER ANALYSIS] Khoảng chương {start}-{end}: map {mr['segments']} đoạn "
+            f"({mr['map_cached']} dùng lại từ cache), reduce {mr['levels']} tầng.\n\n{mr['text']}"
+        )
+        sources = [
+            f"🗺️ Map-reduce chương {start}-{end} ({mr['segments']} đoạn, {mr.get('llm_calls', 0)} lệnh LLM nội bộ; "
+            f"lượt này {call_budget.label()})"
+        ] if mr["segments"] else []
+    else:
+        ctx_text = f"[MULTI-CHAPTER ANALYSIS] Bỏ qua khoảng chương {start}-{end}: đã đạt giới hạn gọi LLM cho lượt này."
+        sources = []
+    return {
+        "kind": "multi",
+        "intent": intent,
+        "ctx_text": ctx_text,
+        "block": f"\n--- [STEP {step_id}: {intent}] ---\n{ctx_text}\n",
+        "sources": [f"Step {step_id}: {intent}"] + sources,
+        "eval_sources": sources,
+        "executor_result": None,
+    }
+
+
+def _run_step(
+    step: Dict,
+    env: Dict[str, Any],
+    ch_range: Optional[Tuple[int, int]] = None,
+    granted: int = 0,
+) -> Dict[str, Any]:
+    """
+    Chạy một bước plan (an toàn khi chạy song song: không đụng state chung của execute_plan).
+    Trả về kind, intent (multi_chapter_analysis thiếu khoảng chương → search_context), ctx_text, block cho cumulative,
+    sources (ghép vào all_sources), eval_sources (cho evaluate_step_outcome), executor_result, data_operation (unified).
+    """
+    ContextManager, _AIService, _Config, _parse, _get_default_tool_model = _get_engine()
+    step_id = step.get("step_id")
+    intent = step.get("intent", "chat_casual")
+    args = step.get("args") or {}
+    op_target = (args.get("data_operation_target") or "").strip()
+
+    # Bước unified (hoặc legacy update_data): thu thập để chạy job unified_chapter_range sau, không build context.
+    if intent in ("update_data", "unified") and op_target == "unified":
+        return {
+            "kind": "unified",
+            "intent": intent,
+            "ctx_text": "",
+            "block": f"\n--- [STEP {step_id}: unified] ---\n(Unified analyze chương — chờ xác nhận để thực hiện)\n",
+            "sources": [],
+            "eval_sources": [],
+            "executor_result": None,
+            "data_operation": _unified_operation(args),
+        }
+
+    # multi_chapter_analysis (V7): map-reduce trên khoảng chương lớn; không xác định được khoảng → search_context.
+    if intent == "multi_chapter_analysis":
+        if ch_range:
+            return _run_multi_chapter(step, env, ch_range, granted)
+        intent = "search_context"
+
+    # Các intent còn lại: build context chuẩn rồi để final LLM (user model) dùng.
+    # numerical_calculation tắt tạm: xử lý như search_context (không chạy Python Executor).
+    if intent == "search_context" or intent == "numerical_calculation":
+        router_result = _build_router_result_with_router_3step_for_search(
+            step,
+            env["user_prompt"],
+            env["project_id"],
+            chat_history_text="",
+        )
+    else:
+        router_result = step_to_router_result(step, env["user_prompt"])
+
+    ctx_text, sources, _, _ = ContextManager.build_context(
+        router_result,
+        env["project_id"],
+        env["persona"],
+        strict_mode=env["strict_mode"],
+        current_arc_id=env["current_arc_id"],
+        session_state=env["session_state"],
+        free_chat_mode=env["free_chat_mode"],
+        max_context_tokens=env["token_limit"],
+    )
+    out = {
+        "kind": "context",
+        "intent": intent,
+        "ctx_text": ctx_text,
+        "sources": [f"Step {step_id}: {intent}"] + (sources or []),
+        "eval_sources": sources or [],
+        "executor_result": None,
+    }
+
+    if intent in INDEPENDENT_INTENTS:
+        out["kind"] = "independent"
+        out["block"] = f"\n--- [STEP {step_id}: {intent}] ---\n(Đã thực hiện; bước sau không dùng kết quả này làm nguồn.)\n"
+        return out
+
+    out["block"] = f"\n--- [STEP {step_id}: {intent}] ---\n{ctx_text}\n"
+    return out
+
+
 def execute_plan(
     plan: List[Dict],
     project_id: str,
@@ -152,17 +451,22 @@ def execute_plan(
     max_retries_per_intent: int = 1,
 ) -> Tuple[str, List[str], List[Dict], List[Dict], List[Dict]]:
     """
-    Thực thi plan; sau mỗi bước có thể re-plan (đổi phần còn lại nếu bước vừa thất bại).
-    llm_budget_ref: [current_count, max_count] — numerical LLM chỉ gọi khi current < max; gọi xong tăng current. None = không giới hạn.
+    Thực thi plan theo dependency; sau mỗi bước có thể re-plan.
+    - Bước không phụ thuộc nhau chạy song song (Config.V7_PARALLEL_STEPS, V7_PARALLEL_MAX_WORKERS); cumulative /
+      step_results luôn ghép theo thứ tự plan (thứ tự dependency). multi_chapter_analysis: map-reduce
+      (ai.map_reduce_analysis, map song song theo Config.MULTI_CHAPTER_MAP_MAX_INFLIGHT), tính 1 lượt llm_budget_ref.
+    - Config.V7_SPECULATIVE_STEPS: bước phụ thuộc chạy trước cùng lúc với bước nó phụ thuộc (context của bước không
+      dùng kết quả bước trước); bước gọi LLM (LLM_STEP_INTENTS: map-reduce, context_planner của search_context) chỉ chạy
+      khi bước trước đã xong.
+    - Bước thất bại → re-plan chỉ với các bước phụ thuộc (trực tiếp / bắc cầu) vào nó: replace / abort thay / huỷ đúng
+      các bước đó (bỏ kết quả chạy trước nếu có), bước độc lập giữ nguyên. Không có bước phụ thuộc → không re-plan.
+    max_steps_per_turn: số bước tối đa được ghi nhận (bước chạy trước bị huỷ không tính).
+    llm_budget_ref: [current_count, max_count] (max 0 = không giới hạn) — LLM call của executor chỉ chạy khi còn lượt;
+    gọi xong tăng current (tại chỗ, an toàn giữa các thread). None = không giới hạn.
     Returns: (cumulative_context, sources, step_results, replan_events, data_operation_steps).
     data_operation_steps: các bước unified cần chạy job sau.
     """
     ContextManager, AIService, Config, parse_chapter_range_from_query, _get_default_tool_model = _get_engine()
-    try:
-        from utils.python_executor import PythonExecutor
-    except ImportError:
-        PythonExecutor = None
-
     evaluate_step_outcome, replan_after_step = _get_replan()
 
     cumulative_parts: List[str] = []
@@ -172,407 +476,186 @@ def execute_plan(
     data_operation_steps: List[Dict] = []
 
     token_limit = max_context_tokens or Config.CONTEXT_SIZE_TOKENS.get("medium", 60000)
-    remaining_steps = list(plan)
+    max_workers = int(getattr(Config, "V7_PARALLEL_MAX_WORKERS", 4) or 1)
+    parallel = bool(getattr(Config, "V7_PARALLEL_STEPS", True)) and max_workers > 1
+    speculative = parallel and bool(getattr(Config, "V7_SPECULATIVE_STEPS", True))
+    budget = _LLMBudget(llm_budget_ref)
+    attach_ctx = _script_ctx_attacher() if parallel else None
+    env: Dict[str, Any] = {
+        "project_id": project_id,
+        "persona": persona,
+        "user_prompt": user_prompt,
+        "strict_mode": strict_mode,
+        "current_arc_id": current_arc_id,
+        "session_state": session_state,
+        "free_chat_mode": free_chat_mode,
+        "token_limit": token_limit,
+        "tool_model": _get_default_tool_model(),
+    }
+
+    pending = _index_plan(plan)
+    known_ids = {s["step_id"] for s in pending}
+    done_ids = set()
     steps_executed = 0
     replan_count = 0
     distinct_intents = set()
     retry_count_per_intent: Dict[str, int] = {}
 
-    while remaining_steps and steps_executed < max_steps_per_turn:
-        step = remaining_steps[0]
-        step_id = step.get("step_id", len(step_results) + 1)
-        intent = step.get("intent", "chat_casual")
-        args = step.get("args") or {}
-        op_target = (args.get("data_operation_target") or "").strip()
-
-        # Giới hạn số loại intent khác nhau được thực thi trong một lượt.
-        # Unified/update_data được coi là thao tác nền, không tính vào giới hạn này.
-        if intent not in ("update_data", "unified"):
-            if intent not in distinct_intents:
-                if len(distinct_intents) >= max_distinct_intents:
-                    skip_note = (
-                        f"[SKIP] Bỏ qua STEP {step_id} (intent={intent}) "
-                        f"vì đã đạt giới hạn {max_distinct_intents} loại tác vụ trong một lượt."
-                    )
-                    cumulative_parts.append(f"\n--- [STEP {step_id}: {intent}] ---\n{skip_note}\n")
-                    step_results.append({
-                        "step_id": step_id,
-                        "intent": intent,
-                        "context_snippet": "",
-                        "executor_result": None,
-                        "evaluation_status": "skipped",
-                    })
-                    break
-                distinct_intents.add(intent)
-
-        # Bước unified (hoặc legacy update_data): thu thập để chạy job unified_chapter_range sau, không build context.
-        if intent in ("update_data", "unified") and op_target == "unified":
-            op_type = args.get("data_operation_type") or "extract"
-            ch_range = args.get("chapter_range")
-            if ch_range and isinstance(ch_range, (list, tuple)) and len(ch_range) >= 2:
-                try:
-                    start, end = int(ch_range[0]), int(ch_range[1])
-                    start, end = min(start, end), max(start, end)
-                    data_operation_steps.append({"operation_type": op_type, "target": "unified", "chapter_range": [start, end]})
-                except (ValueError, TypeError):
-                    if ch_range and len(ch_range) >= 1:
-                        ch_num = int(ch_range[0])
-                        data_operation_steps.append({"operation_type": op_type, "target": "unified", "chapter_range": [ch_num, ch_num]})
-            elif ch_range and len(ch_range) >= 1:
-                ch_num = int(ch_range[0])
-                data_operation_steps.append({"operation_type": op_type, "target": "unified", "chapter_range": [ch_num, ch_num]})
-            block = f"\n--- [STEP {step_id}: unified] ---\n(Unified analyze chương — chờ xác nhận để thực hiện)\n"
-            cumulative_parts.append(block)
-            step_results.append({
-                "step_id": step_id,
-                "intent": intent,
-                "context_snippet": "",
-                "executor_result": None,
-                "evaluation_status": "n/a",
-            })
-            steps_executed += 1
-            remaining_steps = remaining_steps[1:]
-            continue
-
-        # Intent đặc biệt: multi_chapter_analysis (V7) — phân tích khoảng chương lớn bằng cách chia thành nhiều đoạn nhỏ.
-        if intent == "multi_chapter_analysis":
-            ch_range = args.get("chapter_range")
-            start = end = None
-            if isinstance(ch_range, (list, tuple)) and len(ch_range) >= 2:
-                try:
-                    start, end = int(ch_range[0]), int(ch_range[1])
-                    start, end = min(start, end), max(start, end)
-                except (ValueError, TypeError):
-                    start = end = None
-            # Nếu không xác định được khoảng chương, fallback về search_context thông thường.
-            if start is None or end is None:
-                intent = "search_context"
-            else:
-                total_chapters = end - start + 1
-                # Chia thành các đoạn "gần đều", mặc định kích thước ~10 chương (ví dụ 1–30 -> 1–10,11–20,21–30).
-                segment_size = 10 if total_chapters > 10 else total_chapters
-                segments: List[Tuple[int, int]] = []
-                cur = start
-                while cur <= end:
-                    seg_end = min(cur + segment_size - 1, end)
-                    segments.append((cur, seg_end))
-                    cur = seg_end + 1
-
-                branch_blocks: List[str] = []
-                all_branch_sources: List[str] = []
-
-                # Gọi context_planner một lần cho toàn khoảng chương, rồi reuse cho các segment bằng cách override chapter_range.
-                base_router_result = _build_router_result_with_router_3step_for_search(
-                    step,
-                    user_prompt,
-                    project_id,
-                    chat_history_text="",
-                )
-
-                for idx, (seg_start, seg_end) in enumerate(segments, 1):
-                    # Copy từ router_result gốc, chỉ thay chapter_range cho sub-range; intent con là search_context.
-                    seg_router_result = dict(base_router_result)
-                    seg_router_result["intent"] = "search_context"
-                    seg_router_result["chapter_range"] = [seg_start, seg_end]
-                    seg_ctx_text, seg_sources, _, _ = ContextManager.build_context(
-                        seg_router_result,
-                        project_id,
-                        persona,
-                        strict_mode=strict_mode,
-                        current_arc_id=current_arc_id,
-                        session_state=session_state,
-                        free_chat_mode=free_chat_mode,
-                        max_context_tokens=token_limit,
-                        for_v7_segment=True,
-                    )
-
-                    # Gọi LLM tool model cho từng đoạn, với retry tối đa 2 lần khi lỗi.
-                    system_content = (
-                        f"{persona.get('core_instruction', '')}\n\n"
-                        f"- Bạn đang xử lý PHẦN {idx} trong khoảng chương {seg_start}-{seg_end}.\n"
-                        f"- Chỉ phân tích và trả lời cho các chương trong khoảng {seg_start}-{seg_end}.\n"
-                        f"- Kết quả sẽ được hệ thống gom lại để tạo câu trả lời cuối cùng."
-                    )
-                    user_content = (
-                        f"CONTEXT (chỉ cho các chương {seg_start}-{seg_end}):\n{seg_ctx_text}\n\n"
-                        f"YÊU CẦU GỐC CỦA USER:\n{user_prompt}\n\n"
-                        f"Hãy chỉ phân tích phần câu hỏi này dựa trên các chương {seg_start}-{seg_end}, "
-                        f"trả lời súc tích nhưng đủ ý; KHÔNG tổng kết cho toàn bộ {start}-{end} chương."
-                    )
-                    messages = [
-                        {"role": "system", "content": system_content},
-                        {"role": "user", "content": user_content},
-                    ]
-
-                    branch_answer = ""
-                    last_error: Optional[Exception] = None
-                    for attempt in range(3):
-                        try:
-                            model = _get_default_tool_model()
-                            resp = AIService.call_openrouter(
-                                messages=messages,
-                                model=model,
-                                temperature=0.1,
-                                max_tokens=8000,
-                            )
-                            content = (resp.choices[0].message.content or "").strip()
-                            if content:
-                                branch_answer = content
-                                if llm_budget_ref and len(llm_budget_ref) >= 1:
-                                    llm_budget_ref[0] += 1
-                                break
-                        except Exception as ex:
-                            last_error = ex
+    pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="v7-step") if parallel else None
+    try:
+        while pending and steps_executed < max_steps_per_turn:
+            capacity = max_steps_per_turn - steps_executed
+            wave: List[Dict] = []
+            wave_ids = set()
+            limit_step: Optional[Dict] = None
+
+            def _admit(s: Dict) -> bool:
+                # Giới hạn số loại intent khác nhau được thực thi trong một lượt.
+                # Unified/update_data được coi là thao tác nền, không tính vào giới hạn này.
+                s_intent = s.get("intent", "chat_casual")
+                if s_intent not in ("update_data", "unified") and s_intent not in distinct_intents:
+                    if len(distinct_intents) >= max_distinct_intents:
+                        return False
+                    distinct_intents.add(s_intent)
+                wave.append(s)
+                wave_ids.add(s["step_id"])
+                return True
+
+            progress = True
+            while progress and limit_step is None and len(wave) < capacity:
+                progress = False
+                for s in pending:
+                    if len(wave) >= capacity:
+                        break
+                    if s["step_id"] in wave_ids:
+                        continue
+                    deps = _step_dependencies(s, known_ids)
+                    if not all(d in done_ids for d in deps):
+                        if not speculative or s.get("intent") in LLM_STEP_INTENTS:
                             continue
-
-                    if not branch_answer:
-                        branch_answer = f"(Lỗi khi xử lý đoạn chương {seg_start}-{seg_end}: {last_error})"
-
-                    block_hdr = f"#### PHÂN TÍCH ĐOẠN CHƯƠNG {seg_start}–{seg_end}\n"
-                    branch_blocks.append(f"{block_hdr}\n{branch_answer}")
-                    all_branch_sources.extend(seg_sources or [])
-
-                # Gom tất cả phần trả lời nhánh thành context cho step này; final LLM (user model) sẽ tổng hợp lại.
-                ctx_text = (
-                    f"[MULTI-CHAPTER ANALYSIS] Khoảng chương {start}-{end}, chia thành {len(segments)} đoạn.\n\n"
-                    + "\n\n".join(branch_blocks)
-                )
-                block = f"\n--- [STEP {step_id}: {intent}] ---\n{ctx_text}\n"
-                cumulative_parts.append(block)
-                all_sources.extend([f"Step {step_id}: {intent}"] + all_branch_sources)
-                step_results.append({
+                        if not all(d in done_ids or d in wave_ids for d in deps):
+                            continue
+                    if not _admit(s):
+                        limit_step = s
+                        break
+                    progress = True
+            if not wave and limit_step is None:
+                # Dependency vòng / trỏ tới bước không thể xong: chạy bước đầu tiên theo thứ tự plan.
+                if not _admit(pending[0]):
+                    limit_step = pending[0]
+
+            futures: Dict[int, Any] = {}
+            for s in wave:
+                ch_range = None
+                granted = 0
+                if s.get("intent") == "multi_chapter_analysis":
+                    ch_range = _multi_chapter_range(s.get("args") or {})
+                    if ch_range:
+                        # Giữ budget ở thread chính theo thứ tự plan → bước nào được chạy là xác định.
+                        granted = budget.take(1)
+                fn = partial(_run_step, s, env, ch_range, granted)
+                futures[s["step_id"]] = pool.submit(_call_in_ctx, attach_ctx, fn) if pool else _Deferred(fn)
+
+            discarded = set()
+
+            def _drop(steps: List[Dict]) -> List[int]:
+                nonlocal pending
+                ids = [d["step_id"] for d in steps]
+                for sid_drop in ids:
+                    discarded.add(sid_drop)
+                    fut_drop = futures.get(sid_drop)
+                    if fut_drop is not None:
+                        fut_drop.cancel()
+                pending = [p for p in pending if p["step_id"] not in discarded]
+                return ids
+
+            for step in wave:
+                step_id = step["step_id"]
+                if step_id in discarded:
+                    continue
+                out = futures[step_id].result()
+                intent = out["intent"]
+                pending = [p for p in pending if p["step_id"] != step_id]
+                done_ids.add(step_id)
+                steps_executed += 1
+                cumulative_parts.append(out["block"])
+                all_sources.extend(out["sources"])
+                step_result = {
                     "step_id": step_id,
                     "intent": intent,
-                    "context_snippet": ctx_text[:2000],
-                    "executor_result": None,
-                })
-                steps_executed += 1
-                cumulative_so_far = "\n".join(cumulative_parts)
-                remaining_after = remaining_steps[1:]
+                    "context_snippet": out["ctx_text"][:2000],
+                    "executor_result": out["executor_result"],
+                }
+                step_results.append(step_result)
+                if out["kind"] == "unified":
+                    if out.get("data_operation"):
+                        data_operation_steps.append(out["data_operation"])
+                    step_result["evaluation_status"] = "n/a"
+                    continue
 
-                # Vẫn cho phép re-plan dựa trên outcome tổng hợp của bước multi_chapter_analysis (nhưng các LLM call con không tạo thêm bước).
+                # Dynamic re-planning: đánh giá outcome; chỉ các bước phụ thuộc vào bước này có thể bị thay / huỷ.
                 if retry_count_per_intent.get(intent, 0) >= max_retries_per_intent:
                     should_replan, outcome_reason = (False, "")
                 else:
                     should_replan, outcome_reason = evaluate_step_outcome(
                         intent,
-                        ctx_text,
-                        all_branch_sources or [],
-                        step,
-                    )
-                evaluation_status = "ok"
-                evaluation_reason = ""
-                if should_replan:
-                    evaluation_status = "failed"
-                    evaluation_reason = outcome_reason
-                # Ghi lại đánh giá cho step vừa chạy.
-                if step_results:
-                    step_results[-1]["evaluation_status"] = evaluation_status
-                    if evaluation_reason:
-                        step_results[-1]["evaluation_reason"] = evaluation_reason
-                if should_replan and remaining_after and replan_count < max_replan_rounds:
-                    action, reason, new_plan = replan_after_step(
-                        user_prompt,
-                        cumulative_so_far,
-                        step_results,
+                        out["ctx_text"],
+                        out["eval_sources"],
                         step,
-                        outcome_reason,
-                        remaining_after,
-                        project_id,
                     )
-                    replan_events.append({
-                        "step_id": step_id,
-                        "reason": reason or outcome_reason,
-                        "action": action,
-                        "new_plan_summary": [s.get("intent") for s in new_plan] if new_plan else [],
-                    })
-                    if action == "replace" and new_plan:
-                        replan_count += 1
-                        retry_count_per_intent[intent] = retry_count_per_intent.get(intent, 0) + 1
-                        normalized = []
-                        for i, s in enumerate(new_plan):
-                            normalized.append(_normalize_step(s, len(step_results) + 1 + i, user_prompt))
-                        remaining_steps = normalized
-                        continue
-                    if action == "abort":
-                        remaining_steps = []
-                        break
-                remaining_steps = remaining_after
-                continue
-
-        # Các intent còn lại: build context chuẩn rồi để final LLM (user model) dùng.
-        # numerical_calculation tắt tạm: xử lý như search_context (không chạy Python Executor).
-        if intent == "search_context" or intent == "numerical_calculation":
-            router_result = _build_router_result_with_router_3step_for_search(
-                step,
-                user_prompt,
-                project_id,
-                chat_history_text="",
-            )
-        else:
-            router_result = step_to_router_result(step, user_prompt)
-
-        ctx_text, sources, _, _ = ContextManager.build_context(
-            router_result,
-            project_id,
-            persona,
-            strict_mode=strict_mode,
-            current_arc_id=current_arc_id,
-            session_state=session_state,
-            free_chat_mode=free_chat_mode,
-            max_context_tokens=token_limit,
-        )
-
-        # Intent không sinh "nguyên liệu" cho bước sau: chỉ ghi nhắc ngắn, không đưa full context vào cumulative.
-        INDEPENDENT_INTENTS = ("query_Sql", "web_search", "ask_user_clarification", "chat_casual")
-        if intent in INDEPENDENT_INTENTS:
-            block = f"\n--- [STEP {step_id}: {intent}] ---\n(Đã thực hiện; bước sau không dùng kết quả này làm nguồn.)\n"
-            cumulative_parts.append(block)
-            all_sources.extend([f"Step {step_id}: {intent}"] + (sources or []))
-            step_results.append({
-                "step_id": step_id,
-                "intent": intent,
-                "context_snippet": ctx_text[:2000],
-                "executor_result": None,
-            })
-            steps_executed += 1
-            cumulative_so_far = "\n".join(cumulative_parts)
-            remaining_after = remaining_steps[1:]
-            if retry_count_per_intent.get(intent, 0) >= max_retries_per_intent:
-                should_replan, outcome_reason = (False, "")
-            else:
-                should_replan, outcome_reason = evaluate_step_outcome(
-                    intent,
-                    ctx_text,
-                    sources or [],
-                    step,
-                )
-            evaluation_status = "ok"
-            evaluation_reason = ""
-            if should_replan:
-                evaluation_status = "failed"
-                evaluation_reason = outcome_reason
-            if step_results:
-                step_results[-1]["evaluation_status"] = evaluation_status
-                if evaluation_reason:
-                    step_results[-1]["evaluation_reason"] = evaluation_reason
-            if should_replan and remaining_after and replan_count < max_replan_rounds:
+                step_result["evaluation_status"] = "failed" if should_replan else "ok"
+                if should_replan and outcome_reason:
+                    step_result["evaluation_reason"] = outcome_reason
+                if not should_replan or replan_count >= max_replan_rounds:
+                    continue
+                dependents = _dependents_of(step_id, pending, known_ids)
+                if not dependents:
+                    continue
                 action, reason, new_plan = replan_after_step(
-                    user_prompt, cumulative_so_far, step_results, step, outcome_reason, remaining_after, project_id,
+                    user_prompt,
+                    "\n".join(cumulative_parts),
+                    step_results,
+                    step,
+                    outcome_reason,
+                    dependents,
+                    project_id,
                 )
-                replan_events.append({
+                event = {
                     "step_id": step_id,
                     "reason": reason or outcome_reason,
                     "action": action,
                     "new_plan_summary": [s.get("intent") for s in new_plan] if new_plan else [],
-                })
+                }
+                replan_events.append(event)
                 if action == "replace" and new_plan:
                     replan_count += 1
-                    normalized = [(_normalize_step(s, len(step_results) + 1 + i, user_prompt)) for i, s in enumerate(new_plan)]
-                    remaining_steps = normalized
-                    continue
-                if action == "abort":
-                    remaining_steps = []
-                    break
-            remaining_steps = remaining_after
-            continue
-
-        executor_result = None
-        can_use_llm = llm_budget_ref is None or (len(llm_budget_ref) >= 2 and llm_budget_ref[0] < llm_budget_ref[1])
-        # Python Executor tắt tạm (tránh rủi ro); numerical_calculation chỉ build context như search_context.
-        if False and intent == "numerical_calculation" and run_numerical_executor and PythonExecutor and not free_chat_mode and can_use_llm:
-            try:
-                code_prompt = f"""User hỏi: "{user_prompt}"
-Context có sẵn:
-{ctx_text[:6000]}
-
-Nhiệm vụ: Tạo code Python (pandas/numpy) để trả lời. Gán kết quả cuối vào biến result.
-Chỉ trả về code trong block ```python ... ```, không giải thích."""
-                model = _get_default_tool_model()
-                resp = AIService.call_openrouter(
-                    messages=[{"role": "user", "content": code_prompt}],
-                    model=model,
-                    temperature=0.1,
-                    max_tokens=2000,
+                    retry_count_per_intent[intent] = retry_count_per_intent.get(intent, 0) + 1
+                    event["cancelled_step_ids"] = _drop(dependents)
+                    normalized = _normalize_replacement(new_plan, max(known_ids) + 1, user_prompt)
+                    known_ids.update(s["step_id"] for s in normalized)
+                    pending.extend(normalized)
+                elif action == "abort":
+                    event["cancelled_step_ids"] = _drop(dependents)
+
+            if limit_step is not None and any(p["step_id"] == limit_step["step_id"] for p in pending):
+                skip_id = limit_step["step_id"]
+                skip_intent = limit_step.get("intent", "chat_casual")
+                skip_note = (
+                    f"[SKIP] Bỏ qua STEP {skip_id} (intent={skip_intent}) "
+                    f"vì đã đạt giới hạn {max_distinct_intents} loại tác vụ trong một lượt."
                 )
-                if llm_budget_ref and len(llm_budget_ref) >= 1:
-                    llm_budget_ref[0] += 1
-                import re
-                raw = ""
-                if resp and getattr(resp, "choices", None) and len(resp.choices) > 0:
-                    raw = (resp.choices[0].message.content or "").strip()
-                m = re.search(r'```(?:python)?\s*(.*?)```', raw, re.DOTALL) if raw else None
-                code = (m.group(1).strip() if m else raw).strip() if raw else ""
-                if code:
-                    val, err = PythonExecutor.execute(code, result_variable="result")
-                    executor_result = str(val) if val is not None else (f"(Lỗi: {err})" if err else "null")
-                    ctx_text += f"\n\n--- KẾT QUẢ TÍNH TOÁN (Python Executor) ---\n{executor_result}"
-            except Exception as ex:
-                executor_result = f"(Lỗi: {ex})"
-                ctx_text += f"\n\n--- KẾT QUẢ TÍNH TOÁN ---\n{executor_result}"
-        elif False and intent == "numerical_calculation" and not can_use_llm and llm_budget_ref:
-            ctx_text += "\n\n--- KẾT QUẢ TÍNH TOÁN ---\n(Bỏ qua: đã đạt giới hạn gọi LLM cho lượt này.)"
-
-        block = f"\n--- [STEP {step_id}: {intent}] ---\n{ctx_text}\n"
-        cumulative_parts.append(block)
-        all_sources.extend([f"Step {step_id}: {intent}"] + (sources or []))
-        step_results.append({
-            "step_id": step_id,
-            "intent": intent,
-            "context_snippet": ctx_text[:2000],
-            "executor_result": executor_result,
-        })
-        steps_executed += 1
-        cumulative_so_far = "\n".join(cumulative_parts)
-        remaining_after = remaining_steps[1:]
-
-        # Dynamic re-planning: đánh giá outcome và có thể thay plan còn lại
-        if retry_count_per_intent.get(intent, 0) >= max_retries_per_intent:
-            should_replan, outcome_reason = (False, "")
-        else:
-            should_replan, outcome_reason = evaluate_step_outcome(
-                intent,
-                ctx_text,
-                sources or [],
-                step,
-            )
-        evaluation_status = "ok"
-        evaluation_reason = ""
-        if should_replan:
-            evaluation_status = "failed"
-            evaluation_reason = outcome_reason
-        if step_results:
-            step_results[-1]["evaluation_status"] = evaluation_status
-            if evaluation_reason:
-                step_results[-1]["evaluation_reason"] = evaluation_reason
-        if should_replan and remaining_after and replan_count < max_replan_rounds:
-            action, reason, new_plan = replan_after_step(
-                user_prompt,
-                cumulative_so_far,
-                step_results,
-                step,
-                outcome_reason,
-                remaining_after,
-                project_id,
-            )
-            replan_events.append({
-                "step_id": step_id,
-                "reason": reason or outcome_reason,
-                "action": action,
-                "new_plan_summary": [s.get("intent") for s in new_plan] if new_plan else [],
-            })
-            if action == "replace" and new_plan:
-                replan_count += 1
-                # Chuẩn hóa new_plan và gán step_id liên tiếp
-                normalized = []
-                for i, s in enumerate(new_plan):
-                    normalized.append(_normalize_step(s, len(step_results) + 1 + i, user_prompt))
-                remaining_steps = normalized
-                continue
-            if action == "abort":
-                remaining_steps = []
+                cumulative_parts.append(f"\n--- [STEP {skip_id}: {skip_intent}] ---\n{skip_note}\n")
+                step_results.append({
+                    "step_id": skip_id,
+                    "intent": skip_intent,
+                    "context_snippet": "",
+                    "executor_result": None,
+                    "evaluation_status": "skipped",
+                })
                 break
-        remaining_steps = remaining_after
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
 
     cumulative_context = "\n".join(cumulative_parts)
     if max_context_tokens and AIService.estimate_tokens(cumulative_context) > token_limit:
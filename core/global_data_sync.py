@@ -1,14 +1,360 @@
 # core/global_data_sync.py - Kiểm tra và đồng bộ dữ liệu toàn cục (1-N, parent-child, orphan).
 """Chạy khi user bấm; thực thi trong background job. Tự xem → tự sửa → tự đồng bộ, không tự kích hoạt.
-Bible, chunks, timeline, relation: đồng bộ theo tên (trùng tên / regex chuẩn hóa) hoặc pgvector (ngưỡng 97%) trong phạm vi 1 chương."""
+Bible, chunks, timeline, relation: đồng bộ theo tên (trùng tên / regex chuẩn hóa) hoặc pgvector (ngưỡng 97%) trong phạm vi 1 chương;
+trùng theo embedding gom thành cụm (ai.near_duplicates) rồi gán parent một lần cho mỗi cụm; xóa relation trùng
+theo embedding dùng greedy_dedupe (chỉ xóa dòng trùng trực tiếp với dòng được giữ).
+Ghi theo lô (Config.GLOBAL_SYNC_BULK): xóa bằng in_("id", [...]) chia lô, update gộp theo giá trị đích (vd. cùng parent);
+orphan link / relation / chapter_id dọn server-side bằng RPC global_sync_cleanup_orphans (V13) nếu DB đã có.
+Chế độ incremental: chỉ xét dòng có updated_at sau watermark của project (bảng global_sync_state, V14) cùng các
+chương / thực thể Bible chúng chạm tới; mode="full" quét lại toàn bộ như trước."""
 import re
 from collections import defaultdict
+from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional, Set, Tuple
 
+from ai.near_duplicates import near_duplicate_clusters
+from ai.vector_ops import greedy_dedupe
+
 # Ngưỡng similarity pgvector để coi là trùng (trong phạm vi 1 chương)
 SIM_THRESHOLD_CHAPTER = 0.90
 
 
+def _embedding_clusters(group: List[Dict], threshold: float) -> List[List[Dict]]:
+    """Cụm near-duplicate theo embedding trong group (đã sắp xếp); dòng đầu mỗi cụm là bản gốc."""
+    from config import Config
+
+    clusters = near_duplicate_clusters(
+        [r.get("embedding") for r in group],
+        threshold,
+        lsh_min_rows=int(getattr(Config, "NEAR_DUP_LSH_MIN_ROWS", 2000)),
+        lsh_bits=int(getattr(Config, "NEAR_DUP_LSH_BITS", 6)),
+        lsh_tables=int(getattr(Config, "NEAR_DUP_LSH_TABLES", 12)),
+    )
+    return [[group[i] for i in cluster] for cluster in clusters]
+
+
+def _cluster_parent_updates(group: List[Dict], threshold: float, parent_col: str) -> Dict[Any, Dict[str, Any]]:
+    """
+    Gán parent một lần cho cả cụm: mọi thành viên chưa có parent trỏ về bản gốc của cụm
+    (hoặc parent của bản gốc nếu nó đã có, để không tạo chuỗi parent nhiều tầng).
+    """
+    updates: Dict[Any, Dict[str, Any]] = {}
+    for cluster in _embedding_clusters(group, threshold):
+        target = cluster[0].get(parent_col) or cluster[0]["id"]
+        for row in cluster[1:]:
+            if row.get(parent_col) or row["id"] == target:
+                continue
+            updates[row["id"]] = {parent_col: target}
+    return updates
+
+
+class _SyncWriter:
+    """
+    Ghi thay đổi của đồng bộ. bulk=True: delete in_("id", lô) và update gộp các dòng cùng giá trị mới thành một lệnh;
+    lô lỗi (vd. vi phạm UNIQUE) → thử lại từng dòng để không mất cả lô. bulk=False: từng dòng như trước.
+    Các hàm trả về số dòng ghi thành công; updated: {bảng: {id}} các dòng đã update (trigger V14 đổi updated_at).
+    """
+
+    def __init__(self, supabase, bulk: bool = True, chunk_size: int = 200):
+        self.supabase = supabase
+        self.bulk = bulk
+        self.chunk_size = max(1, int(chunk_size))
+        self.updated: Dict[str, Set[Any]] = defaultdict(set)
+
+    def _per_row(self, ids: List[Any], run_one) -> List[Any]:
+        done = []
+        for rid in ids:
+            try:
+                run_one(rid)
+                done.append(rid)
+            except Exception:
+                pass
+        return done
+
+    def delete(self, table: str, ids: List[Any]) -> int:
+        ids = list(dict.fromkeys(i for i in ids if i is not None))
+
+        def _one(rid):
+            self.supabase.table(table).delete().eq("id", rid).execute()
+
+        if not self.bulk:
+            return len(self._per_row(ids, _one))
+        done = 0
+        for i in range(0, len(ids), self.chunk_size):
+            part = ids[i : i + self.chunk_size]
+            try:
+                self.supabase.table(table).delete().in_("id", part).execute()
+                done += len(part)
+            except Exception:
+                done += len(self._per_row(part, _one))
+        return done
+
+    def update(self, table: str, values_by_id: Dict[Any, Dict[str, Any]]) -> int:
+        """values_by_id: {id: {cột: giá trị mới}}."""
+        groups: Dict[Tuple, List[Any]] = defaultdict(list)
+        for rid, values in values_by_id.items():
+            if rid is not None and values:
+                groups[tuple(sorted(values.items()))].append(rid)
+        done = 0
+        for key, ids in groups.items():
+            values = dict(key)
+
+            def _one(rid, values=values):
+                self.supabase.table(table).update(values).eq("id", rid).execute()
+
+            if not self.bulk:
+                ok = self._per_row(ids, _one)
+                self.updated[table].update(ok)
+                done += len(ok)
+                continue
+            for i in range(0, len(ids), self.chunk_size):
+                part = ids[i : i + self.chunk_size]
+                try:
+                    self.supabase.table(table).update(values).in_("id", part).execute()
+                    ok = part
+                except Exception:
+                    ok = self._per_row(part, _one)
+                self.updated[table].update(ok)
+                done += len(ok)
+        return done
+
+
+def _cleanup_orphans_rpc(supabase, project_id: str) -> Optional[Dict[str, int]]:
+    """
+    Dọn orphan server-side (RPC V13, một lệnh SQL mỗi bảng): link chunk_bible / chunk_timeline, relation tới Bible
+    không thuộc project, timeline / chunk trỏ chapter không tồn tại. None nếu DB chưa có RPC → caller dọn phía client.
+    """
+    try:
+        r = supabase.rpc("global_sync_cleanup_orphans", {"p_story_id": project_id}).execute()
+    except Exception:
+        return None
+    data = r.data
+    if isinstance(data, list):
+        data = data[0] if data else None
+    if isinstance(data, dict) and len(data) == 1 and isinstance(next(iter(data.values())), dict):
+        data = next(iter(data.values()))
+    if not isinstance(data, dict):
+        return None
+    return {k: int(v or 0) for k, v in data.items()}
+
+
+# Số mốc tiến độ của run_global_data_sync: 15 bước (1 → 8) + hoàn tất.
+_PROGRESS_STEPS = 16
+
+# Cột đọc khi dò thay đổi sau watermark (updated_at do trigger V14 cập nhật mỗi lần ghi).
+_CHANGE_COLUMNS = {
+    "story_bible": "id, source_chapter, updated_at",
+    "chunks": "id, chapter_id, updated_at",
+    "timeline_events": "id, chapter_id, updated_at",
+    "entity_relations": "id, source_chapter, updated_at",
+    "chunk_bible_links": "id, chunk_id, bible_entry_id, updated_at",
+    "chunk_timeline_links": "id, chunk_id, updated_at",
+}
+# Cỡ trang khi đọc nhiều dòng (dưới max-rows 1000 của PostgREST).
+_PAGE_SIZE = 500
+
+
+def _read_all(make_query, page: int = _PAGE_SIZE) -> List[Dict[str, Any]]:
+    """
+    Đọc hết kết quả theo trang .range(): PostgREST cắt mỗi lần đọc ở max-rows mà không báo lỗi.
+    make_query(): dựng query mới đã sắp theo thứ tự ổn định (vd. order("id")).
+    """
+    rows: List[Dict[str, Any]] = []
+    while True:
+        batch = list(make_query().range(len(rows), len(rows) + page - 1).execute().data or [])
+        rows.extend(batch)
+        if len(batch) < page:
+            return rows
+
+
+def _parse_ts(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def _max_ts(values) -> Optional[str]:
+    best: Optional[Tuple[datetime, str]] = None
+    for v in values:
+        dt = _parse_ts(v)
+        if dt is not None and (best is None or dt > best[0]):
+            best = (dt, str(v))
+    return best[1] if best else None
+
+
+def get_sync_state(project_id: str, supabase=None) -> Optional[Dict[str, Any]]:
+    """Watermark đồng bộ của project: {last_sync_at, last_full_sync_at, watermark, last_mode, last_changed_rows}; None nếu chưa có."""
+    supabase = supabase or _get_supabase()
+    if not supabase or not project_id:
+        return None
+    try:
+        r = supabase.table("global_sync_state").select("*").eq("story_id", project_id).limit(1).execute()
+        return (r.data or [None])[0]
+    except Exception:
+        return None
+
+
+def _save_sync_state(supabase, project_id: str, mode: str, watermark: Optional[str], changed_rows: int) -> None:
+    now_iso = datetime.now(tz=timezone.utc).isoformat()
+    payload = {
+        "story_id": project_id,
+        "last_sync_at": now_iso,
+        "watermark": watermark,
+        "last_mode": mode,
+        "last_changed_rows": changed_rows,
+    }
+    if mode == "full":
+        payload["last_full_sync_at"] = now_iso
+    try:
+        supabase.table("global_sync_state").upsert(payload, on_conflict="story_id").execute()
+    except Exception as e:
+        print(f"global_data_sync: không lưu được watermark: {e}")
+
+
+def _latest_change_ts(supabase, project_id: str) -> Optional[str]:
+    """updated_at lớn nhất trên các bảng được đồng bộ (watermark cho lần quét toàn bộ); None nếu DB chưa có cột."""
+    values = []
+    for table in _CHANGE_COLUMNS:
+        try:
+            r = supabase.table(table).select("updated_at").eq("story_id", project_id).order(
+                "updated_at", desc=True
+            ).limit(1).execute()
+            values.extend(row.get("updated_at") for row in (r.data or []))
+        except Exception:
+            return None
+    return _max_ts(values)
+
+
+class _SyncScope:
+    """
+    Phạm vi quét của một lần đồng bộ. full: mọi dòng của project (như trước).
+    incremental: dòng có updated_at sau watermark, cùng các chương (số chương + chapter_id) và thực thể Bible chúng chạm tới;
+    các bước theo chương chỉ tải dòng của những chương đó (kể cả embedding).
+    """
+
+    def __init__(self, supabase, project_id: str, chunk_size: int = 200):
+        self.supabase = supabase
+        self.project_id = project_id
+        self.chunk_size = max(1, int(chunk_size))
+        self.full = True
+        self.changed: Dict[str, List[Dict[str, Any]]] = {}
+        self.chapter_nums: Set[Any] = set()
+        self.chapter_ids: Set[Any] = set()
+        self.bible_ids: Set[Any] = set()
+        self.watermark: Optional[str] = None
+
+    @property
+    def changed_rows(self) -> int:
+        return sum(len(rows) for rows in self.changed.values())
+
+    def _read_changes(self, since: str) -> Dict[str, List[Dict[str, Any]]]:
+        return {
+            table: _read_all(
+                lambda table=table, cols=cols: self._base(table, cols).gt("updated_at", since).order("updated_at").order("id")
+            )
+            for table, cols in _CHANGE_COLUMNS.items()
+        }
+
+    def load_changes(self, since: str) -> None:
+        """
+        Đọc mọi dòng đổi sau since, theo trang (sắp theo updated_at, id) đến hết — PostgREST cắt mỗi lần đọc ở max-rows,
+        dòng không đọc tới sẽ nằm dưới watermark mới và không lần incremental nào xét lại.
+        Lỗi (chưa có cột updated_at) → ném ra để caller quét toàn bộ.
+        """
+        changed = self._read_changes(since)
+        self.changed = changed
+        self.full = False
+        self.watermark = _max_ts(row.get("updated_at") for rows in changed.values() for row in rows) or since
+
+    def skip_own_writes(self, updated: Dict[str, Set[Any]]) -> None:
+        """
+        Dời watermark qua các dòng chính lần đồng bộ này đã ghi (trigger V14 đặt lại updated_at), để lần incremental
+        sau không xử lý lại chúng. Đọc dòng đổi sau watermark theo thứ tự updated_at, dời tới mốc cuối mà mọi dòng
+        đến đó đều là tự ghi; dừng ở dòng đổi từ nơi khác đầu tiên (lần sau vẫn xét). Tự ghi: id trong updated, hoặc
+        chunk / timeline có chapter_id NULL (RPC dọn orphan đặt; dòng như vậy không còn gì để đồng bộ).
+        Lỗi → giữ watermark cũ.
+        """
+        if not self.watermark:
+            return
+        try:
+            after = self._read_changes(self.watermark)
+        except Exception as e:
+            print(f"global_data_sync: không dời được watermark qua dòng tự ghi: {e}")
+            return
+        own_by_ts: Dict[datetime, List] = {}
+        for table, rows in after.items():
+            mine = updated.get(table) or set()
+            for row in rows:
+                dt = _parse_ts(row.get("updated_at"))
+                if dt is None:
+                    continue
+                own = row.get("id") in mine or (
+                    table in ("chunks", "timeline_events") and row.get("chapter_id") is None
+                )
+                entry = own_by_ts.setdefault(dt, [row.get("updated_at"), True])
+                entry[1] = entry[1] and own
+        for dt in sorted(own_by_ts):
+            ts, own = own_by_ts[dt]
+            if not own:
+                break
+            self.watermark = ts
+
+    def resolve_chapters(self, chapter_rows: List[Dict], chunk_rows: List[Dict]) -> None:
+        """Gom chương bị chạm (số chương ↔ chapter_id) và id Bible đổi từ các dòng thay đổi."""
+        if self.full:
+            return
+        num_by_id = {r["id"]: r.get("chapter_number") for r in chapter_rows if r.get("id")}
+        id_by_num = {n: cid for cid, n in num_by_id.items() if n is not None}
+        chapter_of_chunk = {r["id"]: r.get("chapter_id") for r in chunk_rows if r.get("id")}
+        nums = {r.get("source_chapter") for r in self.changed.get("story_bible", [])}
+        nums |= {r.get("source_chapter") for r in self.changed.get("entity_relations", [])}
+        ids = {r.get("chapter_id") for t in ("chunks", "timeline_events") for r in self.changed.get(t, [])}
+        ids |= {
+            chapter_of_chunk.get(r.get("chunk_id"))
+            for t in ("chunk_bible_links", "chunk_timeline_links") for r in self.changed.get(t, [])
+        }
+        nums |= {num_by_id.get(cid) for cid in ids}
+        ids |= {id_by_num.get(n) for n in nums}
+        self.chapter_nums = {n for n in nums if n is not None}
+        self.chapter_ids = {cid for cid in ids if cid is not None}
+        self.bible_ids = {r.get("id") for r in self.changed.get("story_bible", [])}
+        self.bible_ids |= {r.get("bible_entry_id") for r in self.changed.get("chunk_bible_links", [])}
+        self.bible_ids.discard(None)
+
+    def _base(self, table: str, cols: str):
+        return self.supabase.table(table).select(cols).eq("story_id", self.project_id)
+
+    def select_in(self, table: str, cols: str, col: str, values) -> List[Dict[str, Any]]:
+        values = [v for v in dict.fromkeys(values) if v is not None]
+        out: List[Dict[str, Any]] = []
+        for i in range(0, len(values), self.chunk_size):
+            part = values[i : i + self.chunk_size]
+            out.extend(_read_all(lambda part=part: self._base(table, cols).in_(col, part).order("id")))
+        return out
+
+    def select_all(self, table: str, cols: str) -> List[Dict[str, Any]]:
+        """Mọi dòng của project trong bảng, đọc theo trang."""
+        return _read_all(lambda: self._base(table, cols).order("id"))
+
+    def select(self, table: str, cols: str, chapter_col: Optional[str] = None, changed: bool = False) -> List[Dict[str, Any]]:
+        """full: mọi dòng. incremental: changed=True → dòng đổi sau watermark; chapter_col → dòng thuộc chương bị chạm."""
+        if self.full or (not changed and not chapter_col):
+            return self.select_all(table, cols)
+        if changed:
+            return self.select_in(table, cols, "id", [r.get("id") for r in self.changed.get(table, [])])
+        values = self.chapter_nums if chapter_col == "source_chapter" else self.chapter_ids
+        return self.select_in(table, cols, chapter_col, values)
+
+    def touches_chapter(self, chapter: Any, by_number: bool = True) -> bool:
+        if self.full:
+            return True
+        return chapter in (self.chapter_nums if by_number else self.chapter_ids)
+
+
 def _get_supabase():
     from config import init_services
     s = init_services()
@@ -19,15 +365,20 @@ def run_global_data_sync(
     project_id: str,
     job_id: Optional[str] = None,
     update_job_fn=None,
+    mode: str = "full",
 ) -> Dict[str, Any]:
     """
     Kiểm tra và đồng bộ toàn cục cho project: orphan links, relations không hợp lệ, Bible parent_id, source_chapter.
-    Returns: {"success": bool, "error": str|None, "report": {...}, "fixed": {...}}
+    mode: "full" (quét toàn bộ) | "incremental" (chỉ phần đổi sau watermark; chưa có watermark / chưa chạy V14 → full).
+    Có job_id: ghi tiến độ theo bước và dừng giữa các bước nếu có yêu cầu hủy (result["cancelled"] = True).
+    Returns: {"success": bool, "error": str|None, "mode": "full"|"incremental", "report": {...}, "fixed": {...}}
     """
     result = {
         "success": False,
         "error": None,
+        "mode": "full",
         "report": {
+            "changed_rows": 0,
             "orphan_chunk_bible_links": 0,
             "orphan_chunk_timeline_links": 0,
             "orphan_relations": 0,
@@ -73,66 +424,120 @@ def run_global_data_sync(
         result["error"] = "Không kết nối được Supabase."
         return result
 
+    from config import Config
+
+    writer = _SyncWriter(
+        supabase,
+        bulk=bool(getattr(Config, "GLOBAL_SYNC_BULK", True)),
+        chunk_size=int(getattr(Config, "GLOBAL_SYNC_BULK_CHUNK", 200)),
+    )
+    scope = _SyncScope(supabase, project_id, chunk_size=writer.chunk_size)
+    if (mode or "").strip().lower() == "incremental":
+        since = (get_sync_state(project_id, supabase) or {}).get("watermark")
+        if since:
+            try:
+                scope.load_changes(since)
+            except Exception as e:
+                print(f"global_data_sync: không dò được thay đổi sau watermark ({e}) → quét toàn bộ")
+                scope = _SyncScope(supabase, project_id, chunk_size=writer.chunk_size)
+    if scope.full:
+        # Lấy watermark trước khi ghi: thay đổi từ nơi khác trong lúc chạy sẽ được lần incremental sau xét lại;
+        # dòng chính lần này ghi được bỏ qua ở cuối (skip_own_writes).
+        scope.watermark = _latest_change_ts(supabase, project_id)
+    result["mode"] = "full" if scope.full else "incremental"
+    result["report"]["changed_rows"] = scope.changed_rows
+
+    from core.job_progress import JobCancelled, JobProgress
+
+    # Tiến độ theo bước (1 → 8); giữa các bước kiểm tra yêu cầu hủy.
+    progress = JobProgress(job_id, _PROGRESS_STEPS)
+
+    def _step(message: str) -> None:
+        progress.advance(message=message)
+        progress.raise_if_cancelled()
+
     try:
+        # --- 0) Orphan (bước 2, 3, 4, 7, 8) dọn server-side nếu có RPC: không phải tải các bảng link về ---
+        orphan_rpc = _cleanup_orphans_rpc(supabase, project_id) if writer.bulk else None
+        if orphan_rpc is not None:
+            for report_key, fixed_key, rpc_key in (
+                ("orphan_chunk_bible_links", "chunk_bible_links_deleted", "chunk_bible_links"),
+                ("orphan_chunk_timeline_links", "chunk_timeline_links_deleted", "chunk_timeline_links"),
+                ("orphan_relations", "entity_relations_deleted", "entity_relations"),
+                ("timeline_orphan", "timeline_events_null_chapter", "timeline_events"),
+                ("chunk_orphan", "chunks_orphan_fixed", "chunks"),
+            ):
+                result["report"][report_key] = orphan_rpc.get(rpc_key, 0)
+                result["fixed"][fixed_key] = orphan_rpc.get(rpc_key, 0)
+
+        if not scope.full and not scope.changed_rows:
+            result["success"] = True
+            if any((orphan_rpc or {}).values()):
+                scope.skip_own_writes(writer.updated)
+            _save_sync_state(supabase, project_id, "incremental", scope.watermark, 0)
+            if job_id and update_job_fn:
+                update_job_fn(job_id, "completed", result_summary="Đồng bộ tăng dần: không có thay đổi từ lần đồng bộ trước.")
+            return result
+
+        _step("Bước 1")
         # --- 1) Thu thập ID hợp lệ ---
-        bible_rows = supabase.table("story_bible").select("id, entity_name, source_chapter, parent_id").eq("story_id", project_id).execute()
-        bible_ids: Set[Any] = {r["id"] for r in (bible_rows.data or []) if r.get("id")}
-        bible_by_id = {r["id"]: r for r in (bible_rows.data or []) if r.get("id")}
+        bible_rows = scope.select_all("story_bible", "id, entity_name, source_chapter, parent_id")
+        bible_ids: Set[Any] = {r["id"] for r in bible_rows if r.get("id")}
+        bible_by_id = {r["id"]: r for r in bible_rows if r.get("id")}
 
-        chunk_rows = supabase.table("chunks").select("id, chapter_id").eq("story_id", project_id).execute()
-        chunk_ids: Set[Any] = {r["id"] for r in (chunk_rows.data or []) if r.get("id")}
+        chunk_rows = scope.select_all("chunks", "id, chapter_id")
+        chunk_ids: Set[Any] = {r["id"] for r in chunk_rows if r.get("id")}
 
-        timeline_rows = supabase.table("timeline_events").select("id, chapter_id").eq("story_id", project_id).execute()
-        timeline_ids: Set[Any] = {r["id"] for r in (timeline_rows.data or []) if r.get("id")}
+        timeline_rows = scope.select_all("timeline_events", "id, chapter_id")
+        timeline_ids: Set[Any] = {r["id"] for r in timeline_rows if r.get("id")}
 
-        chapter_rows = supabase.table("chapters").select("id").eq("story_id", project_id).execute()
-        chapter_ids: Set[Any] = {r["id"] for r in (chapter_rows.data or []) if r.get("id")}
+        chapter_rows = scope.select_all("chapters", "id, chapter_number")
+        chapter_ids: Set[Any] = {r["id"] for r in chapter_rows if r.get("id")}
+        scope.resolve_chapters(chapter_rows, chunk_rows)
 
+        _step("Bước 2")
         # --- 2) Orphan chunk_bible_links: link tới chunk hoặc bible đã xóa ---
-        try:
-            cbl = supabase.table("chunk_bible_links").select("id, chunk_id, bible_entry_id").eq("story_id", project_id).execute()
-            for row in (cbl.data or []):
-                cid, bid = row.get("chunk_id"), row.get("bible_entry_id")
-                if cid not in chunk_ids or bid not in bible_ids:
-                    result["report"]["orphan_chunk_bible_links"] += 1
-                    try:
-                        supabase.table("chunk_bible_links").delete().eq("id", row["id"]).execute()
-                        result["fixed"]["chunk_bible_links_deleted"] += 1
-                    except Exception:
-                        pass
-        except Exception:
-            pass
+        if orphan_rpc is None:
+            try:
+                cbl = scope.select("chunk_bible_links", "id, chunk_id, bible_entry_id", changed=True)
+                orphan_ids = [
+                    row["id"] for row in cbl
+                    if row.get("chunk_id") not in chunk_ids or row.get("bible_entry_id") not in bible_ids
+                ]
+                result["report"]["orphan_chunk_bible_links"] += len(orphan_ids)
+                result["fixed"]["chunk_bible_links_deleted"] += writer.delete("chunk_bible_links", orphan_ids)
+            except Exception:
+                pass
 
+        _step("Bước 3")
         # --- 3) Orphan chunk_timeline_links ---
-        try:
-            ctl = supabase.table("chunk_timeline_links").select("id, chunk_id, timeline_event_id").eq("story_id", project_id).execute()
-            for row in (ctl.data or []):
-                cid, tid = row.get("chunk_id"), row.get("timeline_event_id")
-                if cid not in chunk_ids or tid not in timeline_ids:
-                    result["report"]["orphan_chunk_timeline_links"] += 1
-                    try:
-                        supabase.table("chunk_timeline_links").delete().eq("id", row["id"]).execute()
-                        result["fixed"]["chunk_timeline_links_deleted"] += 1
-                    except Exception:
-                        pass
-        except Exception:
-            pass
+        if orphan_rpc is None:
+            try:
+                ctl = scope.select("chunk_timeline_links", "id, chunk_id, timeline_event_id", changed=True)
+                orphan_ids = [
+                    row["id"] for row in ctl
+                    if row.get("chunk_id") not in chunk_ids or row.get("timeline_event_id") not in timeline_ids
+                ]
+                result["report"]["orphan_chunk_timeline_links"] += len(orphan_ids)
+                result["fixed"]["chunk_timeline_links_deleted"] += writer.delete("chunk_timeline_links", orphan_ids)
+            except Exception:
+                pass
 
+        _step("Bước 4")
         # --- 4) entity_relations: source/target phải tồn tại trong story_bible ---
-        try:
-            rels = supabase.table("entity_relations").select("id, source_entity_id, target_entity_id, source_chapter").eq("story_id", project_id).execute()
-            for row in (rels.data or []):
-                sid, tid = row.get("source_entity_id"), row.get("target_entity_id")
-                if sid not in bible_ids or tid not in bible_ids:
-                    result["report"]["orphan_relations"] += 1
-                    try:
-                        supabase.table("entity_relations").delete().eq("id", row["id"]).execute()
-                        result["fixed"]["entity_relations_deleted"] += 1
-                    except Exception:
-                        pass
-        except Exception:
-            pass
+        if orphan_rpc is None:
+            try:
+                rels = scope.select("entity_relations", "id, source_entity_id, target_entity_id", changed=True)
+                orphan_ids = [
+                    row["id"] for row in rels
+                    if row.get("source_entity_id") not in bible_ids or row.get("target_entity_id") not in bible_ids
+                ]
+                result["report"]["orphan_relations"] += len(orphan_ids)
+                result["fixed"]["entity_relations_deleted"] += writer.delete("entity_relations", orphan_ids)
+            except Exception:
+                pass
 
+        _step("Bước 5")
         # --- 5) Bible parent_id: cùng entity_name (chuẩn hóa) xuất hiện nhiều chương → đặt parent = bản đầu (source_chapter nhỏ nhất) ---
         def _norm_name(name: str) -> str:
             n = (name or "").strip().lower()
@@ -142,7 +547,10 @@ def run_global_data_sync(
 
         # 5a) V8.9: Đồng bộ theo tên trong phạm vi 1 chương — gộp bản trùng trong cùng chương
         by_chapter_norm: Dict[Tuple[Any, str], List[Dict]] = defaultdict(list)
-        for r in (bible_rows.data or []):
+        parent_updates: Dict[Any, Dict[str, Any]] = {}
+        # Bible đổi parent trong lần chạy này (incremental: relation / link trỏ tới chúng cần quy lại canonical)
+        parent_changed: Set[Any] = set()
+        for r in bible_rows:
             if not r.get("id"):
                 continue
             norm = _norm_name(r.get("entity_name") or "")
@@ -150,7 +558,7 @@ def run_global_data_sync(
                 ch = r.get("source_chapter")
                 by_chapter_norm[(ch, norm)].append({"id": r["id"], "source_chapter": ch, "entity_name": r.get("entity_name")})
         for (_ch, _norm), items in by_chapter_norm.items():
-            if len(items) < 2:
+            if len(items) < 2 or not scope.touches_chapter(_ch):
                 continue
             # Trong cùng chương: parent = bản đầu (theo id hoặc thứ tự)
             sorted_items = sorted(items, key=lambda x: str(x["id"]))
@@ -158,23 +566,24 @@ def run_global_data_sync(
             for item in sorted_items[1:]:
                 cur = bible_by_id.get(item["id"])
                 if cur and (cur.get("parent_id") or "") != parent_id:
-                    try:
-                        supabase.table("story_bible").update({"parent_id": parent_id}).eq("id", item["id"]).execute()
-                        result["fixed"]["bible_parent_id_updated"] += 1
-                    except Exception:
-                        pass
+                    parent_updates[item["id"]] = {"parent_id": parent_id}
+        result["fixed"]["bible_parent_id_updated"] += writer.update("story_bible", parent_updates)
+        parent_changed.update(parent_updates)
 
         by_norm: Dict[str, List[Dict]] = defaultdict(list)
-        for r in (bible_rows.data or []):
+        for r in bible_rows:
             if not r.get("id"):
                 continue
             norm = _norm_name(r.get("entity_name") or "")
             if norm:
                 by_norm[norm].append({"id": r["id"], "source_chapter": r.get("source_chapter"), "entity_name": r.get("entity_name")})
 
+        parent_updates = {}
         for norm, items in by_norm.items():
             if len(items) < 2:
                 continue
+            if not scope.full and not any(item["id"] in scope.bible_ids for item in items):
+                continue
             result["report"]["bible_parent_synced"] += 1
             # Sắp xếp theo source_chapter (None = 0), lấy đầu làm parent
             sorted_items = sorted(items, key=lambda x: (x["source_chapter"] is None, x["source_chapter"] or 0))
@@ -184,26 +593,14 @@ def run_global_data_sync(
                     continue
                 cur = bible_by_id.get(item["id"])
                 if cur and (cur.get("parent_id") or "") != parent_id:
-                    try:
-                        supabase.table("story_bible").update({"parent_id": parent_id}).eq("id", item["id"]).execute()
-                        result["fixed"]["bible_parent_id_updated"] += 1
-                    except Exception:
-                        pass
+                    parent_updates[item["id"]] = {"parent_id": parent_id}
+        result["fixed"]["bible_parent_id_updated"] += writer.update("story_bible", parent_updates)
+        parent_changed.update(parent_updates)
 
+        _step("Bước 5b")
         # --- 5b) Bible parent_id (embedding): tên khác nhưng cùng thực thể → so embedding với chương trước, đặt parent ---
-        def _cosine(a: List[float], b: List[float]) -> float:
-            if not a or not b or len(a) != len(b):
-                return 0.0
-            dot_ = sum(x * y for x, y in zip(a, b))
-            na = sum(x * x for x in a) ** 0.5
-            nb = sum(x * x for x in b) ** 0.5
-            if na * nb <= 0:
-                return 0.0
-            return dot_ / (na * nb)
-
         try:
-            bible_emb = supabase.table("story_bible").select("id, source_chapter, parent_id, embedding").eq("story_id", project_id).execute()
-            rows_all = list(bible_emb.data or [])
+            rows_all = scope.select("story_bible", "id, source_chapter, parent_id, embedding", chapter_col="source_chapter")
             # Chỉ lấy embedding dạng list[float] (Supabase có thể trả về list)
             rows_with_emb = []
             for r in rows_all:
@@ -216,38 +613,22 @@ def run_global_data_sync(
             for r in rows_with_emb:
                 ch = r.get("source_chapter")
                 by_ch[ch].append(r)
+            parent_updates = {}
             for _ch, group in by_ch.items():
                 group.sort(key=lambda x: str(x.get("id")))
-                for i, row in enumerate(group):
-                    if row.get("parent_id"):
-                        continue
-                    emb_cur = row.get("embedding")
-                    if not emb_cur:
-                        continue
-                    best_id, best_sim = None, SIM_THRESHOLD_CHAPTER
-                    for j in range(i):
-                        other = group[j]
-                        emb_oth = other.get("embedding")
-                        if not emb_oth:
-                            continue
-                        sim = _cosine(emb_cur, emb_oth)
-                        if sim >= best_sim:
-                            best_sim = sim
-                            best_id = other["id"]
-                    if best_id:
-                        try:
-                            supabase.table("story_bible").update({"parent_id": best_id}).eq("id", row["id"]).execute()
-                            result["report"]["bible_same_entity_by_embedding"] += 1
-                            result["fixed"]["bible_parent_id_by_embedding"] += 1
-                        except Exception:
-                            pass
+                parent_updates.update(_cluster_parent_updates(group, SIM_THRESHOLD_CHAPTER, "parent_id"))
+            n = writer.update("story_bible", parent_updates)
+            parent_changed.update(parent_updates)
+            result["report"]["bible_same_entity_by_embedding"] += n
+            result["fixed"]["bible_parent_id_by_embedding"] += n
         except Exception:
             pass
 
         # Reload bible sau khi đã set parent (name + embedding)
-        bible_rows = supabase.table("story_bible").select("id, entity_name, source_chapter, parent_id").eq("story_id", project_id).execute()
-        bible_by_id = {r["id"]: r for r in (bible_rows.data or []) if r.get("id")}
+        bible_rows = scope.select_all("story_bible", "id, entity_name, source_chapter, parent_id")
+        bible_by_id = {r["id"]: r for r in bible_rows if r.get("id")}
 
+        _step("Bước 5c")
         # --- 5c) Chunks: đồng bộ theo tên (trùng content chuẩn hóa) hoặc embedding 97% trong phạm vi 1 chương ---
         def _norm_text(t: str, max_len: int = 300) -> str:
             if not t or not isinstance(t, str):
@@ -256,8 +637,9 @@ def run_global_data_sync(
             return s.strip() or ""
 
         try:
-            chunk_rows_full = supabase.table("chunks").select("id, chapter_id, content, raw_content, parent_chunk_id, embedding").eq("story_id", project_id).execute()
-            chunks_all = list(chunk_rows_full.data or [])
+            chunks_all = scope.select(
+                "chunks", "id, chapter_id, content, raw_content, parent_chunk_id, embedding", chapter_col="chapter_id"
+            )
             by_ch_norm: Dict[Tuple[Any, str], List[Dict]] = defaultdict(list)
             for r in chunks_all:
                 if not r.get("id"):
@@ -266,18 +648,17 @@ def run_global_data_sync(
                 norm = _norm_text(r.get("content") or r.get("raw_content", ""), 300)
                 if norm:
                     by_ch_norm[(ch, norm)].append({"id": r["id"], "chapter_id": ch})
+            parent_updates = {}
             for (_ch, _n), items in by_ch_norm.items():
                 if len(items) < 2:
                     continue
                 sorted_items = sorted(items, key=lambda x: str(x["id"]))
                 parent_id = sorted_items[0]["id"]
                 for item in sorted_items[1:]:
-                    try:
-                        supabase.table("chunks").update({"parent_chunk_id": parent_id}).eq("id", item["id"]).execute()
-                        result["report"]["chunk_parent_by_name_chapter"] += 1
-                        result["fixed"]["chunk_parent_by_name_chapter"] += 1
-                    except Exception:
-                        pass
+                    parent_updates[item["id"]] = {"parent_chunk_id": parent_id}
+            n = writer.update("chunks", parent_updates)
+            result["report"]["chunk_parent_by_name_chapter"] += n
+            result["fixed"]["chunk_parent_by_name_chapter"] += n
             # Chunks: embedding 97% trong cùng chapter_id
             chunks_with_emb = []
             for r in chunks_all:
@@ -287,38 +668,22 @@ def run_global_data_sync(
             by_chunk_ch: Dict[Any, List[Dict]] = defaultdict(list)
             for r in chunks_with_emb:
                 by_chunk_ch[r.get("chapter_id")].append(r)
+            parent_updates = {}
             for _ch, group in by_chunk_ch.items():
                 group.sort(key=lambda x: str(x.get("id")))
-                for i, row in enumerate(group):
-                    if row.get("parent_chunk_id"):
-                        continue
-                    emb_cur = row.get("embedding")
-                    if not emb_cur:
-                        continue
-                    best_id, best_sim = None, SIM_THRESHOLD_CHAPTER
-                    for j in range(i):
-                        other = group[j]
-                        emb_oth = other.get("embedding")
-                        if not emb_oth:
-                            continue
-                        sim = _cosine(emb_cur, emb_oth)
-                        if sim >= best_sim:
-                            best_sim = sim
-                            best_id = other["id"]
-                    if best_id:
-                        try:
-                            supabase.table("chunks").update({"parent_chunk_id": best_id}).eq("id", row["id"]).execute()
-                            result["report"]["chunk_parent_by_embedding_chapter"] += 1
-                            result["fixed"]["chunk_parent_by_embedding_chapter"] += 1
-                        except Exception:
-                            pass
+                parent_updates.update(_cluster_parent_updates(group, SIM_THRESHOLD_CHAPTER, "parent_chunk_id"))
+            n = writer.update("chunks", parent_updates)
+            result["report"]["chunk_parent_by_embedding_chapter"] += n
+            result["fixed"]["chunk_parent_by_embedding_chapter"] += n
         except Exception:
             pass
 
+        _step("Bước 5d")
         # --- 5d) Timeline_events: đồng bộ theo tên (trùng title chuẩn hóa) hoặc embedding 97% trong phạm vi 1 chương ---
         try:
-            timeline_full = supabase.table("timeline_events").select("id, chapter_id, title, parent_event_id, embedding").eq("story_id", project_id).execute()
-            timeline_all = list(timeline_full.data or [])
+            timeline_all = scope.select(
+                "timeline_events", "id, chapter_id, title, parent_event_id, embedding", chapter_col="chapter_id"
+            )
             by_te_ch_norm: Dict[Tuple[Any, str], List[Dict]] = defaultdict(list)
             for r in timeline_all:
                 if not r.get("id"):
@@ -327,18 +692,17 @@ def run_global_data_sync(
                 norm = _norm_text(r.get("title") or "", 200)
                 if norm:
                     by_te_ch_norm[(ch, norm)].append({"id": r["id"], "chapter_id": ch})
+            parent_updates = {}
             for (_ch, _n), items in by_te_ch_norm.items():
                 if len(items) < 2:
                     continue
                 sorted_items = sorted(items, key=lambda x: str(x["id"]))
                 parent_id = sorted_items[0]["id"]
                 for item in sorted_items[1:]:
-                    try:
-                        supabase.table("timeline_events").update({"parent_event_id": parent_id}).eq("id", item["id"]).execute()
-                        result["report"]["timeline_parent_by_name_chapter"] += 1
-                        result["fixed"]["timeline_parent_by_name_chapter"] += 1
-                    except Exception:
-                        pass
+                    parent_updates[item["id"]] = {"parent_event_id": parent_id}
+            n = writer.update("timeline_events", parent_updates)
+            result["report"]["timeline_parent_by_name_chapter"] += n
+            result["fixed"]["timeline_parent_by_name_chapter"] += n
             # Timeline: embedding 97% trong cùng chapter_id
             te_with_emb = []
             for r in timeline_all:
@@ -348,38 +712,22 @@ def run_global_data_sync(
             by_te_ch: Dict[Any, List[Dict]] = defaultdict(list)
             for r in te_with_emb:
                 by_te_ch[r.get("chapter_id")].append(r)
+            parent_updates = {}
             for _ch, group in by_te_ch.items():
                 group.sort(key=lambda x: str(x.get("id")))
-                for i, row in enumerate(group):
-                    if row.get("parent_event_id"):
-                        continue
-                    emb_cur = row.get("embedding")
-                    if not emb_cur:
-                        continue
-                    best_id, best_sim = None, SIM_THRESHOLD_CHAPTER
-                    for j in range(i):
-                        other = group[j]
-                        emb_oth = other.get("embedding")
-                        if not emb_oth:
-                            continue
-                        sim = _cosine(emb_cur, emb_oth)
-                        if sim >= best_sim:
-                            best_sim = sim
-                            best_id = other["id"]
-                    if best_id:
-                        try:
-                            supabase.table("timeline_events").update({"parent_event_id": best_id}).eq("id", row["id"]).execute()
-                            result["report"]["timeline_parent_by_embedding_chapter"] += 1
-                            result["fixed"]["timeline_parent_by_embedding_chapter"] += 1
-                        except Exception:
-                            pass
+                parent_updates.update(_cluster_parent_updates(group, SIM_THRESHOLD_CHAPTER, "parent_event_id"))
+            n = writer.update("timeline_events", parent_updates)
+            result["report"]["timeline_parent_by_embedding_chapter"] += n
+            result["fixed"]["timeline_parent_by_embedding_chapter"] += n
         except Exception:
             pass
 
+        _step("Bước 6")
         # --- 6) entity_relations.source_chapter: nếu null, điền từ bible (source_entity_id hoặc target thuộc chương nào) ---
         try:
-            rels2 = supabase.table("entity_relations").select("id, source_entity_id, target_entity_id, source_chapter").eq("story_id", project_id).execute()
-            for row in (rels2.data or []):
+            rels2 = scope.select("entity_relations", "id, source_entity_id, target_entity_id, source_chapter", changed=True)
+            chapter_updates = {}
+            for row in rels2:
                 if row.get("source_chapter") is not None:
                     continue
                 sid, tid = row.get("source_entity_id"), row.get("target_entity_id")
@@ -391,15 +739,14 @@ def run_global_data_sync(
                 if ch is None and tgt_b and tgt_b.get("source_chapter") is not None:
                     ch = tgt_b["source_chapter"]
                 if ch is not None:
-                    try:
-                        supabase.table("entity_relations").update({"source_chapter": ch}).eq("id", row["id"]).execute()
-                        result["report"]["relation_source_chapter_filled"] += 1
-                        result["fixed"]["entity_relations_source_chapter_updated"] += 1
-                    except Exception:
-                        pass
+                    chapter_updates[row["id"]] = {"source_chapter": ch}
+            n = writer.update("entity_relations", chapter_updates)
+            result["report"]["relation_source_chapter_filled"] += n
+            result["fixed"]["entity_relations_source_chapter_updated"] += n
         except Exception:
             pass
 
+        _step("Bước 6b")
         # --- 6b) Map canonical entity id (root parent) cho mỗi bible id ---
         def _canonical_id(eid: Any) -> Any:
             seen: Set[Any] = set()
@@ -414,54 +761,80 @@ def run_global_data_sync(
                 eid = pid
             return eid
 
+        def _chain_ids(eid: Any) -> Set[Any]:
+            chain: Set[Any] = set()
+            while eid and eid in bible_by_id and eid not in chain:
+                chain.add(eid)
+                eid = bible_by_id[eid].get("parent_id")
+            return chain
+
+        # Incremental: Bible có chuỗi parent đi qua Bible mới / vừa đổi parent → canonical có thể đã đổi.
+        affected_bible: Set[Any] = set()
+        if not scope.full:
+            touched_bible = scope.bible_ids | parent_changed
+            affected_bible = {bid for bid in bible_by_id if _chain_ids(bid) & touched_bible}
+
+        _step("Bước 6c")
         # --- 6c) entity_relations: quy source/target về canonical, rồi gộp trùng (giữ một theo cặp + relation_type) ---
         try:
-            rels_all = supabase.table("entity_relations").select("id, source_entity_id, target_entity_id, relation_type").eq("story_id", project_id).execute()
+            rel_cols = "id, source_entity_id, target_entity_id, relation_type, source_chapter"
+            if scope.full:
+                rels_all = scope.select("entity_relations", rel_cols)
+            else:
+                rels_all = list({
+                    r["id"]: r for r in (
+                        scope.select("entity_relations", rel_cols, changed=True)
+                        + scope.select_in("entity_relations", rel_cols, "source_entity_id", affected_bible)
+                        + scope.select_in("entity_relations", rel_cols, "target_entity_id", affected_bible)
+                    )
+                }.values())
             canonical_src = {}
             canonical_tgt = {}
-            for row in (rels_all.data or []):
+            for row in rels_all:
                 sid = row.get("source_entity_id")
                 tid = row.get("target_entity_id")
                 cs, ct = _canonical_id(sid), _canonical_id(tid)
                 canonical_src[row["id"]] = cs
                 canonical_tgt[row["id"]] = ct
-            for row in (rels_all.data or []):
+            normalize_updates = {}
+            for row in rels_all:
                 rid, sid, tid = row.get("id"), row.get("source_entity_id"), row.get("target_entity_id")
                 cs, ct = canonical_src.get(rid), canonical_tgt.get(rid)
                 if cs is None or ct is None:
                     continue
                 if sid != cs or tid != ct:
-                    try:
-                        supabase.table("entity_relations").update({"source_entity_id": cs, "target_entity_id": ct}).eq("id", rid).execute()
-                        result["report"]["relation_normalized_to_canonical"] += 1
-                        result["fixed"]["entity_relations_normalized"] += 1
-                    except Exception:
-                        pass
+                    normalize_updates[rid] = {"source_entity_id": cs, "target_entity_id": ct}
+            n = writer.update("entity_relations", normalize_updates)
+            result["report"]["relation_normalized_to_canonical"] += n
+            result["fixed"]["entity_relations_normalized"] += n
+            # Relation vừa quy về canonical có thể trùng relation khác trong chương của nó → xét cả chương đó
+            scope.chapter_nums |= {r.get("source_chapter") for r in rels_all if r["id"] in normalize_updates and r.get("source_chapter") is not None}
             # Dedupe trong phạm vi 1 chương: cùng (source_chapter, source, target, relation_type) giữ một
-            rels2 = supabase.table("entity_relations").select("id, source_entity_id, target_entity_id, relation_type, source_chapter").eq("story_id", project_id).execute()
+            rels2 = scope.select(
+                "entity_relations", "id, source_entity_id, target_entity_id, relation_type, source_chapter", chapter_col="source_chapter"
+            )
             key_to_id: Dict[Tuple[Any, Any, Any, str], str] = {}
-            for row in (rels2.data or []):
+            dup_ids = []
+            for row in rels2:
                 ch = row.get("source_chapter")
                 key = (ch, row.get("source_entity_id"), row.get("target_entity_id"), (row.get("relation_type") or "").strip())
                 if key not in key_to_id:
                     key_to_id[key] = row["id"]
                 else:
-                    try:
-                        supabase.table("entity_relations").delete().eq("id", row["id"]).execute()
-                        result["report"]["relation_deduped"] += 1
-                        result["report"]["relation_deduped_by_chapter"] += 1
-                        result["fixed"]["entity_relations_deduped"] += 1
-                        result["fixed"]["relation_deduped_by_chapter"] += 1
-                    except Exception:
-                        pass
+                    dup_ids.append(row["id"])
+            n = writer.delete("entity_relations", dup_ids)
+            for counter, key in (("report", "relation_deduped"), ("report", "relation_deduped_by_chapter"),
+                                 ("fixed", "entity_relations_deduped"), ("fixed", "relation_deduped_by_chapter")):
+                result[counter][key] += n
         except Exception:
             pass
 
+        _step("Bước 6e")
         # --- 6e) entity_relations: trùng theo embedding 97% trong cùng source_chapter → giữ một, xóa bản còn lại ---
         try:
-            rels_emb = supabase.table("entity_relations").select("id, source_chapter, embedding").eq("story_id", project_id).execute()
+            rels_emb = scope.select("entity_relations", "id, source_chapter, embedding", chapter_col="source_chapter")
             rels_with_emb = []
-            for r in (rels_emb.data or []):
+            for r in rels_emb:
                 emb = r.get("embedding")
                 if emb is not None and isinstance(emb, (list, tuple)) and len(emb) > 0 and isinstance(emb[0], (int, float)):
                     rels_with_emb.append({**r, "embedding": list(emb)})
@@ -471,91 +844,100 @@ def run_global_data_sync(
             to_delete = []
             for _ch, group in by_rel_ch.items():
                 group.sort(key=lambda x: str(x.get("id")))
+                # Xóa không hoàn tác được → chỉ xóa dòng trùng trực tiếp với một dòng đã giữ (greedy), không xóa theo
+                # cụm liên thông (A~B, B~C nhưng A≁C thì C vẫn giữ).
+                kept = set(greedy_dedupe([r.get("embedding") for r in group], SIM_THRESHOLD_CHAPTER))
                 for i, row in enumerate(group):
-                    if row["id"] in to_delete:
-                        continue
-                    emb_cur = row.get("embedding")
-                    if not emb_cur:
-                        continue
-                    for j in range(i):
-                        other = group[j]
-                        if other["id"] in to_delete:
-                            continue
-                        emb_oth = other.get("embedding")
-                        if not emb_oth:
-                            continue
-                        if _cosine(emb_cur, emb_oth) >= SIM_THRESHOLD_CHAPTER:
-                            to_delete.append(row["id"])
-                            result["report"]["relation_deduped_by_embedding_chapter"] += 1
-                            result["fixed"]["relation_deduped_by_embedding_chapter"] += 1
-                            break
-            for rid in to_delete:
-                try:
-                    supabase.table("entity_relations").delete().eq("id", rid).execute()
-                except Exception:
-                    pass
+                    if i not in kept:
+                        to_delete.append(row["id"])
+                        result["report"]["relation_deduped_by_embedding_chapter"] += 1
+                        result["fixed"]["relation_deduped_by_embedding_chapter"] += 1
+            writer.delete("entity_relations", to_delete)
         except Exception:
             pass
 
+        _step("Bước 6d")
         # --- 6d) chunk_bible_links: quy bible_entry_id về canonical, rồi gộp trùng (chunk_id, bible_entry_id) ---
         try:
-            cbl_all = supabase.table("chunk_bible_links").select("id, chunk_id, bible_entry_id").eq("story_id", project_id).execute()
+            cbl_cols = "id, chunk_id, bible_entry_id"
+            if scope.full:
+                cbl_all = scope.select("chunk_bible_links", cbl_cols)
+            else:
+                # Mọi link của các chunk có link mới / trỏ tới Bible bị ảnh hưởng (gộp trùng xét theo chunk)
+                seeds = scope.changed.get("chunk_bible_links", []) + scope.select_in(
+                    "chunk_bible_links", "chunk_id", "bible_entry_id", affected_bible
+                )
+                cbl_all = scope.select_in("chunk_bible_links", cbl_cols, "chunk_id", [r.get("chunk_id") for r in seeds])
             seen_cbl: Dict[Tuple[Any, Any], str] = {}
-            for row in (cbl_all.data or []):
+            cbl_updates = {}
+            cbl_dups = []
+            for row in cbl_all:
                 bid = row.get("bible_entry_id")
                 can = _canonical_id(bid)
-                if bid != can:
-                    try:
-                        supabase.table("chunk_bible_links").update({"bible_entry_id": can}).eq("id", row["id"]).execute()
-                        result["report"]["cbl_normalized_to_canonical"] += 1
-                        result["fixed"]["chunk_bible_links_normalized"] += 1
-                    except Exception:
-                        pass
                 key = (row.get("chunk_id"), can)
                 if key not in seen_cbl:
                     seen_cbl[key] = row["id"]
+                    if bid != can:
+                        cbl_updates[row["id"]] = {"bible_entry_id": can}
                 else:
-                    try:
-                        supabase.table("chunk_bible_links").delete().eq("id", row["id"]).execute()
-                        result["report"]["cbl_deduped"] += 1
-                        result["fixed"]["chunk_bible_links_deduped"] += 1
-                    except Exception:
-                        pass
+                    # Bản trùng: xóa luôn, không cần quy về canonical trước (tránh vi phạm UNIQUE(chunk_id, bible_entry_id)).
+                    cbl_dups.append(row["id"])
+            n = writer.delete("chunk_bible_links", cbl_dups)
+            result["report"]["cbl_deduped"] += n
+            result["fixed"]["chunk_bible_links_deduped"] += n
+            n = writer.update("chunk_bible_links", cbl_updates)
+            result["report"]["cbl_normalized_to_canonical"] += n
+            result["fixed"]["chunk_bible_links_normalized"] += n
         except Exception:
             pass
 
+        _step("Bước 7")
         # --- 7) timeline_events.chapter_id không còn tồn tại → set null hoặc báo ---
-        try:
-            for row in (timeline_rows.data or []):
-                cid = row.get("chapter_id")
-                if cid is not None and cid not in chapter_ids:
-                    result["report"]["timeline_orphan"] += 1
-                    try:
-                        supabase.table("timeline_events").update({"chapter_id": None}).eq("id", row["id"]).execute()
-                        result["fixed"]["timeline_events_null_chapter"] += 1
-                    except Exception:
-                        pass
-        except Exception:
-            pass
+        if orphan_rpc is None:
+            orphan_ids = [
+                row["id"] for row in timeline_rows
+                if row.get("chapter_id") is not None and row.get("chapter_id") not in chapter_ids
+            ]
+            result["report"]["timeline_orphan"] += len(orphan_ids)
+            result["fixed"]["timeline_events_null_chapter"] += writer.update(
+                "timeline_events", {rid: {"chapter_id": None} for rid in orphan_ids}
+            )
 
+        _step("Bước 8")
         # --- 8) chunks.chapter_id không tồn tại → set null (nếu schema cho phép) hoặc báo ---
+        if orphan_rpc is None:
+            orphan_ids = [
+                row["id"] for row in chunk_rows
+                if row.get("chapter_id") is not None and row.get("chapter_id") not in chapter_ids
+            ]
+            result["report"]["chunk_orphan"] += len(orphan_ids)
+            result["fixed"]["chunks_orphan_fixed"] += writer.update(
+                "chunks", {rid: {"chapter_id": None} for rid in orphan_ids}
+            )
+
+        progress.advance(message="Hoàn tất")
+        progress.flush()
+        result["success"] = True
+        if writer.updated or any((orphan_rpc or {}).values()):
+            scope.skip_own_writes(writer.updated)
+        _save_sync_state(supabase, project_id, result["mode"], scope.watermark, scope.changed_rows)
         try:
-            for row in (chunk_rows.data or []):
-                cid = row.get("chapter_id")
-                if cid is not None and cid not in chapter_ids:
-                    result["report"]["chunk_orphan"] += 1
-                    try:
-                        supabase.table("chunks").update({"chapter_id": None}).eq("id", row["id"]).execute()
-                        result["fixed"]["chunks_orphan_fixed"] += 1
-                    except Exception:
-                        pass
+            # Đã xóa/gộp nhiều dòng → nạp lại index vector và tổng quan project ở lần dùng sau
+            from ai.vector_index import invalidate_vector_index
+
+            invalidate_vector_index(project_id)
+            from ai.project_overview import invalidate_project_overview
+
+            invalidate_project_overview(project_id)
         except Exception:
             pass
-
-        result["success"] = True
         if job_id and update_job_fn:
             fxd = result["fixed"]
-            summary = (
+            scope_label = (
+                f"Tăng dần ({scope.changed_rows} dòng đổi, {len(scope.chapter_nums)} chương). "
+                if not scope.full else ""
+            )
+            summary = scope_label + (
                 f"Dọn rác: {fxd['chunk_bible_links_deleted']} link bible, {fxd['chunk_timeline_links_deleted']} link timeline, {fxd['entity_relations_deleted']} relation. "
                 f"Bible: {fxd['bible_parent_id_updated']} parent (tên), {fxd['bible_parent_id_by_embedding']} parent (embed 97%). "
                 f"Chunk: {fxd['chunk_parent_by_name_chapter']} (tên), {fxd['chunk_parent_by_embedding_chapter']} (embed 97%). "
@@ -566,8 +948,46 @@ def run_global_data_sync(
                 f"source_chapter: {fxd['entity_relations_source_chapter_updated']}."
             )
             update_job_fn(job_id, "completed", result_summary=summary)
+    except JobCancelled as e:
+        # Không lưu watermark: lần sau xét lại toàn bộ phần thay đổi (các sửa đã ghi vẫn giữ).
+        result["error"] = str(e)
+        result["cancelled"] = True
+        if job_id and update_job_fn:
+            update_job_fn(job_id, "cancelled", result_summary=f"Đã hủy ở {progress.message or 'bước đầu'}.")
     except Exception as e:
         result["error"] = str(e)[:1000]
         if job_id and update_job_fn:
             update_job_fn(job_id, "failed", error_message=result["error"])
     return result
+
+
+def schedule_incremental_sync(project_id: str, user_id: Optional[str] = None) -> Optional[str]:
+    """
+    Xếp job global_data_sync chế độ incremental (không gửi chat) nếu project chưa có job đồng bộ đang chờ.
+    Gọi sau mỗi Unified analyze thành công khi Config.GLOBAL_SYNC_AUTO_INCREMENTAL bật. Trả về job_id hoặc None.
+    """
+    from config import Config
+
+    if not project_id or not getattr(Config, "GLOBAL_SYNC_AUTO_INCREMENTAL", True):
+        return None
+    supabase = _get_supabase()
+    if not supabase:
+        return None
+    try:
+        r = supabase.table("background_jobs").select("id").eq("story_id", project_id).eq(
+            "job_type", "global_data_sync"
+        ).eq("status", "pending").limit(1).execute()
+        if r.data:
+            return None
+    except Exception:
+        return None
+    from core.background_jobs import create_job
+
+    return create_job(
+        story_id=project_id,
+        user_id=user_id,
+        job_type="global_data_sync",
+        label="Đồng bộ tăng dần (sau Unified)",
+        payload={"mode": "incremental"},
+        post_to_chat=False,
+    )
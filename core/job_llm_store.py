@@ -1,8 +1,12 @@
 # core/job_llm_store.py - Lưu và lấy kết quả LLM theo job/step; dùng cho retry không gọi LLM lại.
-"""Lưu llm_raw_response + parsed_result sau mỗi lần gọi LLM; retry dùng dữ liệu đã lưu."""
+"""Lưu llm_raw_response + parsed_result sau mỗi lần gọi LLM; retry dùng dữ liệu đã lưu.
+Checkpoint (step_type "checkpoint"): đánh dấu chương / lô đã lưu xong để job chạy lại (process chết giữa chừng) bỏ qua."""
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional, Tuple
 
+# step_type của bản ghi checkpoint (không phải kết quả LLM, không dùng cho nút Thử lại).
+CHECKPOINT_STEP_TYPE = "checkpoint"
+
 
 def _get_supabase():
     from config import init_services
@@ -162,7 +166,32 @@ def has_stored_result_for_retry(job_id: str, step_type: Optional[str] = None) ->
         ).limit(1)
         if step_type:
             q = q.eq("step_type", step_type)
+        else:
+            q = q.neq("step_type", CHECKPOINT_STEP_TYPE)
         r = q.execute()
         return bool(r.data and len(r.data) > 0)
     except Exception:
         return False
+
+
+def save_checkpoint(job_id: str, key: str, info: Optional[Dict[str, Any]] = None) -> bool:
+    """Ghi checkpoint (vd. "unified:12" = chương 12 đã lưu xong). info: dữ liệu kèm theo (lỗi của lô, ...)."""
+    if not job_id:
+        return False
+    return save_llm_result(job_id, CHECKPOINT_STEP_TYPE, key, info or {}, status="success")
+
+
+def get_checkpoints(job_id: str) -> Dict[str, Dict[str, Any]]:
+    """{key: info} các checkpoint đã ghi của job (rỗng nếu chưa có / lỗi)."""
+    if not job_id:
+        return {}
+    try:
+        supabase = _get_supabase()
+        if not supabase:
+            return {}
+        r = supabase.table("job_llm_results").select("step_key, parsed_result").eq("job_id", job_id).eq(
+            "step_type", CHECKPOINT_STEP_TYPE
+        ).execute()
+        return {str(row.get("step_key")): (row.get("parsed_result") or {}) for row in (r.data or [])}
+    except Exception:
+        return {}
@@ -0,0 +1,188 @@
+# core/job_progress.py - Tiến độ (progress_current / total / ETA) và hủy hợp tác cho job background chạy lâu
+"""
+Job dài (unified_chapter_range, data_operation_batch, global_data_sync) báo tiến độ và kiểm tra yêu cầu hủy:
+
+- JobProgress.advance(): cộng tiến độ; chỉ ghi DB tối đa mỗi Config.JOB_PROGRESS_MIN_INTERVAL_SEC giây (tránh ghi dồn dập).
+  Lệnh UPDATE trả về dòng job → đọc luôn cờ cancel_requested, không tốn thêm request.
+- is_cancelled() / raise_if_cancelled(): worker gọi giữa các chương / lô / bước; đọc cờ tối đa mỗi khoảng trên.
+- request_cancel(): job pending → cancelled ngay; job running → bật cancel_requested, worker tự dừng ở mốc kế tiếp.
+- DB chưa chạy migration V15 (chưa có cột progress / cancel_requested, chưa có status 'cancelled'):
+  không ghi tiến độ, không hủy được job đang chạy; job pending hủy → failed.
+  Lỗi khác khi ghi tiến độ (mạng, PostgREST tạm thời) chỉ bỏ qua lần đó, lần sync sau ghi / đọc cờ hủy lại.
+"""
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CANCELLED_MESSAGE = "Đã hủy theo yêu cầu."
+
+
+class JobCancelled(Exception):
+    """Worker dừng vì người dùng yêu cầu hủy job."""
+
+
+def _cfg(name: str, default: Any) -> Any:
+    try:
+        from config import Config
+
+        return getattr(Config, name, default)
+    except Exception:
+        return default
+
+
+def _get_supabase():
+    from config import init_services
+
+    services = init_services()
+    return (services or {}).get("supabase")
+
+
+def _now_iso() -> str:
+    return datetime.now(tz=timezone.utc).isoformat()
+
+
+class JobProgress:
+    """
+    Tiến độ của một job. job_id None → mọi hàm là no-op (chạy ngoài background job, vd. gọi trực tiếp từ view).
+    """
+
+    def __init__(
+        self,
+        job_id: Optional[str],
+        total: int = 0,
+        supabase=None,
+        min_interval_sec: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.job_id = job_id
+        self.total = max(0, int(total or 0))
+        self.current = 0
+        self.message: Optional[str] = None
+        self.cancelled = False
+        self.min_interval_sec = float(
+            min_interval_sec if min_interval_sec is not None else _cfg("JOB_PROGRESS_MIN_INTERVAL_SEC", 5.0)
+        )
+        self._supabase = supabase
+        self._clock = clock
+        self._started = clock()
+        self._last_sync: Optional[float] = None
+        self._enabled = bool(job_id)
+
+    def eta_sec(self) -> Optional[int]:
+        """Thời gian còn lại ước lượng theo tốc độ trung bình từ lúc bắt đầu; None nếu chưa đủ dữ liệu."""
+        if self.current <= 0 or self.total <= 0:
+            return None
+        elapsed = self._clock() - self._started
+        return max(0, int(round(elapsed / self.current * (self.total - self.current))))
+
+    def set_total(self, total: int) -> None:
+        self.total = max(0, int(total or 0))
+
+    def advance(self, n: int = 1, message: Optional[str] = None) -> None:
+        self.current = min(self.current + n, self.total) if self.total else self.current + n
+        if message is not None:
+            self.message = message
+        self._sync()
+
+    def flush(self) -> None:
+        """Ghi tiến độ ngay (bỏ qua giới hạn tần suất)."""
+        self._sync(force=True)
+
+    def is_cancelled(self) -> bool:
+        if not self.cancelled:
+            self._sync()
+        return self.cancelled
+
+    def raise_if_cancelled(self) -> None:
+        if self.is_cancelled():
+            raise JobCancelled(CANCELLED_MESSAGE)
+
+    def _sync(self, force: bool = False) -> None:
+        """Ghi tiến độ và đọc cờ cancel_requested trong cùng một UPDATE (tối đa mỗi min_interval_sec)."""
+        if not self._enabled:
+            return
+        now = self._clock()
+        if not force and self._last_sync is not None and now - self._last_sync < self.min_interval_sec:
+            return
+        self._last_sync = now
+        try:
+            supabase = self._supabase or _get_supabase()
+            if not supabase:
+                return
+            eta = self.eta_sec()
+            r = supabase.table("background_jobs").update({
+                "progress_current": self.current,
+                "progress_total": self.total,
+                "progress_eta_sec": eta,
+                "progress_message": (self.message or "")[:200] or None,
+                "progress_updated_at": _now_iso(),
+            }).eq("id", self.job_id).execute()
+            row = (r.data or [{}])[0]
+            if row.get("cancel_requested"):
+                self.cancelled = True
+        except Exception as e:
+            if _is_missing_column_error(e):
+                logger.warning("job_progress: background_jobs chưa có cột tiến độ (chưa chạy migration V15): %s", e)
+                self._enabled = False
+            else:
+                # Lỗi tạm thời (mạng, PostgREST): giữ bật, thử lại ở lần sync kế tiếp để vẫn đọc được cancel_requested.
+                logger.warning("job_progress: không ghi được tiến độ, thử lại sau: %s", e)
+
+
+def _is_missing_column_error(e: Exception) -> bool:
+    """Lỗi do DB chưa có cột (Postgres 42703 undefined_column, PostgREST PGRST204 không thấy cột trong schema cache)."""
+    msg = str(e).lower()
+    if "42703" in msg or "pgrst204" in msg:
+        return True
+    return "column" in msg and ("does not exist" in msg or "schema cache" in msg)
+
+
+def request_cancel(job_id: str, supabase=None) -> str:
+    """
+    Yêu cầu hủy job. Trả về "cancelled" (job pending đã hủy ngay), "requested" (job running sẽ dừng ở mốc kế tiếp)
+    hoặc "" (job đã xong / không hủy được).
+    """
+    supabase = supabase or _get_supabase()
+    if not supabase or not job_id:
+        return ""
+    done = {"completed_at": _now_iso(), "error_message": CANCELLED_MESSAGE}
+    try:
+        r = supabase.table("background_jobs").update({**done, "status": "cancelled"}).eq("id", job_id).eq(
+            "status", "pending"
+        ).execute()
+    except Exception:
+        # Chưa có status 'cancelled' (V15) → đánh dấu failed để worker không nhận job nữa.
+        try:
+            r = supabase.table("background_jobs").update({**done, "status": "failed"}).eq("id", job_id).eq(
+                "status", "pending"
+            ).execute()
+        except Exception:
+            return ""
+    if r.data:
+        return "cancelled"
+    try:
+        r = supabase.table("background_jobs").update({"cancel_requested": True}).eq("id", job_id).eq(
+            "status", "running"
+        ).execute()
+        return "requested" if r.data else ""
+    except Exception as e:
+        logger.warning("job_progress: không đặt được cancel_requested: %s", e)
+        return ""
+
+
+def progress_view(job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Tiến độ để hiển thị từ một dòng background_jobs: {current, total, fraction, eta_sec, message}; None nếu chưa có."""
+    total = int(job.get("progress_total") or 0)
+    if total <= 0:
+        return None
+    current = min(total, int(job.get("progress_current") or 0))
+    return {
+        "current": current,
+        "total": total,
+        "fraction": current / total,
+        "eta_sec": job.get("progress_eta_sec"),
+        "message": job.get("progress_message") or "",
+    }
@@ -0,0 +1,414 @@
+# core/job_queue.py - Worker pool cho hàng đợi background_jobs: nhận job bằng lease, giới hạn đồng thời theo project / loại job
+"""
+Nhiều process (Streamlit replica, runner) cùng chia một hàng đợi background_jobs an toàn:
+
+- Nhận job: UPDATE ... SET status='running', claimed_by, lease_expires_at WHERE id=? AND status='pending'.
+  PostgREST chỉ trả dòng nếu cập nhật thành công → đúng một worker thắng (compare-and-set, không cần RPC).
+- Lease: worker gia hạn lease_expires_at định kỳ trong lúc chạy; chạy xong thì xóa lease.
+  Job running mà lease hết hạn (process chết giữa chừng) → về lại pending, quá Config.JOB_MAX_ATTEMPTS lần nhận → failed.
+- Giới hạn: tổng Config.JOB_WORKER_MAX_CONCURRENCY thread mỗi process; Config.JOB_WORKER_MAX_PER_PROJECT và
+  Config.JOB_WORKER_MAX_PER_TYPE tính trên mọi job đang giữ lease (toàn hệ thống, đọc từ DB).
+- Lane ưu tiên (V16, cột priority): interactive > normal > bulk; lane mặc định theo Config.JOB_PRIORITY_BY_TYPE.
+  Job chờ mỗi Config.JOB_PRIORITY_AGING_SEC giây được nâng một lane (bulk không bị bỏ đói). Cùng lane: user rồi project
+  đang có ít job chạy hơn được nhận trước (fair share), sau đó theo created_at.
+  Config.JOB_WORKER_MAX_PER_LANE giữ chỗ trong process cho lane cao (vd. bulk tối đa 2 / 3 thread).
+- DB chưa chạy migration V11 (chưa có cột lease): vẫn nhận job bằng status CAS, giới hạn chỉ tính trong process.
+  Chưa chạy V16 (chưa có cột priority): lane suy ra từ job_type.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Id worker của process này (ghi vào background_jobs.claimed_by).
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+# Số job pending xem xét mỗi lần chọn (để bỏ qua job bị chặn bởi giới hạn project / loại).
+_CANDIDATE_WINDOW = 50
+
+# Lane ưu tiên, cao → thấp.
+LANES = ("interactive", "normal", "bulk")
+
+
+def _cfg(name: str, default: Any) -> Any:
+    try:
+        from config import Config
+
+        return getattr(Config, name, default)
+    except Exception:
+        return default
+
+
+def _now() -> datetime:
+    return datetime.now(tz=timezone.utc)
+
+
+def _lease_until(lease_sec: float) -> str:
+    return (_now() + timedelta(seconds=lease_sec)).isoformat()
+
+
+def _parse_ts(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def job_limits() -> Dict[str, Any]:
+    """Giới hạn đồng thời hiện hành (đọc từ Config mỗi lần để chỉnh nóng được)."""
+    return {
+        "max_workers": max(1, int(_cfg("JOB_WORKER_MAX_CONCURRENCY", 3))),
+        "per_project": int(_cfg("JOB_WORKER_MAX_PER_PROJECT", 1)),
+        "per_type": dict(_cfg("JOB_WORKER_MAX_PER_TYPE", {}) or {}),
+        "per_user": int(_cfg("JOB_WORKER_MAX_PER_USER", 0)),
+        "per_lane": dict(_cfg("JOB_WORKER_MAX_PER_LANE", {}) or {}),
+        "interactive_bypass_project": bool(_cfg("JOB_INTERACTIVE_BYPASS_PROJECT_CAP", True)),
+    }
+
+
+def job_lane(job: Dict[str, Any]) -> str:
+    """Lane của job: cột priority nếu hợp lệ, không thì theo Config.JOB_PRIORITY_BY_TYPE (mặc định normal)."""
+    lane = (job.get("priority") or "").strip()
+    if lane in LANES:
+        return lane
+    by_type = _cfg("JOB_PRIORITY_BY_TYPE", {}) or {}
+    lane = by_type.get((job.get("job_type") or "").strip(), "normal")
+    return lane if lane in LANES else "normal"
+
+
+def job_wait_sec(job: Dict[str, Any], now: Optional[datetime] = None) -> float:
+    created = _parse_ts(job.get("created_at"))
+    if created is None:
+        return 0.0
+    return max(0.0, ((now or _now()) - created).total_seconds())
+
+
+def effective_rank(job: Dict[str, Any], now: Optional[datetime] = None, aging_sec: Optional[float] = None) -> int:
+    """Hạng lane sau aging (0 = interactive): cứ mỗi aging_sec giây chờ được nâng một lane."""
+    rank = LANES.index(job_lane(job))
+    aging = float(aging_sec if aging_sec is not None else _cfg("JOB_PRIORITY_AGING_SEC", 600))
+    if aging > 0:
+        rank -= int(job_wait_sec(job, now) // aging)
+    return max(0, rank)
+
+
+def order_candidates(
+    candidates: List[Dict[str, Any]],
+    running_by_user: Counter,
+    running_by_project: Counter,
+    now: Optional[datetime] = None,
+    aging_sec: Optional[float] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Thứ tự nhận job: lane sau aging → user đang chạy ít job hơn → project đang chạy ít job hơn → created_at.
+    Cùng hạng sau aging thì job cũ hơn (thường là bulk đã chờ lâu) đi trước.
+    """
+    now = now or _now()
+    return sorted(
+        candidates,
+        key=lambda job: (
+            effective_rank(job, now, aging_sec),
+            running_by_user[str(job.get("user_id") or "")],
+            running_by_project[str(job.get("story_id") or "")],
+            str(job.get("created_at") or ""),
+        ),
+    )
+
+
+def pick_claimable(
+    candidates: List[Dict[str, Any]],
+    running_by_project: Counter,
+    running_by_type: Counter,
+    limits: Dict[str, Any],
+    running_by_user: Optional[Counter] = None,
+    running_by_lane: Optional[Counter] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Các job pending (giữ thứ tự) không vượt giới hạn project / loại job / user / lane nếu nhận thêm;
+    0 hoặc âm = không giới hạn. Job interactive bỏ qua giới hạn project nếu limits["interactive_bypass_project"].
+    """
+    per_project = int(limits.get("per_project") or 0)
+    per_type = limits.get("per_type") or {}
+    per_user = int(limits.get("per_user") or 0)
+    per_lane = limits.get("per_lane") or {}
+    bypass_project = bool(limits.get("interactive_bypass_project"))
+    running_by_user = running_by_user if running_by_user is not None else Counter()
+    running_by_lane = running_by_lane if running_by_lane is not None else Counter()
+    out = []
+    for job in candidates:
+        story_id = str(job.get("story_id") or "")
+        job_type = (job.get("job_type") or "").strip()
+        lane = job_lane(job)
+        project_capped = per_project > 0 and running_by_project[story_id] >= per_project
+        if project_capped and not (bypass_project and lane == "interactive"):
+            continue
+        type_cap = int(per_type.get(job_type) or 0)
+        if type_cap > 0 and running_by_type[job_type] >= type_cap:
+            continue
+        if per_user > 0 and running_by_user[str(job.get("user_id") or "")] >= per_user:
+            continue
+        lane_cap = int(per_lane.get(lane) or 0)
+        if lane_cap > 0 and running_by_lane[lane] >= lane_cap:
+            continue
+        out.append(job)
+    return out
+
+
+def requeue_expired_leases(supabase) -> int:
+    """Job running có lease hết hạn → pending (hoặc failed nếu đã nhận quá JOB_MAX_ATTEMPTS lần). Trả về số job đưa lại hàng đợi."""
+    now_iso = _now().isoformat()
+    max_attempts = int(_cfg("JOB_MAX_ATTEMPTS", 3))
+    cleared = {"claimed_by": None, "lease_expires_at": None}
+    if max_attempts > 0:
+        supabase.table("background_jobs").update({
+            **cleared,
+            "status": "failed",
+            "error_message": f"Worker mất kết nối giữa chừng quá {max_attempts} lần (lease hết hạn).",
+            "completed_at": now_iso,
+        }).eq("status", "running").lt("lease_expires_at", now_iso).gte("attempts", max_attempts).execute()
+    r = supabase.table("background_jobs").update({**cleared, "status": "pending"}).eq(
+        "status", "running"
+    ).lt("lease_expires_at", now_iso).execute()
+    n = len(r.data or [])
+    if n:
+        logger.warning("job_queue: đưa lại %s job có lease hết hạn về pending", n)
+    return n
+
+
+def running_counts(supabase) -> Tuple[Counter, Counter, Counter]:
+    """Số job đang giữ lease còn hạn theo story_id, job_type và user_id (mọi worker)."""
+    r = (
+        supabase.table("background_jobs")
+        .select("story_id, job_type, user_id")
+        .eq("status", "running")
+        .gt("lease_expires_at", _now().isoformat())
+        .execute()
+    )
+    by_project: Counter = Counter()
+    by_type: Counter = Counter()
+    by_user: Counter = Counter()
+    for row in r.data or []:
+        by_project[str(row.get("story_id") or "")] += 1
+        by_type[(row.get("job_type") or "").strip()] += 1
+        by_user[str(row.get("user_id") or "")] += 1
+    return by_project, by_type, by_user
+
+
+def lane_stats(supabase, now: Optional[datetime] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Theo lane (toàn hệ thống): pending (độ sâu hàng đợi), running, chờ lâu nhất / trung bình (giây) của job pending.
+    Đọc tối đa 1000 job mỗi trạng thái.
+    """
+    now = now or _now()
+    stats = {lane: {"pending": 0, "running": 0, "max_wait_sec": 0.0, "avg_wait_sec": 0.0} for lane in LANES}
+    waits: Dict[str, List[float]] = {lane: [] for lane in LANES}
+    for status in ("pending", "running"):
+        try:
+            rows = (
+                supabase.table("background_jobs").select("job_type, created_at, priority")
+                .eq("status", status).limit(1000).execute().data
+            )
+        except Exception:
+            # Chưa có cột priority (V16) → lane theo job_type.
+            rows = (
+                supabase.table("background_jobs").select("job_type, created_at")
+                .eq("status", status).limit(1000).execute().data
+            )
+        for row in rows or []:
+            lane = job_lane(row)
+            stats[lane][status] += 1
+            if status == "pending":
+                waits[lane].append(job_wait_sec(row, now))
+    for lane, values in waits.items():
+        if values:
+            stats[lane]["max_wait_sec"] = max(values)
+            stats[lane]["avg_wait_sec"] = sum(values) / len(values)
+    return stats
+
+
+def claim_job(supabase, job: Dict[str, Any], worker_id: str, lease_sec: float, use_lease: bool = True) -> bool:
+    """Nhận job nếu nó vẫn pending (compare-and-set). True nếu worker này thắng."""
+    payload: Dict[str, Any] = {"status": "running", "started_at": _now().isoformat()}
+    if use_lease:
+        payload.update({
+            "claimed_by": worker_id,
+            "lease_expires_at": _lease_until(lease_sec),
+            "attempts": int(job.get("attempts") or 0) + 1,
+        })
+    r = supabase.table("background_jobs").update(payload).eq("id", job["id"]).eq("status", "pending").execute()
+    return bool(r.data)
+
+
+def renew_leases(supabase, job_ids: List[str], worker_id: str, lease_sec: float) -> None:
+    if not job_ids:
+        return
+    supabase.table("background_jobs").update({"lease_expires_at": _lease_until(lease_sec)}).in_(
+        "id", list(job_ids)
+    ).eq("claimed_by", worker_id).eq("status", "running").execute()
+
+
+def release_lease(supabase, job_id: str, worker_id: str) -> None:
+    """Chạy xong: bỏ lease để job (dù worker quên cập nhật status) không bị đưa lại hàng đợi."""
+    supabase.table("background_jobs").update({"lease_expires_at": None}).eq("id", job_id).eq(
+        "claimed_by", worker_id
+    ).execute()
+
+
+class JobWorkerPool:
+    """
+    Dispatcher + ThreadPoolExecutor: nhận job pending theo lane / fair share (order_candidates) trong giới hạn,
+    chạy run_fn(job_id) song song.
+    run_until_idle() trả về khi không còn job pending nhận được và mọi job của process này đã xong.
+    """
+
+    def __init__(
+        self,
+        run_fn: Callable[[str], None],
+        supabase,
+        worker_id: str = WORKER_ID,
+        poll_sec: Optional[float] = None,
+        wake: Optional[threading.Event] = None,
+    ):
+        self.run_fn = run_fn
+        self.supabase = supabase
+        self.worker_id = worker_id
+        self.poll_sec = float(poll_sec if poll_sec is not None else _cfg("JOB_QUEUE_POLL_SEC", 2.0))
+        self.lease_sec = float(_cfg("JOB_LEASE_SEC", 300))
+        self.use_lease = True
+        self.use_priority = True
+        # Tín hiệu có job mới (core/job_runner): cắt ngắn lượt chờ poll_sec.
+        self.wake = wake or threading.Event()
+        self._active: Dict[str, Tuple[Future, Dict[str, Any]]] = {}
+        self._last_renew = 0.0
+
+    def _disable_lease(self, err: Exception) -> None:
+        if self.use_lease:
+            logger.warning("job_queue: không dùng được cột lease (chưa chạy migration V11?): %s", err)
+        self.use_lease = False
+
+    def _disable_priority(self, err: Exception) -> None:
+        if self.use_priority:
+            logger.warning("job_queue: không dùng được cột priority (chưa chạy migration V16?), lane theo job_type: %s", err)
+        self.use_priority = False
+
+    def _counts(self) -> Tuple[Counter, Counter, Counter, Counter]:
+        """(theo project, theo loại, theo user) toàn hệ thống nếu có lease; theo lane luôn tính trong process."""
+        by_project: Counter = Counter()
+        by_type: Counter = Counter()
+        by_user: Counter = Counter()
+        if self.use_lease:
+            try:
+                by_project, by_type, by_user = running_counts(self.supabase)
+            except Exception as e:
+                self._disable_lease(e)
+        by_lane: Counter = Counter()
+        for _fut, job in self._active.values():
+            by_lane[job_lane(job)] += 1
+            if not self.use_lease:
+                by_project[str(job.get("story_id") or "")] += 1
+                by_type[(job.get("job_type") or "").strip()] += 1
+                by_user[str(job.get("user_id") or "")] += 1
+        return by_project, by_type, by_user, by_lane
+
+    def _select_pending(self, cols: str, lanes: Optional[Tuple[str, ...]] = None) -> List[Dict[str, Any]]:
+        q = self.supabase.table("background_jobs").select(cols).eq("status", "pending")
+        if lanes:
+            q = q.in_("priority", list(lanes))
+        return list(q.order("created_at").limit(_CANDIDATE_WINDOW).execute().data or [])
+
+    def _pending_candidates(self) -> List[Dict[str, Any]]:
+        """Cửa sổ job pending cũ nhất + cửa sổ job lane interactive / normal cũ nhất (để job ưu tiên không bị khuất sau bulk)."""
+        cols = "id, story_id, user_id, job_type, created_at"
+        cols += (", attempts" if self.use_lease else "") + (", priority" if self.use_priority else "")
+        try:
+            rows = self._select_pending(cols)
+            if self.use_priority:
+                seen = {r.get("id") for r in rows}
+                rows += [r for r in self._select_pending(cols, LANES[:-1]) if r.get("id") not in seen]
+        except Exception as e:
+            if self.use_priority:
+                self._disable_priority(e)
+            elif self.use_lease:
+                self._disable_lease(e)
+            else:
+                raise
+            return self._pending_candidates()
+        return rows
+
+    def claim_next(self) -> Tuple[Optional[Dict[str, Any]], int]:
+        """(job vừa nhận hoặc None, số job pending thấy được)."""
+        candidates = self._pending_candidates()
+        if not candidates:
+            return None, 0
+        by_project, by_type, by_user, by_lane = self._counts()
+        ordered = order_candidates(candidates, by_user, by_project)
+        for job in pick_claimable(ordered, by_project, by_type, job_limits(), by_user, by_lane):
+            try:
+                won = claim_job(self.supabase, job, self.worker_id, self.lease_sec, use_lease=self.use_lease)
+            except Exception as e:
+                if not self.use_lease:
+                    raise
+                self._disable_lease(e)
+                won = claim_job(self.supabase, job, self.worker_id, self.lease_sec, use_lease=False)
+            if won:
+                return job, len(candidates)
+        return None, len(candidates)
+
+    def _run_one(self, job_id: str) -> None:
+        try:
+            self.run_fn(job_id)
+        except Exception as e:
+            logger.warning("job_queue: run_fn(%s) lỗi: %s", job_id, e)
+        finally:
+            if self.use_lease:
+                try:
+                    release_lease(self.supabase, job_id, self.worker_id)
+                except Exception:
+                    pass
+
+    def _housekeeping(self) -> None:
+        """Dọn future đã xong, gia hạn lease job đang chạy, đưa lại hàng đợi job có lease hết hạn."""
+        for job_id in [jid for jid, (fut, _job) in self._active.items() if fut.done()]:
+            self._active.pop(job_id, None)
+        if not self.use_lease or time.time() - self._last_renew < self.lease_sec / 3:
+            return
+        self._last_renew = time.time()
+        try:
+            renew_leases(self.supabase, list(self._active.keys()), self.worker_id, self.lease_sec)
+            requeue_expired_leases(self.supabase)
+        except Exception as e:
+            logger.warning("job_queue: gia hạn / requeue lease lỗi: %s", e)
+
+    def run_until_idle(self) -> None:
+        max_workers = job_limits()["max_workers"]
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bg-job") as executor:
+            while True:
+                self._housekeeping()
+                pending = 0
+                if len(self._active) < max_workers:
+                    try:
+                        job, pending = self.claim_next()
+                    except Exception as e:
+                        logger.warning("job_queue: lấy job pending lỗi: %s", e)
+                        job, pending = None, 0
+                    if job:
+                        job_id = str(job["id"])
+                        self._active[job_id] = (executor.submit(self._run_one, job_id), job)
+                        continue
+                else:
+                    pending = 1
+                if not pending and not self._active:
+                    break
+                self.wake.wait(self.poll_sec)
+                self.wake.clear()
@@ -0,0 +1,205 @@
+# core/job_runner.py - Runner hàng đợi background_jobs chạy thường trực (python -m core.job_runner), đánh thức theo sự kiện
+"""
+Process riêng xử lý background_jobs, không phụ thuộc phiên Streamlit còn sống:
+
+- Chờ tín hiệu "có job mới" từ:
+  1) UDP localhost (Config.JOB_RUNNER_WAKE_HOST / JOB_RUNNER_WAKE_PORT): create_job / ensure_background_job_runner
+     gọi notify_job_runner() → gửi một datagram, không chặn, mất gói cũng không sao.
+  2) Postgres LISTEN trên kênh JOB_WAKE_CHANNEL (trigger V17 gọi pg_notify khi INSERT job pending) nếu có
+     Config.JOB_RUNNER_DATABASE_URL và cài psycopg2 — đánh thức được cả khi job tạo từ máy khác.
+  3) Polling fallback mỗi Config.JOB_RUNNER_FALLBACK_POLL_SEC giây (job mồ côi, lease hết hạn, mất tín hiệu).
+- Mỗi lần thức: JobWorkerPool (core/job_queue.py) nhận và chạy job cho tới khi hết job nhận được.
+  Tín hiệu đến trong lúc pool đang chạy cắt ngắn lượt chờ của pool → job mới bắt đầu gần như ngay.
+- Chạy song song với thread trong Streamlit vẫn an toàn (nhận job bằng lease). Đặt Config.JOB_RUNNER_EXTERNAL = True
+  để Streamlit chỉ gửi tín hiệu, không tự chạy thread hàng đợi.
+
+Chạy: python -m core.job_runner [--once] [--poll-sec N]
+"""
+import argparse
+import logging
+import select
+import signal
+import socket
+import threading
+import time
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Kênh Postgres NOTIFY (khớp trigger trong schema_v17_migration.sql).
+JOB_WAKE_CHANNEL = "background_jobs_wake"
+_WAKE_MESSAGE = b"wake"
+
+
+def _cfg(name: str, default: Any) -> Any:
+    try:
+        from config import Config
+
+        return getattr(Config, name, default)
+    except Exception:
+        return default
+
+
+def _wake_addr() -> Optional[tuple]:
+    port = int(_cfg("JOB_RUNNER_WAKE_PORT", 0) or 0)
+    if port <= 0:
+        return None
+    return str(_cfg("JOB_RUNNER_WAKE_HOST", "127.0.0.1")), port
+
+
+def notify_job_runner() -> None:
+    """Gửi tín hiệu đánh thức tới runner trên cùng máy (UDP, fire-and-forget). Không có runner → bỏ qua."""
+    addr = _wake_addr()
+    if not addr:
+        return
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(_WAKE_MESSAGE, addr)
+    except OSError:
+        pass
+
+
+class JobRunner:
+    """Vòng lặp thường trực: chờ tín hiệu (UDP / Postgres NOTIFY / timeout) → chạy pool tới khi rảnh → chờ tiếp."""
+
+    def __init__(self, supabase, run_fn=None, fallback_poll_sec: Optional[float] = None, database_url: Optional[str] = None):
+        from core.job_queue import JobWorkerPool
+
+        if run_fn is None:
+            from core.background_jobs import run_job_worker as run_fn
+        self.supabase = supabase
+        self.fallback_poll_sec = float(
+            fallback_poll_sec if fallback_poll_sec is not None else _cfg("JOB_RUNNER_FALLBACK_POLL_SEC", 30.0)
+        )
+        self.database_url = database_url if database_url is not None else _cfg("JOB_RUNNER_DATABASE_URL", "")
+        self.wake = threading.Event()
+        self.stop = threading.Event()
+        self.pool = JobWorkerPool(run_fn, supabase, wake=self.wake)
+        self._sock: Optional[socket.socket] = None
+        self._threads = []
+
+    def request_stop(self, *_args) -> None:
+        self.stop.set()
+        self.wake.set()
+
+    def _start_listeners(self) -> None:
+        addr = _wake_addr()
+        if addr:
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.bind(addr)
+                self._sock = sock
+                self._spawn(self._listen_udp, "job-runner-udp")
+                logger.info("job_runner: nghe tín hiệu UDP %s:%s", *addr)
+            except OSError as e:
+                logger.warning("job_runner: không mở được UDP %s:%s (%s), dùng polling", addr[0], addr[1], e)
+        if self.database_url:
+            self._spawn(self._listen_postgres, "job-runner-pg")
+
+    def _spawn(self, target, name: str) -> None:
+        t = threading.Thread(target=target, name=name, daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def _listen_udp(self) -> None:
+        sock = self._sock
+        sock.settimeout(1.0)
+        while not self.stop.is_set():
+            try:
+                sock.recvfrom(64)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.wake.set()
+
+    def _listen_postgres(self) -> None:
+        """LISTEN JOB_WAKE_CHANNEL; mất kết nối → thử lại sau tối đa 60s. Không có psycopg2 → chỉ UDP + polling."""
+        try:
+            import psycopg2
+            import psycopg2.extensions
+        except ImportError:
+            logger.warning("job_runner: chưa cài psycopg2, bỏ qua Postgres LISTEN (dùng UDP + polling)")
+            return
+        backoff = 1.0
+        while not self.stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.database_url)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute(f"LISTEN {JOB_WAKE_CHANNEL};")
+                logger.info("job_runner: LISTEN %s", JOB_WAKE_CHANNEL)
+                backoff = 1.0
+                # Có thể đã lỡ tín hiệu lúc mất kết nối → quét hàng đợi một lượt.
+                self.wake.set()
+                while not self.stop.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        del conn.notifies[:]
+                        self.wake.set()
+            except Exception as e:
+                logger.warning("job_runner: Postgres LISTEN lỗi (%s), thử lại sau %.0fs", e, backoff)
+                self.stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def drain(self) -> None:
+        """Chạy pool tới khi không còn job nhận được. Xóa cờ wake trước để không lỡ tín hiệu đến trong lúc chạy."""
+        from core.background_jobs import expire_stale_pending_jobs
+
+        self.wake.clear()
+        expire_stale_pending_jobs(self.supabase)
+        try:
+            self.pool.run_until_idle()
+        except Exception as e:
+            logger.warning("job_runner: worker pool lỗi: %s", e)
+
+    def run_forever(self) -> None:
+        self._start_listeners()
+        try:
+            while not self.stop.is_set():
+                self.drain()
+                if self.stop.is_set():
+                    break
+                self.wake.wait(self.fallback_poll_sec)
+        finally:
+            self.stop.set()
+            if self._sock is not None:
+                self._sock.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m core.job_runner", description="Runner hàng đợi background_jobs.")
+    parser.add_argument("--once", action="store_true", help="Chạy hết job pending rồi thoát.")
+    parser.add_argument("--poll-sec", type=float, default=None, help="Chu kỳ polling fallback (giây).")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    from config import init_services
+
+    services = init_services()
+    if not services:
+        logger.error("job_runner: không kết nối được Supabase")
+        return 1
+    runner = JobRunner(services["supabase"], fallback_poll_sec=args.poll_sec)
+    if args.once:
+        runner.drain()
+        return 0
+    signal.signal(signal.SIGTERM, runner.request_stop)
+    signal.signal(signal.SIGINT, runner.request_stop)
+    logger.info("job_runner: bắt đầu (polling fallback %.0fs)", runner.fallback_poll_sec)
+    started = time.monotonic()
+    runner.run_forever()
+    logger.info("job_runner: dừng sau %.0fs", time.monotonic() - started)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
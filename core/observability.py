@@ -11,8 +11,15 @@ def log_chat_turn(
     context_tokens: Optional[int] = None,
     llm_calls_count: Optional[int] = None,
     verification_used: bool = False,
+    query_text: Optional[str] = None,
+    router_intent: Optional[str] = None,
+    intent_source: Optional[str] = None,
 ) -> None:
-    """Ghi một dòng vào chat_turn_logs. Bỏ qua khi không có supabase hoặc bảng chưa có."""
+    """
+    Ghi một dòng vào chat_turn_logs. Bỏ qua khi không có supabase hoặc bảng chưa có.
+    query_text / router_intent / intent_source (V19): câu user, intent bước 1 và nguồn (llm | local) — dữ liệu huấn luyện
+    bộ phân loại intent cục bộ (ai/intent_classifier.py).
+    """
     try:
         from config import init_services
         services = init_services()
@@ -28,6 +35,18 @@ def log_chat_turn(
             "llm_calls_count": llm_calls_count,
             "verification_used": verification_used,
         }
-        supabase.table("chat_turn_logs").insert(row).execute()
+        extra = {
+            "query_text": (query_text or "")[:1000] or None,
+            "router_intent": router_intent,
+            "intent_source": intent_source,
+        }
+        extra = {k: v for k, v in extra.items() if v is not None}
+        try:
+            supabase.table("chat_turn_logs").insert({**row, **extra}).execute()
+        except Exception:
+            if not extra:
+                raise
+            # Chưa chạy migration V19 → ghi các cột cũ.
+            supabase.table("chat_turn_logs").insert(row).execute()
     except Exception as e:
         print(f"log_chat_turn error: {e}")
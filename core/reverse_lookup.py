@@ -49,16 +49,132 @@ class ReverseLookupAssembler:
             return None
 
     @staticmethod
-    def assemble_single(chunk_id: str) -> str:
+    def get_chunks_with_parents_bulk(chunk_ids: List[str]) -> Dict[str, Dict[str, Any]]:
         """
-        Build one block of context for a chunk in strict order:
-        [MACRO CONTEXT - ARC] -> [MESO CONTEXT - CHAPTER] -> [MICRO EVIDENCE - CHUNK].
-        V8.x: MICRO EVIDENCE dùng "window" các chunk lân cận trong cùng chương
-        (vd. chunk trước và sau) để LLM có đủ ngữ cảnh đoạn, không phải 1 chunk lẻ.
+        Bản bulk của get_chunk_with_parents: 1 query chunks + 1 query chapters + 1 query arcs cho cả danh sách.
+        Returns {chunk_id: {chunk, chapter, arc}} (chunk không tồn tại thì không có key). Lỗi query → raise để caller fallback.
         """
-        data = ReverseLookupAssembler.get_chunk_with_parents(chunk_id)
-        if not data:
-            return ""
+        supabase = ReverseLookupAssembler._supabase()
+        ids = [str(cid) for cid in chunk_ids if cid]
+        if not supabase or not ids:
+            return {}
+        r = supabase.table("chunks").select("*").in_("id", ids).execute()
+        chunks = {str(c.get("id")): c for c in (r.data or [])}
+        chapter_ids = sorted({str(c["chapter_id"]) for c in chunks.values() if c.get("chapter_id")})
+        chapters: Dict[str, Dict[str, Any]] = {}
+        if chapter_ids:
+            cr = supabase.table("chapters").select("*").in_("id", chapter_ids).execute()
+            chapters = {str(ch.get("id")): ch for ch in (cr.data or [])}
+        out: Dict[str, Dict[str, Any]] = {}
+        arc_of: Dict[str, Any] = {}
+        for cid, chunk in chunks.items():
+            chapter = chapters.get(str(chunk["chapter_id"])) if chunk.get("chapter_id") else None
+            arc_id = chunk.get("arc_id")
+            if not arc_id and chapter and chapter.get("arc_id"):
+                arc_id = chapter["arc_id"]
+            arc_of[cid] = arc_id
+            out[cid] = {"chunk": chunk, "chapter": chapter, "arc": None}
+        arc_ids = sorted({str(a) for a in arc_of.values() if a})
+        if arc_ids:
+            ar = supabase.table("arcs").select("*").in_("id", arc_ids).execute()
+            arcs = {str(a.get("id")): a for a in (ar.data or [])}
+            for cid, arc_id in arc_of.items():
+                if arc_id:
+                    out[cid]["arc"] = arcs.get(str(arc_id))
+        return out
+
+    # Số chunk lân cận mỗi phía quanh chunk chính trong MICRO EVIDENCE.
+    NEIGHBOR_WINDOW = 1
+
+    @staticmethod
+    def _neighbor_key(data: Dict[str, Any]) -> Optional[Tuple[str, str, int]]:
+        """(story_id, chapter_id, sort_order) để lấy window lân cận; None nếu chunk không đủ thông tin."""
+        chunk = data["chunk"]
+        chapter = data["chapter"]
+        if not chapter or chunk.get("sort_order") is None:
+            return None
+        story_id = chunk.get("story_id")
+        chapter_id = chapter.get("id") or chunk.get("chapter_id")
+        if not story_id or not chapter_id:
+            return None
+        return str(story_id), str(chapter_id), int(chunk.get("sort_order") or 0)
+
+    # Số khoảng (chương, sort_order) mỗi query or_ (giữ URL ngắn); mỗi query đọc theo trang (dưới max-rows của PostgREST).
+    NEIGHBOR_RANGES_PER_QUERY = 50
+    NEIGHBOR_PAGE_SIZE = 500
+
+    @staticmethod
+    def _neighbor_ranges(keys: List[Tuple[str, str, int]]) -> List[Tuple[str, str, int, int]]:
+        """Gộp window của các chunk cùng chương thành các khoảng sort_order rời nhau: [(story_id, chapter_id, lo, hi)]."""
+        w = ReverseLookupAssembler.NEIGHBOR_WINDOW
+        by_chapter: Dict[Tuple[str, str], List[int]] = {}
+        for story_id, chapter_id, sort_val in keys:
+            by_chapter.setdefault((story_id, chapter_id), []).append(sort_val)
+        ranges = []
+        for (story_id, chapter_id), values in sorted(by_chapter.items()):
+            lo = hi = None
+            for v in sorted(set(values)):
+                if hi is not None and v - w <= hi + 1:
+                    hi = v + w
+                    continue
+                if lo is not None:
+                    ranges.append((story_id, chapter_id, lo, hi))
+                lo, hi = v - w, v + w
+            ranges.append((story_id, chapter_id, lo, hi))
+        return ranges
+
+    @staticmethod
+    def _fetch_neighbor_windows(keys: List[Tuple[str, str, int]]) -> Dict[Tuple[str, str, int], List[Dict[str, Any]]]:
+        """
+        Window lân cận cho nhiều chunk: mỗi query lọc or_ theo khoảng sort_order của từng chương (chỉ đúng các dòng cần)
+        và đọc theo trang, rồi chia lại theo từng chunk (sắp theo sort_order). Lỗi query → raise để caller fallback.
+        """
+        supabase = ReverseLookupAssembler._supabase()
+        if not supabase or not keys:
+            return {}
+        w = ReverseLookupAssembler.NEIGHBOR_WINDOW
+        ranges = ReverseLookupAssembler._neighbor_ranges(keys)
+        step = ReverseLookupAssembler.NEIGHBOR_RANGES_PER_QUERY
+        page = ReverseLookupAssembler.NEIGHBOR_PAGE_SIZE
+        by_chapter: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for i in range(0, len(ranges), step):
+            part = ranges[i : i + step]
+            cond = ",".join(
+                f"and(chapter_id.eq.{chapter_id},sort_order.gte.{lo},sort_order.lte.{hi})"
+                for _story, chapter_id, lo, hi in part
+            )
+            start = 0
+            while True:
+                r = (
+                    supabase.table("chunks")
+                    .select("id, story_id, chapter_id, content, raw_content, meta_json, sort_order")
+                    .in_("story_id", sorted({story for story, _c, _lo, _hi in part}))
+                    .or_(cond)
+                    .order("chapter_id")
+                    .order("sort_order")
+                    .order("id")
+                    .range(start, start + page - 1)
+                    .execute()
+                )
+                batch = list(r.data or [])
+                for row in batch:
+                    by_chapter.setdefault((str(row.get("story_id")), str(row.get("chapter_id"))), []).append(row)
+                if len(batch) < page:
+                    break
+                start += page
+        out = {}
+        for key in keys:
+            story_id, chapter_id, sort_val = key
+            rows = [
+                row for row in by_chapter.get((story_id, chapter_id), [])
+                if row.get("sort_order") is not None and sort_val - w <= int(row["sort_order"]) <= sort_val + w
+            ]
+            out[key] = sorted(rows, key=lambda row: int(row["sort_order"]))
+        return out
+
+    @staticmethod
+    def _format_block(data: Dict[str, Any], neighbor_chunks: List[Dict[str, Any]]) -> str:
+        """Ghép block [MACRO - ARC] -> [MESO - CHAPTER] -> [MICRO - window chunk] từ dữ liệu đã tải."""
         chunk = data["chunk"]
         chapter = data["chapter"]
         arc = data["arc"]
@@ -76,29 +192,6 @@ class ReverseLookupAssembler:
                     (chapter.get("summary") or "").strip() or "(none)",
                 )
             )
-        # MICRO: thay vì chỉ 1 chunk lẻ, lấy window các chunk lân cận trong cùng chương (ví dụ chunk trước/sau).
-        supabase = ReverseLookupAssembler._supabase()
-        neighbor_window = 1  # ±1 chunk quanh chunk chính
-        neighbor_chunks: List[Dict[str, Any]] = []
-        try:
-            if supabase and chapter and chunk.get("sort_order") is not None:
-                story_id = chunk.get("story_id")
-                chapter_id = chapter.get("id") or chunk.get("chapter_id")
-                if story_id and chapter_id:
-                    sort_val = int(chunk.get("sort_order") or 0)
-                    r = (
-                        supabase.table("chunks")
-                        .select("id, content, raw_content, meta_json, sort_order")
-                        .eq("story_id", story_id)
-                        .eq("chapter_id", chapter_id)
-                        .gte("sort_order", sort_val - neighbor_window)
-                        .lte("sort_order", sort_val + neighbor_window)
-                        .order("sort_order")
-                        .execute()
-                    )
-                    neighbor_chunks = list(r.data or [])
-        except Exception:
-            neighbor_chunks = []
         if not neighbor_chunks:
             neighbor_chunks = [chunk]
 
@@ -134,6 +227,79 @@ class ReverseLookupAssembler:
         parts.append("\n\n".join(micro_blocks))
         return "\n\n".join(parts)
 
+    @staticmethod
+    def _source_label(data: Optional[Dict[str, Any]], cid: str) -> Optional[str]:
+        if not data or not data.get("chunk"):
+            return None
+        meta = (data["chunk"].get("meta_json") or {}) or {}
+        sm = meta.get("source_metadata", meta) if isinstance(meta, dict) else {}
+        label = sm.get("sheet_name", "") or sm.get("source_file", "") or cid[:8]
+        return "Chunk %s" % label
+
+    @staticmethod
+    def assemble_single(chunk_id: str) -> str:
+        """
+        Build one block of context for a chunk in strict order:
+        [MACRO CONTEXT - ARC] -> [MESO CONTEXT - CHAPTER] -> [MICRO EVIDENCE - CHUNK].
+        V8.x: MICRO EVIDENCE dùng "window" các chunk lân cận trong cùng chương
+        (vd. chunk trước và sau) để LLM có đủ ngữ cảnh đoạn, không phải 1 chunk lẻ.
+        """
+        data = ReverseLookupAssembler.get_chunk_with_parents(chunk_id)
+        if not data:
+            return ""
+        # MICRO: thay vì chỉ 1 chunk lẻ, lấy window các chunk lân cận trong cùng chương (ví dụ chunk trước/sau).
+        supabase = ReverseLookupAssembler._supabase()
+        neighbor_window = ReverseLookupAssembler.NEIGHBOR_WINDOW  # ±1 chunk quanh chunk chính
+        neighbor_chunks: List[Dict[str, Any]] = []
+        try:
+            key = ReverseLookupAssembler._neighbor_key(data)
+            if supabase and key:
+                story_id, chapter_id, sort_val = key
+                r = (
+                    supabase.table("chunks")
+                    .select("id, content, raw_content, meta_json, sort_order")
+                    .eq("story_id", story_id)
+                    .eq("chapter_id", chapter_id)
+                    .gte("sort_order", sort_val - neighbor_window)
+                    .lte("sort_order", sort_val + neighbor_window)
+                    .order("sort_order")
+                    .execute()
+                )
+                neighbor_chunks = list(r.data or [])
+        except Exception:
+            neighbor_chunks = []
+        return ReverseLookupAssembler._format_block(data, neighbor_chunks)
+
+    @staticmethod
+    def _assemble_blocks_bulk(chunk_ids: List[str]) -> List[Tuple[str, str, Optional[str]]]:
+        """[(chunk_id, block, source_label)] theo đúng thứ tự chunk_ids, tải dữ liệu bằng vài query in_ thay vì N+1."""
+        parents = ReverseLookupAssembler.get_chunks_with_parents_bulk(chunk_ids)
+        keys = {cid: ReverseLookupAssembler._neighbor_key(d) for cid, d in parents.items()}
+        try:
+            windows = ReverseLookupAssembler._fetch_neighbor_windows(sorted({k for k in keys.values() if k}))
+        except Exception:
+            windows = {}
+        out = []
+        for cid in chunk_ids:
+            data = parents.get(cid)
+            if not data:
+                continue
+            block = ReverseLookupAssembler._format_block(data, windows.get(keys[cid]) or [])
+            out.append((cid, block, ReverseLookupAssembler._source_label(data, cid)))
+        return out
+
+    @staticmethod
+    def _assemble_blocks_per_chunk(chunk_ids: List[str]) -> List[Tuple[str, str, Optional[str]]]:
+        """Đường cũ (từng chunk một): dùng khi query bulk lỗi."""
+        out = []
+        for cid in chunk_ids:
+            block = ReverseLookupAssembler.assemble_single(cid)
+            if not block:
+                continue
+            label = ReverseLookupAssembler._source_label(ReverseLookupAssembler.get_chunk_with_parents(cid), cid)
+            out.append((cid, block, label))
+        return out
+
     @staticmethod
     def assemble_from_chunks(chunk_ids: List[str], token_limit: int = 0) -> Tuple[str, List[str]]:
         """
@@ -152,24 +318,23 @@ class ReverseLookupAssembler:
                 deduped_ids.append(cid_str)
         chunk_ids = deduped_ids
 
+        try:
+            assembled = ReverseLookupAssembler._assemble_blocks_bulk(chunk_ids)
+        except Exception as e:
+            print(f"ReverseLookupAssembler bulk error, fallback per chunk: {e}")
+            assembled = ReverseLookupAssembler._assemble_blocks_per_chunk(chunk_ids)
+
         total_tokens = 0
         blocks = []
         sources = []
-        for cid in chunk_ids:
-            block = ReverseLookupAssembler.assemble_single(cid)
-            if not block:
-                continue
+        for cid, block, label in assembled:
             t = AIService.estimate_tokens(block)
             if token_limit > 0 and total_tokens + t > token_limit:
                 continue
             total_tokens += t
             blocks.append(block)
-            data = ReverseLookupAssembler.get_chunk_with_parents(cid)
-            if data and data.get("chunk"):
-                meta = (data["chunk"].get("meta_json") or {}) or {}
-                sm = meta.get("source_metadata", meta) if isinstance(meta, dict) else {}
-                label = sm.get("sheet_name", "") or sm.get("source_file", "") or cid[:8]
-                sources.append("Chunk %s" % label)
+            if label:
+                sources.append(label)
         return "\n\n---\n\n".join(blocks), sources
 
     @staticmethod
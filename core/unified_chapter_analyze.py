@@ -2,6 +2,8 @@
 """Chạy unified extract cho một chương: 1 LLM call → bible, timeline, chunks (kèm metadata: summary + entities), relations + link tables. Ghi unified_extract_runs và source_chunk_id (Bible, Timeline). Embedding được xử lý riêng bằng backfill."""
 import json
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional, Tuple
 
 from core.user_data_save_pipeline import (
@@ -122,6 +124,7 @@ Nếu không có: mảng rỗng []. Chỉ trả về JSON, không giải thích.
             temperature=0.15,
             max_tokens=20000,
             response_format={"type": "json_object"},
+            cache_site="unified_extract",
         )
         raw = (resp.choices[0].message.content or "").strip()
         raw = re.sub(r"^```\w*\n?", "", raw).strip()
@@ -144,6 +147,52 @@ def _step_with_retry(fn, max_retries: int = 2) -> Tuple[bool, Optional[str]]:
     return False, last_err
 
 
+def _mark_vector_rows_deleted(deleted_ids: Dict[str, List[Any]]) -> None:
+    try:
+        from ai.vector_index import mark_vector_rows_dirty
+
+        for table, ids in deleted_ids.items():
+            mark_vector_rows_dirty(table, ids)
+    except Exception as e:
+        print(f"unified_chapter_analyze: mark_vector_rows_dirty error: {e}")
+
+
+def _load_chapter_for_unified(supabase, project_id: str, chapter_number: int) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Đọc chương (id, content, title, arc_id) và kiểm tra nội dung. Trả về (chapter, None) hoặc (None, lỗi)."""
+    ch_row = supabase.table("chapters").select("id, content, title, arc_id").eq(
+        "story_id", project_id
+    ).eq("chapter_number", chapter_number).limit(1).execute()
+    if not ch_row.data or len(ch_row.data) == 0:
+        return None, f"Không tìm thấy chương {chapter_number}."
+    chapter = ch_row.data[0]
+    content = (chapter.get("content") or "").strip()
+    if not content:
+        return None, "Chương không có nội dung."
+    if len(content) > UNIFIED_MAX_CONTENT_CHARS:
+        return None, f"Nội dung chương vượt {UNIFIED_MAX_CONTENT_CHARS} ký tự. Cắt bớt hoặc dùng Data Analyze từng bước."
+    return chapter, None
+
+
+def _extract_and_store(chapter: Dict[str, Any], chapter_number: int, job_id: Optional[str]) -> Dict[str, Any]:
+    """1 LLM call cho chương; có job_id thì lưu kết quả vào job_llm_results (để retry không gọi lại LLM). Lỗi → raise."""
+    from core.job_llm_store import save_llm_result
+
+    content = (chapter.get("content") or "").strip()
+    chapter_label = (chapter.get("title") or "").strip() or f"Chương {chapter_number}"
+    data, raw_llm = _llm_unified_extract(content, chapter_label, _get_persona())
+    if job_id:
+        save_llm_result(
+            job_id,
+            "unified",
+            str(chapter_number),
+            data,
+            llm_raw_response=raw_llm,
+            input_snapshot={"chapter_number": chapter_number, "content_length": len(content)},
+            status="success",
+        )
+    return data
+
+
 def run_unified_chapter_analyze(
     project_id: str,
     chapter_number: int,
@@ -158,7 +207,7 @@ def run_unified_chapter_analyze(
     Returns: {"success": bool, "error": str|None, "steps": {...}, "counts": {...}}
     """
     from config import Config
-    from core.job_llm_store import save_llm_result, mark_failed
+    from core.job_llm_store import mark_failed
     result = {
         "success": False,
         "error": None,
@@ -171,48 +220,25 @@ def run_unified_chapter_analyze(
         return result
 
     # Load chapter
-    ch_row = supabase.table("chapters").select("id, content, title, arc_id").eq(
-        "story_id", project_id
-    ).eq("chapter_number", chapter_number).limit(1).execute()
-    if not ch_row.data or len(ch_row.data) == 0:
-        result["error"] = f"Không tìm thấy chương {chapter_number}."
+    chapter, load_err = _load_chapter_for_unified(supabase, project_id, chapter_number)
+    if load_err:
+        result["error"] = load_err
         return result
-    chapter = ch_row.data[0]
     chapter_id = chapter.get("id")
     content = (chapter.get("content") or "").strip()
-    chapter_label = (chapter.get("title") or "").strip() or f"Chương {chapter_number}"
     arc_id = chapter.get("arc_id")
 
-    if not content:
-        result["error"] = "Chương không có nội dung."
-        return result
-
-    if len(content) > UNIFIED_MAX_CONTENT_CHARS:
-        result["error"] = f"Nội dung chương vượt {UNIFIED_MAX_CONTENT_CHARS} ký tự. Cắt bớt hoặc dùng Data Analyze từng bước."
-        return result
-
     # 1) LLM call hoặc dùng stored_data (retry)
     if stored_data is not None:
         data = stored_data
     else:
-        persona = _get_persona()
         try:
-            data, raw_llm = _llm_unified_extract(content, chapter_label, persona)
+            data = _extract_and_store(chapter, chapter_number, job_id)
         except Exception as e:
             result["error"] = str(e)
             if job_id and update_job_fn:
                 update_job_fn(job_id, "failed", result_summary="Unified extract thất bại.", error_message=result["error"])
             return result
-        if job_id:
-            save_llm_result(
-                job_id,
-                "unified",
-                str(chapter_number),
-                data,
-                llm_raw_response=raw_llm,
-                input_snapshot={"chapter_number": chapter_number, "content_length": len(content)},
-                status="success",
-            )
 
     bible_items = data.get("bible") or []
     timeline_items = data.get("timeline") or []
@@ -267,16 +293,25 @@ def run_unified_chapter_analyze(
                 pass
 
     # Delete existing data for this chapter (bulk: ít round-trip)
+    # Id đã xóa có embedding (quan hệ, timeline, chunk) → báo index vector gỡ ngay, không đợi lần search hụt payload.
+    deleted_ids: Dict[str, List[Any]] = {"entity_relations": [], "timeline_events": [], "chunks": []}
+
+    def _track(table: str, response) -> None:
+        deleted_ids[table].extend(row.get("id") for row in (getattr(response, "data", None) or []) if row.get("id"))
+
     try:
         r = supabase.table("story_bible").select("id").eq("story_id", project_id).eq("source_chapter", chapter_number).execute()
         entity_ids_chapter = [row["id"] for row in (r.data or []) if row.get("id")]
         if entity_ids_chapter:
             for i in range(0, len(entity_ids_chapter), BATCH_DELETE_IDS):
                 batch = entity_ids_chapter[i : i + BATCH_DELETE_IDS]
-                supabase.table("entity_relations").delete().in_("source_entity_id", batch).execute()
-                supabase.table("entity_relations").delete().in_("target_entity_id", batch).execute()
+                _track("entity_relations", supabase.table("entity_relations").delete().in_("source_entity_id", batch).execute())
+                _track("entity_relations", supabase.table("entity_relations").delete().in_("target_entity_id", batch).execute())
         supabase.table("story_bible").delete().eq("story_id", project_id).eq("source_chapter", chapter_number).execute()
-        supabase.table("timeline_events").delete().eq("story_id", project_id).eq("chapter_id", chapter_id).execute()
+        _track(
+            "timeline_events",
+            supabase.table("timeline_events").delete().eq("story_id", project_id).eq("chapter_id", chapter_id).execute(),
+        )
         r = supabase.table("chunks").select("id").eq("story_id", project_id).eq("chapter_id", chapter_id).execute()
         chunk_ids_old = [row["id"] for row in (r.data or []) if row.get("id")]
         for i in range(0, len(chunk_ids_old), BATCH_DELETE_IDS):
@@ -289,12 +324,14 @@ def run_unified_chapter_analyze(
                 supabase.table("chunk_timeline_links").delete().in_("chunk_id", batch).execute()
             except Exception:
                 pass
-        supabase.table("chunks").delete().eq("story_id", project_id).eq("chapter_id", chapter_id).execute()
+        _track("chunks", supabase.table("chunks").delete().eq("story_id", project_id).eq("chapter_id", chapter_id).execute())
     except Exception as e:
         result["error"] = f"Xóa dữ liệu cũ thất bại: {e}"
         if job_id and update_job_fn:
             update_job_fn(job_id, "failed", result_summary="Unified: xóa dữ liệu cũ lỗi.", error_message=result["error"])
         return result
+    finally:
+        _mark_vector_rows_deleted(deleted_ids)
 
     # Step 2: Save Bible (batch insert, 1 query existing_bible_rows thay vì N)
     bible_ids_by_index: List[Any] = [None] * max(len(bible_items), 1)
@@ -636,6 +673,15 @@ def run_unified_chapter_analyze(
     except Exception:
         pass
 
+    # Step 8: Digest chương (V20) — hash nội dung đã có digest thì bỏ qua
+    if getattr(Config, "CHAPTER_DIGEST_ON_ANALYZE", True):
+        try:
+            from ai.chapter_digest import refresh_chapter_digest
+
+            refresh_chapter_digest(supabase, project_id, chapter_number, content, chapter.get("title") or "")
+        except Exception as e:
+            print(f"unified_chapter_analyze digest error: {e}")
+
     result["success"] = True
     if job_id and update_job_fn:
         summary = f"Bible {result['counts']['bible']}, Timeline {result['counts']['timeline']}, Chunks {result['counts']['chunks']}, Relations {result['counts']['relations']}, Links B/T {result['counts']['link_bible']}/{result['counts']['link_timeline']}"
@@ -643,44 +689,154 @@ def run_unified_chapter_analyze(
     return result
 
 
+def _extract_for_range(project_id: str, chapter_number: int, job_id: Optional[str]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Giai đoạn extract của pipeline: đọc chương + LLM + lưu job_llm_store. Trả về (data, None) hoặc (None, lỗi)."""
+    supabase = _get_supabase()
+    if not supabase:
+        return None, "Không kết nối được Supabase."
+    try:
+        chapter, err = _load_chapter_for_unified(supabase, project_id, chapter_number)
+        if err:
+            return None, err
+        return _extract_and_store(chapter, chapter_number, job_id), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _range_resume_state(job_id: Optional[str], start: int, end: int) -> Tuple[set, Dict[int, Dict[str, Any]]]:
+    """
+    (chương đã lưu xong theo checkpoint "unified:N", {chương: kết quả LLM đã lưu} của chương chưa xong).
+    Job mới / không có job_id → (set(), {}).
+    """
+    if not job_id:
+        return set(), {}
+    from core.job_llm_store import get_all_stored_results_for_job, get_checkpoints
+
+    done = set()
+    for key in get_checkpoints(job_id):
+        kind, _, num = key.partition(":")
+        if kind == "unified" and num.lstrip("-").isdigit() and start <= int(num) <= end:
+            done.add(int(num))
+    stored: Dict[int, Dict[str, Any]] = {}
+    for row in get_all_stored_results_for_job(job_id):
+        key = str(row.get("step_key") or "")
+        if row.get("step_type") != "unified" or not key.isdigit() or not isinstance(row.get("parsed_result"), dict):
+            continue
+        ch = int(key)
+        if start <= ch <= end and ch not in done:
+            stored[ch] = row["parsed_result"]
+    return done, stored
+
+
 def run_unified_chapter_range(
     project_id: str,
     chapter_start: int,
     chapter_end: int,
     job_id: Optional[str] = None,
     update_job_fn=None,
+    max_inflight: Optional[int] = None,
 ) -> Dict[str, Any]:
     """
-    Chạy unified analyze tuần tự cho từng chương từ chapter_start đến chapter_end (bao gồm cả hai).
+    Chạy unified analyze cho từng chương từ chapter_start đến chapter_end (bao gồm cả hai).
+    Pipeline (Config.UNIFIED_RANGE_PIPELINE): tối đa max_inflight (mặc định Config.UNIFIED_RANGE_MAX_INFLIGHT) lệnh LLM extract
+    chạy trước trên thread pool; các bước save (xóa cũ, bible, timeline, chunks, relations, links, rollback khi lỗi)
+    vẫn chạy lần lượt theo thứ tự chương trên thread gọi, trong lúc các chương sau đang được extract.
+    max_inflight <= 1 → tuần tự như cũ.
     Không truyền job_id/update_job_fn vào từng chương để tránh ghi đè trạng thái job.
-    Trả về và (nếu có) cập nhật job với result_summary + error_message ghi rõ chương nào lỗi.
-    Returns: {"success": bool, "total": int, "ok": int, "failed": [int], "error_per_chapter": {ch: str}}
+    Trả về và (nếu có) cập nhật job với result_summary (kèm tốc độ chương/phút) + error_message ghi rõ chương nào lỗi.
+    Hủy hợp tác (core/job_progress.py): kiểm tra cancel_requested trước mỗi chương, dừng và ghi status cancelled.
+    Checkpoint (job_llm_store): chương lưu xong ghi "unified:N"; job chạy lại bỏ qua các chương đó và dùng lại
+    kết quả LLM đã lưu của chương extract xong nhưng chưa lưu (không trả tiền LLM lần nữa).
+    Returns: {"success": bool, "total": int, "ok": int, "failed": [int], "error_per_chapter": {ch: str},
+              "elapsed_sec": float, "chapters_per_min": float, "cancelled": bool}
     """
+    from config import Config
+
     start, end = min(chapter_start, chapter_end), max(chapter_start, chapter_end)
     total = max(0, end - start + 1)
     failed_list: List[int] = []
     error_per_chapter: Dict[int, str] = {}
-
-    for ch in range(start, end + 1):
-        out = run_unified_chapter_analyze(
-            project_id, ch,
-            job_id=job_id,
-            update_job_fn=None,
-        )
+    if max_inflight is None:
+        max_inflight = int(getattr(Config, "UNIFIED_RANGE_MAX_INFLIGHT", 3)) if getattr(Config, "UNIFIED_RANGE_PIPELINE", True) else 1
+    max_inflight = max(1, min(int(max_inflight), total or 1))
+    t0 = time.perf_counter()
+
+    from core.job_llm_store import save_checkpoint
+    from core.job_progress import JobProgress
+
+    # Job chạy lại (process chết giữa chừng): bỏ chương đã lưu xong, chương đã extract thì dùng lại kết quả LLM.
+    done_before, stored_extracts = _range_resume_state(job_id, start, end)
+    pending = [ch for ch in range(start, end + 1) if ch not in done_before]
+    progress = JobProgress(job_id, total)
+    progress.advance(len(done_before), message=f"Tiếp tục sau {len(done_before)} chương đã xong" if done_before else None)
+    progress.flush()
+
+    def _record(ch: int, out: Dict[str, Any]) -> None:
         if not out.get("success"):
             failed_list.append(ch)
-            err = (out.get("error") or "Lỗi không xác định")[:500]
-            error_per_chapter[ch] = err
-
-    ok = total - len(failed_list)
-    success = len(failed_list) == 0
+            error_per_chapter[ch] = (out.get("error") or "Lỗi không xác định")[:500]
+        elif job_id:
+            save_checkpoint(job_id, f"unified:{ch}")
+        progress.advance(message=f"Chương {ch}")
+
+    def _extract(ch: int) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        if ch in stored_extracts:
+            return stored_extracts[ch], None
+        return _extract_for_range(project_id, ch, job_id)
+
+    # Hủy: kiểm tra trước mỗi chương; chương đang save vẫn chạy xong (không để dữ liệu nửa vời).
+    done_chapters = len(done_before)
+    if max_inflight <= 1:
+        for ch in pending:
+            if progress.is_cancelled():
+                break
+            _record(ch, run_unified_chapter_analyze(
+                project_id, ch, job_id=job_id, update_job_fn=None, stored_data=stored_extracts.get(ch)
+            ))
+            done_chapters += 1
+    else:
+        with ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="unified-extract") as executor:
+            futures: Dict[int, Any] = {}
+            next_i = 0
+            for i, ch in enumerate(pending):
+                if progress.is_cancelled():
+                    for fut in futures.values():
+                        fut.cancel()
+                    break
+                # Giữ tối đa max_inflight chương (pending[i] .. pending[i+max_inflight-1]) đang/đã extract.
+                while next_i < len(pending) and next_i < i + max_inflight:
+                    futures[pending[next_i]] = executor.submit(_extract, pending[next_i])
+                    next_i += 1
+                data, err = futures.pop(ch).result()
+                done_chapters += 1
+                if err:
+                    _record(ch, {"success": False, "error": err})
+                    continue
+                _record(ch, run_unified_chapter_analyze(project_id, ch, job_id=job_id, update_job_fn=None, stored_data=data))
+
+    cancelled = done_chapters < total
+    ok = done_chapters - len(failed_list)
+    success = len(failed_list) == 0 and not cancelled
+    elapsed = time.perf_counter() - t0
+    chapters_per_min = ((ok - len(done_before)) * 60.0 / elapsed) if elapsed > 0 else 0.0
+    mode = f"pipeline {max_inflight} luồng extract" if max_inflight > 1 else "tuần tự"
+    summary = (
+        f"Đã xong {ok}/{total} chương (chương {start}–{end}). "
+        f"Tốc độ {chapters_per_min:.1f} chương/phút ({elapsed:.0f}s, {mode})."
+    )
+    if done_before:
+        summary += f" Tiếp tục từ checkpoint: bỏ qua {len(done_before)} chương đã lưu."
+    progress.flush()
 
     if job_id and update_job_fn:
-        if success:
-            summary = f"Đã xong {ok}/{total} chương (chương {start}–{end})."
+        if cancelled:
+            error_message = None
+            if failed_list:
+                error_message = "Lỗi: " + "; ".join(f"Chương {ch}: {error_per_chapter.get(ch, '')}" for ch in failed_list)
+            update_job_fn(job_id, "cancelled", result_summary="Đã hủy. " + summary, error_message=error_message)
+        elif success:
             update_job_fn(job_id, "completed", result_summary=summary)
         else:
-            summary = f"Đã xong {ok}/{total} chương (chương {start}–{end})."
             err_parts = [f"Chương {ch}: {error_per_chapter.get(ch, '')}" for ch in failed_list]
             error_message = "Lỗi: " + "; ".join(err_parts)
             update_job_fn(job_id, "failed", result_summary=summary, error_message=error_message)
@@ -691,4 +847,7 @@ def run_unified_chapter_range(
         "ok": ok,
         "failed": failed_list,
         "error_per_chapter": error_per_chapter,
+        "elapsed_sec": round(elapsed, 2),
+        "chapters_per_min": round(chapters_per_min, 2),
+        "cancelled": cancelled,
     }
@@ -149,6 +149,10 @@ def main():
         st.error("Failed to initialize services.")
         st.stop()
 
+    # Job background bị bỏ dở (process trước chết giữa chừng) → đưa lại hàng đợi, chạy tiếp từ checkpoint.
+    from core.background_jobs import resume_orphaned_jobs
+    resume_orphaned_jobs()
+
     project_id, persona = render_sidebar(session_manager)
 
     # Header (tiêu đề căn giữa)
@@ -0,0 +1,107 @@
+# tests/bench_openrouter_client_pool.py
+"""
+Microbenchmark: chi phí mỗi lệnh gọi khi tạo OpenAI client mới mỗi lần (cách cũ) so với client dùng chung
+từ ai.client_pool (keep-alive). Dùng server HTTP cục bộ trả embedding giả nên chỉ đo overhead client + kết nối
+(không có TLS; với OpenRouter thật, mỗi kết nối mới còn tốn thêm TLS handshake).
+
+Chạy (không cần mạng):
+  python -m tests.bench_openrouter_client_pool
+  python -m tests.bench_openrouter_client_pool --calls 500 --threads 8
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_EMBED_BODY = json.dumps({
+    "object": "list",
+    "model": "bench",
+    "data": [{"object": "embedding", "index": 0, "embedding": [0.0] * 8}],
+    "usage": {"prompt_tokens": 1, "total_tokens": 1},
+}).encode("utf-8")
+
+
+class _FakeOpenRouterHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.server.connections_seen.add(self.client_address)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(_EMBED_BODY)))
+        self.end_headers()
+        self.wfile.write(_EMBED_BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeOpenRouterHandler)
+    server.daemon_threads = True
+    server.connections_seen = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _run(call_fn, calls: int, threads: int) -> float:
+    start = time.perf_counter()
+    if threads <= 1:
+        for _ in range(calls):
+            call_fn()
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(lambda _: call_fn(), range(calls)))
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    from openai import OpenAI
+    from ai.client_pool import get_openrouter_client, reset_openrouter_clients
+
+    server = _start_server()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    def call_new_client():
+        client = OpenAI(base_url=base_url, api_key="bench")
+        client.embeddings.create(model="bench", input="xin chào")
+        client.close()
+
+    def call_pooled_client():
+        get_openrouter_client(base_url=base_url, api_key="bench").embeddings.create(model="bench", input="xin chào")
+
+    # Warm-up (import lazy, JIT của pydantic model...)
+    call_new_client()
+    call_pooled_client()
+
+    results = []
+    for name, fn in (("new client / call", call_new_client), ("pooled client", call_pooled_client)):
+        server.connections_seen.clear()
+        elapsed = _run(fn, args.calls, args.threads)
+        results.append((name, elapsed, len(server.connections_seen)))
+
+    reset_openrouter_clients()
+    server.shutdown()
+
+    print(f"calls={args.calls} threads={args.threads}")
+    print(f"{'mode':<20} {'total (s)':>10} {'per call (ms)':>14} {'tcp conns':>10}")
+    for name, elapsed, conns in results:
+        print(f"{name:<20} {elapsed:>10.3f} {elapsed * 1000 / args.calls:>14.3f} {conns:>10}")
+    base = results[0][1]
+    if results[1][1] > 0:
+        print(f"speedup: {base / results[1][1]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
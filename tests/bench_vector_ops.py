@@ -0,0 +1,134 @@
+# tests/bench_vector_ops.py
+"""
+Microbenchmark: chấm điểm vector phía Python kiểu cũ (vòng lặp thuần Python, parse JSON từng dòng) so với ai.vector_ops
+(ma trận float32 NumPy) ở 100 / 1k / 10k dòng, embedding 4096 chiều như qwen3.
+
+- score+top-k: 1 query so với n embedding (check_semantic_intent, relation/timeline/chunk-in-candidates).
+- dedupe: lọc near-duplicate tham lam (filter_context_items_by_embedding, global_data_sync).
+- cột "matrix": chỉ phần tính toán khi ma trận đã parse sẵn (phần còn lại của "new top-k" là parse chuỗi '[...]').
+
+Đường cũ rất chậm ở n lớn nên chỉ đo thật tới --old-max-rows (score) / --old-dedupe-max-rows (dedupe);
+phía trên ngưỡng đó ghi giá trị ngoại suy (~, tuyến tính cho score, bậc hai cho dedupe).
+
+Chạy (không cần mạng):
+  python -m tests.bench_vector_ops
+  python -m tests.bench_vector_ops --dim 1024 --sizes 100 1000
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from ai.vector_ops import cosine_scores, greedy_dedupe, to_matrix, top_k
+
+
+def _old_cosine(a, b):
+    if not a or not b or len(a) != len(b):
+        return 0.0
+    dot = sum(x * y for x, y in zip(a, b))
+    na = sum(x * x for x in a) ** 0.5
+    nb = sum(y * y for y in b) ** 0.5
+    if na <= 0 or nb <= 0:
+        return 0.0
+    return dot / (na * nb)
+
+
+def _old_top_k(query, raw_embeddings, k):
+    scored = []
+    for i, raw in enumerate(raw_embeddings):
+        emb = json.loads(raw) if isinstance(raw, str) else raw
+        if isinstance(emb, list) and len(emb) == len(query):
+            scored.append((_old_cosine(emb, query), i))
+    scored.sort(key=lambda x: -x[0])
+    return scored[:k]
+
+
+def _old_dedupe(raw_embeddings, threshold):
+    kept = []
+    for raw in raw_embeddings:
+        emb = json.loads(raw) if isinstance(raw, str) else raw
+        if not any(_old_cosine(emb, k) >= threshold for k in kept):
+            kept.append(emb)
+    return kept
+
+
+def _make_rows(n, dim, seed):
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        if i and rnd.random() < 0.2:
+            # ~20% bản gần trùng của một dòng trước đó
+            base = json.loads(rows[rnd.randrange(len(rows))])
+            vec = [x + rnd.gauss(0, 0.01) for x in base]
+        else:
+            vec = [rnd.gauss(0, 1) for _ in range(dim)]
+        # Supabase/PostgREST trả vector dạng chuỗi '[...]'
+        rows.append(json.dumps([round(x, 6) for x in vec]))
+    return rows
+
+
+def _time(fn, repeat=1):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dim", type=int, default=4096)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--k", type=int, default=40)
+    parser.add_argument("--threshold", type=float, default=0.90)
+    parser.add_argument("--old-max-rows", type=int, default=1000)
+    parser.add_argument("--old-dedupe-max-rows", type=int, default=100)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    query = [rnd.gauss(0, 1) for _ in range(args.dim)]
+    print(f"dim={args.dim} k={args.k} threshold={args.threshold}")
+    print(f"{'rows':>7} | {'old top-k':>11} | {'new top-k':>10} | {'speedup':>8} | {'matrix':>9} | {'old dedupe':>11} | {'new dedupe':>10} | {'speedup':>8}")
+    old_score_ref = None
+    old_dedupe_ref = None
+    for n in args.sizes:
+        rows = _make_rows(n, args.dim, seed=n)
+
+        new_score = _time(lambda: top_k(query, rows, k=args.k))
+        matrix, _idx = to_matrix(rows)
+        matrix_score = _time(lambda: np.argsort(-cosine_scores(query, matrix), kind="stable")[: args.k], repeat=3)
+        if n <= args.old_max_rows:
+            old_score = _time(lambda: _old_top_k(query, rows, args.k))
+            old_score_ref = (n, old_score)
+            old_score_txt = f"{old_score * 1000:9.1f}ms"
+        elif old_score_ref:
+            old_score = old_score_ref[1] * n / old_score_ref[0]
+            old_score_txt = f"~{old_score * 1000:8.0f}ms"
+        else:
+            old_score, old_score_txt = None, "n/a"
+
+        new_dedupe = _time(lambda: greedy_dedupe(rows, args.threshold))
+        if n <= args.old_dedupe_max_rows:
+            old_dedupe = _time(lambda: _old_dedupe(rows, args.threshold))
+            old_dedupe_ref = (n, old_dedupe)
+            old_dedupe_txt = f"{old_dedupe * 1000:9.1f}ms"
+        elif old_dedupe_ref:
+            old_dedupe = old_dedupe_ref[1] * (n / old_dedupe_ref[0]) ** 2
+            old_dedupe_txt = f"~{old_dedupe * 1000:8.0f}ms"
+        else:
+            old_dedupe, old_dedupe_txt = None, "n/a"
+
+        sp_score = f"{old_score / new_score:7.1f}x" if old_score else "n/a"
+        sp_dedupe = f"{old_dedupe / new_dedupe:7.1f}x" if old_dedupe else "n/a"
+        print(
+            f"{n:>7} | {old_score_txt:>11} | {new_score * 1000:8.1f}ms | {sp_score:>8} | {matrix_score * 1000:7.1f}ms | "
+            f"{old_dedupe_txt:>11} | {new_dedupe * 1000:8.1f}ms | {sp_dedupe:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
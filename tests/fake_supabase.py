@@ -0,0 +1,287 @@
+# tests/fake_supabase.py - Supabase / PostgREST giả trong bộ nhớ dùng chung cho unit test
+"""
+FakeSupabase(tables) mô phỏng phần PostgREST mà code gọi: select / insert / update / upsert / delete, bộ lọc
+eq / neq / in_ / gt / gte / lt / lte / is_ / ilike / or_ (kèm not_), order, limit, range, count="exact", rpc.
+
+Giống server thật ở chỗ hay gây lỗi ngầm: mỗi SELECT trả tối đa max_rows dòng (PostgREST max-rows, mặc định 1000),
+không báo lỗi khi bị cắt — code đọc nhiều dòng phải phân trang bằng .range().
+
+- db.calls: [(table, action)] theo thứ tự (action: select / insert / update / upsert / delete; rpc: (tên, "rpc")).
+- missing_tables: bảng chưa migrate → execute() lỗi "relation does not exist".
+- missing_columns: {bảng: {cột}} → select / lọc / order theo cột đó lỗi "column does not exist".
+- unique: {bảng: [(cột, ...)]} → ghi làm trùng khóa thì lỗi "duplicate key" và không đổi dữ liệu.
+- rpcs: {tên: fn(db, params)} → rpc(tên) trả fn(...); chưa đăng ký → lỗi "Could not find the function".
+"""
+import copy
+from collections import Counter
+import fnmatch
+import threading
+
+PGRST_MAX_ROWS = 1000
+
+
+class FakeResult:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _same(a, b):
+    # PostgREST gửi giá trị lọc dạng chuỗi: 1 và "1" cùng khớp.
+    return a == b or (a is not None and b is not None and str(a) == str(b))
+
+
+def _sort_key(value):
+    # NULL cuối khi tăng dần (như Postgres).
+    return (value is None, value if value is not None else 0)
+
+
+class FakeQuery:
+    def __init__(self, db, table):
+        self.db = db
+        self.table_name = table
+        self.action = "select"
+        self.values = None
+        self.on_conflict = None
+        self.count_mode = None
+        self.filters = []
+        self.orders = []
+        self.offset = 0
+        self.max_rows = None
+        self._negate = False
+
+    # --- hành động ---
+    def select(self, cols="*", count=None):
+        self.count_mode = count
+        self._check_columns(c.strip() for c in (cols or "*").split(",") if c.strip() and "(" not in c)
+        return self
+
+    def insert(self, values):
+        self.action, self.values = "insert", values
+        return self
+
+    def update(self, values):
+        self.action, self.values = "update", values
+        return self
+
+    def upsert(self, values, on_conflict=None, **_kw):
+        self.action, self.values, self.on_conflict = "upsert", values, on_conflict
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    # --- bộ lọc ---
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def _add(self, col, pred):
+        if col is not None:
+            self._check_columns([col])
+        negate, self._negate = self._negate, False
+        self.filters.append((lambda r: not pred(r)) if negate else pred)
+        return self
+
+    def eq(self, col, val):
+        return self._add(col, lambda r: _same(r.get(col), val))
+
+    def neq(self, col, val):
+        return self._add(col, lambda r: not _same(r.get(col), val))
+
+    def in_(self, col, vals):
+        vals = list(vals)
+        return self._add(col, lambda r: any(_same(r.get(col), v) for v in vals))
+
+    def gt(self, col, val):
+        return self._add(col, lambda r: r.get(col) is not None and r[col] > val)
+
+    def gte(self, col, val):
+        return self._add(col, lambda r: r.get(col) is not None and r[col] >= val)
+
+    def lt(self, col, val):
+        return self._add(col, lambda r: r.get(col) is not None and r[col] < val)
+
+    def lte(self, col, val):
+        return self._add(col, lambda r: r.get(col) is not None and r[col] <= val)
+
+    def is_(self, col, val):
+        want = None if val in (None, "null") else val
+        return self._add(col, lambda r: r.get(col) is want or r.get(col) == want)
+
+    def ilike(self, col, pattern):
+        pat = str(pattern).lower().replace("%", "*").replace("_", "?")
+        return self._add(col, lambda r: r.get(col) is not None and fnmatch.fnmatchcase(str(r[col]).lower(), pat))
+
+    def or_(self, expr):
+        """or_("and(col.eq.x,col.gte.1),col.eq.y") — đủ cho eq / gte / lte / gt / lt / in lồng một tầng and()."""
+        groups = _split_top(expr)
+        preds = [_parse_group(g) for g in groups]
+        return self._add(None, lambda r: any(all(p(r) for p in group) for group in preds))
+
+    # --- sắp xếp / cắt ---
+    def order(self, col, desc=False, **_kw):
+        self._check_columns([col])
+        self.orders.append((col, desc))
+        return self
+
+    def limit(self, n):
+        self.max_rows = n
+        return self
+
+    def range(self, start, end):
+        self.offset, self.max_rows = start, end - start + 1
+        return self
+
+    # --- thực thi ---
+    def _check_columns(self, cols):
+        missing = self.db.missing_columns.get(self.table_name) or ()
+        for c in cols:
+            if c in missing:
+                raise Exception(f"column {self.table_name}.{c} does not exist")
+
+    def _match(self, rows):
+        return [r for r in rows if all(f(r) for f in self.filters)]
+
+    def execute(self):
+        db = self.db
+        with db.lock:
+            db.calls.append((self.table_name, self.action))
+            if self.table_name in db.missing_tables:
+                raise Exception(f'relation "public.{self.table_name}" does not exist')
+            rows = db.tables.setdefault(self.table_name, [])
+            if self.action == "insert":
+                new = [dict(v) for v in (self.values if isinstance(self.values, list) else [self.values])]
+                for i, row in enumerate(new):
+                    row.setdefault("id", f"{self.table_name}{len(rows) + i}")
+                db._write(self.table_name, rows + new, new)
+                return FakeResult([dict(r) for r in new])
+            if self.action == "upsert":
+                keys = [k.strip() for k in (self.on_conflict or "id").split(",")]
+                after = list(rows)
+                new = [dict(v) for v in (self.values if isinstance(self.values, list) else [self.values])]
+                written = []
+                for row in new:
+                    hit = next((r for r in after if all(r.get(k) == row.get(k) for k in keys)), None)
+                    if hit is None:
+                        after.append(row)
+                        written.append(row)
+                    else:
+                        after[after.index(hit)] = merged = {**hit, **row}
+                        written.append(merged)
+                db._write(self.table_name, after, written)
+                return FakeResult([dict(r) for r in new])
+            hit = self._match(rows)
+            for col, desc in reversed(self.orders):
+                hit.sort(key=lambda r: _sort_key(r.get(col)), reverse=desc)
+            total = len(hit)
+            if self.action == "select":
+                hit = hit[self.offset:]
+                cap = db.max_rows if self.max_rows is None else min(self.max_rows, db.max_rows)
+                hit = hit[:cap]
+                return FakeResult([dict(r) for r in hit], count=total if self.count_mode else None)
+            if self.max_rows is not None:
+                hit = hit[self.offset:self.offset + self.max_rows]
+            ids = {id(r) for r in hit}
+            if self.action == "delete":
+                db._write(self.table_name, [r for r in rows if id(r) not in ids], [])
+                return FakeResult([dict(r) for r in hit])
+            after = [{**r, **self.values} if id(r) in ids else r for r in rows]
+            db._check_unique(self.table_name, after, [a for a, r in zip(after, rows) if id(r) in ids])
+            for r in hit:
+                r.update(self.values)
+            return FakeResult([dict(r) for r in hit])
+
+
+def _split_top(expr):
+    parts, depth, cur = [], 0, ""
+    for ch in expr:
+        if ch == "," and depth == 0:
+            parts.append(cur)
+            cur = ""
+            continue
+        depth += ch == "("
+        depth -= ch == ")"
+        cur += ch
+    if cur:
+        parts.append(cur)
+    return parts
+
+
+def _parse_cond(cond):
+    col, op, raw = cond.split(".", 2)
+
+    def _val(v):
+        try:
+            return int(v)
+        except ValueError:
+            return v
+
+    if op == "in":
+        vals = [_val(v.strip()) for v in raw.strip("()").split(",")]
+        return lambda r: any(_same(r.get(col), v) for v in vals)
+    val = _val(raw)
+    ops = {
+        "eq": lambda a: _same(a, val),
+        "neq": lambda a: not _same(a, val),
+        "gt": lambda a: a is not None and a > val,
+        "gte": lambda a: a is not None and a >= val,
+        "lt": lambda a: a is not None and a < val,
+        "lte": lambda a: a is not None and a <= val,
+    }
+    fn = ops[op]
+    return lambda r: fn(r.get(col) if not isinstance(val, str) or r.get(col) is None else str(r.get(col)))
+
+
+def _parse_group(group):
+    if group.startswith("and(") and group.endswith(")"):
+        return [_parse_cond(c) for c in _split_top(group[4:-1])]
+    return [_parse_cond(group)]
+
+
+class FakeSupabase:
+    def __init__(self, tables=None, max_rows=PGRST_MAX_ROWS, missing_tables=(), missing_columns=None, unique=None,
+                 rpcs=None):
+        self.tables = tables if tables is not None else {}
+        self.max_rows = max_rows
+        self.missing_tables = set(missing_tables)
+        self.missing_columns = missing_columns or {}
+        self.unique = unique or {}
+        self.rpcs = rpcs or {}
+        self.calls = []
+        self.lock = threading.RLock()
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params=None):
+        self.calls.append((name, "rpc"))
+        fn = self.rpcs.get(name)
+        if fn is None:
+            raise Exception(f"Could not find the function public.{name}")
+        db = self
+
+        class _Rpc:
+            def execute(self_inner):
+                return FakeResult(fn(db, params or {}))
+        return _Rpc()
+
+    def count(self, table, action="select"):
+        return self.calls.count((table, action))
+
+    def snapshot(self):
+        return copy.deepcopy(self.tables)
+
+    def _check_unique(self, table, rows, written):
+        # Như ràng buộc thật: chỉ dòng đang ghi bị từ chối khi trùng khóa với dòng khác.
+        for cols in self.unique.get(table, ()):
+            counts = Counter(tuple(r.get(c) for c in cols) for r in rows)
+            if any(counts[tuple(r.get(c) for c in cols)] > 1 for r in written):
+                raise Exception("duplicate key value violates unique constraint")
+
+    def _write(self, table, rows, written):
+        self._check_unique(table, rows, written)
+        # Sửa list tại chỗ: test giữ tham chiếu tới db.tables[bảng] vẫn thấy dữ liệu mới.
+        self.tables.setdefault(table, [])[:] = rows
@@ -0,0 +1,61 @@
+# tests/test_async_service.py
+"""Unit test: AsyncAIService — giới hạn đồng thời theo model, gather_sync giữ thứ tự, lỗi giống AIService."""
+import asyncio
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+class _FakeCompletions:
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def create(self, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return MagicMock(choices=[MagicMock(message=MagicMock(content=kwargs["messages"][0]["content"]))])
+
+
+class TestAsyncAIService(unittest.TestCase):
+    def test_gather_sync_respects_per_model_limit_and_order(self):
+        from ai.async_service import AsyncAIService, gather_sync
+
+        fake = _FakeCompletions()
+        client = MagicMock()
+        client.chat.completions = fake
+        with patch("ai.async_service.get_async_openrouter_client", return_value=client), \
+                patch("ai.async_service.get_model_concurrency", return_value=2), \
+                patch("ai.async_service.get_rate_limiter", return_value=None):
+            coros = [
+                AsyncAIService.acall_openrouter([{"role": "user", "content": str(i)}], model="limit-test/model")
+                for i in range(6)
+            ]
+            results = gather_sync(coros)
+        self.assertEqual([r.choices[0].message.content for r in results], [str(i) for i in range(6)])
+        self.assertLessEqual(fake.max_in_flight, 2)
+        self.assertEqual(fake.max_in_flight, 2)
+
+    def test_acall_openrouter_wraps_errors(self):
+        from ai.async_service import AsyncAIService, run_sync
+
+        client = MagicMock()
+
+        async def _boom(**kwargs):
+            raise ValueError("boom")
+
+        client.chat.completions.create = _boom
+        with patch("ai.async_service.get_async_openrouter_client", return_value=client):
+            with self.assertRaises(Exception) as ctx:
+                run_sync(AsyncAIService.acall_openrouter([{"role": "user", "content": "x"}], model="m"))
+        self.assertIn("OpenRouter API error", str(ctx.exception))
+
+    def test_aget_embedding_empty_text_returns_none(self):
+        from ai.async_service import AsyncAIService, run_sync
+
+        self.assertIsNone(run_sync(AsyncAIService.aget_embedding("   ")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# tests/test_batch_planner.py
+"""
+Unit test: core.batch_planner (chia lô chương theo token) và _group_into_chunked_batches.
+- First-fit decreasing: không lô nào vượt ngân sách input / số chương tối đa; ít lô hơn chia tuần tự.
+- Chương vượt ngân sách tách riêng; chương trong lô tăng dần.
+- chapter_token_estimates: đọc cột token_estimate, thiếu cột → ước lượng từ content.
+
+Chạy: python -m pytest tests/test_batch_planner.py -v
+"""
+import unittest
+
+from tests.fake_supabase import FakeSupabase
+
+
+class TestBatchPlanner(unittest.TestCase):
+    def test_packs_under_budget_with_fewer_batches(self):
+        from core.batch_planner import plan_token_batches
+
+        tokens = {1: 9000, 2: 1000, 3: 8000, 4: 2000, 5: 500, 6: 7000, 7: 3000, 8: 600}
+        batches, oversized = plan_token_batches(tokens, input_tokens=10000, max_chapters=5)
+        self.assertEqual(oversized, [])
+        self.assertEqual(sorted(ch for b in batches for ch in b), sorted(tokens))
+        for b in batches:
+            self.assertLessEqual(sum(tokens[ch] for ch in b), 10000)
+            self.assertLessEqual(len(b), 5)
+            self.assertEqual(b, sorted(b))
+        self.assertEqual(len(batches), 4)  # tổng 31100 token → tối thiểu 4 lô
+        self.assertEqual([b[0] for b in batches], sorted(b[0] for b in batches))
+
+    def test_oversized_and_max_chapters(self):
+        from core.batch_planner import plan_token_batches
+
+        batches, oversized = plan_token_batches({1: 50, 2: 50, 3: 99999, 4: 50}, input_tokens=1000, max_chapters=2)
+        self.assertEqual(oversized, [3])
+        self.assertEqual(batches, [[1, 2], [4]])
+
+    def test_default_limits_from_config(self):
+        from core.batch_planner import batch_limits
+        from config import Config
+
+        limits = batch_limits()
+        self.assertLess(limits["input_tokens"], Config.DATA_BATCH_MAX_TOKENS)
+        self.assertEqual(limits["max_chapters"], Config.DATA_BATCH_MAX_OUTPUT_TOKENS // Config.DATA_BATCH_OUTPUT_TOKENS_PER_CHAPTER)
+
+    def test_estimates_fall_back_to_content(self):
+        from core.batch_planner import chapter_token_estimates
+
+        rows = [
+            {"story_id": "p", "chapter_number": 1, "token_estimate": 123, "content": "x" * 40},
+            {"story_id": "p", "chapter_number": 2, "token_estimate": None, "content": "y" * 400},
+        ]
+        self.assertEqual(chapter_token_estimates(FakeSupabase({"chapters": rows}), "p", [1, 2, 9]), {1: 123, 2: 100})
+        no_column = FakeSupabase({"chapters": rows}, missing_columns={"chapters": {"token_estimate"}})
+        self.assertEqual(chapter_token_estimates(no_column, "p", [1, 2]), {1: 10, 2: 100})
+
+    def test_group_steps_by_tokens(self):
+        from core.data_operation_jobs import _group_into_chunked_batches
+
+        steps = [
+            {"operation_type": "extract", "target": "bible", "chapter_range": [1, 10]},
+            {"operation_type": "delete", "target": "timeline", "chapter_range": [1, 10]},
+        ]
+        estimates = {n: 200 for n in range(1, 11)}
+        estimates[4] = 10 ** 7
+        items = _group_into_chunked_batches(steps, token_estimates=estimates)
+        bible = [i["chapter_numbers"] for i in items if i["target"] == "bible"]
+        delete = [i["chapter_numbers"] for i in items if i["target"] == "timeline"]
+        self.assertEqual(bible, [[1, 2, 3, 5, 6, 7, 8, 9, 10], [4]])
+        self.assertEqual(delete, [[1, 2, 3, 4, 5, 6, 7], [8, 9, 10]])
+        fixed = _group_into_chunked_batches(steps[:1])
+        self.assertEqual([i["chapter_numbers"] for i in fixed], [list(range(1, 8)), [8, 9, 10]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+# tests/test_chapter_digest.py
+"""
+Unit test: ai.chapter_digest (digest chương theo cỡ token, khóa theo hash nội dung) với Supabase / LLM giả.
+- plan_chapter_context: chọn cỡ digest lớn nhất vừa ngân sách, nâng cấp chương ưu tiên, bỏ chương đầu khi vẫn không vừa;
+  summary / art_style tính vào chi phí từng cách như khi render.
+- refresh_chapter_digest: nội dung không đổi → không gọi LLM; đổi nội dung → dựng lại và dọn digest cũ của chương.
+- ContextManager.load_chapters_by_range: vượt token_limit → dùng digest thay cho chỉ summary.
+
+Chạy: python -m pytest tests/test_chapter_digest.py -v
+"""
+import json
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from tests.fake_supabase import FakeSupabase
+
+
+def _estimate(text):
+    return len(text or "") // 4
+
+
+def _digests(n):
+    return {"100": "a" * 400, "400": "b" * 1600, "1500": f"chương {n} " + "c" * 6000}
+
+
+class TestPlanChapterContext(unittest.TestCase):
+    def setUp(self):
+        self.p = patch("ai.service.AIService.estimate_tokens", side_effect=_estimate)
+        self.p.start()
+
+    def tearDown(self):
+        self.p.stop()
+
+    def _items(self, n):
+        return [{"content_tokens": 5000, "digests": _digests(i), "summary_tokens": 50} for i in range(n)]
+
+    def test_everything_fits_keeps_full_text(self):
+        from ai.chapter_digest import plan_chapter_context
+
+        self.assertEqual(plan_chapter_context(self._items(2), 20000), [("full", None)] * 2)
+
+    def test_picks_largest_uniform_level_then_upgrades_focus(self):
+        from ai.chapter_digest import plan_chapter_context
+
+        # 6 chương × ~1520 token (cỡ 1500) = 9120 > 8000 → cỡ 400 (6 × 420 = 2520), dư nâng chương cuối lên toàn văn.
+        plan = plan_chapter_context(self._items(6), 8000)
+        self.assertEqual(plan[:5], [("digest", 400)] * 5)
+        self.assertEqual(plan[5], ("full", None))
+
+        plan = plan_chapter_context(self._items(6), 8000, priority=[0, 1, 2, 3, 4, 5])
+        self.assertEqual(plan[0], ("full", None))
+        self.assertEqual(plan[5], ("digest", 400))
+
+    def test_summary_and_art_style_are_costed_per_option(self):
+        from ai.chapter_digest import plan_chapter_context
+
+        # Toàn văn 1000 token vừa 2200 nếu chỉ đếm content, nhưng render còn ghi summary + art_style (600 / chương).
+        items = [{"content_tokens": 1000, "digests": _digests(i), "summary_tokens": 300, "art_style_tokens": 300}
+                 for i in range(2)]
+        self.assertEqual(plan_chapter_context(items, 2200), [("digest", 400)] * 2)
+        self.assertEqual(plan_chapter_context(items, 3240), [("full", None)] * 2)
+
+    def test_missing_digest_falls_back_to_summary_and_omits_oldest(self):
+        from ai.chapter_digest import plan_chapter_context
+
+        items = self._items(3)
+        items[1]["digests"] = None
+        plan = plan_chapter_context(items, 300)
+        self.assertEqual(plan, [("omit", None), ("summary", None), ("digest", 100)])
+
+
+class TestRefreshChapterDigest(unittest.TestCase):
+    def setUp(self):
+        import ai.chapter_digest as cd
+
+        cd._table_unsupported_until = 0.0
+        self.calls = []
+
+        def _call(messages, model, **kwargs):
+            self.calls.append(messages[0]["content"])
+            body = json.dumps({"1500": "dài", "400": "vừa", "100": "ngắn"}, ensure_ascii=False)
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=body))])
+
+        self.patches = [
+            patch("ai.service.AIService.estimate_tokens", side_effect=_estimate),
+            patch("ai.service.AIService.call_openrouter", side_effect=_call),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+
+    def test_unchanged_content_is_not_rebuilt(self):
+        from ai.chapter_digest import chapter_content_hash, refresh_chapter_digest
+
+        sb = FakeSupabase({"chapter_digests": []})
+        text = "Lan gặp Minh. " * 800
+        self.assertTrue(refresh_chapter_digest(sb, "p1", 3, text, "Chương 3"))
+        self.assertFalse(refresh_chapter_digest(sb, "p1", 3, text + "  \n", "Chương 3 (đổi tên)"))
+        self.assertEqual(len(self.calls), 1)
+        row = sb.tables["chapter_digests"][0]
+        self.assertEqual(row["content_hash"], chapter_content_hash(text))
+        self.assertEqual(row["digests"], {"100": "ngắn", "400": "vừa", "1500": "dài"})
+
+        self.assertTrue(refresh_chapter_digest(sb, "p1", 3, text + "Kết.", "Chương 3"))
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual([r["content_hash"] for r in sb.tables["chapter_digests"]], [chapter_content_hash(text + "Kết.")])
+
+    def test_short_chapter_uses_text_without_llm_for_large_levels(self):
+        from ai.chapter_digest import generate_chapter_digests
+
+        text = "x" * 2000  # ~500 token: cỡ 1500 = nguyên văn
+        out = generate_chapter_digests(text, "Ngắn")
+        self.assertEqual(out["1500"], text)
+        self.assertEqual((out["400"], out["100"]), ("vừa", "ngắn"))
+        self.assertNotIn('"1500"', self.calls[0])
+
+
+class TestLoadChaptersByRange(unittest.TestCase):
+    def test_over_budget_uses_digests(self):
+        import ai.chapter_digest as cd
+        from ai.chapter_digest import chapter_content_hash
+        from ai_engine import ContextManager
+
+        cd._table_unsupported_until = 0.0
+        chapters = [
+            {"story_id": "p1", "chapter_number": n, "title": f"Chương {n}", "content": f"nội dung {n} " + "z" * 20000,
+             "summary": f"tóm tắt {n}"}
+            for n in range(1, 5)
+        ]
+        digests = [
+            {"story_id": "p1", "content_hash": chapter_content_hash(c["content"]), "chapter_number": c["chapter_number"],
+             "digests": _digests(c["chapter_number"])}
+            for c in chapters
+        ]
+        sb = FakeSupabase({"chapters": chapters, "chapter_digests": digests})
+        with patch("ai_engine.init_services", return_value={"supabase": sb}), \
+                patch("ai.service.AIService.estimate_tokens", side_effect=_estimate):
+            text, sources = ContextManager.load_chapters_by_range("p1", 1, 4, token_limit=10000)
+
+        self.assertIn("[Digest ~1500 token]:\nchương 1 ", text)
+        self.assertIn("nội dung 4 ", text)
+        self.assertNotIn("nội dung 1 ", text)
+        self.assertEqual(sources, ["📄 Chương 1 (digest 1500)", "📄 Chương 2 (digest 1500)",
+                                   "📄 Chương 3 (digest 1500)", "📄 Chương 4"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+# tests/test_context_gather.py
+"""
+Unit test: gather context song song trong _intent_handle_llm_with_context.
+- _run_context_fetchers chạy các nguồn chồng lên nhau, nguồn lỗi trả về None, timing theo thứ tự khai báo.
+- Thứ tự ghép context luôn là chunk → bible → relation → timeline dù nguồn nào xong trước.
+
+Chạy: python -m pytest tests/test_context_gather.py -v
+"""
+import time
+import unittest
+from unittest.mock import patch
+
+
+class TestRunContextFetchers(unittest.TestCase):
+    def test_fetchers_overlap_and_errors_become_none(self):
+        import ai_engine
+
+        def _slow(value):
+            def _fn():
+                time.sleep(0.2)
+                return value
+            return _fn
+
+        def _boom():
+            raise RuntimeError("boom")
+
+        with patch.object(ai_engine.Config, "CONTEXT_GATHER_PARALLEL", True), \
+                patch.object(ai_engine.Config, "CONTEXT_GATHER_MAX_WORKERS", 4):
+            t0 = time.perf_counter()
+            results, timings, wall_ms = ai_engine._run_context_fetchers(
+                [("chunk", _slow("c")), ("bible", _slow("b")), ("relation", _boom), ("timeline", _slow("t"))]
+            )
+            elapsed = time.perf_counter() - t0
+
+        self.assertEqual(results, {"chunk": "c", "bible": "b", "relation": None, "timeline": "t"})
+        self.assertEqual(list(timings.keys()), ["chunk", "bible", "relation", "timeline"])
+        self.assertLess(elapsed, 0.5)
+        self.assertGreaterEqual(wall_ms, 190)
+
+    def test_sequential_when_disabled(self):
+        import ai_engine
+
+        order = []
+        with patch.object(ai_engine.Config, "CONTEXT_GATHER_PARALLEL", False):
+            ai_engine._run_context_fetchers([("a", lambda: order.append("a")), ("b", lambda: order.append("b"))])
+        self.assertEqual(order, ["a", "b"])
+
+
+class TestParallelGatherMergeOrder(unittest.TestCase):
+    def test_merge_order_is_fixed_when_chunk_finishes_last(self):
+        import ai_engine
+        from ai_engine import ContextManager
+
+        def _slow_chunk_lookup(project_id, chunk_ids, current_arc_id, token_limit=12000):
+            time.sleep(0.15)
+            return "CHUNK_CTX", ["📄 chunk src"], 10
+
+        ctx = {
+            "context_parts": [],
+            "sources": [],
+            "total_tokens": 0,
+            "project_id": "p1",
+            "session_state": {},
+            "max_context_tokens": None,
+            "context_needs": ["chunk", "bible", "relation", "timeline"],
+            "context_priority": ["chunk", "bible", "relation", "timeline"],
+            "chapter_range_mode": None,
+            "chapter_range_count": 5,
+            "chapter_range": None,
+            "target_files": [],
+            "target_bible_entities": [],
+            "query_embedding": [0.1, 0.2],
+            "context_parts_meta": [],
+        }
+        router_result = {"intent": "search_context", "rewritten_query": "ai là A?"}
+
+        with patch.object(ai_engine, "ArcService", None), \
+                patch.object(ai_engine, "init_services", return_value=None), \
+                patch.object(ai_engine.Config, "get_valid_prefix_keys", return_value=set()), \
+                patch.object(ContextManager, "_resolve_chapter_range", return_value=None), \
+                patch.object(ai_engine, "search_chunks_vector", return_value=[{"id": "c1", "content": "x"}]), \
+                patch.object(ContextManager, "llm_select_chunks_for_query", return_value=(["c1"], "")), \
+                patch.object(ContextManager, "build_context_with_chunk_reverse_lookup", side_effect=_slow_chunk_lookup), \
+                patch.object(ai_engine.HybridSearch, "smart_search_hybrid_raw", return_value=[{"id": 7, "entity_name": "A"}]), \
+                patch.object(ai_engine.HybridSearch, "update_lookup_stats") as mock_stats, \
+                patch.object(ContextManager, "get_entity_relations", return_value=""), \
+                patch.object(ai_engine, "format_bible_context_by_sections", return_value="BIBLE_PART"), \
+                patch.object(ai_engine, "get_top_relations_by_query", return_value="REL_TEXT"), \
+                patch.object(ai_engine, "get_timeline_events", return_value=[]), \
+                patch.object(ai_engine, "get_top_timeline_by_query", return_value="TL_TEXT"):
+            ai_engine._intent_handle_llm_with_context(router_result, ctx)
+
+        parts = ctx["context_parts"]
+        idx = [
+            next(i for i, p in enumerate(parts) if marker in p)
+            for marker in ("CHUNK_CTX", "BIBLE_PART", "REL_TEXT", "TL_TEXT")
+        ]
+        self.assertEqual(idx, sorted(idx))
+        self.assertEqual([m["source"] for m in ctx["context_parts_meta"]], ["chunk", "bible", "relation", "timeline"])
+        self.assertEqual(set(ctx["source_timings"]), {"chunk", "bible", "relation", "timeline", "total"})
+        self.assertTrue(any(s.startswith("⏱️ Gather: chunk") for s in ctx["sources"]))
+        mock_stats.assert_called_once_with(7)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+# tests/test_embedding_cache.py
+"""Unit test: EmbeddingCache (LRU + SQLite, TTL, bộ đếm) và get_embeddings_batch chỉ gửi text chưa có trong cache."""
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, "emb.sqlite")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_normalized_text_shares_key_and_counts_hits(self):
+        from ai.embedding_cache import EmbeddingCache
+
+        cache = EmbeddingCache(db_path=self.db_path, memory_items=10)
+        cache.put("m", "Xin   chào\n", [0.5, 0.25])
+        self.assertEqual(cache.get("m", " Xin chào"), [0.5, 0.25])
+        self.assertIsNone(cache.get("other-model", "Xin chào"))
+        stats = cache.stats()
+        self.assertEqual(stats["memory_hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_memory_tier_packs_float32_and_returns_copies(self):
+        from ai.embedding_cache import EmbeddingCache
+
+        cache = EmbeddingCache(db_path=None, memory_items=10)
+        cache.put("m", "abc", [0.5, 0.25])
+        first = cache.get("m", "abc")
+        first.append(99.0)
+        self.assertEqual(cache.get("m", "abc"), [0.5, 0.25])
+        (_created_at, blob), = cache._mem.values()
+        self.assertIsInstance(blob, bytes)
+        self.assertEqual(len(blob), 8)
+
+    def test_disk_tier_survives_new_instance_and_ttl_expires(self):
+        from ai.embedding_cache import EmbeddingCache
+
+        EmbeddingCache(db_path=self.db_path).put("m", "abc", [1.0, 2.0])
+        fresh = EmbeddingCache(db_path=self.db_path)
+        self.assertEqual(fresh.get("m", "abc"), [1.0, 2.0])
+        self.assertEqual(fresh.stats()["disk_hits"], 1)
+        expired = EmbeddingCache(db_path=self.db_path, memory_items=0, ttl_sec=-1)
+        self.assertIsNone(expired.get("m", "abc"))
+
+    def test_lru_evicts_oldest(self):
+        from ai.embedding_cache import EmbeddingCache
+
+        cache = EmbeddingCache(db_path=None, memory_items=2)
+        cache.put("m", "a", [1.0])
+        cache.put("m", "b", [2.0])
+        cache.get("m", "a")
+        cache.put("m", "c", [3.0])
+        self.assertIsNone(cache.get("m", "b"))
+        self.assertEqual(cache.get("m", "a"), [1.0])
+
+    def test_batch_sends_only_misses(self):
+        from ai.embedding_cache import EmbeddingCache
+        from ai.service import AIService
+        from config import Config
+
+        cache = EmbeddingCache(db_path=None)
+        cache.put(Config.EMBEDDING_MODEL, "đã có", [9.0])
+        client = MagicMock()
+        client.embeddings.create.side_effect = lambda model, input: MagicMock(
+            data=[MagicMock(embedding=[float(len(t))]) for t in input]
+        )
+        with patch("ai.service.get_embedding_cache", return_value=cache), \
+                patch("ai.service.get_openrouter_client", return_value=client):
+            out = AIService.get_embeddings_batch(["đã có", "", "mới", "đã  có"])
+            self.assertEqual(out, [[9.0], None, [3.0], [9.0]])
+            self.assertEqual(client.embeddings.create.call_args.kwargs["input"], ["mới"])
+            AIService.get_embeddings_batch(["mới"])
+        self.assertEqual(client.embeddings.create.call_count, 1)
+
+    def test_api_input_is_not_normalized(self):
+        from ai.service import AIService
+
+        client = MagicMock()
+        client.embeddings.create.return_value = MagicMock(data=[MagicMock(embedding=[1.0])])
+        with patch("ai.service.get_embedding_cache", return_value=None), \
+                patch("ai.service.get_openrouter_client", return_value=client):
+            AIService.get_embedding("Xin   chào\nbạn")
+            self.assertEqual(client.embeddings.create.call_args.kwargs["input"], "Xin   chào\nbạn")
+            AIService.get_embeddings_batch([" a  b "])
+            self.assertEqual(client.embeddings.create.call_args.kwargs["input"], ["a  b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+# tests/test_executor_v7.py
+"""
+Unit test: core.executor_v7.execute_plan (thực thi plan theo dependency, song song) với ContextManager / LLM giả.
+- Bước độc lập chạy chồng lên nhau; step_results / cumulative vẫn theo thứ tự plan.
+- Bước thất bại: re-plan chỉ nhận và thay các bước phụ thuộc vào nó; bước độc lập giữ kết quả.
+- multi_chapter_analysis: gọi map-reduce (1 lượt llm_budget_ref), hết lượt thì ghi chú bỏ qua.
+- Chạy trước (speculative) chỉ với bước không gọi LLM: search_context (context_planner) chờ bước nó phụ thuộc.
+
+Chạy: python -m pytest tests/test_executor_v7.py -v
+"""
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from config import Config
+
+
+class _FakeContextManager:
+    calls = []
+    lock = threading.Lock()
+
+    @staticmethod
+    def build_context(router_result, project_id, persona, **kwargs):
+        time.sleep(0.2)
+        query = router_result.get("rewritten_query") or ""
+        with _FakeContextManager.lock:
+            _FakeContextManager.calls.append(query)
+        if "MISS" in query:
+            return "MISS", [], 0, 0
+        return f"ctx[{query}]", [f"📚 {query}"], 0, 0
+
+
+class _FakeAIService:
+    @staticmethod
+    def estimate_tokens(text):
+        return len(text) // 4
+
+
+def _step(step_id, intent, query, dependency=None, **args):
+    return {"step_id": step_id, "intent": intent, "args": {"query_refined": query, **args}, "dependency": dependency}
+
+
+def _evaluate(intent, ctx_text, sources, step=None):
+    return (True, "không có dữ liệu") if ctx_text == "MISS" else (False, "")
+
+
+class TestExecutePlan(unittest.TestCase):
+    def setUp(self):
+        from core import executor_v7
+
+        _FakeContextManager.calls = []
+        self.replan_calls = []
+        self.replan_result = ("continue", "", [])
+
+        def _replan(user_prompt, cumulative, step_results, step_done, reason, remaining, project_id):
+            self.replan_calls.append((step_done["step_id"], [s["step_id"] for s in remaining]))
+            return self.replan_result
+
+        engine = (_FakeContextManager, _FakeAIService, Config, None, lambda: "tool-model")
+        self.patches = [
+            patch.object(executor_v7, "_get_engine", return_value=engine),
+            patch.object(executor_v7, "_get_replan", return_value=(_evaluate, _replan)),
+            patch.object(
+                executor_v7, "_build_router_result_with_router_3step_for_search",
+                side_effect=lambda step, prompt, pid, chat_history_text="": executor_v7.step_to_router_result(step, prompt),
+            ),
+            patch.object(Config, "V7_PARALLEL_STEPS", True),
+            patch.object(Config, "V7_PARALLEL_MAX_WORKERS", 4),
+            patch.object(Config, "V7_SPECULATIVE_STEPS", True),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+
+    def _run(self, plan, **kwargs):
+        from core.executor_v7 import execute_plan
+
+        return execute_plan(plan, "p1", {"core_instruction": ""}, "hỏi", **kwargs)
+
+    def test_independent_steps_overlap_and_keep_plan_order(self):
+        plan = [_step(1, "search_context", "A"), _step(2, "search_context", "B"), _step(3, "search_context", "C")]
+        t0 = time.perf_counter()
+        cumulative, sources, results, events, _ops = self._run(plan)
+        elapsed = time.perf_counter() - t0
+
+        self.assertLess(elapsed, 0.45)
+        self.assertEqual([r["step_id"] for r in results], [1, 2, 3])
+        self.assertLess(cumulative.index("ctx[A]"), cumulative.index("ctx[B]"))
+        self.assertLess(cumulative.index("ctx[B]"), cumulative.index("ctx[C]"))
+        self.assertEqual(sources[:2], ["Step 1: search_context", "📚 A"])
+        self.assertEqual(events, [])
+
+    def test_replan_only_reshapes_dependents_of_failed_step(self):
+        self.replan_result = ("replace", "thử truy vấn khác", [_step(1, "search_context", "B2")])
+        plan = [
+            _step(1, "search_context", "MISS"),
+            _step(2, "search_context", "B", dependency=1),
+            _step(3, "search_context", "C"),
+            _step(4, "search_context", "D", dependency="step 2"),
+        ]
+        cumulative, _sources, results, events, _ops = self._run(plan)
+
+        self.assertEqual(self.replan_calls, [(1, [2, 4])])
+        self.assertEqual([(r["step_id"], r["evaluation_status"]) for r in results],
+                         [(1, "failed"), (3, "ok"), (5, "ok")])
+        self.assertIn("ctx[C]", cumulative)
+        self.assertIn("ctx[B2]", cumulative)
+        self.assertNotIn("ctx[B]", cumulative)
+        self.assertEqual(events[0]["cancelled_step_ids"], [2, 4])
+
+    def test_speculation_skips_steps_that_call_llm(self):
+        from core import executor_v7
+
+        self.replan_result = ("abort", "", [])
+        plan = [
+            _step(1, "search_context", "MISS"),
+            _step(2, "search_context", "B", dependency=1),
+            _step(3, "check_chapter_logic", "C", dependency=1),
+        ]
+        _cumulative, _sources, results, _events, _ops = self._run(plan)
+        built = [c.args[0]["step_id"] for c in executor_v7._build_router_result_with_router_3step_for_search.call_args_list]
+        self.assertEqual(built, [1])  # bước 2 bị huỷ trước khi gọi context_planner
+        self.assertIn("C", _FakeContextManager.calls)  # bước không gọi LLM vẫn chạy trước
+        self.assertEqual([r["step_id"] for r in results], [1])
+
+    def test_failed_step_without_dependents_does_not_replan(self):
+        plan = [_step(1, "search_context", "MISS"), _step(2, "search_context", "B")]
+        _cumulative, _sources, results, events, _ops = self._run(plan)
+        self.assertEqual(self.replan_calls, [])
+        self.assertEqual(events, [])
+        self.assertEqual(len(results), 2)
+
+    def test_multi_chapter_runs_map_reduce_within_llm_budget(self):
+        from ai import map_reduce_analysis
+
+        mr = {"text": "### Chương 1–30\nghi chú", "segments": 3, "map_cached": 2, "levels": 1, "llm_calls": 4}
+        plan = [
+            _step(1, "multi_chapter_analysis", "tổng hợp", chapter_range=[30, 1]),
+            _step(2, "multi_chapter_analysis", "so sánh", chapter_range=[31, 60]),
+        ]
+        budget = [4, 5]
+        with patch.object(map_reduce_analysis, "run_map_reduce", return_value=mr) as run_mr, \
+                patch.object(Config, "get_max_internal_llm_calls_per_turn", return_value=60):
+            cumulative, sources, results, _events, _ops = self._run(plan, llm_budget_ref=budget, max_context_tokens=20000)
+
+        run_mr.assert_called_once()
+        self.assertEqual(run_mr.call_args.args, ("p1", 1, 30, "tổng hợp", 20000, "tool-model"))
+        self.assertEqual(run_mr.call_args.kwargs["call_budget"].max_calls, 60)
+        self.assertEqual(budget, [5, 5])
+        self.assertIn("map 3 đoạn (2 dùng lại từ cache), reduce 1 tầng", cumulative)
+        self.assertIn("Bỏ qua khoảng chương 31-60", cumulative)
+        self.assertEqual([r["intent"] for r in results], ["multi_chapter_analysis"] * 2)
+        self.assertIn("🗺️ Map-reduce chương 1-30 (3 đoạn, 4 lệnh LLM nội bộ; lượt này 0/60)", sources)
+
+    def test_sequential_mode_skips_cancelled_dependents(self):
+        self.replan_result = ("abort", "", [])
+        plan = [_step(1, "search_context", "MISS"), _step(2, "search_context", "B", dependency=[1])]
+        with patch.object(Config, "V7_PARALLEL_STEPS", False):
+            _cumulative, _sources, results, events, _ops = self._run(plan)
+        self.assertEqual([r["step_id"] for r in results], [1])
+        self.assertEqual(_FakeContextManager.calls, ["MISS"])
+        self.assertEqual(events[0]["action"], "abort")
+
+
+if __name__ == "__main__":
+    unittest.main()
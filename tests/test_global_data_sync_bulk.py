@@ -0,0 +1,124 @@
+# tests/test_global_data_sync_bulk.py
+"""
+Unit test: run_global_data_sync ghi theo lô trên Supabase giả trong bộ nhớ (đếm số request).
+- Orphan link / relation: xóa bằng in_("id", lô), kết quả giống chế độ từng dòng.
+- parent_id cùng đích gộp thành một update; UNIQUE lỗi cả lô → thử lại từng dòng.
+- Có RPC global_sync_cleanup_orphans → không tải bảng link, đếm lấy từ RPC.
+- Relation trùng theo embedding: chỉ xóa dòng trùng trực tiếp với dòng được giữ (A~B, B~C, A≁C → giữ A và C).
+
+Chạy: python -m pytest tests/test_global_data_sync_bulk.py -v
+"""
+import copy
+import math
+import unittest
+from unittest.mock import patch
+
+from tests.fake_supabase import FakeSupabase
+
+
+def _cleanup_orphans_rpc(db, _params):
+    ids = lambda t: {r["id"] for r in db.tables.get(t, [])}
+    chunks, bible = ids("chunks"), ids("story_bible")
+    before = len(db.tables["chunk_bible_links"])
+    db.tables["chunk_bible_links"] = [
+        r for r in db.tables["chunk_bible_links"] if r["chunk_id"] in chunks and r["bible_entry_id"] in bible
+    ]
+    return {"chunk_bible_links": before - len(db.tables["chunk_bible_links"])}
+
+
+def _db(tables, has_rpc=False):
+    # UNIQUE(chunk_id, bible_entry_id) như bảng thật.
+    return FakeSupabase(
+        tables,
+        unique={"chunk_bible_links": [("chunk_id", "bible_entry_id")]},
+        rpcs={"global_sync_cleanup_orphans": _cleanup_orphans_rpc} if has_rpc else None,
+    )
+
+
+def _tables(n_links=1000):
+    bible = [{"id": i, "story_id": "p", "entity_name": f"[CHARACTER] Tên {i % 10}", "source_chapter": 1 + i // 10,
+              "parent_id": None, "embedding": None} for i in range(1, 51)]
+    chunks = [{"id": f"c{i}", "story_id": "p", "chapter_id": "ch1", "content": f"đoạn {i}", "raw_content": "",
+               "parent_chunk_id": None, "embedding": None} for i in range(20)]
+    links = [{"id": f"l{i}", "story_id": "p", "chunk_id": f"c{i % 25}", "bible_entry_id": 1 + i % 50} for i in range(n_links)]
+    return {
+        "story_bible": bible,
+        "chunks": chunks,
+        "timeline_events": [],
+        "chapters": [{"id": "ch1", "story_id": "p"}],
+        "chunk_bible_links": links,
+        "chunk_timeline_links": [],
+        "entity_relations": [],
+    }
+
+
+class TestGlobalDataSyncBulk(unittest.TestCase):
+    def _run(self, db, bulk=True):
+        from core import global_data_sync
+        from config import Config
+
+        with patch.object(global_data_sync, "_get_supabase", return_value=db), \
+                patch.object(Config, "GLOBAL_SYNC_BULK", bulk, create=True), \
+                patch.object(Config, "GLOBAL_SYNC_BULK_CHUNK", 100, create=True), \
+                patch("ai.vector_index.invalidate_vector_index"):
+            return global_data_sync.run_global_data_sync("p")
+
+    def test_bulk_matches_per_row_with_far_fewer_requests(self):
+        bulk_db = _db(_tables())
+        row_db = _db(copy.deepcopy(bulk_db.tables))
+        bulk = self._run(bulk_db)
+        per_row = self._run(row_db, bulk=False)
+
+        self.assertTrue(bulk["success"], bulk["error"])
+        self.assertEqual(bulk["fixed"], per_row["fixed"])
+        bulk_db.tables.pop("global_sync_state")
+        row_db.tables.pop("global_sync_state")
+        self.assertEqual(bulk_db.tables, row_db.tables)
+        self.assertEqual(bulk["fixed"]["chunk_bible_links_deleted"], 200)  # c20..c24 không tồn tại
+        self.assertEqual(bulk["fixed"]["bible_parent_id_updated"], 40)
+        self.assertLess(len(bulk_db.calls), 60)
+        self.assertGreater(len(row_db.calls), 400)
+        # Cùng tên → cùng parent (bản ở chương sớm nhất) → một update cho cả nhóm
+        parent_updates = [c for c in bulk_db.calls if c == ("story_bible", "update")]
+        self.assertEqual(len(parent_updates), 10)
+
+    def test_relation_embedding_dedupe_does_not_chain(self):
+        # cos(A, B) = cos(B, C) = 0.97, cos(A, C) ≈ 0.88 < ngưỡng: C không trùng bản được giữ (A).
+        theta = math.acos(0.97)
+        emb = lambda k: [math.cos(k * theta), math.sin(k * theta)]
+        tables = _tables(n_links=0)
+        tables["entity_relations"] = [
+            {"id": f"r{k}", "story_id": "p", "source_entity_id": 1 + k, "target_entity_id": 11 + k,
+             "relation_type": f"kiểu {k}", "source_chapter": 1, "embedding": emb(k)}
+            for k in range(3)
+        ]
+        db = _db(tables)
+        out = self._run(db)
+        self.assertTrue(out["success"], out["error"])
+        self.assertEqual(sorted(r["id"] for r in db.tables["entity_relations"]), ["r0", "r2"])
+        self.assertEqual(out["fixed"]["relation_deduped_by_embedding_chapter"], 1)
+
+    def test_rpc_cleans_orphans_without_loading_links(self):
+        db = _db(_tables(), has_rpc=True)
+        out = self._run(db)
+        self.assertEqual(out["fixed"]["chunk_bible_links_deleted"], 200)
+        self.assertEqual(out["report"]["orphan_chunk_bible_links"], 200)
+        # Trước RPC chỉ có các lệnh đọc updated_at mới nhất (watermark); orphan link không tải bảng link.
+        rpc_at = db.calls.index(("global_sync_cleanup_orphans", "rpc"))
+        self.assertNotIn(("chunk_timeline_links", "select"), db.calls[rpc_at:])
+
+    def test_failed_chunk_retries_row_by_row(self):
+        from core.global_data_sync import _SyncWriter
+
+        db = _db({"chunk_bible_links": [
+            {"id": "a", "chunk_id": "c1", "bible_entry_id": 1},
+            {"id": "b", "chunk_id": "c2", "bible_entry_id": 1},
+            {"id": "x", "chunk_id": "c1", "bible_entry_id": 2},
+        ]})
+        n = _SyncWriter(db, bulk=True).update("chunk_bible_links", {"a": {"bible_entry_id": 2}, "b": {"bible_entry_id": 2}})
+        self.assertEqual(n, 1)  # "a" → (c1, 2) trùng "x" nên lỗi; "b" → (c2, 2) vẫn được ghi
+        self.assertEqual({r["id"]: r["bible_entry_id"] for r in db.tables["chunk_bible_links"]}, {"a": 1, "b": 2, "x": 2})
+        self.assertEqual(db.calls.count(("chunk_bible_links", "update")), 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+# tests/test_global_data_sync_incremental.py
+"""
+Unit test: run_global_data_sync(mode="incremental") trên Supabase giả trong bộ nhớ.
+- Có watermark: chỉ xử lý dòng đổi sau watermark (orphan cũ không bị đụng), lưu watermark mới.
+- Chưa có watermark / DB chưa có cột updated_at → quét toàn bộ.
+- Không có thay đổi → thoát sớm, không tải story_bible.
+- Hơn max-rows (1000) dòng đổi: đọc theo trang đến hết, watermark = updated_at lớn nhất thực sự đã đọc.
+- Dòng do chính lần đồng bộ ghi (trigger V14 đổi updated_at) không bị lần sau xử lý lại; thay đổi từ nơi khác thì có.
+- Bảng hơn max-rows (không có RPC dọn orphan): link hợp lệ tới chunk ngoài 1000 dòng đầu không bị xóa nhầm.
+
+Chạy: python -m pytest tests/test_global_data_sync_incremental.py -v
+"""
+import unittest
+from unittest.mock import patch
+
+from tests.fake_supabase import FakeSupabase
+
+
+def _db(tables, has_updated_at=True):
+    missing = {} if has_updated_at else {t: {"updated_at"} for t in tables if t != "global_sync_state"}
+    return FakeSupabase(tables, missing_columns=missing)
+
+
+OLD = "2026-01-01T00:00:00+00:00"
+WATERMARK = "2026-02-01T00:00:00+00:00"
+NEW = "2026-03-01T00:00:00+00:00"
+LATER = "2026-04-01T00:00:00+00:00"
+
+
+def _touch_on_update(db, now, on_first_update=None):
+    """Như trigger touch_updated_at (V14): mọi update đặt updated_at = now; on_first_update chạy ở lần update đầu."""
+    table = db.table
+    pending = [on_first_update] if on_first_update else []
+
+    def _table(name):
+        q = table(name)
+        update = q.update
+
+        def _update(values):
+            while pending:
+                pending.pop()()
+            return update({**values, "updated_at": now})
+        q.update = _update
+        return q
+    db.table = _table
+
+
+def _tables(watermark=WATERMARK):
+    chunks = [
+        {"id": "c1", "story_id": "p", "chapter_id": "ch1", "content": "a", "raw_content": "", "parent_chunk_id": None,
+         "embedding": None, "updated_at": OLD},
+        {"id": "c2", "story_id": "p", "chapter_id": "ch2", "content": "b", "raw_content": "", "parent_chunk_id": None,
+         "embedding": None, "updated_at": NEW},
+    ]
+    bible = [{"id": 1, "story_id": "p", "entity_name": "[CHARACTER] An", "source_chapter": 1, "parent_id": None,
+              "embedding": None, "updated_at": OLD}]
+    links = [
+        # Orphan cũ (trước watermark): chỉ lần quét toàn bộ dọn.
+        {"id": "l_old", "story_id": "p", "chunk_id": "c_gone", "bible_entry_id": 1, "updated_at": OLD},
+        # Orphan mới (sau watermark): incremental phải dọn.
+        {"id": "l_new", "story_id": "p", "chunk_id": "c2", "bible_entry_id": 99, "updated_at": NEW},
+        {"id": "l_ok", "story_id": "p", "chunk_id": "c1", "bible_entry_id": 1, "updated_at": OLD},
+    ]
+    state = [{"story_id": "p", "watermark": watermark, "last_mode": "full"}] if watermark else []
+    return {
+        "story_bible": bible,
+        "chunks": chunks,
+        "timeline_events": [],
+        "chapters": [{"id": "ch1", "story_id": "p", "chapter_number": 1},
+                     {"id": "ch2", "story_id": "p", "chapter_number": 2}],
+        "chunk_bible_links": links,
+        "chunk_timeline_links": [],
+        "entity_relations": [],
+        "global_sync_state": state,
+    }
+
+
+class TestGlobalDataSyncIncremental(unittest.TestCase):
+    def _run(self, db):
+        from core import global_data_sync
+
+        with patch.object(global_data_sync, "_get_supabase", return_value=db), \
+                patch("ai.vector_index.invalidate_vector_index"):
+            return global_data_sync.run_global_data_sync("p", mode="incremental")
+
+    def _link_ids(self, db):
+        return {r["id"] for r in db.tables["chunk_bible_links"]}
+
+    def test_incremental_only_touches_changes_and_advances_watermark(self):
+        db = _db(_tables())
+        out = self._run(db)
+        self.assertTrue(out["success"], out["error"])
+        self.assertEqual(out["mode"], "incremental")
+        self.assertEqual(out["report"]["changed_rows"], 2)  # c2 + l_new
+        self.assertEqual(out["fixed"]["chunk_bible_links_deleted"], 1)
+        self.assertEqual(self._link_ids(db), {"l_old", "l_ok"})
+        state, = db.tables["global_sync_state"]
+        self.assertEqual((state["watermark"], state["last_mode"], state["last_changed_rows"]), (NEW, "incremental", 2))
+
+    def test_changes_past_row_cap_are_all_read(self):
+        tables = _tables()
+        # 1200 orphan link đổi sau watermark (quá max-rows 1000), dòng chèn sau có updated_at muộn hơn.
+        tables["chunk_bible_links"] += [
+            {"id": f"l_many{i}", "story_id": "p", "chunk_id": "c_gone", "bible_entry_id": 1,
+             "updated_at": f"2026-03-01T00:{i // 60:02d}:{i % 60:02d}+00:00"}
+            for i in range(1200)
+        ]
+        db = _db(tables)
+        out = self._run(db)
+        self.assertTrue(out["success"], out["error"])
+        self.assertEqual(out["report"]["changed_rows"], 1202)
+        self.assertEqual(out["fixed"]["chunk_bible_links_deleted"], 1201)
+        self.assertEqual(self._link_ids(db), {"l_old", "l_ok"})
+        self.assertEqual(db.tables["global_sync_state"][0]["watermark"], "2026-03-01T00:19:59+00:00")
+
+    def test_without_watermark_falls_back_to_full(self):
+        db = _db(_tables(watermark=None))
+        out = self._run(db)
+        self.assertEqual(out["mode"], "full")
+        self.assertEqual(self._link_ids(db), {"l_ok"})
+        state, = db.tables["global_sync_state"]
+        self.assertEqual((state["watermark"], state["last_mode"]), (NEW, "full"))
+        self.assertIn("last_full_sync_at", state)
+
+    def test_missing_updated_at_column_falls_back_to_full(self):
+        db = _db(_tables(), has_updated_at=False)
+        out = self._run(db)
+        self.assertTrue(out["success"], out["error"])
+        self.assertEqual(out["mode"], "full")
+        self.assertEqual(self._link_ids(db), {"l_ok"})
+
+    def test_no_changes_exits_early(self):
+        db = _db(_tables(watermark=NEW))
+        out = self._run(db)
+        self.assertTrue(out["success"])
+        self.assertEqual(out["report"]["changed_rows"], 0)
+        # Chỉ một lần đọc story_bible (dò thay đổi sau watermark), không tải toàn bảng.
+        self.assertEqual(db.calls.count(("story_bible", "select")), 1)
+        self.assertEqual(len(self._link_ids(db)), 3)
+        self.assertEqual(db.tables["global_sync_state"][0]["watermark"], NEW)
+
+    def test_own_writes_are_not_reprocessed(self):
+        tables = _tables()
+        # Timeline đổi sau watermark trỏ chương đã xóa → đồng bộ đặt chapter_id = NULL (trigger đổi updated_at).
+        tables["timeline_events"] = [{"id": "t1", "story_id": "p", "chapter_id": "ch_gone", "updated_at": NEW}]
+        db = _db(tables)
+
+        def _foreign_write():
+            # Ghi từ nơi khác trong lúc đồng bộ chạy, sau các dòng tự ghi.
+            tables["chunks"][0]["updated_at"] = "2026-04-02T00:00:00+00:00"
+        _touch_on_update(db, LATER, _foreign_write)
+        out = self._run(db)
+        self.assertTrue(out["success"], out["error"])
+        self.assertEqual(out["fixed"]["timeline_events_null_chapter"], 1)
+        self.assertEqual(db.tables["global_sync_state"][0]["watermark"], LATER)
+
+        out = self._run(db)
+        self.assertTrue(out["success"], out["error"])
+        self.assertEqual(out["report"]["changed_rows"], 1)  # chỉ c1 (ghi từ nơi khác), không phải t1
+
+    def test_valid_links_past_row_cap_are_kept(self):
+        tables = _tables()
+        tables["chunks"] += [
+            {"id": f"c_many{i}", "story_id": "p", "chapter_id": "ch1", "content": "", "raw_content": "",
+             "parent_chunk_id": None, "embedding": None, "updated_at": OLD}
+            for i in range(1200)
+        ]
+        # Link hợp lệ đổi sau watermark, trỏ chunk nằm ngoài 1000 dòng đầu.
+        tables["chunk_bible_links"].append(
+            {"id": "l_far", "story_id": "p", "chunk_id": "c_many1199", "bible_entry_id": 1, "updated_at": NEW}
+        )
+        db = _db(tables)
+        out = self._run(db)
+        self.assertTrue(out["success"], out["error"])
+        self.assertEqual(out["fixed"]["chunk_bible_links_deleted"], 1)  # chỉ l_new
+        self.assertEqual(self._link_ids(db), {"l_old", "l_ok", "l_far"})
+
+
+if __name__ == "__main__":
+    unittest.main()
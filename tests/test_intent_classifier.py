@@ -0,0 +1,138 @@
+# tests/test_intent_classifier.py
+"""
+Unit test: ai.intent_classifier (phân loại intent cục bộ trước LLM router).
+- Nearest-centroid: câu gần cụm → đúng intent, độ tin cậy cao; câu lưng chừng hai cụm → độ tin cậy thấp.
+- Hiệu chỉnh: trên dữ liệu mới cùng phân phối, độ tin cậy trung bình sát tỷ lệ đúng.
+- classify_intent_locally: đủ tự tin → step1 (không gọi LLM); câu đặt luật / thiếu tự tin / có lịch sử gần đây → None.
+- get_intent_classifier: không huấn luyện trong lượt chat (thread nền), hết hạn vẫn trả mô hình cũ.
+
+Chạy: python -m pytest tests/test_intent_classifier.py -v
+"""
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+_INTENTS = ["chat_casual", "search_context", "web_search"]
+
+
+def _samples(rng, centers, n_per, noise):
+    vecs, labels = [], []
+    for intent, center in zip(_INTENTS, centers):
+        for _ in range(n_per):
+            vecs.append((center + rng.normal(0, noise, center.shape)).tolist())
+            labels.append(intent)
+    return vecs, labels
+
+
+class TestNearestCentroid(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.centers = [self.rng.normal(0, 1, 32) for _ in _INTENTS]
+
+    def test_confident_near_cluster_unsure_between(self):
+        from ai.intent_classifier import NearestCentroidIntentClassifier
+
+        vecs, labels = _samples(self.rng, self.centers, 20, 0.3)
+        vecs.append(None)  # embedding lỗi bị bỏ qua
+        labels.append("chat_casual")
+        clf = NearestCentroidIntentClassifier(vecs, labels, min_samples=5)
+        self.assertEqual(clf.intents, sorted(_INTENTS))
+        self.assertEqual(len(clf), 60)
+        self.assertGreater(clf.loo_accuracy, 0.95)
+        intent, conf = clf.predict(self.centers[1] + self.rng.normal(0, 0.1, 32))
+        self.assertEqual(intent, "search_context")
+        self.assertGreater(conf, 0.9)
+        _, conf_mid = clf.predict((self.centers[0] + self.centers[1]) / 2)
+        self.assertLess(conf_mid, 0.8)
+
+    def test_confidence_is_calibrated_on_held_out(self):
+        from ai.intent_classifier import NearestCentroidIntentClassifier
+
+        vecs, labels = _samples(self.rng, self.centers, 40, 1.6)
+        clf = NearestCentroidIntentClassifier(vecs, labels)
+        test_vecs, test_labels = _samples(self.rng, self.centers, 200, 1.6)
+        preds = [clf.predict(v) for v in test_vecs]
+        accuracy = np.mean([p[0] == lab for p, lab in zip(preds, test_labels)])
+        mean_conf = np.mean([p[1] for p in preds])
+        self.assertLess(accuracy, 0.98)  # đủ khó để có lỗi
+        self.assertLess(abs(mean_conf - accuracy), 0.08)
+
+    def test_needs_two_intents_with_enough_samples(self):
+        from ai.intent_classifier import NearestCentroidIntentClassifier
+
+        vecs, labels = _samples(self.rng, self.centers, 3, 0.3)
+        clf = NearestCentroidIntentClassifier(vecs, labels, min_samples=5)
+        self.assertIsNone(clf.predict(self.centers[0]))
+
+
+class TestClassifyLocally(unittest.TestCase):
+    def test_bypass_only_when_confident_and_no_rule(self):
+        from ai import intent_classifier
+        from ai.intent_classifier import NearestCentroidIntentClassifier, classify_intent_locally
+
+        rng = np.random.default_rng(1)
+        centers = [rng.normal(0, 1, 16) for _ in _INTENTS]
+        clf = NearestCentroidIntentClassifier(*_samples(rng, centers, 10, 0.2))
+        before = intent_classifier.local_intent_stats()["local_hits"]
+        with patch.object(intent_classifier, "get_intent_classifier", return_value=clf):
+            step1 = classify_intent_locally("Lan là ai?", "p1", query_embedding=centers[1].tolist())
+            rule = classify_intent_locally("Từ giờ hãy nhớ trả lời ngắn", "p1", query_embedding=centers[0].tolist())
+            unsure = classify_intent_locally("ừm", "p1", query_embedding=((centers[0] + centers[2]) / 2).tolist())
+            follow_up = classify_intent_locally(
+                "Còn cô ấy thì sao?", "p1", query_embedding=centers[1].tolist(),
+                recent_history_text="user: Lan là ai?\nassistant: Lan là nữ chính.",
+            )
+        self.assertEqual(step1["intent"], "search_context")
+        self.assertTrue(step1["needs_data"])
+        self.assertEqual(step1["intent_source"], "local")
+        self.assertEqual(step1["new_rules"], [])
+        self.assertIsNone(rule)
+        self.assertIsNone(unsure)
+        self.assertIsNone(follow_up)
+        self.assertEqual(intent_classifier.local_intent_stats()["local_hits"], before + 1)
+
+
+class TestBackgroundTraining(unittest.TestCase):
+    def test_training_runs_off_the_chat_turn(self):
+        from ai import intent_classifier
+
+        release = threading.Event()
+        built = []
+
+        def _build(supabase, project_id):
+            release.wait(5)
+            built.append(project_id)
+            return "model-%d" % len(built)
+
+        with patch.dict(intent_classifier._classifiers, {}, clear=True), \
+                patch.object(intent_classifier, "init_services", return_value={"supabase": object()}), \
+                patch.object(intent_classifier, "build_intent_classifier", side_effect=_build):
+            t0 = time.perf_counter()
+            self.assertIsNone(intent_classifier.get_intent_classifier("p1"))
+            self.assertIsNone(intent_classifier.get_intent_classifier("p1"))
+            self.assertLess(time.perf_counter() - t0, 1.0)
+            release.set()
+            for _ in range(100):
+                if intent_classifier.get_intent_classifier("p1"):
+                    break
+                time.sleep(0.02)
+            self.assertEqual(intent_classifier.get_intent_classifier("p1"), "model-1")
+            self.assertEqual(built, ["p1"])
+
+            # Hết TTL: trả mô hình cũ ngay, huấn luyện lại ở nền.
+            release.clear()
+            intent_classifier._classifiers["p1"] = (0.0, "model-1")
+            self.assertEqual(intent_classifier.get_intent_classifier("p1"), "model-1")
+            release.set()
+            for _ in range(100):
+                if intent_classifier.get_intent_classifier("p1") == "model-2":
+                    break
+                time.sleep(0.02)
+            self.assertEqual(intent_classifier.get_intent_classifier("p1"), "model-2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+# tests/test_job_progress.py
+"""
+Unit test: core.job_progress (tiến độ + hủy hợp tác) trên bảng background_jobs giả trong bộ nhớ.
+- Ghi tiến độ tối đa mỗi min_interval_sec; flush() ghi ngay; ETA theo tốc độ trung bình.
+- Cờ cancel_requested đọc từ chính lệnh UPDATE tiến độ.
+- Lỗi tạm thời khi ghi: lần sau thử lại (vẫn hủy được); chỉ thiếu cột (chưa V15) mới tắt hẳn.
+- request_cancel: pending → cancelled ngay, running → bật cờ.
+- run_unified_chapter_range dừng trước chương kế tiếp khi bị hủy và ghi status cancelled.
+
+Chạy: python -m pytest tests/test_job_progress.py -v
+"""
+import unittest
+from unittest.mock import patch
+
+from tests.fake_supabase import FakeSupabase
+
+
+def _db(rows):
+    return FakeSupabase({"background_jobs": rows})
+
+
+def _rows(db):
+    return db.tables["background_jobs"]
+
+
+class _Clock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+class TestJobProgress(unittest.TestCase):
+    def test_writes_are_throttled_and_eta_estimated(self):
+        from core.job_progress import JobProgress
+
+        db = _db([{"id": "j1", "status": "running"}])
+        clock = _Clock()
+        progress = JobProgress("j1", total=10, supabase=db, min_interval_sec=5, clock=clock)
+        for _ in range(4):
+            clock.t += 1
+            progress.advance()
+        self.assertEqual(db.count("background_jobs", "update"), 1)  # lần đầu ghi ngay, 3 lần sau trong khoảng 5s bị gộp
+        clock.t += 5
+        progress.advance(message="Chương 5")
+        self.assertEqual(db.count("background_jobs", "update"), 2)
+        row = _rows(db)[0]
+        self.assertEqual((row["progress_current"], row["progress_total"], row["progress_message"]), (5, 10, "Chương 5"))
+        self.assertEqual(row["progress_eta_sec"], 9)  # 9s cho 5 đơn vị → còn 5 đơn vị ≈ 9s
+        progress.flush()
+        self.assertEqual(db.count("background_jobs", "update"), 3)
+
+    def test_cancel_flag_read_from_progress_update(self):
+        from core.job_progress import JobCancelled, JobProgress
+
+        db = _db([{"id": "j1", "status": "running", "cancel_requested": False}])
+        clock = _Clock()
+        progress = JobProgress("j1", total=3, supabase=db, min_interval_sec=5, clock=clock)
+        self.assertFalse(progress.is_cancelled())
+        _rows(db)[0]["cancel_requested"] = True
+        self.assertFalse(progress.is_cancelled())  # chưa tới lượt đọc lại
+        clock.t += 5
+        with self.assertRaises(JobCancelled):
+            progress.raise_if_cancelled()
+
+    def test_transient_error_retries_and_missing_column_disables(self):
+        from core.job_progress import JobCancelled, JobProgress
+
+        db = _db([{"id": "j1", "status": "running", "cancel_requested": True}])
+        real_table = db.table
+        errors = [Exception("Server disconnected without sending a response")]
+
+        def _table(name):
+            if errors:
+                raise errors.pop(0)
+            return real_table(name)
+
+        clock = _Clock()
+        with patch.object(db, "table", side_effect=_table):
+            progress = JobProgress("j1", total=3, supabase=db, min_interval_sec=5, clock=clock)
+            self.assertFalse(progress.is_cancelled())
+            clock.t += 5
+            with self.assertRaises(JobCancelled):
+                progress.raise_if_cancelled()
+
+            errors.append(Exception("{'code': '42703', 'message': 'column background_jobs.progress_current does not exist'}"))
+            progress = JobProgress("j1", total=3, supabase=db, min_interval_sec=5, clock=clock)
+            self.assertFalse(progress.is_cancelled())
+            clock.t += 5
+            self.assertFalse(progress.is_cancelled())
+        self.assertEqual(db.count("background_jobs", "update"), 1)
+
+    def test_without_job_id_is_noop(self):
+        from core.job_progress import JobProgress
+
+        progress = JobProgress(None, total=3)
+        progress.advance()
+        progress.flush()
+        self.assertFalse(progress.is_cancelled())
+
+    def test_request_cancel_pending_and_running(self):
+        from core.job_progress import request_cancel
+
+        db = _db([
+            {"id": "p", "status": "pending"},
+            {"id": "r", "status": "running"},
+            {"id": "c", "status": "completed"},
+        ])
+        self.assertEqual(request_cancel("p", db), "cancelled")
+        self.assertEqual(request_cancel("r", db), "requested")
+        self.assertEqual(request_cancel("c", db), "")
+        status = {r["id"]: (r["status"], r.get("cancel_requested")) for r in _rows(db)}
+        self.assertEqual(status, {"p": ("cancelled", None), "r": ("running", True), "c": ("completed", None)})
+
+
+class TestUnifiedRangeCancel(unittest.TestCase):
+    def test_range_stops_before_next_chapter(self):
+        from core import job_progress
+        from core import unified_chapter_analyze as uca
+        from config import Config
+
+        db = _db([{"id": "job1", "status": "running", "cancel_requested": False}])
+        saves = []
+        job_updates = []
+
+        def _save(project_id, ch, **_kw):
+            saves.append(ch)
+            if ch == 2:
+                _rows(db)[0]["cancel_requested"] = True
+            return {"success": True}
+
+        with patch.object(job_progress, "_get_supabase", return_value=db), \
+                patch("core.job_llm_store._get_supabase", return_value=None), \
+                patch.object(Config, "JOB_PROGRESS_MIN_INTERVAL_SEC", 0, create=True), \
+                patch.object(uca, "run_unified_chapter_analyze", side_effect=_save):
+            out = uca.run_unified_chapter_range(
+                "p1", 1, 5, job_id="job1",
+                update_job_fn=lambda *a, **kw: job_updates.append((a, kw)),
+                max_inflight=1,
+            )
+        self.assertEqual(saves, [1, 2])
+        self.assertTrue(out["cancelled"])
+        self.assertEqual((out["ok"], out["total"]), (2, 5))
+        (args, kwargs), = job_updates
+        self.assertEqual(args[1], "cancelled")
+        self.assertIn("Đã hủy", kwargs["result_summary"])
+        self.assertEqual(_rows(db)[0]["progress_current"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
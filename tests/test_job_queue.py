@@ -0,0 +1,153 @@
+# tests/test_job_queue.py
+"""
+Unit test: core.job_queue (worker pool + lease cho background_jobs) trên bảng giả trong bộ nhớ.
+- Hai pool (hai "process") cùng chia hàng đợi: mỗi job chạy đúng một lần, có chạy song song.
+- Giới hạn theo project / loại job.
+- Job running có lease hết hạn → pending; quá JOB_MAX_ATTEMPTS lần → failed.
+- Lane ưu tiên + aging + fair share theo user; giới hạn theo lane; job interactive không bị khuất sau cửa sổ bulk.
+
+Chạy: python -m pytest tests/test_job_queue.py -v
+"""
+import threading
+import time
+import unittest
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from tests.fake_supabase import FakeSupabase
+
+
+def _db(rows):
+    return FakeSupabase({"background_jobs": rows})
+
+
+def _rows(db):
+    return db.tables["background_jobs"]
+
+
+def _job(i, story="s1", job_type="data_analyze_chunk", **extra):
+    return {"id": f"j{i}", "story_id": story, "job_type": job_type, "status": "pending",
+            "created_at": f"2026-01-01T00:00:{i:02d}+00:00", "attempts": 0, "claimed_by": None,
+            "lease_expires_at": None, **extra}
+
+
+class TestJobWorkerPool(unittest.TestCase):
+    def test_two_pools_share_queue_each_job_runs_once(self):
+        from core import job_queue
+
+        db = _db([_job(i, story=f"s{i}") for i in range(8)])
+        runs = Counter()
+        state = {"active": 0, "peak": 0}
+        lock = threading.Lock()
+
+        def _run(job_id):
+            with lock:
+                runs[job_id] += 1
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            time.sleep(0.05)
+            with lock:
+                state["active"] -= 1
+            with db.lock:
+                next(r for r in _rows(db) if r["id"] == job_id)["status"] = "completed"
+
+        with patch.object(job_queue, "job_limits", return_value={"max_workers": 3, "per_project": 1, "per_type": {}}):
+            pools = [job_queue.JobWorkerPool(_run, db, worker_id=f"w{n}", poll_sec=0.01) for n in range(2)]
+            threads = [threading.Thread(target=p.run_until_idle) for p in pools]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join(timeout=10)
+
+        self.assertEqual(runs, Counter({f"j{i}": 1 for i in range(8)}))
+        self.assertGreater(state["peak"], 1)
+        self.assertTrue(all(r["lease_expires_at"] is None and r["attempts"] == 1 for r in _rows(db)))
+
+    def test_pick_claimable_respects_project_and_type_caps(self):
+        from core.job_queue import pick_claimable
+
+        jobs = [_job(0, "s1"), _job(1, "s2", "unified_chapter_range"), _job(2, "s3"), _job(3, "s3", "global_data_sync")]
+        picked = pick_claimable(
+            jobs,
+            Counter({"s1": 1}),
+            Counter({"unified_chapter_range": 2}),
+            {"per_project": 1, "per_type": {"unified_chapter_range": 2, "global_data_sync": 1}},
+        )
+        self.assertEqual([j["id"] for j in picked], ["j2", "j3"])
+
+    def test_expired_leases_requeued_or_failed(self):
+        from core import job_queue
+
+        past = (datetime.now(tz=timezone.utc) - timedelta(minutes=5)).isoformat()
+        future = (datetime.now(tz=timezone.utc) + timedelta(minutes=5)).isoformat()
+        db = _db([
+            _job(0, status="running", claimed_by="dead", lease_expires_at=past, attempts=1),
+            _job(1, status="running", claimed_by="dead", lease_expires_at=past, attempts=3),
+            _job(2, status="running", claimed_by="alive", lease_expires_at=future, attempts=1),
+        ])
+        with patch.object(job_queue, "_cfg", side_effect=lambda name, default: 3 if name == "JOB_MAX_ATTEMPTS" else default):
+            self.assertEqual(job_queue.requeue_expired_leases(db), 1)
+        status = {r["id"]: (r["status"], r["claimed_by"]) for r in _rows(db)}
+        self.assertEqual(status, {"j0": ("pending", None), "j1": ("failed", None), "j2": ("running", "alive")})
+
+
+class TestPriorityLanes(unittest.TestCase):
+    NOW = datetime(2026, 1, 1, 1, 0, tzinfo=timezone.utc)
+
+    def _at(self, minutes_ago):
+        return (self.NOW - timedelta(minutes=minutes_ago)).isoformat()
+
+    def test_lane_then_fair_share_then_age(self):
+        from core.job_queue import order_candidates
+
+        jobs = [
+            _job(0, priority="bulk", user_id="a", created_at=self._at(9)),
+            _job(1, priority="normal", user_id="a", created_at=self._at(8)),
+            _job(2, priority="interactive", user_id="a", created_at=self._at(3)),
+            _job(3, priority="interactive", user_id="b", created_at=self._at(2)),
+        ]
+        ordered = order_candidates(jobs, Counter({"a": 1}), Counter(), now=self.NOW, aging_sec=3600)
+        self.assertEqual([j["id"] for j in ordered], ["j3", "j2", "j1", "j0"])
+
+    def test_aging_promotes_waiting_bulk_job(self):
+        from core.job_queue import effective_rank, order_candidates
+
+        old_bulk = _job(0, priority="bulk", created_at=self._at(25))
+        fresh = _job(1, priority="interactive", created_at=self._at(1))
+        self.assertEqual(effective_rank(old_bulk, self.NOW, aging_sec=600), 0)
+        ordered = order_candidates([fresh, old_bulk], Counter(), Counter(), now=self.NOW, aging_sec=600)
+        self.assertEqual([j["id"] for j in ordered], ["j0", "j1"])
+
+    def test_lane_from_job_type_without_priority_column(self):
+        from core.job_queue import job_lane
+
+        self.assertEqual(job_lane({"job_type": "global_data_sync"}), "bulk")
+        self.assertEqual(job_lane({"job_type": "data_analyze_chunk"}), "interactive")
+        self.assertEqual(job_lane({"job_type": "unknown"}), "normal")
+        self.assertEqual(job_lane({"job_type": "global_data_sync", "priority": "interactive"}), "interactive")
+
+    def test_lane_cap_and_interactive_bypass_project_cap(self):
+        from core.job_queue import pick_claimable
+
+        jobs = [_job(0, "s1", priority="bulk"), _job(1, "s1", priority="interactive"), _job(2, "s2", priority="bulk")]
+        limits = {"per_project": 1, "per_type": {}, "per_lane": {"bulk": 2}, "interactive_bypass_project": True}
+        picked = pick_claimable(jobs, Counter({"s1": 1}), Counter(), limits, Counter(), Counter({"bulk": 2}))
+        self.assertEqual([j["id"] for j in picked], ["j1"])
+
+    def test_pool_sees_interactive_job_behind_bulk_window(self):
+        from core import job_queue
+
+        rows = [_job(i, story=f"s{i}", priority="bulk") for i in range(5)]
+        rows.append(_job(59, story="s9", priority="interactive"))
+        db = _db(rows)
+        pool = job_queue.JobWorkerPool(lambda _jid: None, db, worker_id="w0", poll_sec=0.01)
+        with patch.object(job_queue, "_CANDIDATE_WINDOW", 3), \
+                patch("config.Config.JOB_PRIORITY_AGING_SEC", 0):
+            job, seen = pool.claim_next()
+        self.assertEqual(job["id"], "j59")
+        self.assertEqual(seen, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
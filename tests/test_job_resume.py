@@ -0,0 +1,84 @@
+# tests/test_job_resume.py
+"""
+Unit test: job chạy lại từ checkpoint (core/job_llm_store) trên Supabase giả trong bộ nhớ.
+- unified_chapter_range: bỏ chương đã lưu xong, chương đã extract dùng lại kết quả LLM, chỉ gọi LLM chương còn lại.
+- data_operation_batch: chỉ chạy chương chưa có checkpoint, giữ lỗi đã ghi lần trước.
+
+Chạy: python -m pytest tests/test_job_resume.py -v
+"""
+import unittest
+from unittest.mock import patch
+
+from tests.fake_supabase import FakeSupabase
+
+
+def _result_row(step_type, step_key, parsed):
+    return {"id": f"r-{step_type}-{step_key}", "job_id": "job1", "step_type": step_type, "step_key": step_key,
+            "parsed_result": parsed, "status": "success"}
+
+
+class TestJobResume(unittest.TestCase):
+    def test_unified_range_skips_saved_and_replays_extracted(self):
+        from core import unified_chapter_analyze as uca
+
+        db = FakeSupabase({"job_llm_results": [
+            _result_row("checkpoint", "unified:1", {}),
+            _result_row("checkpoint", "unified:2", {}),
+            _result_row("unified", "2", {"marker": 2}),
+            _result_row("unified", "3", {"marker": 3}),
+        ]})
+        extracted, saves = [], []
+
+        def _extract(project_id, ch, job_id):
+            extracted.append(ch)
+            return {"marker": ch}, None
+
+        def _save(project_id, ch, stored_data=None, **_kw):
+            saves.append((ch, stored_data["marker"]))
+            return {"success": True}
+
+        with patch("core.job_llm_store._get_supabase", return_value=db), \
+                patch("core.job_progress._get_supabase", return_value=None), \
+                patch.object(uca, "_extract_for_range", side_effect=_extract), \
+                patch.object(uca, "run_unified_chapter_analyze", side_effect=_save):
+            out = uca.run_unified_chapter_range("p1", 1, 5, job_id="job1", update_job_fn=lambda *a, **kw: None, max_inflight=2)
+
+        self.assertEqual(saves, [(3, 3), (4, 4), (5, 5)])
+        self.assertEqual(extracted, [4, 5])
+        self.assertEqual((out["ok"], out["total"], out["success"]), (5, 5, True))
+        checkpoints = {r["step_key"] for r in db.tables["job_llm_results"] if r["step_type"] == "checkpoint"}
+        self.assertEqual(checkpoints, {f"unified:{ch}" for ch in range(1, 6)})
+
+    def test_data_operation_batch_runs_only_remaining_chapters(self):
+        from core import data_operation_jobs as doj
+
+        db = FakeSupabase({
+            "job_llm_results": [_result_row("checkpoint", "op:extract:bible:1-3", {
+                "operation_type": "extract", "target": "bible", "chapters": [1, 2, 3], "failed": ["bible ch.2: lỗi cũ"],
+            })],
+            "background_jobs": [{"id": "job1", "status": "running"}],
+        })
+        runs = []
+
+        def _chunk(**kw):
+            runs.append(kw["chapter_numbers"])
+            return []
+
+        with patch("core.job_llm_store._get_supabase", return_value=db), \
+                patch("core.job_progress._get_supabase", return_value=None), \
+                patch("config.init_services", return_value={"supabase": db}), \
+                patch.object(doj, "_token_estimates_for_steps", return_value=None), \
+                patch.object(doj, "run_data_operation_chunk", side_effect=_chunk):
+            doj.run_data_operations_batch(
+                "p1", "u1", [{"operation_type": "extract", "target": "bible", "chapter_range": [1, 5]}], "req", job_id="job1",
+            )
+
+        self.assertEqual(runs, [[4, 5]])
+        job = db.tables["background_jobs"][0]
+        self.assertEqual(job["status"], "completed")
+        self.assertEqual(job["error_message"], "bible ch.2: lỗi cũ")
+        self.assertTrue(job["result_summary"].startswith("5 thao tác"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+# tests/test_job_runner.py
+"""
+Unit test: core.job_runner (runner thường trực đánh thức theo sự kiện) trên bảng background_jobs giả.
+- Job tạo lúc runner rảnh bắt đầu ngay khi có tín hiệu UDP, không đợi polling fallback.
+- notify_job_runner không làm gì khi tắt kênh UDP.
+
+Chạy: python -m pytest tests/test_job_runner.py -v
+"""
+import socket
+import threading
+import time
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+from tests.test_job_queue import _db, _job, _rows
+
+
+def _free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestJobRunner(unittest.TestCase):
+    def test_udp_wake_starts_new_job_without_polling(self):
+        from config import Config
+        from core import job_runner
+
+        db = _db([])
+        started = {}
+        done = threading.Event()
+
+        def _run(job_id):
+            started[job_id] = time.monotonic()
+            with db.lock:
+                next(r for r in _rows(db) if r["id"] == job_id)["status"] = "completed"
+            if len(started) == 2:
+                done.set()
+
+        port = _free_udp_port()
+        with patch.object(Config, "JOB_RUNNER_WAKE_PORT", port), \
+                patch.object(Config, "JOB_RUNNER_WAKE_HOST", "127.0.0.1"):
+            runner = job_runner.JobRunner(db, run_fn=_run, fallback_poll_sec=30, database_url="")
+            runner.pool.poll_sec = 30
+            thread = threading.Thread(target=runner.run_forever, daemon=True)
+            thread.start()
+            try:
+                time.sleep(0.2)  # runner đã quét hàng đợi rỗng, đang chờ tín hiệu
+                now = datetime.now(tz=timezone.utc).isoformat()
+                for i in range(2):
+                    with db.lock:
+                        _rows(db).append(_job(i, story=f"s{i}", created_at=now))
+                    created = time.monotonic()
+                    job_runner.notify_job_runner()
+                    deadline = time.monotonic() + 3
+                    while f"j{i}" not in started and time.monotonic() < deadline:
+                        time.sleep(0.01)
+                    self.assertIn(f"j{i}", started)
+                    self.assertLess(started[f"j{i}"] - created, 2.0)
+                self.assertTrue(done.wait(3))
+            finally:
+                runner.request_stop()
+                thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+
+    def test_notify_without_port_is_noop(self):
+        from config import Config
+        from core import job_runner
+
+        with patch.object(Config, "JOB_RUNNER_WAKE_PORT", 0):
+            job_runner.notify_job_runner()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+# tests/test_map_reduce_analysis.py
+"""
+Unit test: ai.map_reduce_analysis (map-reduce cho multi_chapter_analysis) với Supabase / OpenRouter giả.
+- Đoạn map theo lưới cố định, tách tiếp theo token; nhóm reduce ít nhất 2 ghi chú.
+- Cây reduce đưa tổng ghi chú về vừa phần context của model trả lời.
+- Câu hỏi tiếp theo trên cùng khoảng chương: map lấy từ response cache, chỉ gọi lại reduce.
+- _call_text: lỗi không thử lại chồng lên call_openrouter; JSON hỏng thử lại một lần, bỏ qua và ghi đè cache.
+- CallBudget: số lệnh LLM nội bộ không vượt giới hạn của lượt, đoạn map bị bớt được báo skipped.
+
+Chạy: python -m pytest tests/test_map_reduce_analysis.py -v
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+from tests.fake_supabase import FakeSupabase
+
+
+class _FakeCompletions:
+    def __init__(self):
+        self.map_calls = 0
+        self.reduce_calls = 0
+        self.lock = threading.Lock()
+
+    def create(self, model, messages, response_format=None, **kwargs):
+        user = messages[-1]["content"]
+        with self.lock:
+            if response_format:
+                self.map_calls += 1
+                nums = [int(n) for n in re.findall(r"=== CHƯƠNG (\d+)", user)]
+                content = json.dumps({
+                    "chapters": [{"chapter": n, "summary": "Tóm tắt " + "x" * 200, "events": ["sự kiện"], "characters": ["Lan"]}
+                                 for n in nums],
+                    "open_threads": ["bí ẩn"],
+                }, ensure_ascii=False)
+            else:
+                self.reduce_calls += 1
+                start, end = re.search(r"cho chương (\d+)-(\d+)", user).groups()
+                content = f"### Chương {start}–{end}\nGộp: " + "z" * 1000
+        return MagicMock(
+            choices=[MagicMock(message=MagicMock(content=content))],
+            usage=MagicMock(prompt_tokens=1000, completion_tokens=100),
+        )
+
+
+class TestSegmentsAndGrouping(unittest.TestCase):
+    def test_grid_segments_are_aligned(self):
+        from ai.map_reduce_analysis import grid_segments
+
+        self.assertEqual(grid_segments(15, 42, 10), [(15, 20), (21, 30), (31, 40), (41, 42)])
+        self.assertEqual(grid_segments(1, 10, 10), [(1, 10)])
+
+    def test_plan_splits_cell_by_tokens_and_skips_empty(self):
+        from ai.map_reduce_analysis import plan_map_segments
+
+        chapters = [{"chapter_number": n, "content": "a" * 4000} for n in range(1, 13)]
+        chapters[2]["content"] = ""
+        segments = plan_map_segments(chapters, 1, 12, 10, input_tokens=2500)
+        self.assertEqual([[r["chapter_number"] for r in s] for s in segments],
+                         [[1, 2], [4, 5], [6, 7], [8, 9], [10], [11, 12]])
+
+    def test_reduce_groups_have_at_least_two_nodes(self):
+        from ai.map_reduce_analysis import group_for_reduce
+
+        nodes = [{"range": (i, i), "text": "a" * 4000} for i in range(5)]
+        groups = group_for_reduce(nodes, input_tokens=1500)
+        self.assertEqual([len(g) for g in groups], [2, 3])
+
+
+class TestRunMapReduce(unittest.TestCase):
+    def setUp(self):
+        from ai.response_cache import ResponseCache
+        from config import Config
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(os.path.join(self.tmp.name, "resp.sqlite"))
+        self.completions = _FakeCompletions()
+        client = MagicMock()
+        client.chat.completions = self.completions
+        self.patches = [
+            patch("ai.response_cache.get_response_cache", return_value=self.cache),
+            patch("ai.service.get_openrouter_client", return_value=client),
+            patch.object(Config, "RATE_LIMIT_ENABLED", False),
+            patch.object(Config, "MULTI_CHAPTER_REDUCE_INPUT_TOKENS", 1000),
+            patch.object(Config, "MULTI_CHAPTER_REDUCE_OUTPUT_TOKENS", 100),
+        ]
+        for p in self.patches:
+            p.start()
+        chapters = [
+            {"story_id": "p1", "chapter_number": n, "title": f"C{n}", "content": f"Nội dung chương {n}. " + "y" * 2000}
+            for n in range(1, 61)
+        ]
+        self.db = FakeSupabase({"chapters": chapters})
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+        self.tmp.cleanup()
+
+    def _run(self, question):
+        from ai.map_reduce_analysis import run_map_reduce
+
+        return run_map_reduce("p1", 1, 60, question, token_limit=600, model="m", supabase=self.db)
+
+    def test_reduce_tree_fits_budget_and_follow_up_reuses_map(self):
+        first = self._run("Lan thay đổi thế nào?")
+        self.assertEqual(first["segments"], 6)
+        self.assertEqual(self.completions.map_calls, 6)
+        self.assertEqual(first["map_cached"], 0)
+        self.assertEqual((first["levels"], first["reduce_calls"]), (2, 4))  # 6 → 3 → 1
+        self.assertLessEqual(len(first["text"]) // 4, 300)
+        self.assertTrue(first["text"].startswith("### Chương 1–"))
+        self.assertIn("60", first["text"])
+
+        reduce_before = self.completions.reduce_calls
+        second = self._run("Bí ẩn nào còn bỏ ngỏ?")
+        self.assertEqual(self.completions.map_calls, 6)
+        self.assertEqual(second["map_cached"], 6)
+        self.assertGreater(self.completions.reduce_calls, reduce_before)
+
+    def test_call_budget_caps_internal_calls(self):
+        from ai.map_reduce_analysis import CallBudget, run_map_reduce
+
+        budget = CallBudget(5)
+        out = run_map_reduce("p1", 1, 60, "câu hỏi", token_limit=600, model="m", supabase=self.db, call_budget=budget)
+        self.assertEqual(out["segments"], 4)  # 5 lượt: chừa 1 cho reduce
+        self.assertEqual(out["skipped"], (41, 60))
+        self.assertEqual(budget.used, 5)
+        self.assertEqual(out["llm_calls"], 5)
+        self.assertEqual(self.completions.map_calls + self.completions.reduce_calls, 5)
+        self.assertIn("chưa được phân tích", out["text"])
+
+        # Lượt đã hết: không gọi thêm.
+        again = run_map_reduce("p1", 1, 60, "câu khác", token_limit=600, model="m", supabase=self.db, call_budget=budget)
+        self.assertEqual(again["segments"], 0)
+        self.assertEqual(self.completions.map_calls + self.completions.reduce_calls, 5)
+
+    def test_edited_chapter_is_mapped_again(self):
+        self._run("câu 1")
+        self.db.tables["chapters"][0]["content"] += " (sửa)"
+        second = self._run("câu 2")
+        self.assertEqual(self.completions.map_calls, 7)
+        self.assertEqual(second["map_cached"], 5)
+
+
+class TestCallText(unittest.TestCase):
+    def _resp(self, content, cached=False):
+        resp = MagicMock(choices=[MagicMock(message=MagicMock(content=content))])
+        resp.cached = cached
+        return resp
+
+    def test_errors_are_not_retried_on_top_of_call_openrouter(self):
+        from ai.map_reduce_analysis import CallBudget, _call_text
+
+        budget = CallBudget(10)
+        with patch("ai.service.AIService.call_openrouter", side_effect=RuntimeError("429")) as call:
+            with self.assertRaises(RuntimeError):
+                _call_text([{"role": "user", "content": "x"}], "m", 100, budget=budget)
+        self.assertEqual(call.call_count, 1)
+        self.assertEqual(budget.used, 1)
+
+    def test_invalid_json_retried_once_bypassing_cache(self):
+        from ai.map_reduce_analysis import CallBudget, _call_text
+
+        budget = CallBudget(10)
+        replies = [self._resp("{hỏng", cached=True), self._resp('{"chapters": []}')]
+        with patch("ai.service.AIService.call_openrouter", side_effect=replies) as call, \
+                patch("ai.response_cache.is_cacheable_call", return_value=True), \
+                patch("ai.response_cache.store_cached_response") as store:
+            text, cached = _call_text([{"role": "user", "content": "x"}], "m", 100, budget=budget, expect_json=True,
+                                      response_format={"type": "json_object"}, cache_site="multi_chapter_map")
+        self.assertEqual((text, cached), ('{"chapters": []}', False))
+        self.assertEqual(call.call_count, 2)
+        self.assertEqual(call.call_args_list[0].kwargs["cache_site"], "multi_chapter_map")
+        self.assertNotIn("cache_site", call.call_args_list[1].kwargs)
+        store.assert_called_once()
+        self.assertEqual(budget.used, 1)  # lần đầu lấy từ cache không tính
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+# tests/test_near_duplicates.py
+"""
+Unit test: ai.near_duplicates.near_duplicate_clusters.
+- Chế độ chính xác = thành phần liên thông của các cặp cosine >= ngưỡng (so với vòng lặp thuần Python).
+- LSH tìm lại các cụm near-duplicate rõ ràng; embedding lỗi bị bỏ qua.
+- global_data_sync: cả cụm trỏ về một parent (không tạo chuỗi parent), relation trùng chỉ giữ bản gốc.
+
+Chạy: python -m pytest tests/test_near_duplicates.py -v
+"""
+import random
+import unittest
+from unittest.mock import patch
+
+
+def _old_cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    na = sum(x * x for x in a) ** 0.5
+    nb = sum(y * y for y in b) ** 0.5
+    return dot / (na * nb) if na > 0 and nb > 0 else 0.0
+
+
+def _rows(n, dim, seed, dup_rate=0.4, noise=0.02):
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        if i and rnd.random() < dup_rate:
+            base = out[rnd.randrange(len(out))]
+            out.append([x + rnd.gauss(0, noise) for x in base])
+        else:
+            out.append([rnd.gauss(0, 1) for _ in range(dim)])
+    return out
+
+
+def _components(rows, threshold):
+    parent = list(range(len(rows)))
+
+    def find(i):
+        while parent[i] != i:
+            i = parent[i]
+        return i
+
+    for i in range(len(rows)):
+        for j in range(i + 1, len(rows)):
+            if _old_cosine(rows[i], rows[j]) >= threshold:
+                parent[max(find(i), find(j))] = min(find(i), find(j))
+    groups = {}
+    for i in range(len(rows)):
+        groups.setdefault(find(i), []).append(i)
+    return sorted((g for g in groups.values() if len(g) > 1), key=lambda g: g[0])
+
+
+class TestNearDuplicateClusters(unittest.TestCase):
+    def test_exact_matches_pairwise_components(self):
+        from ai import near_duplicates
+
+        rows = _rows(60, 16, seed=1)
+        with patch.object(near_duplicates, "_BLOCK_ROWS", 7):
+            clusters = near_duplicates.near_duplicate_clusters(rows, 0.9)
+        self.assertEqual(clusters, _components(rows, 0.9))
+        self.assertTrue(clusters)
+
+    def test_lsh_recovers_clear_duplicates_and_skips_invalid(self):
+        from ai.near_duplicates import near_duplicate_clusters
+
+        rows = _rows(300, 64, seed=2, dup_rate=0.3, noise=0.005)
+        rows[5] = None
+        rows[6] = "không phải vector"
+        exact = near_duplicate_clusters(rows, 0.97)
+        lsh = near_duplicate_clusters(rows, 0.97, lsh_min_rows=100, lsh_bits=6, lsh_tables=12)
+        self.assertEqual(lsh, exact)
+        self.assertFalse(any(i in (5, 6) for c in exact for i in c))
+
+
+class TestGlobalSyncClusters(unittest.TestCase):
+    def test_cluster_parent_points_to_root(self):
+        from core.global_data_sync import _cluster_parent_updates
+
+        base = [1.0, 0.0, 0.0, 0.0]
+        group = [
+            {"id": "a", "embedding": base, "parent_chunk_id": None},
+            {"id": "b", "embedding": [0.99, 0.05, 0.0, 0.0], "parent_chunk_id": None},
+            {"id": "c", "embedding": [0.98, 0.1, 0.0, 0.0], "parent_chunk_id": None},
+            {"id": "d", "embedding": [0.97, 0.1, 0.0, 0.0], "parent_chunk_id": "x"},
+            {"id": "e", "embedding": [0.0, 1.0, 0.0, 0.0], "parent_chunk_id": None},
+        ]
+        updates = _cluster_parent_updates(group, 0.9, "parent_chunk_id")
+        self.assertEqual(updates, {"b": {"parent_chunk_id": "a"}, "c": {"parent_chunk_id": "a"}})
+
+    def test_root_with_parent_passes_it_on(self):
+        from core.global_data_sync import _cluster_parent_updates
+
+        group = [
+            {"id": 1, "embedding": [1.0, 0.0], "parent_id": 9},
+            {"id": 2, "embedding": [1.0, 0.01], "parent_id": None},
+        ]
+        self.assertEqual(_cluster_parent_updates(group, 0.9, "parent_id"), {2: {"parent_id": 9}})
+
+
+if __name__ == "__main__":
+    unittest.main()
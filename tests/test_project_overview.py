@@ -0,0 +1,121 @@
+# tests/test_project_overview.py
+"""
+Unit test: ai.project_overview (snapshot tổng quan project có version) trên Supabase giả đếm số query.
+- Dựng một lần: một query chapters cho mọi arc (không N+1), chương đúng theo arc.
+- Router + planner cùng lượt: 0 query; lượt sau: đúng 1 query đọc version; version đổi → dựng lại.
+- DB chưa có bảng version: snapshot sống PROJECT_OVERVIEW_TTL_NO_VERSION_SEC.
+
+Chạy: python -m pytest tests/test_project_overview.py -v
+"""
+import unittest
+from unittest.mock import patch
+
+from tests.fake_supabase import FakeSupabase
+
+
+def _db(with_versions=True):
+    tables = {
+        "stories": [{"id": "p1", "title": "Truyện A"}],
+        "arcs": [{"id": "a1", "story_id": "p1", "name": "Arc 1"}, {"id": "a2", "story_id": "p1", "name": "Arc 2"},
+                 {"id": "a3", "story_id": "p1", "name": "Arc 3"}],
+        "chapters": [
+            {"story_id": "p1", "chapter_number": 1, "title": "Mở đầu", "arc_id": "a1"},
+            {"story_id": "p1", "chapter_number": 2, "title": "", "arc_id": "a1"},
+            {"story_id": "p1", "chapter_number": 3, "title": "Biến cố", "arc_id": "a2"},
+        ],
+        "story_bible": [{"id": "b1", "story_id": "p1", "entity_name": "[CHAR] Lan", "lookup_count": 3, "parent_id": None}],
+        "entity_relations": [{"id": 1, "story_id": "p1"}],
+        "timeline_events": [],
+        "chunks": [{"id": 1, "story_id": "p1"}, {"id": 2, "story_id": "p1"}],
+    }
+    tables["project_overview_versions"] = [{"story_id": "p1", "version": 4}]
+    return FakeSupabase(tables, missing_tables=() if with_versions else ("project_overview_versions",))
+
+
+def _tables_read(db):
+    return [table for table, _action in db.calls]
+
+
+class TestProjectOverviewSnapshot(unittest.TestCase):
+    def setUp(self):
+        from ai import project_overview
+
+        project_overview.invalidate_project_overview()
+        project_overview._version_unsupported_until = 0.0
+
+    def _patch(self, db, **cfg):
+        from ai import project_overview
+        from config import Config
+
+        patches = [patch.object(project_overview, "init_services", return_value={"supabase": db})]
+        for name, value in cfg.items():
+            patches.append(patch.object(Config, name, value, create=True))
+        return patches
+
+    def _run(self, patches, fn):
+        for p in patches:
+            p.start()
+        try:
+            return fn()
+        finally:
+            for p in reversed(patches):
+                p.stop()
+
+    def test_single_build_shared_by_router_and_planner(self):
+        from ai.utils import get_bible_index, get_chapter_list_for_router, get_project_overview
+
+        db = _db()
+
+        def _turn():
+            router = get_project_overview("p1", bible_max_tokens=0)
+            planner = get_project_overview("p1", bible_max_tokens=1200)
+            return router, planner, get_bible_index("p1", 2000), get_chapter_list_for_router("p1")
+
+        router, planner, bible, chapters = self._run(self._patch(db, PROJECT_OVERVIEW_VERSION_CHECK_SEC=60), _turn)
+        self.assertEqual(_tables_read(db).count("chapters"), 1)
+        self.assertEqual(len(db.calls), 8)  # version + stories + chapters + arcs + bible + 3 count
+        self.assertEqual(planner["arc_chapters_summary"], "Arc 1: chương 1, 2. Arc 2: chương 3. Arc 3: (chưa gán chương)")
+        self.assertEqual(chapters, "1 - Mở đầu, 2 - Chương 2, 3 - Biến cố")
+        self.assertEqual(router["project_name"], "Truyện A")
+        self.assertEqual((planner["relation_summary"], planner["chunks_summary"]), ("1 quan hệ", "2 chunks"))
+        self.assertEqual(bible, "Entity: [CHAR] Lan")
+        self.assertEqual(planner["overview_version"], 4)
+
+    def test_warm_turn_reads_only_version_and_rebuilds_on_change(self):
+        from ai.utils import get_project_overview
+
+        db = _db()
+        patches = self._patch(db, PROJECT_OVERVIEW_VERSION_CHECK_SEC=0)
+
+        def _turns():
+            get_project_overview("p1")
+            db.calls.clear()
+            get_project_overview("p1")
+            warm = _tables_read(db)
+            db.tables["chapters"].append({"story_id": "p1", "chapter_number": 4, "title": "Mới", "arc_id": "a3"})
+            db.tables["project_overview_versions"][0]["version"] = 5
+            db.calls.clear()
+            return warm, get_project_overview("p1")
+
+        warm, after = self._run(patches, _turns)
+        self.assertEqual(warm, ["project_overview_versions"])
+        self.assertIn("Arc 3: chương 4", after["arc_chapters_summary"])
+        self.assertEqual(_tables_read(db).count("chapters"), 1)
+
+    def test_without_version_table_uses_ttl(self):
+        from ai.utils import get_project_overview
+
+        db = _db(with_versions=False)
+
+        def _turns():
+            get_project_overview("p1")
+            db.calls.clear()
+            get_project_overview("p1")
+            return _tables_read(db)
+
+        calls = self._run(self._patch(db, PROJECT_OVERVIEW_VERSION_CHECK_SEC=0, PROJECT_OVERVIEW_TTL_NO_VERSION_SEC=60), _turns)
+        self.assertEqual(calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
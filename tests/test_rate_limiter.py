@@ -0,0 +1,102 @@
+# tests/test_rate_limiter.py
+"""
+Unit test: ai.rate_limiter (token bucket + AIMD) và retry 429 trong AIService.call_openrouter.
+- reserve(): burst rồi giãn đều theo tốc độ; AIMD tăng khi thành công, giảm khi 429 / 5xx.
+- 429 có Retry-After → chặn gửi tới hết thời gian đó.
+- call_openrouter thử lại sau 429 thay vì ném lỗi ngay.
+
+Chạy: python -m pytest tests/test_rate_limiter.py -v
+"""
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+class _Clock:
+    def __init__(self):
+        self.t = 1000.0
+
+    def __call__(self):
+        return self.t
+
+
+class _ApiError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = MagicMock(status_code=status_code, headers=headers or {})
+
+
+class TestAdaptiveRateLimiter(unittest.TestCase):
+    def _limiter(self, **kw):
+        from ai.rate_limiter import AdaptiveRateLimiter
+
+        clock = _Clock()
+        opts = {"initial_rps": 2.0, "min_rps": 0.1, "max_rps": 5.0, "burst": 3, "clock": clock}
+        opts.update(kw)
+        return AdaptiveRateLimiter("m", **opts), clock
+
+    def test_burst_then_spaced_by_rate(self):
+        lim, clock = self._limiter()
+        clock.t += 60  # rảnh lâu → đủ tín dụng burst
+        waits = [lim.reserve() for _ in range(5)]
+        self.assertEqual(waits[:3], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(waits[3], 0.5)
+        self.assertAlmostEqual(waits[4], 1.0)
+
+    def test_aimd_increase_and_decrease(self):
+        lim, _clock = self._limiter()
+        with patch("ai.rate_limiter._cfg", side_effect=lambda name, d: {"RATE_LIMIT_INCREASE_RPS": 0.5,
+                                                                         "RATE_LIMIT_DECREASE_FACTOR": 0.5}.get(name, d)):
+            lim.on_success()
+            self.assertAlmostEqual(lim.rate, 2.5)
+            for _ in range(10):
+                lim.on_success()
+            self.assertAlmostEqual(lim.rate, 5.0)  # chặn trên max_rps
+            lim.on_throttle()
+            self.assertAlmostEqual(lim.rate, 2.5)
+            lim.on_server_error()
+            self.assertAlmostEqual(lim.rate, 2.0)
+            for _ in range(10):
+                lim.on_throttle()
+            self.assertAlmostEqual(lim.rate, 0.1)  # chặn dưới min_rps
+
+    def test_retry_after_blocks_requests(self):
+        from ai.rate_limiter import record_error
+
+        lim, clock = self._limiter()
+        self.assertTrue(record_error(lim, _ApiError(429, {"retry-after": "30"})))
+        self.assertGreaterEqual(lim.reserve(), 30.0)
+        self.assertEqual(lim.snapshot()["throttled"], 1)
+        clock.t += 60
+        self.assertEqual(lim.snapshot()["blocked_for_sec"], 0)
+
+    def test_classify_error(self):
+        from ai.rate_limiter import classify_error, record_error
+
+        self.assertEqual(classify_error(_ApiError(429, {"retry-after": "7"})), ("throttle", 7.0))
+        self.assertEqual(classify_error(_ApiError(503))[0], "server")
+        self.assertEqual(classify_error(_ApiError(400)), (None, None))
+        self.assertEqual(classify_error(ValueError("x")), (None, None))
+        self.assertFalse(record_error(None, _ApiError(429)))
+
+
+class TestCallOpenrouterRetry(unittest.TestCase):
+    def test_retries_after_429(self):
+        from ai import service
+        from ai.rate_limiter import AdaptiveRateLimiter
+
+        lim = AdaptiveRateLimiter("m", initial_rps=100.0, max_rps=100.0, burst=5)
+        client = MagicMock()
+        client.chat.completions.create.side_effect = [_ApiError(429, {"retry-after": "0.01"}), "ok"]
+        with patch.object(service, "get_openrouter_client", return_value=client), \
+                patch.object(service, "get_rate_limiter", return_value=lim), \
+                patch.object(service, "lookup_cached_response", return_value=(None, None)):
+            out = service.AIService.call_openrouter([{"role": "user", "content": "hi"}], model="m")
+        self.assertEqual(out, "ok")
+        self.assertEqual(client.chat.completions.create.call_count, 2)
+        snap = lim.snapshot()
+        self.assertEqual((snap["throttled"], snap["successes"]), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# tests/test_response_cache.py
+"""Unit test: response cache cho lệnh gọi công cụ — chỉ cache khi bật call site (opt-in) và temperature thấp; hit tính tiền tiết kiệm."""
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+def _fake_response(content="{}"):
+    return MagicMock(
+        choices=[MagicMock(message=MagicMock(content=content))],
+        usage=MagicMock(prompt_tokens=1_000_000, completion_tokens=0),
+    )
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        from ai.response_cache import ResponseCache
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(os.path.join(self.tmp.name, "resp.sqlite"))
+        self.client = MagicMock()
+        self.client.chat.completions.create.return_value = _fake_response('{"intent": "search_context"}')
+        self.patches = [
+            patch("ai.response_cache.get_response_cache", return_value=self.cache),
+            patch("ai.service.get_openrouter_client", return_value=self.client),
+            patch.dict("config.Config.LLM_RESPONSE_CACHE_SITES", {"router_intent": True}),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.tmp.cleanup()
+
+    def _call(self, **kw):
+        from ai.service import AIService
+
+        args = dict(
+            messages=[{"role": "user", "content": "phân loại"}],
+            model="deepseek/deepseek-chat-v3.1",
+            temperature=0.1,
+            max_tokens=500,
+            response_format={"type": "json_object"},
+            cache_site="router_intent",
+        )
+        args.update(kw)
+        return AIService.call_openrouter(**args)
+
+    def test_second_identical_call_is_served_from_cache(self):
+        first = self._call()
+        second = self._call()
+        self.assertEqual(second.choices[0].message.content, first.choices[0].message.content)
+        self.assertTrue(getattr(second, "cached", False))
+        self.assertEqual(self.client.chat.completions.create.call_count, 1)
+        stats = self.cache.stats_by_site()
+        self.assertEqual(stats[0]["site"], "router_intent")
+        self.assertEqual(stats[0]["hits"], 1)
+        self.assertAlmostEqual(stats[0]["saved"], 0.15)
+
+    def test_high_temperature_or_no_site_bypasses_cache(self):
+        self._call(temperature=0.9)
+        self._call(temperature=0.9)
+        self._call(cache_site=None)
+        self._call(cache_site=None)
+        self.assertEqual(self.client.chat.completions.create.call_count, 4)
+
+    def test_different_max_tokens_is_a_different_key(self):
+        self._call()
+        self._call(max_tokens=600)
+        self.assertEqual(self.client.chat.completions.create.call_count, 2)
+
+    def test_sites_are_opt_in(self):
+        from ai.response_cache import is_cacheable_call
+        from config import Config
+
+        with patch.dict(Config.LLM_RESPONSE_CACHE_SITES, {"router_intent": False}):
+            self._call()
+            self._call()
+            self.assertEqual(self.client.chat.completions.create.call_count, 2)
+        self.assertFalse(is_cacheable_call("router_plan_v7", 0.0, False))
+        self.assertFalse(is_cacheable_call("arc_summary", 0.3, False))
+        self.assertFalse(is_cacheable_call("unknown_site", 0.0, False))
+        self.assertTrue(is_cacheable_call("multi_chapter_map", 0.0, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
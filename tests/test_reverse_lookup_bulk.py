@@ -0,0 +1,93 @@
+# tests/test_reverse_lookup_bulk.py
+"""
+Regression test: ReverseLookupAssembler.assemble_from_chunks (bulk, vài query in_) cho output giống hệt
+đường cũ từng chunk (assemble_single + get_chunk_with_parents): cùng thứ tự block, cùng source label, cùng cắt theo token_limit.
+Window lân cận vẫn đủ khi tổng số dòng cần vượt max-rows (1000) của PostgREST.
+
+Chạy: python -m pytest tests/test_reverse_lookup_bulk.py -v
+"""
+import unittest
+from unittest.mock import patch
+
+from tests.fake_supabase import FakeSupabase
+
+
+def _fixture():
+    arcs = [{"id": "a1", "name": "Arc Một", "summary": "Tóm tắt arc"}, {"id": "a2", "name": "Arc Hai", "summary": ""}]
+    chapters = [
+        {"id": "ch1", "title": "Chương 1", "summary": "S1", "arc_id": "a1"},
+        {"id": "ch2", "title": "Chương 2", "summary": "", "arc_id": "a2"},
+        {"id": "ch3", "title": "Chương 3", "summary": "S3", "arc_id": None},
+    ]
+    chunks = []
+    for ch in ("ch1", "ch2", "ch3"):
+        for i in range(6):
+            chunks.append({
+                "id": f"{ch}-c{i}",
+                "story_id": "s1",
+                "chapter_id": ch,
+                "arc_id": None,
+                "sort_order": i,
+                "content": f"Nội dung {ch} #{i} " + "chữ " * (20 + i * 5),
+                "raw_content": "",
+                "meta_json": {"source_metadata": {"source_file": f"{ch}.txt", "title": f"T{i}"}} if i % 2 else "{}",
+            })
+    chunks.append({"id": "orphan", "story_id": "s1", "chapter_id": None, "arc_id": "a1", "sort_order": None,
+                   "content": "Chunk lẻ", "raw_content": "", "meta_json": {"sheet_name": "Sheet9"}})
+    return {"arcs": arcs, "chapters": chapters, "chunks": chunks}
+
+
+class TestReverseLookupBulk(unittest.TestCase):
+    def _run(self, fn, db, *args, **kwargs):
+        from core.reverse_lookup import ReverseLookupAssembler
+
+        with patch.object(ReverseLookupAssembler, "_supabase", return_value=db):
+            return fn(*args, **kwargs)
+
+    def test_bulk_output_matches_per_chunk_path(self):
+        from core.reverse_lookup import ReverseLookupAssembler
+
+        ids = ["ch2-c3", "ch1-c0", "missing", "orphan", "ch1-c5", "ch2-c3", "ch3-c1", "ch1-c1"]
+        for token_limit in (0, 400):
+            legacy_db = FakeSupabase(_fixture())
+            with patch.object(ReverseLookupAssembler, "_assemble_blocks_bulk", side_effect=RuntimeError("off")):
+                expected = self._run(ReverseLookupAssembler.assemble_from_chunks, legacy_db, ids, token_limit=token_limit)
+            bulk_db = FakeSupabase(_fixture())
+            got = self._run(ReverseLookupAssembler.assemble_from_chunks, bulk_db, ids, token_limit=token_limit)
+            self.assertEqual(got, expected)
+            self.assertTrue(expected[0])
+            self.assertLessEqual(len(bulk_db.calls), 4)
+            self.assertGreater(len(legacy_db.calls), 20)
+
+    def test_neighbor_window_spans_chapters_in_one_query(self):
+        from core.reverse_lookup import ReverseLookupAssembler
+
+        db = FakeSupabase(_fixture())
+        out = self._run(ReverseLookupAssembler._assemble_blocks_bulk, db, ["ch1-c0", "ch3-c5"])
+        self.assertEqual([cid for cid, _, _ in out], ["ch1-c0", "ch3-c5"])
+        self.assertIn("chunk #0", out[0][1])
+        self.assertIn("chunk #1", out[0][1])
+        self.assertNotIn("chunk #2", out[0][1])
+        self.assertIn("chunk #4", out[1][1])
+        self.assertNotIn("Nội dung ch1", out[1][1])
+
+    def test_neighbor_windows_complete_past_row_cap(self):
+        from core.reverse_lookup import ReverseLookupAssembler
+
+        # 30 chương × 40 chunk, window mọi vị trí chia hết cho 3 → cần 1200 dòng, quá max-rows 1000 của PostgREST.
+        chunks = [
+            {"id": f"k{ch}-{i}", "story_id": "s1", "chapter_id": f"ch{ch:02d}", "sort_order": i, "content": "x",
+             "raw_content": "", "meta_json": {}}
+            for ch in range(30) for i in range(40)
+        ]
+        keys = [("s1", f"ch{ch:02d}", i) for ch in range(30) for i in range(0, 40, 3)]
+        db = FakeSupabase({"chunks": chunks})
+        windows = self._run(ReverseLookupAssembler._fetch_neighbor_windows, db, keys)
+        for story_id, chapter_id, pos in keys:
+            want = [p for p in (pos - 1, pos, pos + 1) if 0 <= p < 40]
+            self.assertEqual([r["sort_order"] for r in windows[(story_id, chapter_id, pos)]], want, (chapter_id, pos))
+        self.assertLessEqual(len(db.calls), 12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+# tests/test_semantic_intent_matcher.py
+"""
+Unit test: ai.semantic_intent_matcher.
+- match() cho cùng kết quả với vòng lặp cũ của check_semantic_intent ((cosine+1)/2, ngưỡng, mẫu đầu tiên khi bằng nhau).
+- Ngưỡng trong settings ghi đè tham số; check_semantic_intent dùng matcher cache, không gọi DB / embedding khi không có mẫu.
+
+Chạy: python -m pytest tests/test_semantic_intent_matcher.py -v
+"""
+import json
+import random
+import unittest
+from unittest.mock import MagicMock, patch
+
+
+def _old_cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    na = sum(x * x for x in a) ** 0.5
+    nb = sum(y * y for y in b) ** 0.5
+    return dot / (na * nb)
+
+
+def _rows(n, dim, seed):
+    rnd = random.Random(seed)
+    return [
+        {"id": i, "question_sample": f"q{i}", "intent": "chat_casual", "related_data": f"d{i}",
+         "embedding": json.dumps([rnd.gauss(0, 1) for _ in range(dim)])}
+        for i in range(n)
+    ]
+
+
+class TestSemanticIntentMatcher(unittest.TestCase):
+    def test_match_equals_legacy_loop(self):
+        from ai.semantic_intent_matcher import SemanticIntentMatcher
+
+        rows = _rows(30, 24, seed=1)
+        rows.append({"id": "dup", "question_sample": "dup", "embedding": rows[4]["embedding"]})
+        matcher = SemanticIntentMatcher("p1", rows)
+        rnd = random.Random(9)
+        for target in (4, 17):
+            base = json.loads(rows[target]["embedding"])
+            query = [x + rnd.gauss(0, 0.05) for x in base]
+            best, best_sim = None, 0.0
+            for row in rows:
+                sim = (_old_cosine(query, json.loads(row["embedding"])) + 1) / 2
+                if sim >= 0.9 and sim > best_sim:
+                    best, best_sim = row, sim
+            got = matcher.match(query, threshold=0.9)
+            self.assertEqual(got["id"], best["id"])
+            self.assertAlmostEqual(got["similarity"], best_sim, places=5)
+            self.assertNotIn("embedding", got)
+        self.assertIsNone(matcher.match([1.0] * 24, threshold=0.999))
+
+    def test_settings_threshold_overrides_argument(self):
+        from ai.semantic_intent_matcher import SemanticIntentMatcher
+
+        rows = [{"id": 1, "embedding": [1.0, 0.0]}]
+        query = [1.0, 1.0]  # cosine ≈ 0.707 → similarity ≈ 0.854
+        self.assertIsNone(SemanticIntentMatcher("p1", rows, threshold=0.9).match(query, threshold=0.5))
+        self.assertEqual(SemanticIntentMatcher("p1", rows, threshold=None).match(query, threshold=0.85)["id"], 1)
+
+    def test_check_semantic_intent_uses_cached_matcher(self):
+        from ai import hybrid_search, semantic_intent_matcher
+
+        rows = _rows(5, 8, seed=2)
+        sb = MagicMock()
+        sb.table.return_value.select.return_value.eq.return_value.execute.return_value.data = [{"value": 90}]
+        chain = sb.table.return_value.select.return_value.eq.return_value.eq.return_value
+        chain.not_.is_.return_value.order.return_value.range.return_value.execute.return_value.data = rows
+        query = json.loads(rows[3]["embedding"])
+        with patch.dict(semantic_intent_matcher._matchers, {}, clear=True), \
+                patch.object(semantic_intent_matcher, "init_services", return_value={"supabase": sb}):
+            first = hybrid_search.check_semantic_intent("hỏi", "p1", query_embedding=query)
+            calls = sb.table.call_count
+            second = hybrid_search.check_semantic_intent("hỏi", "p1", query_embedding=query)
+            self.assertEqual(sb.table.call_count, calls)
+            semantic_intent_matcher.invalidate_semantic_intent_matcher("p1")
+            hybrid_search.check_semantic_intent("hỏi", "p1", query_embedding=query)
+            self.assertGreater(sb.table.call_count, calls)
+        self.assertEqual(first["id"], 3)
+        self.assertEqual(second["id"], 3)
+
+    def test_no_embedding_call_when_project_has_no_samples(self):
+        from ai import hybrid_search, semantic_intent_matcher
+
+        empty = semantic_intent_matcher.SemanticIntentMatcher("p2", [])
+        with patch.object(hybrid_search, "get_semantic_intent_matcher", return_value=empty), \
+                patch.object(hybrid_search.AIService, "get_embedding") as mock_emb:
+            self.assertIsNone(hybrid_search.check_semantic_intent("xin chào", "p2"))
+        mock_emb.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+# tests/test_unified_range_pipeline.py
+"""
+Unit test: run_unified_chapter_range chế độ pipeline.
+- Save chạy đúng thứ tự chương, dùng dữ liệu extract (stored_data), chồng lên extract của chương sau.
+- Số extract đồng thời không vượt max_inflight; chương extract lỗi → failed, không save.
+- result_summary có tốc độ chương/phút.
+
+Chạy: python -m pytest tests/test_unified_range_pipeline.py -v
+"""
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+
+class TestUnifiedRangePipeline(unittest.TestCase):
+    def test_pipeline_saves_in_order_and_reports_throughput(self):
+        from core import unified_chapter_analyze as uca
+
+        lock = threading.Lock()
+        state = {"inflight": 0, "peak": 0}
+        saves = []
+        job_updates = []
+
+        def _extract(project_id, ch, job_id):
+            with lock:
+                state["inflight"] += 1
+                state["peak"] = max(state["peak"], state["inflight"])
+            time.sleep(0.1)
+            with lock:
+                state["inflight"] -= 1
+            if ch == 4:
+                return None, "LLM unified extract failed: timeout"
+            return {"bible": [], "marker": ch}, None
+
+        def _save(project_id, ch, job_id=None, update_job_fn=None, stored_data=None):
+            saves.append((ch, stored_data["marker"]))
+            time.sleep(0.05)
+            return {"success": True}
+
+        with patch.object(uca, "_extract_for_range", side_effect=_extract), \
+                patch.object(uca, "run_unified_chapter_analyze", side_effect=_save), \
+                patch("core.job_progress._get_supabase", return_value=None), \
+                patch("core.job_llm_store._get_supabase", return_value=None):
+            t0 = time.perf_counter()
+            out = uca.run_unified_chapter_range(
+                "p1", 1, 6, job_id="job1",
+                update_job_fn=lambda *a, **kw: job_updates.append((a, kw)),
+                max_inflight=3,
+            )
+            elapsed = time.perf_counter() - t0
+
+        self.assertEqual(saves, [(1, 1), (2, 2), (3, 3), (5, 5), (6, 6)])
+        self.assertEqual(out["failed"], [4])
+        self.assertEqual(out["ok"], 5)
+        self.assertLessEqual(state["peak"], 3)
+        self.assertGreater(state["peak"], 1)
+        # Tuần tự: 6 × 0.1 + 5 × 0.05 = 0.85s
+        self.assertLess(elapsed, 0.7)
+        (args, kwargs), = job_updates
+        self.assertEqual(args[1], "failed")
+        self.assertIn("chương/phút", kwargs["result_summary"])
+        self.assertIn("Chương 4: LLM unified extract failed", kwargs["error_message"])
+
+    def test_sequential_mode_calls_full_analyze(self):
+        from core import unified_chapter_analyze as uca
+
+        calls = []
+        with patch.object(uca, "run_unified_chapter_analyze",
+                          side_effect=lambda p, ch, **kw: calls.append((ch, kw.get("stored_data"))) or {"success": True}):
+            out = uca.run_unified_chapter_range("p1", 3, 1, max_inflight=1)
+        self.assertEqual(calls, [(1, None), (2, None), (3, None)])
+        self.assertTrue(out["success"])
+
+
+if __name__ == "__main__":
+    unittest.main()
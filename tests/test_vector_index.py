@@ -0,0 +1,209 @@
+# tests/test_vector_index.py
+"""
+Unit test: ai.vector_index (index vector trong bộ nhớ theo project).
+- search trả top-k giống chấm điểm phẳng, có lọc phạm vi theo cột / id.
+- mark_vector_rows_dirty: lần search sau chỉ tải lại đúng các id bị đánh dấu (thêm, sửa, gỡ embedding);
+  id đánh dấu trong lúc đang load không bị mất.
+- upsert_rows nhiều dòng mới một lô (kể cả id lặp trong lô): hàng khớp ma trận, get_vectors / remove / search đúng.
+- IVF (bảng lớn) vẫn tìm được láng giềng gần nhất.
+- search_rows_via_vector_index: dòng bị xóa ngoài luồng → gỡ khỏi index và vẫn trả đủ k.
+- Unified analyze xóa dữ liệu cũ của chương → đánh dấu dirty đúng các id quan hệ / timeline / chunk.
+
+Chạy: python -m pytest tests/test_vector_index.py -v
+"""
+import json
+import random
+import unittest
+from unittest.mock import patch
+
+
+def _vec(rnd, dim):
+    return [rnd.gauss(0, 1) for _ in range(dim)]
+
+
+class _FakeTable:
+    """fetch_fn giả: giữ dòng theo id, ghi lại các lần tải theo id."""
+
+    def __init__(self, rows):
+        self.rows = {str(r["id"]): dict(r) for r in rows}
+        self.id_fetches = []
+
+    def __call__(self, project_id, spec, ids=None):
+        if ids is None:
+            return [dict(r) for r in self.rows.values() if r.get("embedding") is not None]
+        self.id_fetches.append(sorted(ids))
+        return [dict(self.rows[i]) for i in ids if i in self.rows]
+
+
+class TestProjectVectorIndex(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(1)
+        self.rows = [
+            {"id": i, "embedding": json.dumps(_vec(rnd, 16)), "source_chapter": i % 4}
+            for i in range(50)
+        ]
+        self.table = _FakeTable(self.rows)
+
+    def _index(self):
+        from ai.vector_index import ProjectVectorIndex
+
+        ix = ProjectVectorIndex("p1", "relations", fetch_fn=self.table)
+        self.assertTrue(ix.load())
+        return ix
+
+    def test_search_matches_flat_scoring_with_scope_filter(self):
+        from ai.vector_ops import top_k
+
+        ix = self._index()
+        query = json.loads(self.rows[9]["embedding"])
+        scoped = [r for r in self.rows if r["source_chapter"] in (1, 2)]
+        expected = [scoped[i]["id"] for i, _ in top_k(query, [r["embedding"] for r in scoped], k=5)]
+        hits = ix.search(query, k=5, where={"source_chapter": [1, 2]})
+        self.assertEqual([rid for rid, _ in hits], expected)
+        self.assertEqual(hits[0][0], 9)
+        self.assertAlmostEqual(hits[0][1], 1.0, places=5)
+        self.assertEqual([rid for rid, _ in ix.search(query, k=3, where={"id": ["3", "9"]})], [9, 3])
+        self.assertTrue(all(s >= 0.5 for _, s in ix.search(query, k=50, min_sim=0.5)))
+
+    def test_dirty_rows_refreshed_by_id(self):
+        from ai import vector_index
+
+        ix = self._index()
+        rnd = random.Random(2)
+        new_vec = _vec(rnd, 16)
+        self.table.rows["100"] = {"id": 100, "embedding": new_vec, "source_chapter": 0}
+        self.table.rows["5"]["embedding"] = None
+        with patch.dict(vector_index._indexes, {("p1", "relations"): ix}, clear=True):
+            vector_index.mark_vector_rows_dirty("entity_relations", [100, 5])
+            vector_index.mark_vector_rows_dirty("story_bible", [7])
+            hits = ix.search(new_vec, k=50)
+        self.assertEqual(self.table.id_fetches, [["100", "5"]])
+        self.assertEqual(hits[0][0], 100)
+        self.assertNotIn(5, [rid for rid, _ in hits])
+        self.assertEqual(len(ix), 50)
+
+    def test_batch_upsert_of_new_rows_keeps_rows_aligned(self):
+        import numpy as np
+
+        ix = self._index()
+        rnd = random.Random(5)
+        vec_a, vec_b, vec_c, vec_a2 = (_vec(rnd, 16) for _ in range(4))
+        ix.upsert_rows([
+            {"id": "a", "embedding": vec_a, "source_chapter": 1},
+            {"id": "b", "embedding": vec_b, "source_chapter": 1},
+            {"id": "a", "embedding": vec_a2, "source_chapter": 2},  # lặp trong lô: dòng sau thắng
+            {"id": "c", "embedding": vec_c, "source_chapter": 1},
+            {"id": 3, "embedding": None},
+        ])
+        self.assertEqual(len(ix), 52)
+        vecs = ix.get_vectors(["a", "b", "c", 3])
+        self.assertEqual(sorted(vecs), ["a", "b", "c"])
+        for rid, raw in (("a", vec_a2), ("b", vec_b), ("c", vec_c)):
+            want = np.asarray(raw, dtype=np.float32)
+            self.assertTrue(np.allclose(vecs[rid], want / np.linalg.norm(want), atol=1e-5), rid)
+        self.assertEqual(ix.search(vec_c, k=1)[0][0], "c")
+        self.assertEqual(ix.search(vec_a2, k=1, where={"source_chapter": [2]})[0][0], "a")
+        ix.remove(["b"])
+        self.assertNotIn("b", [rid for rid, _ in ix.search(vec_b, k=60)])
+        self.assertEqual(ix.search(vec_c, k=1)[0][0], "c")
+        self.assertEqual(len(ix), 51)
+
+    def test_ids_marked_during_load_are_refreshed(self):
+        from ai.vector_index import ProjectVectorIndex
+
+        rnd = random.Random(6)
+        new_vec = _vec(rnd, 16)
+        table = self.table
+        ix = ProjectVectorIndex("p1", "relations", fetch_fn=None)
+
+        def _fetch(project_id, spec, ids=None):
+            rows = table(project_id, spec, ids)
+            if ids is None:
+                # Ghi xong sau khi đã đọc xong: bản tải toàn bộ không thấy dòng mới.
+                table.rows["200"] = {"id": 200, "embedding": new_vec, "source_chapter": 0}
+                ix.mark_dirty([200])
+            return rows
+
+        ix._fetch = _fetch
+        ix.mark_dirty([1])
+        self.assertTrue(ix.load())
+        self.assertEqual(ix.search(new_vec, k=1)[0][0], 200)
+        self.assertEqual(table.id_fetches, [["200"]])
+
+    def test_ivf_partitions_find_nearest_neighbour(self):
+        from ai.vector_index import ProjectVectorIndex
+
+        rnd = random.Random(3)
+        rows = [{"id": i, "embedding": _vec(rnd, 8), "source_chapter": 0} for i in range(400)]
+        with patch("ai.vector_index.Config.VECTOR_INDEX_IVF_MIN_ROWS", 100), \
+                patch("ai.vector_index.Config.VECTOR_INDEX_IVF_NPROBE", 4):
+            ix = ProjectVectorIndex("p1", "relations", fetch_fn=_FakeTable(rows))
+            self.assertTrue(ix.load())
+            self.assertIsNotNone(ix._centroids)
+            for target in (0, 123, 399):
+                self.assertEqual(ix.search(rows[target]["embedding"], k=1)[0][0], target)
+
+    def test_get_vector_index_loads_in_background_and_falls_back(self):
+        from ai import vector_index
+
+        started = []
+        with patch.dict(vector_index._indexes, {}, clear=True), \
+                patch.object(vector_index, "_start_background_load", side_effect=started.append):
+            self.assertIsNone(vector_index.get_vector_index("p1", "timeline"))
+            self.assertIsNone(vector_index.get_vector_index("p1", "timeline"))
+            self.assertEqual(len(started), 1)
+            ix = started[0]
+            ix._fetch = _FakeTable([{"id": 1, "embedding": [1.0, 0.0], "chapter_id": 3, "arc_id": None}])
+            ix.load()
+            self.assertIs(vector_index.get_vector_index("p1", "timeline"), ix)
+            vector_index.invalidate_vector_index("p1")
+            self.assertNotIn(("p1", "timeline"), vector_index._indexes)
+
+
+class TestVectorIndexDeletions(unittest.TestCase):
+    def test_search_rows_refills_k_after_out_of_band_delete(self):
+        from ai import vector_index
+        from ai.context_helpers import search_rows_via_vector_index
+        from ai.vector_index import ProjectVectorIndex
+        from tests.fake_supabase import FakeSupabase
+
+        rnd = random.Random(4)
+        rows = [{"id": i, "story_id": "p1", "embedding": _vec(rnd, 8), "source_chapter": 0, "description": f"r{i}"}
+                for i in range(20)]
+        ix = ProjectVectorIndex("p1", "relations", fetch_fn=_FakeTable(rows))
+        self.assertTrue(ix.load())
+        query = rows[0]["embedding"]
+        top = [rid for rid, _ in ix.search(query, k=5)]
+        db = FakeSupabase({"entity_relations": [r for r in rows if r["id"] not in top[:2]]})
+        with patch.dict(vector_index._indexes, {("p1", "relations"): ix}, clear=True), \
+                patch("ai.context_helpers.init_services", return_value={"supabase": db}):
+            out = search_rows_via_vector_index("p1", "relations", query, "id, description", k=5, attach_vectors=False)
+        self.assertEqual([row["id"] for _, row in out], [rid for rid, _ in ix.search(query, k=5)])
+        self.assertEqual(len(out), 5)
+        self.assertFalse(set(top[:2]) & {row["id"] for _, row in out})
+        self.assertEqual(len(ix), 18)
+
+    def test_unified_analyze_marks_deleted_rows_dirty(self):
+        from core import unified_chapter_analyze as uca
+        from tests.fake_supabase import FakeSupabase
+
+        db = FakeSupabase({
+            "chapters": [{"id": "ch3", "story_id": "p1", "chapter_number": 3, "content": "Lan gặp Minh.", "arc_id": None}],
+            "story_bible": [{"id": 1, "story_id": "p1", "source_chapter": 3, "entity_name": "[CHARACTER] Lan"}],
+            "entity_relations": [{"id": "rel1", "source_entity_id": 1, "target_entity_id": 9},
+                                 {"id": "rel2", "source_entity_id": 8, "target_entity_id": 9}],
+            "timeline_events": [{"id": "t1", "story_id": "p1", "chapter_id": "ch3"}],
+            "chunks": [{"id": "k1", "story_id": "p1", "chapter_id": "ch3"}, {"id": "k2", "story_id": "p1", "chapter_id": "ch4"}],
+        })
+        marked = {}
+        with patch.object(uca, "_get_supabase", return_value=db), \
+                patch("ai.vector_index.mark_vector_rows_dirty", side_effect=lambda t, ids: marked.update({t: list(ids)})), \
+                patch("core.job_llm_store._get_supabase", return_value=None):
+            uca.run_unified_chapter_analyze("p1", 3, stored_data={"chunks": [{"content": "Lan gặp Minh."}]})
+        self.assertEqual(marked.get("entity_relations"), ["rel1"])
+        self.assertEqual(marked.get("timeline_events"), ["t1"])
+        self.assertEqual(marked.get("chunks"), ["k1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
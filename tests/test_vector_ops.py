@@ -0,0 +1,89 @@
+# tests/test_vector_ops.py
+"""Unit test: ai.vector_ops cho kết quả giống các vòng lặp cosine thuần Python cũ (top-k, lọc trùng, parent sớm nhất)."""
+import json
+import random
+import unittest
+
+
+def _old_cosine(a, b):
+    if not a or not b or len(a) != len(b):
+        return 0.0
+    dot = sum(x * y for x, y in zip(a, b))
+    na = sum(x * x for x in a) ** 0.5
+    nb = sum(y * y for y in b) ** 0.5
+    if na <= 0 or nb <= 0:
+        return 0.0
+    return dot / (na * nb)
+
+
+def _rows(n, dim, seed, dup_rate=0.3):
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        if i and rnd.random() < dup_rate:
+            base = out[rnd.randrange(len(out))]
+            out.append([x + rnd.gauss(0, 0.02) for x in base])
+        else:
+            out.append([rnd.gauss(0, 1) for _ in range(dim)])
+    return out
+
+
+class TestVectorOps(unittest.TestCase):
+    def test_parse_vector_accepts_db_formats(self):
+        from ai.vector_ops import parse_vector
+
+        self.assertEqual(parse_vector("[1, 2.5]").tolist(), [1.0, 2.5])
+        self.assertEqual(parse_vector((3, 4)).tolist(), [3.0, 4.0])
+        self.assertIsNone(parse_vector("not a vector"))
+        self.assertIsNone(parse_vector([1.0, None]))
+        self.assertIsNone(parse_vector([1.0, 2.0], dim=3))
+
+    def test_top_k_matches_python_loop(self):
+        from ai.vector_ops import top_k
+
+        rows = _rows(60, 32, seed=1)
+        query = rows[7]
+        raw = [json.dumps(r) if i % 2 else r for i, r in enumerate(rows)]
+        raw[3] = None
+        raw[5] = [1.0, 2.0]  # sai chiều → bỏ
+        old = sorted(
+            ((_old_cosine(r, query), i) for i, r in enumerate(rows) if i not in (3, 5)),
+            key=lambda x: -x[0],
+        )
+        old_ids = [i for s, i in old if s >= 0.1][:10]
+        new = top_k(query, raw, k=10, min_sim=0.1)
+        self.assertEqual([i for i, _ in new], old_ids)
+        self.assertAlmostEqual(new[0][1], 1.0, places=5)
+
+    def test_greedy_dedupe_matches_filter_context_items(self):
+        from ai.context_helpers import filter_context_items_by_embedding
+        from ai.vector_ops import greedy_dedupe
+
+        rows = _rows(80, 16, seed=2)
+        items = [{"id": i, "embedding": r} for i, r in enumerate(rows)]
+        items.insert(10, {"id": "no-emb"})
+        kept_old = []
+        for it in items:
+            emb = it.get("embedding")
+            if emb is None or not any(_old_cosine(emb, k["embedding"]) >= 0.9 for k in kept_old if "embedding" in k):
+                kept_old.append(it)
+        self.assertEqual([it["id"] for it in filter_context_items_by_embedding(items)], [it["id"] for it in kept_old])
+        self.assertLess(len(greedy_dedupe(rows, 0.9)), len(rows))
+
+    def test_best_earlier_match_picks_most_similar_previous_row(self):
+        from ai.vector_ops import best_earlier_match, to_matrix
+
+        rows = _rows(40, 16, seed=3, dup_rate=0.5)
+        matrix, _idx = to_matrix(rows)
+        best = best_earlier_match(matrix, 0.9)
+        for i, row in enumerate(rows):
+            best_j, best_sim = -1, 0.9
+            for j in range(i):
+                sim = _old_cosine(row, rows[j])
+                if sim >= best_sim:
+                    best_sim, best_j = sim, j
+            self.assertEqual(int(best[i]), best_j)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -197,6 +197,15 @@ def approve_pending_change(pending_id: str) -> bool:
             supabase.table("chapters").upsert(
                 payload, on_conflict="story_id,chapter_number"
             ).execute()
+            if payload.get("content"):
+                try:
+                    from ai.chapter_digest import schedule_chapter_digest
+
+                    schedule_chapter_digest(
+                        story_id, payload.get("chapter_number"), payload["content"], payload.get("title") or ""
+                    )
+                except Exception as e:
+                    print(f"schedule_chapter_digest error: {e}")
         elif table_name == "story_bible":
             if target_key.get("id"):
                 # update existing
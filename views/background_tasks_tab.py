@@ -1,9 +1,97 @@
-# views/background_tasks_tab.py - Background Jobs tab: list jobs, nút Refresh, nút Thử lại khi thất bại
+# views/background_tasks_tab.py - Background Jobs tab: list jobs, tiến độ, hàng đợi theo lane, nút Refresh, nút Hủy, nút Thử lại khi thất bại
 import streamlit as st
 
 from config import init_services
 from core.background_jobs import list_jobs, retry_job_with_stored_data, ensure_background_job_runner
 from core.job_llm_store import has_stored_result_for_retry
+from core.job_progress import progress_view, request_cancel
+from core.job_queue import LANES, job_lane, lane_stats
+from ai.rate_limiter import snapshot_rate_limiters
+
+
+def _render_rate_limiter_status():
+    """Tốc độ gọi LLM hiện tại theo model (limiter thích ứng của process này)."""
+    snaps = snapshot_rate_limiters()
+    if not snaps:
+        return
+    with st.expander("⏱️ Tốc độ gọi API (limiter thích ứng)", expanded=False):
+        for snap in snaps:
+            line = (
+                f"**{snap['key']}** — {snap['rate_rps']:.2f} req/s · {snap['successes']} ok · "
+                f"429: {snap['throttled']} · 5xx: {snap['server_errors']} · đã chờ {snap['wait_sec']:.0f}s"
+            )
+            if snap["blocked_for_sec"] > 0:
+                line += f" · ⏸️ tạm dừng {snap['blocked_for_sec']:.0f}s (Retry-After)"
+            st.caption(line)
+
+
+_LANE_LABELS = {"interactive": "⚡ Interactive", "normal": "📋 Normal", "bulk": "📦 Bulk"}
+
+
+def _format_wait(sec):
+    sec = int(sec or 0)
+    if sec >= 3600:
+        return f"{sec // 3600}h{(sec % 3600) // 60:02d}"
+    if sec >= 60:
+        return f"{sec // 60} phút"
+    return f"{sec}s"
+
+
+def _render_queue_lanes(supabase):
+    """Độ sâu hàng đợi và thời gian chờ theo lane ưu tiên (toàn hệ thống)."""
+    try:
+        stats = lane_stats(supabase)
+    except Exception:
+        return
+    with st.expander("🚦 Hàng đợi theo mức ưu tiên", expanded=False):
+        cols = st.columns(len(LANES))
+        for col, lane in zip(cols, LANES):
+            s = stats[lane]
+            with col:
+                st.metric(_LANE_LABELS[lane], f"{s['pending']} chờ", help=f"Đang chạy: {s['running']}")
+                if s["pending"]:
+                    st.caption(f"Chờ lâu nhất {_format_wait(s['max_wait_sec'])} · TB {_format_wait(s['avg_wait_sec'])}")
+        st.caption("Job chờ lâu được nâng dần lane (aging) nên job bulk không bị bỏ đói.")
+
+
+def _format_eta(sec):
+    if sec is None:
+        return ""
+    sec = int(sec)
+    if sec >= 3600:
+        return f"còn ~{sec // 3600}h{(sec % 3600) // 60:02d}"
+    if sec >= 60:
+        return f"còn ~{sec // 60} phút"
+    return f"còn ~{sec}s"
+
+
+def _render_job_progress(job):
+    """Thanh tiến độ (job đang chạy) + nút Hủy (pending / running)."""
+    status = job.get("status")
+    job_id = job.get("id")
+    prog = progress_view(job) if status == "running" else None
+    if prog:
+        parts = [f"{prog['current']}/{prog['total']}"]
+        if prog["message"]:
+            parts.append(prog["message"])
+        eta = _format_eta(prog["eta_sec"])
+        if eta:
+            parts.append(eta)
+        st.progress(prog["fraction"], text=" · ".join(parts))
+    if status not in ("pending", "running") or not job_id:
+        return
+    if job.get("cancel_requested"):
+        st.caption("⏳ Đã yêu cầu hủy — job sẽ dừng sau chương / lô / bước hiện tại.")
+        return
+    if st.button("⏹️ Hủy", key=f"bg_cancel_{job_id}"):
+        outcome = request_cancel(job_id)
+        if outcome == "cancelled":
+            st.success("Đã hủy job.")
+        elif outcome == "requested":
+            st.info("Đã gửi yêu cầu hủy. Job sẽ dừng ở mốc kế tiếp (đã xử lý xong vẫn được giữ).")
+        else:
+            st.warning("Không hủy được (job đã xong hoặc DB chưa chạy migration V15).")
+        st.rerun()
 
 
 def render_background_tasks_tab(project_id):
@@ -30,11 +118,14 @@ def render_background_tasks_tab(project_id):
     with col_ctrl2:
         if st.button("▶️ Chạy hàng đợi", key="bg_tasks_run_queue_btn"):
             ensure_background_job_runner()
-            st.success("Đã kích hoạt xử lý hàng đợi. Các job pending (chưa quá hạn) sẽ được chạy lần lượt trong nền.")
+            st.success("Đã kích hoạt xử lý hàng đợi. Các job pending (chưa quá hạn) sẽ được worker pool chạy trong nền.")
+
+    _render_rate_limiter_status()
+    _render_queue_lanes(services["supabase"])
 
     status_filter_label = st.selectbox(
         "Status",
-        ["All", "pending", "running", "completed", "failed"],
+        ["All", "pending", "running", "completed", "failed", "cancelled"],
         key="bg_tasks_filter",
     )
     status_key = None if status_filter_label == "All" else status_filter_label
@@ -100,15 +191,18 @@ def render_background_tasks_tab(project_id):
             icon = "✅"
         elif status == "failed":
             icon = "❌"
+        elif status == "cancelled":
+            icon = "⏹️"
         else:
             icon = "⏸️"
 
         with st.expander(f"{icon} **{label}** — {status}", expanded=(status in ("running", "failed"))):
-            st.caption(f"Type: {job_type} | Created: {created}")
+            st.caption(f"Type: {job_type} | Lane: {job_lane(j)} | Created: {created}")
             if started:
                 st.caption(f"Started: {started}")
             if completed:
                 st.caption(f"Completed: {completed}")
+            _render_job_progress(j)
             if result_summary:
                 st.success(result_summary)
             if error_message:
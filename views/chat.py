@@ -1,4 +1,5 @@
 import threading
+import time
 from datetime import datetime
 
 import streamlit as st
@@ -20,6 +21,7 @@ from core.executor_v7 import execute_plan
 from core.command_parser import is_command_message, parse_command, get_fallback_clarification
 from core.observability import log_chat_turn
 from ai.router import is_multi_intent_request
+from ai.intent_classifier import classify_intent_locally, record_llm_router_call
 from persona import PersonaSystem
 from utils.auth_manager import check_permission, submit_pending_change
 from utils.python_executor import PythonExecutor
@@ -850,6 +852,8 @@ def render_chat_tab(project_id, persona, chat_mode=None):
                 v7_handled = False
                 router_out = None
                 query_embedding_cache = None  # (canonical_text, embedding) để tái sử dụng, chỉ embed tối thiểu
+                router_intent_source = None  # llm | local: nguồn intent bước 1 (ghi chat_turn_logs, huấn luyện intent cục bộ)
+                router_intent_step1 = None
                 free_chat_mode = is_v_home or st.session_state.get('free_chat_mode', False)
 
                 # Số tin đưa vào Router/Planner theo slider (0 = không dùng lịch sử).
@@ -937,8 +941,24 @@ def render_chat_tab(project_id, persona, chat_mode=None):
                             needs_data = step1["needs_data"]
                         else:
                             can_call = max_llm_calls_per_turn == 0 or llm_calls_this_turn[0] < max_llm_calls_per_turn
-                            if can_call:
+                            # Bộ phân loại cục bộ (nearest-centroid trên embedding) đủ tự tin → bỏ qua lệnh LLM router.
+                            local_step1 = None
+                            try:
+                                _q_emb = query_embedding_cache[1] if query_embedding_cache and query_embedding_cache[0] == (prompt or "").strip() else None
+                                local_step1 = classify_intent_locally(
+                                    prompt, project_id, query_embedding=_q_emb, recent_history_text=recent_history_text
+                                )
+                            except Exception as _e:
+                                print(f"classify_intent_locally error: {_e}")
+                            if local_step1:
+                                step1 = local_step1
+                                router_intent_source = "local"
+                                debug_notes.append(f"⚡ Intent cục bộ {int(local_step1['confidence'] * 100)}%")
+                            elif can_call:
+                                _t_router = time.perf_counter()
                                 step1 = SmartAIRouter.intent_only_classifier(prompt, recent_history_text, project_id)
+                                record_llm_router_call(time.perf_counter() - _t_router)
+                                router_intent_source = "llm"
                                 llm_calls_this_turn[0] += 1
                             else:
                                 step1 = {
@@ -950,6 +970,7 @@ def render_chat_tab(project_id, persona, chat_mode=None):
                                     "new_rules": [],
                                 }
                             intent_step1 = step1.get("intent", "chat_casual")
+                            router_intent_step1 = intent_step1
                             needs_data = step1.get("needs_data", False)
                             low_prompt = (prompt or "").strip().lower()
                             # Heuristic: Câu rất ngắn, chủ yếu là than vãn cảm xúc, không nhắc tới nội dung dự án → ép về chat_casual.
@@ -1387,7 +1408,6 @@ def render_chat_tab(project_id, persona, chat_mode=None):
                             with st.chat_message("assistant", avatar=active_persona['icon']):
                                 # Stream hiển thị câu trả lời cuối (typewriter effect)
                                 _placeholder = st.empty()
-                                import time
                                 _chunk = 25
                                 for _i in range(0, len(final_response), _chunk):
                                     _placeholder.markdown(final_response[:_i + _chunk] + "▌")
@@ -1787,6 +1807,9 @@ Chỉ trả về code trong block ```python ... ```, không giải thích."""
                                 context_needs=router_out.get("context_needs") if isinstance(router_out.get("context_needs"), list) else None,
                                 context_tokens=context_tokens,
                                 llm_calls_count=llm_calls_this_turn[0],
+                                query_text=prompt if router_intent_source else None,
+                                router_intent=router_intent_step1 if router_intent_source else None,
+                                intent_source=router_intent_source,
                             )
                         except Exception:
                             pass
@@ -8,6 +8,7 @@ from config import init_services
 from utils.auth_manager import check_permission
 from ai_engine import AIService
 from ai.content import generate_chunk_summary
+from ai.vector_index import mark_vector_rows_dirty
 
 KNOWLEDGE_PAGE_SIZE = 10
 
@@ -262,6 +263,7 @@ def render_chunking_tab(project_id):
 
                         try:
                             supabase.table("chunks").update(update_payload_meta).eq("id", cid).execute()
+                            mark_vector_rows_dirty("chunks", [cid])
                             if embedding is not None:
                                 st.success("Đã cập nhật metadata + embedding cho chunk (không gọi LLM).")
                             else:
@@ -345,6 +347,7 @@ def render_chunking_tab(project_id):
 
                             try:
                                 supabase.table("chunks").update(update_payload).eq("id", cid).execute()
+                                mark_vector_rows_dirty("chunks", [cid])
                                 if summ:
                                     st.success("Đã cập nhật nội dung + tóm tắt + embedding cho chunk.")
                                 elif embedding is not None:
@@ -61,6 +61,46 @@ def render_cost_tab():
     df = pd.DataFrame(model_costs)
     st.dataframe(df, width="stretch", hide_index=True)
 
+    st.markdown("---")
+    st.subheader("⚡ Cache")
+
+    try:
+        from ai.response_cache import get_response_cache
+        from ai.embedding_cache import get_embedding_cache
+
+        response_cache = get_response_cache()
+        site_stats = response_cache.stats_by_site() if response_cache else []
+        total_hits = sum(s["hits"] for s in site_stats)
+        total_saved = sum(s["saved"] for s in site_stats)
+        emb_stats = get_embedding_cache().stats() if get_embedding_cache() else {}
+
+        col_c1, col_c2, col_c3 = st.columns(3)
+        with col_c1:
+            st.metric("LLM cache hits", f"{total_hits}")
+        with col_c2:
+            st.metric("Saved by LLM cache", f"${total_saved:.4f}")
+        with col_c3:
+            st.metric("Embedding cache hit rate", f"{emb_stats.get('hit_rate', 0.0) * 100:.1f}%")
+
+        if site_stats:
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "Call site": s["site"],
+                        "Entries": s["entries"],
+                        "Hits": s["hits"],
+                        "Saved": f"${s['saved']:.4f}",
+                    }
+                    for s in site_stats
+                ]),
+                width="stretch",
+                hide_index=True,
+            )
+        elif not response_cache:
+            st.caption("LLM response cache đang tắt (Config.LLM_RESPONSE_CACHE_ENABLED).")
+    except Exception as e:
+        st.caption(f"Không đọc được thống kê cache: {e}")
+
     st.markdown("---")
     st.subheader("📈 Usage History")
 
@@ -130,9 +130,21 @@ def _run_extract_bible_batch(contents_list, ext_persona, project_id, supabase=No
     """
     Extract Bible cho nhiều chương trong một lần gọi API.
     contents_list: [(ch_num, content), ...]. Trả về {ch_num: [item, ...]} (mỗi item có entity_name, type, description).
+    Danh sách vượt giới hạn một lô (core/batch_planner.py) → tự chia lô theo token, mỗi lô một lần gọi.
     """
     if not contents_list:
         return {}
+    from core.batch_planner import estimate_chapter_tokens, plan_token_batches
+
+    by_num = dict(contents_list)
+    batches, oversized = plan_token_batches({ch: estimate_chapter_tokens(c) for ch, c in by_num.items()})
+    # Chương quá dài vẫn gọi riêng (nội dung bị cắt bớt bên dưới) như trước.
+    batches = sorted(batches + [[ch] for ch in oversized], key=lambda b: b[0])
+    if len(batches) > 1:
+        merged = {}
+        for batch in batches:
+            merged.update(_run_extract_bible_batch([(ch, by_num[ch]) for ch in batch], ext_persona, project_id, supabase))
+        return merged
     from ai_engine import AIService
     allowed_keys = Config.get_allowed_prefix_keys_for_extract()
     prefix_list_str = ", ".join(allowed_keys) + ", OTHER" if allowed_keys else "OTHER"
@@ -162,7 +174,7 @@ def _run_extract_bible_batch(contents_list, ext_persona, project_id, supabase=No
             messages=[{"role": "user", "content": full_prompt}],
             model=_get_default_tool_model(),
             temperature=0.0,
-            max_tokens=16000,
+            max_tokens=int(getattr(Config, "DATA_BATCH_MAX_OUTPUT_TOKENS", 16000)),
             response_format={"type": "json_object"},
         )
         if not resp or not resp.choices:
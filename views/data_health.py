@@ -2,17 +2,66 @@
 """
 - Validation conflicts (validation_logs): Force Sync | Keep Exception.
 - Lỗi logic theo chương: chọn chương -> Soát chương (5 dimensions); hiển thị active + đã khắc phục.
+- Đồng bộ dữ liệu: watermark lần đồng bộ gần nhất; chạy đồng bộ tăng dần hoặc quét toàn bộ (background).
 """
 import streamlit as st
 
 from config import init_services
 from utils.active_sentry import resolve_conflict
 from utils.cache_helpers import get_chapters_cached
+from utils.auth_manager import check_permission
 from core.chapter_logic_check import run_chapter_logic_check, get_chapter_logic_issues, LOGIC_DIMENSIONS
+from core.background_jobs import create_job, ensure_background_job_runner
+from core.global_data_sync import get_sync_state
 
 KNOWLEDGE_PAGE_SIZE = 10
 
 
+def _render_sync_state(project_id, services):
+    """Watermark đồng bộ toàn cục + nút chạy đồng bộ tăng dần / quét toàn bộ trong background."""
+    st.markdown("#### 🔄 Đồng bộ dữ liệu toàn cục")
+    state = get_sync_state(project_id, services["supabase"] if services else None) or {}
+    if state:
+        st.caption(
+            "Lần gần nhất: **%s** (%s, %s dòng thay đổi) · Quét toàn bộ gần nhất: **%s** · Watermark: %s"
+            % (
+                (state.get("last_sync_at") or "—")[:19],
+                "tăng dần" if state.get("last_mode") == "incremental" else "toàn bộ",
+                state.get("last_changed_rows") if state.get("last_changed_rows") is not None else "—",
+                (state.get("last_full_sync_at") or "—")[:19],
+                (state.get("watermark") or "—")[:19],
+            )
+        )
+    else:
+        st.caption("Chưa có watermark (chưa đồng bộ lần nào hoặc DB chưa chạy migration V14) → lần đầu sẽ quét toàn bộ.")
+    st.caption("Sau mỗi lần Unified thành công, hệ thống tự xếp một job đồng bộ tăng dần (chỉ xử lý dòng đổi từ watermark).")
+
+    uid = getattr(st.session_state.get("user"), "id", None) or ""
+    uem = getattr(st.session_state.get("user"), "email", None) or ""
+    if not check_permission(uid, uem, project_id, "write"):
+        return
+    c1, c2 = st.columns(2)
+    for col, mode, label, key in (
+        (c1, "incremental", "Đồng bộ tăng dần", "dh_sync_incremental"),
+        (c2, "full", "Quét toàn bộ", "dh_sync_full"),
+    ):
+        with col:
+            if st.button("🔄 %s" % label, key=key, width="stretch"):
+                job_id = create_job(
+                    story_id=project_id,
+                    user_id=uid or None,
+                    job_type="global_data_sync",
+                    label="Đồng bộ dữ liệu toàn cục (%s)" % label.lower(),
+                    payload={"mode": mode},
+                    post_to_chat=False,
+                )
+                if job_id:
+                    ensure_background_job_runner()
+                    st.toast("Đã xếp hàng. Xem tab Background Jobs.")
+                else:
+                    st.error("Không tạo được job.")
+
+
 def render_data_health_tab(project_id):
     """Tab Data Health: validation_logs + chapter logic issues (soát từng chương, đã khắc phục)."""
     st.subheader("🛡️ Data Health")
@@ -74,6 +123,9 @@ def render_data_health_tab(project_id):
                         if resolve_conflict(log_id, "resolved_keep_exception", resolved_by=getattr(st.session_state.get("user"), "email", "")):
                             st.toast("Đã đánh dấu: Keep Exception. Bấm Refresh để cập nhật.")
 
+    st.markdown("---")
+    _render_sync_state(project_id, services)
+
     st.markdown("---")
     st.markdown("#### 📋 Lỗi logic theo chương (Timeline, Bible, Relation, Chat crystallize, Rule)")
 
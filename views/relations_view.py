@@ -7,6 +7,7 @@ import streamlit as st
 from config import init_services
 from utils.auth_manager import check_permission
 from utils.cache_helpers import get_bible_list_cached, invalidate_cache, full_refresh
+from ai.vector_index import mark_vector_rows_dirty
 
 KNOWLEDGE_PAGE_SIZE = 10
 
@@ -167,6 +168,7 @@ def render_relations_tab(project_id, persona):
                                 "description": (new_desc or "").strip(),
                                 "embedding": None,
                             }).eq("id", rel_id).execute()
+                            mark_vector_rows_dirty("entity_relations", [rel_id])
                             st.session_state.pop("rel_editing_id", None)
                             invalidate_cache()
                         except Exception as ex:
@@ -7,6 +7,7 @@ from config import init_services
 from ai_engine import AIService
 from utils.auth_manager import check_permission
 from core.background_jobs import run_semantic_intent_embedding_backfill, is_embedding_backfill_running
+from ai.semantic_intent_matcher import invalidate_semantic_intent_matcher
 
 KNOWLEDGE_PAGE_SIZE = 10
 
@@ -111,6 +112,7 @@ def render_semantic_intent_tab(project_id):
                 supabase.table("settings").upsert({"key": "semantic_intent_threshold", "value": threshold}, on_conflict="key").execute()
             except Exception:
                 supabase.table("settings").insert({"key": "semantic_intent_threshold", "value": threshold}).execute()
+            invalidate_semantic_intent_matcher()
             st.toast("Đã lưu ngưỡng.")
         except Exception as e:
             st.error(str(e))
@@ -268,6 +270,7 @@ def render_semantic_intent_tab(project_id):
                 if can_delete and st.button("🗑️ Xóa", key=f"si_del_{item.get('id')}"):
                     try:
                         supabase.table("semantic_intent").delete().eq("id", item["id"]).execute()
+                        invalidate_semantic_intent_matcher(project_id)
                         st.success("Đã xóa.")
                     except Exception as e:
                         st.error(str(e))
@@ -276,6 +279,7 @@ def render_semantic_intent_tab(project_id):
                     if not approved and st.button("✅ Approve", key=f"si_approve_{item.get('id')}"):
                         try:
                             supabase.table("semantic_intent").update({"approve": True, "updated_at": datetime.utcnow().isoformat()}).eq("id", item["id"]).execute()
+                            invalidate_semantic_intent_matcher(project_id)
                             st.success("Đã duyệt Semantic Intent.")
                         except Exception as e:
                             st.error(str(e))
@@ -304,6 +308,7 @@ def render_semantic_intent_tab(project_id):
                     }
                     try:
                         supabase.table("semantic_intent").update(upd).eq("id", edit_id).execute()
+                        invalidate_semantic_intent_matcher(project_id)
                         del st.session_state["si_editing"]
                         st.success("Đã cập nhật. Bấm **Đồng bộ vector (Semantic Intent)** để embed lại theo câu hỏi.")
                     except Exception as e:
@@ -320,6 +325,7 @@ def render_semantic_intent_tab(project_id):
             if confirm and st.button("🗑️ Xóa sạch Semantic Intent", type="primary"):
                 try:
                     supabase.table("semantic_intent").delete().eq("story_id", project_id).execute()
+                    invalidate_semantic_intent_matcher(project_id)
                     st.success("Đã xóa sạch.")
                 except Exception as e:
                     st.error(str(e))
@@ -4,6 +4,22 @@ from config import Config, init_services
 from .setup_tabs import render_prefix_setup, render_persona_setup
 
 
+def _render_local_intent_stats():
+    """Intent cục bộ (ai/intent_classifier.py): số lượt bỏ qua LLM router và thời gian tiết kiệm (process hiện tại)."""
+    from ai.intent_classifier import local_intent_stats
+
+    stats = local_intent_stats()
+    if not stats["local_hits"] and not stats["llm_calls"]:
+        st.caption("⚡ Intent cục bộ: chưa có lượt chat nào qua router trong phiên server này.")
+        return
+    st.caption(
+        f"⚡ Intent cục bộ: {stats['local_hits']} / {stats['local_hits'] + stats['llm_calls']} lượt bỏ qua LLM router "
+        f"({stats['hit_rate'] * 100:.0f}%) · LLM router TB {stats['avg_llm_latency_sec']:.2f}s, cục bộ TB "
+        f"{stats['avg_local_latency_sec'] * 1000:.0f}ms · tiết kiệm ~{stats['saved_latency_sec']:.0f}s và "
+        f"{stats['saved_llm_calls']} lệnh LLM. Học từ chat_turn_logs (migration V19) + Semantic Intent đã duyệt."
+    )
+
+
 def render_settings_tab():
     """Tab Settings Ver 7.0 — Account, AI Model (từ sidebar), Cấu hình AI, Giao diện, Bible & Personas."""
     st.header("⚙️ Settings")
@@ -191,7 +207,34 @@ def render_settings_tab():
                     st.toast("Đã lưu.")
                 except Exception as e:
                     st.error(str(e))
+            try:
+                r3 = supabase.table("settings").select("value").eq("key", "max_internal_llm_calls_per_turn").execute()
+                max_internal_val = Config.DEFAULT_MAX_INTERNAL_LLM_CALLS_PER_TURN
+                if r3.data and r3.data[0] is not None:
+                    v = r3.data[0].get("value")
+                    if v is not None:
+                        max_internal_val = max(0, int(v) if isinstance(v, (int, float)) else int(str(v).strip() or "0"))
+            except Exception:
+                max_internal_val = Config.DEFAULT_MAX_INTERNAL_LLM_CALLS_PER_TURN
+            max_internal_calls = st.number_input(
+                "Số lệnh LLM nội bộ tối đa mỗi turn (map-reduce nhiều chương: map + reduce + thử lại). 0 = không giới hạn.",
+                min_value=0,
+                max_value=500,
+                value=max_internal_val,
+                step=5,
+                key="max_internal_llm_calls_per_turn_input",
+            )
+            if st.button("💾 Lưu giới hạn LLM nội bộ/turn", key="save_max_internal_llm"):
+                try:
+                    supabase.table("settings").upsert(
+                        {"key": "max_internal_llm_calls_per_turn", "value": max_internal_calls},
+                        on_conflict="key",
+                    ).execute()
+                    st.toast("Đã lưu.")
+                except Exception as e:
+                    st.error(str(e))
             st.divider()
             st.caption("Observability: mỗi turn chat ghi log vào bảng **chat_turn_logs** (intent, context_needs, context_tokens, llm_calls_count). Chạy migration V8.3 để tạo bảng.")
+            _render_local_intent_stats()
         else:
             st.warning("Chưa kết nối Supabase. Không thể lưu cài đặt V8.")
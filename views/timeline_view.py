@@ -6,6 +6,7 @@ from config import init_services
 from ai_engine import get_timeline_events
 from utils.auth_manager import check_permission
 from utils.cache_helpers import full_refresh
+from ai.vector_index import mark_vector_rows_dirty
 from core.user_data_save_pipeline import run_logic_check_then_save_timeline
 
 KNOWLEDGE_PAGE_SIZE = 10
@@ -261,6 +262,7 @@ def render_timeline_tab(project_id):
                         update_fields = {k: v for k, v in payload_ready.items() if k not in ("id", "story_id")}
                         update_fields["embedding"] = None  # Chỉnh sửa tay → xóa embed để lần đồng bộ vector sau sẽ embed lại
                         supabase.table("timeline_events").update(update_fields).eq("id", edit_id).execute()
+                        mark_vector_rows_dirty("timeline_events", [edit_id])
                         for k in ["tl_editing_id", "tl_edit_title", "tl_edit_description", "tl_edit_raw_date", "tl_edit_event_type", "tl_edit_event_order"]:
                             st.session_state.pop(k, None)
                         st.toast("Đã lưu.")
@@ -173,6 +173,12 @@ def render_workstation_tab(project_id, persona):
                                 daemon=True,
                             )
                             thread.start()
+                            try:
+                                from ai.chapter_digest import schedule_chapter_digest
+
+                                schedule_chapter_digest(project_id, chap_num, current_content, current_title)
+                            except Exception as e:
+                                print(f"schedule_chapter_digest error: {e}")
                             time.sleep(0.5)
                         elif can_request:
                             pid = submit_pending_change(
@@ -385,6 +391,14 @@ def render_workstation_tab(project_id, persona):
                                                     "title": part.get("title", f"Chương {start_num + i}"),
                                                     "content": part.get("content", ""),
                                                 }).execute()
+                                                try:
+                                                    from ai.chapter_digest import schedule_chapter_digest
+
+                                                    schedule_chapter_digest(
+                                                        project_id, start_num + i, part.get("content", ""), part.get("title", "")
+                                                    )
+                                                except Exception as e:
+                                                    print(f"schedule_chapter_digest error: {e}")
                                                 progress_bar.progress((i + 1) / total)
                                             
                                             status_text.empty()